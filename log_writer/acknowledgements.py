@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 Tampere University and VTT Technical Research Centre of Finland
+# This software was developed as a part of the ProCemPlus project: https://www.senecc.fi/projects/procemplus
+# This source code is licensed under the MIT license. See LICENSE in the repository root directory.
+# Author(s): Ville Heikkilä <ville.heikkila@tuni.fi>
+#            Otto Hylli <otto.hylli@tuni.fi>
+
+"""Module containing the acknowledgement tracking for the message bus deliveries.
+
+In the acknowledge after store mode a delivery is acknowledged only after the document for the message has been
+stored, either to the database or to the spool. The delivery that is being handled is available in
+the CURRENT_DELIVERY context variable, so that the message batcher can attach the delivery to the batch that
+contains the message. A delivery that was not attached to any batch while its message was handled, e.g. because
+the message was filtered out, is acknowledged right after the handling.
+
+The deliveries are acknowledged with cumulative acknowledgements: when all the deliveries up to some delivery
+have been stored, they are all acknowledged with a single acknowledgement. The deliveries whose documents
+could not be stored are rejected and requeued once, a redelivered message is not requeued again. When the channel
+of the deliveries has been closed, e.g. after a reconnection, the pending deliveries from the closed channel are
+forgotten, since the message bus redelivers their messages."""
+
+import asyncio
+import collections
+import contextvars
+import functools
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from tools.tools import FullLogger
+
+LOGGER = FullLogger(__name__)
+
+# the delivery for the message that is currently being handled, None if the deliveries are not tracked
+CURRENT_DELIVERY: "contextvars.ContextVar[Optional[Delivery]]" = contextvars.ContextVar(
+    "current_delivery", default=None)
+
+
+class Delivery:
+    """Class for a single message bus delivery that is waiting for the acknowledgement."""
+    __slots__ = ("__message", "__tracker", "__attached", "__completed", "__stored")
+
+    def __init__(self, message: Any, tracker: "AckTracker"):
+        self.__message = message
+        self.__tracker = tracker
+        self.__attached = False
+        self.__completed = False
+        self.__stored = False
+
+    @property
+    def message(self) -> Any:
+        """The delivered message from the message bus client."""
+        return self.__message
+
+    @property
+    def tracker(self) -> "AckTracker":
+        """The acknowledgement tracker for the delivery."""
+        return self.__tracker
+
+    @property
+    def attached(self) -> bool:
+        """Returns True, if the delivery waits for the write of the batch containing its message."""
+        return self.__attached
+
+    @property
+    def completed(self) -> bool:
+        """Returns True, if the delivery has been stored or rejected."""
+        return self.__completed
+
+    @property
+    def stored(self) -> bool:
+        """Returns True, if the message has been stored or it did not need to be stored."""
+        return self.__stored
+
+    def attach(self):
+        """Marks the delivery as waiting for the write of a batch."""
+        self.__attached = True
+
+    def complete(self, stored: bool):
+        """Marks the delivery as stored or rejected."""
+        self.__completed = True
+        self.__stored = stored
+
+
+class AckTracker:
+    """Class for tracking the deliveries from a single channel and acknowledging them in the delivery order.
+
+    The acknowledge function is called with the latest message of the stored deliveries and it should
+    acknowledge that message and all the earlier messages. The reject function is called with a single message
+    and whether the message should be requeued. The optional delivery tag function should return the delivery
+    tag of a message. The delivery tags increase within a channel, so a delivery tag that is not larger than
+    the previous one means that the deliveries come from a new channel and the earlier deliveries are forgotten.
+    """
+    def __init__(self, acknowledge_function: Callable[[Any], Awaitable[Any]],
+                 reject_function: Callable[[Any, bool], Awaitable[Any]],
+                 redelivered_function: Optional[Callable[[Any], bool]] = None,
+                 delivery_tag_function: Optional[Callable[[Any], int]] = None):
+        self.__acknowledge_function = acknowledge_function
+        self.__reject_function = reject_function
+        self.__redelivered_function = redelivered_function
+        self.__delivery_tag_function = delivery_tag_function
+        self.__latest_delivery_tag = None
+        # the deliveries that have not been acknowledged in the delivery order
+        self.__deliveries = collections.deque()
+        self.__tasks = set()
+        self.__acknowledged = 0
+        self.__rejected = 0
+
+    @property
+    def pending_deliveries(self) -> int:
+        """The number of deliveries that have not been acknowledged."""
+        return len(self.__deliveries)
+
+    @property
+    def acknowledged_deliveries(self) -> int:
+        """The total number of acknowledged deliveries."""
+        return self.__acknowledged
+
+    @property
+    def rejected_deliveries(self) -> int:
+        """The total number of rejected deliveries."""
+        return self.__rejected
+
+    def receive(self, message: Any) -> Delivery:
+        """Registers a received message and returns the delivery for it."""
+        if self.__delivery_tag_function is not None:
+            delivery_tag = self.__delivery_tag_function(message)
+            if self.__latest_delivery_tag is not None and delivery_tag <= self.__latest_delivery_tag:
+                # the delivery tags start again from the beginning in a new channel
+                self.reset()
+            self.__latest_delivery_tag = delivery_tag
+
+        delivery = Delivery(message, self)
+        self.__deliveries.append(delivery)
+        return delivery
+
+    def complete(self, deliveries: List[Delivery], stored: bool):
+        """Marks the deliveries as handled. The stored deliveries are acknowledged once all the earlier
+           deliveries have also been handled, the deliveries that were not stored are rejected."""
+        for delivery in deliveries:
+            if delivery.completed:
+                continue
+            delivery.complete(stored)
+            if not stored:
+                requeue = self.__redelivered_function is None or not self.__redelivered_function(delivery.message)
+                self.__rejected += 1
+                self.__run(self.__reject_function, delivery.message, requeue)
+
+        # the rejected deliveries are no longer waiting for an acknowledgement, so they are skipped
+        latest_delivery = None
+        while self.__deliveries and self.__deliveries[0].completed:
+            delivery = self.__deliveries.popleft()
+            if delivery.stored:
+                latest_delivery = delivery
+                self.__acknowledged += 1
+        if latest_delivery is not None:
+            self.__run(self.__acknowledge_function, latest_delivery.message)
+
+    def reset(self):
+        """Forgets the pending deliveries, e.g. when the channel of the deliveries has been closed.
+           The message bus redelivers the unacknowledged messages from a closed channel, so the forgotten
+           deliveries are neither acknowledged nor rejected."""
+        if self.__deliveries:
+            LOGGER.info("Forgetting {:d} unacknowledged deliveries from a closed channel".format(
+                len(self.__deliveries)))
+        for delivery in self.__deliveries:
+            delivery.complete(False)
+        self.__deliveries.clear()
+        self.__latest_delivery_tag = None
+
+    async def close(self):
+        """Waits for the acknowledgements that have already been sent."""
+        await asyncio.gather(*self.__tasks, return_exceptions=True)
+
+    def __str__(self) -> str:
+        return "acknowledged: {:d}, rejected: {:d}, pending: {:d}".format(
+            self.__acknowledged, self.__rejected, len(self.__deliveries))
+
+    def __run(self, acknowledgement_function: Callable[..., Awaitable[Any]], *args: Any):
+        """Sends the acknowledgement in a separate task."""
+        try:
+            task = asyncio.ensure_future(acknowledgement_function(*args))
+        except Exception as error:  # pylint: disable=broad-except
+            LOGGER.warning("Could not acknowledge a delivery: {:s}".format(str(error)))
+            return
+        self.__tasks.add(task)
+        task.add_done_callback(self.__acknowledgement_done)
+
+    def __acknowledgement_done(self, task: asyncio.Future):
+        """Logs the errors from the acknowledgements."""
+        self.__tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            LOGGER.warning("Could not acknowledge a delivery: {:s}".format(str(task.exception())))
+
+
+def complete_deliveries(deliveries: List[Delivery], stored: bool):
+    """Marks the deliveries as handled using the trackers of the deliveries."""
+    tracker_deliveries: Dict[AckTracker, List[Delivery]] = {}
+    for delivery in deliveries:
+        tracker_deliveries.setdefault(delivery.tracker, []).append(delivery)
+    for tracker, deliveries_for_tracker in tracker_deliveries.items():
+        tracker.complete(deliveries_for_tracker, stored)
+
+
+def complete_written_deliveries(deliveries: List[Delivery], document_count: int, write_future: asyncio.Future):
+    """Done callback for a write job future. The deliveries are stored if all the documents were written."""
+    if write_future.cancelled():
+        return
+    complete_deliveries(deliveries, write_future.exception() is None and write_future.result() == document_count)
+
+
+def get_write_callback(deliveries: List[Delivery], document_count: int) -> Callable[[asyncio.Future], None]:
+    """Returns a done callback for the write job future that completes the given deliveries."""
+    return functools.partial(complete_written_deliveries, deliveries, document_count)
+
+
+def acknowledge_when_handled(message_handler: Callable[[Any, str], Awaitable[None]]) -> \
+        Callable[[Any, str], Awaitable[None]]:
+    """Returns a message handler that completes the current delivery after the message has been handled,
+       if the message was not added to any batch. The delivery is rejected if the handling failed."""
+    @functools.wraps(message_handler)
+    async def acknowledging_handler(message: Any, topic_name: str):
+        handled = False
+        try:
+            await message_handler(message, topic_name)
+            handled = True
+        finally:
+            delivery = CURRENT_DELIVERY.get()
+            if delivery is not None and not delivery.attached:
+                delivery.tracker.complete([delivery], handled)
+    return acknowledging_handler
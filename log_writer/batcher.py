@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 Tampere University and VTT Technical Research Centre of Finland
+# This software was developed as a part of the ProCemPlus project: https://www.senecc.fi/projects/procemplus
+# This source code is licensed under the MIT license. See LICENSE in the repository root directory.
+# Author(s): Ville Heikkilä <ville.heikkila@tuni.fi>
+#            Otto Hylli <otto.hylli@tuni.fi>
+
+"""Module containing a message batcher that buffers the messages from all simulations before the database writes."""
+
+import asyncio
+import functools
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+from tools.messages import BaseMessage
+from tools.timer import Timer
+from tools.tools import FullLogger
+
+from log_writer.acknowledgements import CURRENT_DELIVERY, Delivery, get_write_callback
+from log_writer.flush_controller import AdaptiveFlushController
+from log_writer.invalid_message import InvalidMessage
+from log_writer.metrics import FLUSH_SIZE
+from log_writer.profiling import STAGE_SERIALIZATION, STAGE_TIMERS
+from log_writer.raw_message import RawMessage
+from log_writer.spool import MessageSpool
+from log_writer.write_queue import WriteJob, WriteQueue
+
+LOGGER = FullLogger(__name__)
+
+# (simulation id, invalid messages, priority messages)
+BatchKey = Tuple[str, bool, bool]
+# (batch key, (message, topic) tuples, deliveries) for a batch that has been taken for a flush
+FlushedBatch = Tuple[BatchKey, List[Tuple[Union[BaseMessage, RawMessage], str]], Optional[List[Delivery]]]
+StoredCallback = Callable[[str, List[Union[BaseMessage, RawMessage]]], None]
+
+
+class MessageBatcher:
+    """Class for buffering the messages from all the simulations and writing them to the database in batches.
+
+    The pending messages are grouped by their target collection and all groups are flushed together either
+    when the total number of pending messages reaches the batch size or when the flush interval has passed.
+    The batch size and the flush interval are chosen by the flush controller. The priority messages,
+    i.e. the control messages, are kept in separate groups that are sent to the write queue as priority jobs.
+    """
+    def __init__(self, write_queue: Union[WriteQueue, MessageSpool],
+                 flush_controller: Optional[AdaptiveFlushController] = None):
+        self.__write_queue = write_queue
+        self.__flush_controller = flush_controller if flush_controller is not None else AdaptiveFlushController()
+        self.__write_queue.add_write_callback(self.__register_write)
+
+        # the messages are grouped by the simulation id, whether they are invalid messages and their priority
+        self.__batches = {}
+        # the message bus deliveries that are acknowledged after the messages in the batch have been stored
+        self.__deliveries: Dict[BatchKey, List[Delivery]] = {}
+        self.__stored_callbacks: List[StoredCallback] = []
+        self.__pending_documents = 0
+        self.__flush_timer = None
+        self.__flush_count = 0
+
+    @property
+    def write_queue(self) -> Union[WriteQueue, MessageSpool]:
+        """The write queue or the spool in front of it that is used for the database writes."""
+        return self.__write_queue
+
+    @property
+    def flush_controller(self) -> AdaptiveFlushController:
+        """The controller that chooses the batch size and the flush interval."""
+        return self.__flush_controller
+
+    @property
+    def pending_documents(self) -> int:
+        """The number of messages that are waiting to be flushed."""
+        return self.__pending_documents
+
+    @property
+    def flush_count(self) -> int:
+        """The number of flushes that have sent at least one message to the write queue."""
+        return self.__flush_count
+
+    def add_stored_callback(self, callback: StoredCallback):
+        """Adds a callback that is called with the simulation id and the messages of each batch of valid messages
+           after all the messages in the batch have been persisted, i.e. written to the database or to the spool."""
+        self.__stored_callbacks.append(callback)
+
+    async def add_message(self, simulation_id: str, message_object: Union[BaseMessage, RawMessage],
+                          message_topic: str, priority: bool = False) -> List[asyncio.Future]:
+        """Adds a message to the batch for the given simulation.
+           If the batch size is reached, all the pending messages are flushed and
+           a list of futures that are done when the messages have been written is returned."""
+        self.__flush_controller.record_message()
+
+        batch_key = (simulation_id, isinstance(message_object, InvalidMessage), priority)
+        batch = self.__batches.get(batch_key, None)
+        if batch is None:
+            batch = []
+            self.__batches[batch_key] = batch
+        batch.append((message_object, message_topic))
+        self.__pending_documents += 1
+        delivery = CURRENT_DELIVERY.get()
+        if delivery is not None:
+            delivery.attach()
+            self.__deliveries.setdefault(batch_key, []).append(delivery)
+
+        if self.__pending_documents >= self.__flush_controller.batch_size:
+            return await self.flush()
+        if self.__flush_timer is None:
+            self.__flush_timer = Timer(False, self.__flush_controller.flush_interval, self.__timed_flush)
+        return []
+
+    async def flush(self, simulation_id: Optional[str] = None) -> List[asyncio.Future]:
+        """Sends the pending messages to the write queue. If simulation_id is given, only the messages
+           for that simulation are sent. Returns a list of futures that are done when the messages have been
+           written to the database."""
+        if simulation_id is None:
+            batch_keys = list(self.__batches)
+        else:
+            batch_keys = [
+                batch_key
+                for batch_key in (
+                    (simulation_id, False, True), (simulation_id, False, False),
+                    (simulation_id, True, True), (simulation_id, True, False))
+                if batch_key in self.__batches
+            ]
+        batches = [
+            (batch_key, self.__batches.pop(batch_key), self.__deliveries.pop(batch_key, None))
+            for batch_key in batch_keys
+        ]
+        self.__pending_documents -= sum(len(batch) for _, batch, _ in batches)
+        if not self.__batches:
+            self.__cancel_timer()
+
+        write_futures = []
+        for batch_index, (batch_key, batch, deliveries) in enumerate(batches):
+            batch_simulation_id, invalid, priority = batch_key
+            stage_start = STAGE_TIMERS.start(STAGE_SERIALIZATION)
+            write_job = WriteJob(
+                batch_simulation_id,
+                [(message_object.json(), message_topic) for message_object, message_topic in batch],
+                invalid, priority)
+            STAGE_TIMERS.stop(STAGE_SERIALIZATION, stage_start)
+            if deliveries is not None:
+                # with the spool the deliveries can be acknowledged before the documents are in the database
+                write_job.persisted.add_done_callback(get_write_callback(deliveries, write_job.size))
+            if self.__stored_callbacks and not invalid:
+                # with the spool the messages are released as soon as they have been appended to the spool
+                write_job.persisted.add_done_callback(functools.partial(
+                    self.__notify_stored, batch_simulation_id, [message_object for message_object, _ in batch],
+                    write_job.size))
+
+            try:
+                write_futures.append(await self.__write_queue.put(write_job))
+            except BaseException:
+                # e.g. cancelled while waiting for the write queue, the batches that were not accepted are returned
+                # so that they are written by a later flush and their deliveries are still acknowledged
+                self.__restore_batches(batches[batch_index + 1 if write_job.queued else batch_index:])
+                raise
+            FLUSH_SIZE.observe(write_job.size)
+
+        if write_futures:
+            self.__flush_count += 1
+        return write_futures
+
+    def __str__(self) -> str:
+        return "{:s}, pending: {:d}, write queue: {:d}, flushes: {:d}".format(
+            str(self.__flush_controller), self.pending_documents,
+            self.__write_queue.pending_documents, self.flush_count)
+
+    def __restore_batches(self, batches: List[FlushedBatch]):
+        """Returns the given batches in front of the messages that have been added to the batches after the flush."""
+        for batch_key, batch, deliveries in batches:
+            self.__batches[batch_key] = batch + self.__batches.get(batch_key, [])
+            if deliveries is not None:
+                self.__deliveries[batch_key] = deliveries + self.__deliveries.get(batch_key, [])
+            self.__pending_documents += len(batch)
+
+    async def __timed_flush(self):
+        """Flushes all the pending messages when the flush interval has passed."""
+        self.__flush_timer = None
+        await self.flush()
+
+    def __cancel_timer(self):
+        """Cancels the flush timer if it is running."""
+        if self.__flush_timer is not None:
+            self.__flush_timer.cancel()
+            self.__flush_timer = None
+
+    def __notify_stored(self, simulation_id: str, message_objects: List[Union[BaseMessage, RawMessage]],
+                        document_count: int, write_future: asyncio.Future):
+        """Calls the stored callbacks if all the messages of the batch were persisted."""
+        if write_future.cancelled() or write_future.exception() is not None or write_future.result() != document_count:
+            return
+        for callback in self.__stored_callbacks:
+            try:
+                callback(simulation_id, message_objects)
+            except Exception as error:  # pylint: disable=broad-except
+                LOGGER.warning("Error in a stored callback: {:s}".format(str(error)))
+
+    def __register_write(self, write_job: WriteJob):
+        """Registers the write latency of the given job to the flush controller if all its documents were written.
+           The latencies of the failed writes, e.g. connection timeouts, do not describe the database throughput."""
+        if (write_job.latency is not None and write_job.done.done() and not write_job.done.cancelled() and
+                write_job.done.result() == write_job.size):
+            self.__flush_controller.record_write(write_job.latency)
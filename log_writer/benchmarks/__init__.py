@@ -0,0 +1,12 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 Tampere University and VTT Technical Research Centre of Finland
+# This software was developed as a part of the ProCemPlus project: https://www.senecc.fi/projects/procemplus
+# This source code is licensed under the MIT license. See LICENSE in the repository root directory.
+# Author(s): Ville Heikkilä <ville.heikkila@tuni.fi>
+#            Otto Hylli <otto.hylli@tuni.fi>
+
+"""Offline benchmarks for the log writer that use in-memory stand-ins for RabbitMQ and MongoDB.
+
+Run with: python -m log_writer.benchmarks.run --help"""
+
+import init
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 Tampere University and VTT Technical Research Centre of Finland
+# This software was developed as a part of the ProCemPlus project: https://www.senecc.fi/projects/procemplus
+# This source code is licensed under the MIT license. See LICENSE in the repository root directory.
+# Author(s): Ville Heikkilä <ville.heikkila@tuni.fi>
+#            Otto Hylli <otto.hylli@tuni.fi>
+
+"""Module containing in-memory stand-ins for the RabbitMQ and MongoDB clients used in the benchmarks."""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, Union
+
+
+class FakeRabbitmqClient:
+    """In-memory stand-in for the RabbitmqClient that delivers the published messages directly to the listeners."""
+    def __init__(self):
+        self.__listeners = []
+
+    def add_listener(self, topic_names: Union[str, List[str]],
+                     callback_function: Callable[[Any, str], Awaitable[None]]):
+        """Adds a listener that receives all the published messages regardless of the topic names."""
+        del topic_names
+        self.__listeners.append(callback_function)
+
+    async def publish(self, topic_name: str, message_body: Union[str, bytes]):
+        """Delivers the message to all the listeners and waits until they have handled it."""
+        for callback_function in self.__listeners:
+            await callback_function(message_body, topic_name)
+
+    async def close(self):
+        """Removes all the listeners."""
+        self.__listeners = []
+
+
+class FakeMongodbClient:
+    """In-memory stand-in for the MongodbClient that only counts the writes and waits for the configured latency.
+
+    The latency of a message write is the base latency plus the per document latency times the number of
+    documents. The written documents are not kept in memory.
+    """
+    def __init__(self, store_latency: float = 0.0, document_latency: float = 0.0, metadata_latency: float = 0.0):
+        self.__store_latency = store_latency
+        self.__document_latency = document_latency
+        self.__metadata_latency = metadata_latency
+
+        self.__store_calls = 0
+        self.__stored_documents = 0
+        self.__metadata_updates = 0
+        self.__index_updates = 0
+        self.__simulation_documents = {}
+
+    @property
+    def store_calls(self) -> int:
+        """The number of store_messages calls."""
+        return self.__store_calls
+
+    @property
+    def stored_documents(self) -> int:
+        """The total number of stored documents."""
+        return self.__stored_documents
+
+    @property
+    def metadata_updates(self) -> int:
+        """The number of update_metadata calls."""
+        return self.__metadata_updates
+
+    @property
+    def index_updates(self) -> int:
+        """The number of index creation calls."""
+        return self.__index_updates
+
+    @property
+    def simulation_documents(self) -> Dict[Optional[str], int]:
+        """The number of stored documents for each simulation."""
+        return self.__simulation_documents
+
+    async def store_messages(self, documents: List[Tuple[dict, str]], invalid: bool = False,
+                             default_simulation_id: Optional[str] = None) -> List[str]:
+        """Waits for the configured write latency and returns generated ids for the documents."""
+        await asyncio.sleep(self.__store_latency + self.__document_latency * len(documents))
+        self.__store_calls += 1
+        self.__stored_documents += len(documents)
+        for document, _ in documents:
+            simulation_id = default_simulation_id if invalid else document.get("SimulationId", None)
+            self.__simulation_documents[simulation_id] = self.__simulation_documents.get(simulation_id, 0) + 1
+        return [str(self.__stored_documents - index) for index in range(len(documents), 0, -1)]
+
+    async def update_metadata(self, simulation_id: str, **attributes: Any) -> bool:
+        """Waits for the configured metadata latency."""
+        del simulation_id, attributes
+        await asyncio.sleep(self.__metadata_latency)
+        self.__metadata_updates += 1
+        return True
+
+    async def update_metadata_indexes(self):
+        """Counts the index update."""
+        self.__index_updates += 1
+
+    async def add_simulation_indexes(self, simulation_id: str):
+        """Counts the index update."""
+        del simulation_id
+        self.__index_updates += 1
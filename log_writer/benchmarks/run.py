@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 Tampere University and VTT Technical Research Centre of Finland
+# This software was developed as a part of the ProCemPlus project: https://www.senecc.fi/projects/procemplus
+# This source code is licensed under the MIT license. See LICENSE in the repository root directory.
+# Author(s): Ville Heikkilä <ville.heikkila@tuni.fi>
+#            Otto Hylli <otto.hylli@tuni.fi>
+
+"""Command line tool for running the log writer benchmarks without RabbitMQ or MongoDB.
+
+The synthetic messages are fed to the listener component through an in-memory message bus and
+the database writes go to an in-memory database client with a configurable latency."""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+import tracemalloc
+from typing import Dict, List, NamedTuple, cast
+
+from tools.clients import RabbitmqClient
+from tools.db_clients import MongodbClient
+
+from log_writer.benchmarks.fake_clients import FakeMongodbClient, FakeRabbitmqClient
+from log_writer.benchmarks.traffic import TrafficGenerator
+from log_writer.listener import ListenerComponent
+
+# the simulation id that is used for the invalid messages if SIMULATION_ID has not been set
+DEFAULT_SIMULATION_ID = "benchmark-invalid-messages"
+LATENCY_PERCENTILES = (50.0, 90.0, 99.0, 99.9)
+
+
+class BenchmarkResult(NamedTuple):
+    """The results of a single benchmark run."""
+    messages: int
+    duration: float
+    throughput: float
+    latency_percentiles: Dict[str, float]
+    flush_count: int
+    store_calls: int
+    stored_documents: int
+    metadata_updates: int
+    peak_memory: int
+    peak_memory_per_simulation: int
+
+
+def get_percentile(sorted_values: List[float], percentile: float) -> float:
+    """Returns the given percentile from a sorted list using the nearest rank method."""
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(percentile / 100.0 * len(sorted_values))), 1)
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+async def ignore_simulation_end():
+    """Used instead of stopping the listener when a simulation ends, since the listener is stopped
+       only after all the simulations have been fed."""
+
+
+async def run_benchmark(traffic_generator: TrafficGenerator, mongo_client: FakeMongodbClient,
+                        raw_storage_mode: bool = False, trace_memory: bool = False) -> BenchmarkResult:
+    """Feeds the generated messages to a listener component and returns the benchmark results.
+       The measured duration includes writing all the buffered messages when the listener is stopped."""
+    os.environ.setdefault("SIMULATION_ID", DEFAULT_SIMULATION_ID)
+    # the messages are generated before the measurement, so that only the log writer is measured
+    messages = [
+        (topic_name, message_body.encode("UTF-8") if raw_storage_mode else message_body)
+        for topic_name, message_body in traffic_generator.messages()
+    ]
+
+    if trace_memory:
+        tracemalloc.start()
+    rabbitmq_client = FakeRabbitmqClient()
+    listener = ListenerComponent(
+        raw_storage_mode=raw_storage_mode,
+        stop_function=ignore_simulation_end,
+        rabbitmq_client=cast(RabbitmqClient, rabbitmq_client),
+        mongo_client=cast(MongodbClient, mongo_client))
+
+    latencies = []
+    start_time = time.perf_counter()
+    for topic_name, message_body in messages:
+        message_start_time = time.perf_counter()
+        await rabbitmq_client.publish(topic_name, message_body)
+        latencies.append(time.perf_counter() - message_start_time)
+    await listener.stop()
+    duration = time.perf_counter() - start_time
+
+    peak_memory = 0
+    if trace_memory:
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    latencies.sort()
+    return BenchmarkResult(
+        messages=len(messages),
+        duration=duration,
+        throughput=len(messages) / duration if duration > 0 else 0.0,
+        latency_percentiles={
+            "p{:g}".format(percentile): get_percentile(latencies, percentile)
+            for percentile in LATENCY_PERCENTILES
+        },
+        flush_count=listener.message_buffer.flush_count,
+        store_calls=mongo_client.store_calls,
+        stored_documents=mongo_client.stored_documents,
+        metadata_updates=mongo_client.metadata_updates,
+        peak_memory=peak_memory,
+        peak_memory_per_simulation=peak_memory // max(len(traffic_generator.simulation_ids), 1))
+
+
+def format_result(result: BenchmarkResult) -> str:
+    """Returns the benchmark result as a human readable report."""
+    return "\n".join([
+        "messages:                   {:d}".format(result.messages),
+        "duration:                   {:.3f} s".format(result.duration),
+        "throughput:                 {:.1f} messages/s".format(result.throughput),
+        "message handling latency:   {:s}".format(", ".join(
+            "{:s} {:.3f} ms".format(name, latency * 1000.0)
+            for name, latency in result.latency_percentiles.items())),
+        "message buffer flushes:     {:d}".format(result.flush_count),
+        "store_messages calls:       {:d}".format(result.store_calls),
+        "stored documents:           {:d}".format(result.stored_documents),
+        "metadata updates:           {:d}".format(result.metadata_updates),
+        "peak memory:                {:s}".format(
+            "{:.1f} KiB".format(result.peak_memory / 1024) if result.peak_memory else "(not traced)"),
+        "peak memory per simulation: {:s}".format(
+            "{:.1f} KiB".format(result.peak_memory_per_simulation / 1024) if result.peak_memory else "(not traced)")
+    ])
+
+
+def main():
+    """Parses the command line arguments, runs the benchmark and prints out the results."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--simulations", type=int, default=1, help="the number of concurrent simulations")
+    parser.add_argument("--epochs", type=int, default=100, help="the number of epochs per simulation")
+    parser.add_argument("--components", type=int, default=10, help="the number of components per simulation")
+    parser.add_argument("--series-length", type=int, default=96,
+                        help="the number of values in the time series of the result messages")
+    parser.add_argument("--invalid-share", type=float, default=0.01,
+                        help="the share of the non-control messages that are replaced with invalid ones")
+    parser.add_argument("--store-latency", type=float, default=0.005,
+                        help="the base latency in seconds for each store_messages call")
+    parser.add_argument("--document-latency", type=float, default=0.00005,
+                        help="the additional store_messages latency in seconds for each document")
+    parser.add_argument("--metadata-latency", type=float, default=0.005,
+                        help="the latency in seconds for each update_metadata call")
+    parser.add_argument("--raw", action="store_true", help="use the raw storage mode")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="trace the peak memory usage (slows down the message handling)")
+    parser.add_argument("--seed", type=int, default=0, help="the seed for the random generator")
+    parser.add_argument("--json", action="store_true", help="print the results in JSON format")
+    arguments = parser.parse_args()
+
+    traffic_generator = TrafficGenerator(
+        simulations=arguments.simulations, epochs=arguments.epochs, components=arguments.components,
+        series_length=arguments.series_length, invalid_share=arguments.invalid_share, seed=arguments.seed)
+    mongo_client = FakeMongodbClient(
+        store_latency=arguments.store_latency, document_latency=arguments.document_latency,
+        metadata_latency=arguments.metadata_latency)
+
+    result = asyncio.run(run_benchmark(
+        traffic_generator, mongo_client, raw_storage_mode=arguments.raw, trace_memory=arguments.trace_memory))
+    if arguments.json:
+        print(json.dumps(result._asdict(), indent=4))
+    else:
+        print(format_result(result))
+
+
+if __name__ == "__main__":
+    main()
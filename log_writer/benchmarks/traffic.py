@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 Tampere University and VTT Technical Research Centre of Finland
+# This software was developed as a part of the ProCemPlus project: https://www.senecc.fi/projects/procemplus
+# This source code is licensed under the MIT license. See LICENSE in the repository root directory.
+# Author(s): Ville Heikkilä <ville.heikkila@tuni.fi>
+#            Otto Hylli <otto.hylli@tuni.fi>
+
+"""Module containing a generator for synthetic simulation message traffic."""
+
+import datetime
+import json
+import random
+from typing import Any, Dict, Iterator, List, Tuple
+
+SIMULATION_STATE_TOPIC = "SimulationState"
+EPOCH_TOPIC = "Epoch"
+STATUS_TOPIC = "Status.Ready"
+RESULT_TOPIC_PREFIX = "Result."
+MANAGER_PROCESS_ID = "SimulationManager"
+
+START_TIME = datetime.datetime(2020, 6, 1, tzinfo=datetime.timezone.utc)
+EPOCH_LENGTH = datetime.timedelta(hours=1)
+
+
+def to_timestamp(timestamp: datetime.datetime) -> str:
+    """Returns the given datetime as a simulation platform timestamp string."""
+    return timestamp.strftime("%Y-%m-%dT%H:%M:%S.") + "{:03d}Z".format(timestamp.microsecond // 1000)
+
+
+class TrafficGenerator:
+    """Class for generating the messages of simulation runs in the order they would be seen on the message bus.
+
+    Each simulation starts and ends with a simulation state message. In every epoch the simulation manager
+    sends an epoch message and every component answers with a result message containing a time series block
+    and with a ready status message. The epochs of concurrent simulations are interleaved.
+    A share of the messages can be replaced with invalid JSON or with messages missing required attributes.
+    """
+    def __init__(self, simulations: int = 1, epochs: int = 10, components: int = 5, series_length: int = 96,
+                 invalid_share: float = 0.0, seed: int = 0):
+        self.__simulations = max(simulations, 1)
+        self.__epochs = max(epochs, 1)
+        self.__components = max(components, 1)
+        self.__series_length = max(series_length, 1)
+        self.__invalid_share = min(max(invalid_share, 0.0), 1.0)
+        self.__random = random.Random(seed)
+        self.__message_counter = 0
+
+        self.__simulation_ids = [
+            to_timestamp(START_TIME + datetime.timedelta(seconds=simulation_index))
+            for simulation_index in range(self.__simulations)
+        ]
+        self.__component_ids = ["Component{:d}".format(component_index)
+                                for component_index in range(self.__components)]
+
+    @property
+    def simulation_ids(self) -> List[str]:
+        """The simulation ids of the generated simulations."""
+        return self.__simulation_ids
+
+    @property
+    def message_count(self) -> int:
+        """The total number of messages that are generated."""
+        return self.__simulations * (2 + self.__epochs * (1 + 2 * self.__components))
+
+    def messages(self) -> Iterator[Tuple[str, str]]:
+        """Generates the messages as (topic, message body) tuples."""
+        yield from self.__simulation_state_messages("running")
+        yield from self.__epoch_messages()
+        yield from self.__simulation_state_messages("stopped")
+
+    def __simulation_state_messages(self, simulation_state: str) -> Iterator[Tuple[str, str]]:
+        """Generates the simulation state messages for all the simulations."""
+        for simulation_id in self.__simulation_ids:
+            yield SIMULATION_STATE_TOPIC, self.__to_body({
+                **self.__base_message("SimulationState", simulation_id, MANAGER_PROCESS_ID),
+                "SimulationState": simulation_state,
+                "Name": "Benchmark simulation",
+                "Description": "Synthetic traffic for the log writer benchmarks"
+            })
+
+    def __epoch_messages(self) -> Iterator[Tuple[str, str]]:
+        """Generates the messages for all the epochs."""
+        for epoch_number in range(1, self.__epochs + 1):
+            epoch_start = START_TIME + (epoch_number - 1) * EPOCH_LENGTH
+            for simulation_id in self.__simulation_ids:
+                epoch_message = {
+                    **self.__base_message("Epoch", simulation_id, MANAGER_PROCESS_ID),
+                    "EpochNumber": epoch_number,
+                    "TriggeringMessageIds": [],
+                    "StartTime": to_timestamp(epoch_start),
+                    "EndTime": to_timestamp(epoch_start + EPOCH_LENGTH)
+                }
+                epoch_message_id = epoch_message["MessageId"]
+                yield EPOCH_TOPIC, self.__to_body(epoch_message)
+
+                for component_id in self.__component_ids:
+                    yield RESULT_TOPIC_PREFIX + component_id, self.__to_body({
+                        **self.__base_message("Result", simulation_id, component_id),
+                        "EpochNumber": epoch_number,
+                        "TriggeringMessageIds": [epoch_message_id],
+                        "Forecast": self.__time_series_block(epoch_start)
+                    })
+                    yield STATUS_TOPIC, self.__to_body({
+                        **self.__base_message("Status", simulation_id, component_id),
+                        "EpochNumber": epoch_number,
+                        "TriggeringMessageIds": [epoch_message_id],
+                        "Value": "ready"
+                    })
+
+    def __base_message(self, message_type: str, simulation_id: str, source_process_id: str) -> Dict[str, Any]:
+        """Returns the attributes that are common to all the messages."""
+        self.__message_counter += 1
+        return {
+            "Type": message_type,
+            "SimulationId": simulation_id,
+            "SourceProcessId": source_process_id,
+            "MessageId": "{:s}-{:d}".format(source_process_id, self.__message_counter),
+            "Timestamp": to_timestamp(datetime.datetime.now(datetime.timezone.utc))
+        }
+
+    def __time_series_block(self, epoch_start: datetime.datetime) -> Dict[str, Any]:
+        """Returns a time series block with two series of the configured length."""
+        step = EPOCH_LENGTH / self.__series_length
+        return {
+            "TimeIndex": [to_timestamp(epoch_start + index * step) for index in range(self.__series_length)],
+            "Series": {
+                "RealPower": {
+                    "UnitOfMeasure": "kW",
+                    "Values": [round(self.__random.uniform(-10.0, 10.0), 3) for _ in range(self.__series_length)]
+                },
+                "ReactivePower": {
+                    "UnitOfMeasure": "kV.A{r}",
+                    "Values": [round(self.__random.uniform(-5.0, 5.0), 3) for _ in range(self.__series_length)]
+                }
+            }
+        }
+
+    def __to_body(self, message: Dict[str, Any]) -> str:
+        """Returns the message as a JSON string. The message is replaced with an invalid one with
+           the probability given by the invalid share. Control messages are never replaced."""
+        if (self.__invalid_share > 0.0 and message["Type"] not in ("SimulationState", "Epoch") and
+                self.__random.random() < self.__invalid_share):
+            if self.__random.random() < 0.5:
+                # invalid JSON
+                return json.dumps(message)[:-1]
+            # valid JSON that is missing a required attribute
+            del message["SourceProcessId"]
+        return json.dumps(message)
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 Tampere University and VTT Technical Research Centre of Finland
+# This software was developed as a part of the ProCemPlus project: https://www.senecc.fi/projects/procemplus
+# This source code is licensed under the MIT license. See LICENSE in the repository root directory.
+# Author(s): Ville Heikkilä <ville.heikkila@tuni.fi>
+#            Otto Hylli <otto.hylli@tuni.fi>
+
+"""Command line tool for comparing the message decoding and validation throughput.
+
+The baseline decodes the messages with the standard library json module and validates them with
+GeneralMessage.from_json. The compared variants decode the messages with the configured JSON codecs
+and validate them with the message validator cache that is used by the listener component."""
+
+import argparse
+import json
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+from tools.messages import GeneralMessage
+
+from log_writer.benchmarks.traffic import TrafficGenerator
+from log_writer.json_codec import JSON_CODEC_ORJSON, JSON_CODEC_STDLIB, JsonCodec
+from log_writer.validation import MessageValidatorCache
+
+
+class ValidationResult(NamedTuple):
+    """The results of a single decoding and validation variant."""
+    name: str
+    messages: int
+    valid_messages: int
+    decoding_time: float
+    validation_time: float
+    throughput: float
+
+
+def measure(name: str, message_bodies: List[bytes], decode: Callable[[bytes], Any],
+            validate: Callable[[Dict[str, Any]], Optional[Any]], rounds: int) -> ValidationResult:
+    """Decodes and validates the given messages the given number of times and returns the results."""
+    decoding_time = 0.0
+    validation_time = 0.0
+    valid_messages = 0
+    for _ in range(rounds):
+        start_time = time.perf_counter()
+        decoded_messages = []
+        for message_body in message_bodies:
+            try:
+                decoded_messages.append(decode(message_body))
+            except ValueError:
+                # the invalid JSON messages are skipped
+                pass
+        decoding_time += time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        valid_messages = sum(1 for message_json in decoded_messages if validate(message_json) is not None)
+        validation_time += time.perf_counter() - start_time
+
+    total_time = decoding_time + validation_time
+    return ValidationResult(
+        name=name,
+        messages=len(message_bodies) * rounds,
+        valid_messages=valid_messages * rounds,
+        decoding_time=decoding_time,
+        validation_time=validation_time,
+        throughput=len(message_bodies) * rounds / total_time if total_time > 0 else 0.0)
+
+
+def run_validation_benchmark(traffic_generator: TrafficGenerator, rounds: int = 1) -> List[ValidationResult]:
+    """Returns the results for the baseline and for each available JSON codec with the validator cache."""
+    message_bodies = [message_body.encode("UTF-8") for _, message_body in traffic_generator.messages()]
+    results = [
+        measure("json + GeneralMessage.from_json", message_bodies, json.loads, GeneralMessage.from_json, rounds)
+    ]
+
+    codec_names = [JSON_CODEC_STDLIB]
+    if JsonCodec(JSON_CODEC_ORJSON).name == JSON_CODEC_ORJSON:
+        codec_names.append(JSON_CODEC_ORJSON)
+    for codec_name in codec_names:
+        # a new cache for each variant, so that the cache is also filled during the measurement
+        validator = MessageValidatorCache()
+        results.append(measure(
+            "{:s} + MessageValidatorCache".format(codec_name), message_bodies,
+            JsonCodec(codec_name).loads, validator.validate, rounds))
+    return results
+
+
+def format_results(results: List[ValidationResult]) -> str:
+    """Returns the results as a human readable report relative to the first result."""
+    baseline_throughput = results[0].throughput if results else 0.0
+    return "\n".join(
+        "{:s}\n  valid messages: {:d}/{:d}, decoding: {:.3f} s, validation: {:.3f} s, "
+        "throughput: {:.1f} messages/s ({:.2f}x)".format(
+            result.name, result.valid_messages, result.messages, result.decoding_time, result.validation_time,
+            result.throughput, result.throughput / baseline_throughput if baseline_throughput > 0 else 0.0)
+        for result in results
+    )
+
+
+def main():
+    """Parses the command line arguments, runs the benchmark and prints out the results."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--simulations", type=int, default=1, help="the number of concurrent simulations")
+    parser.add_argument("--epochs", type=int, default=100, help="the number of epochs per simulation")
+    parser.add_argument("--components", type=int, default=10, help="the number of components per simulation")
+    parser.add_argument("--series-length", type=int, default=96,
+                        help="the number of values in the time series of the result messages")
+    parser.add_argument("--invalid-share", type=float, default=0.01,
+                        help="the share of the non-control messages that are replaced with invalid ones")
+    parser.add_argument("--rounds", type=int, default=5, help="the number of times the messages are handled")
+    parser.add_argument("--seed", type=int, default=0, help="the seed for the random generator")
+    parser.add_argument("--json", action="store_true", help="print the results in JSON format")
+    arguments = parser.parse_args()
+
+    traffic_generator = TrafficGenerator(
+        simulations=arguments.simulations, epochs=arguments.epochs, components=arguments.components,
+        series_length=arguments.series_length, invalid_share=arguments.invalid_share, seed=arguments.seed)
+
+    results = run_validation_benchmark(traffic_generator, rounds=max(arguments.rounds, 1))
+    if arguments.json:
+        print(json.dumps([result._asdict() for result in results], indent=4))
+    else:
+        print(format_results(results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 Tampere University and VTT Technical Research Centre of Finland
+# This software was developed as a part of the ProCemPlus project: https://www.senecc.fi/projects/procemplus
+# This source code is licensed under the MIT license. See LICENSE in the repository root directory.
+# Author(s): Ville Heikkilä <ville.heikkila@tuni.fi>
+#            Otto Hylli <otto.hylli@tuni.fi>
+
+"""Module containing the preparation of the simulation specific message collections and their indexes.
+
+In the document mode the collections are created by MongodbClient when the first message is stored and the indexes
+are added after the simulation has ended or, if the early indexes are enabled, in a background task soon after
+the simulation has started. In the time series mode the collections are created before the first message is stored
+as MongoDB time series collections (requires MongoDB 5.0 or later) with Timestamp as the time field and Topic as
+the meta field. The time series collections are clustered by the meta and time fields, so the separate simulation
+indexes are not added to them. If the time series collection cannot be created or an ordinary collection already
+exists for the simulation, the indexes are added in the same way as in the document mode."""
+
+import asyncio
+from typing import Any, Optional, Set, cast
+
+from tools.tools import FullLogger, load_environmental_variables
+
+from log_writer.mongodb import get_simulation_collection
+from log_writer.storage import StorageBackend
+
+LOGGER = FullLogger(__name__)
+
+COLLECTION_MODE_DOCUMENT = "document"
+COLLECTION_MODE_TIMESERIES = "timeseries"
+
+MESSAGE_COLLECTION_MODE_NAME = "MESSAGE_COLLECTION_MODE"
+TIMESERIES_GRANULARITY_NAME = "TIMESERIES_GRANULARITY"
+EARLY_INDEXES_NAME = "EARLY_INDEXES"
+EARLY_INDEX_DELAY_NAME = "EARLY_INDEX_DELAY"
+
+ENV_VARIABLES = load_environmental_variables(
+    # the type of the simulation specific message collections: document or timeseries
+    (MESSAGE_COLLECTION_MODE_NAME, str, COLLECTION_MODE_DOCUMENT),
+    # the granularity of the time series collections: seconds, minutes or hours
+    (TIMESERIES_GRANULARITY_NAME, str, "seconds"),
+    # whether the indexes are added in a background task soon after a simulation has started in the document mode
+    (EARLY_INDEXES_NAME, bool, False),
+    # the delay in seconds after the first message of a simulation before the early indexes are added
+    (EARLY_INDEX_DELAY_NAME, float, 5.0)
+)
+
+TIMESERIES_TIME_FIELD = "Timestamp"
+TIMESERIES_META_FIELD = "Topic"
+TIMESERIES_COLLECTION_TYPE = "timeseries"
+
+
+class CollectionManager:
+    """Class for preparing the simulation specific message collections and adding their indexes."""
+    def __init__(self, storage: StorageBackend, collection_mode: Optional[str] = None,
+                 early_indexes: Optional[bool] = None, early_index_delay: Optional[float] = None,
+                 database: Any = None):
+        self.__storage = storage
+        collection_mode = cast(str, collection_mode if collection_mode is not None
+                               else ENV_VARIABLES[MESSAGE_COLLECTION_MODE_NAME]).lower()
+        if collection_mode not in (COLLECTION_MODE_DOCUMENT, COLLECTION_MODE_TIMESERIES):
+            LOGGER.warning("Unknown message collection mode '{:s}', using '{:s}'.".format(
+                collection_mode, COLLECTION_MODE_DOCUMENT))
+            collection_mode = COLLECTION_MODE_DOCUMENT
+        if collection_mode == COLLECTION_MODE_TIMESERIES and not storage.uses_mongodb:
+            LOGGER.warning("The time series collections require the MongoDB storage backend, using '{:s}'.".format(
+                COLLECTION_MODE_DOCUMENT))
+            collection_mode = COLLECTION_MODE_DOCUMENT
+        self.__collection_mode = collection_mode
+        self.__early_indexes = cast(bool, early_indexes if early_indexes is not None
+                                    else ENV_VARIABLES[EARLY_INDEXES_NAME])
+        self.__early_index_delay = max(cast(float, early_index_delay if early_index_delay is not None
+                                            else ENV_VARIABLES[EARLY_INDEX_DELAY_NAME]), 0.0)
+        # if not given, the database from the MONGODB_DATABASE environmental variable is used
+        self.__database = database
+
+        # the simulations whose indexes have been added or that do not need separate indexes
+        self.__indexed_simulations: Set[str] = set()
+        self.__index_tasks = set()
+
+    @property
+    def collection_mode(self) -> str:
+        """The type of the simulation specific message collections: document or timeseries."""
+        return self.__collection_mode
+
+    @property
+    def early_indexes(self) -> bool:
+        """Returns True, if the indexes are added soon after the simulations have started."""
+        return self.__early_indexes
+
+    async def prepare_simulation(self, simulation_id: str):
+        """Prepares the message collection for a new simulation. Called before the first message of
+           the simulation is stored."""
+        if (self.__collection_mode == COLLECTION_MODE_TIMESERIES and
+                await self.__create_timeseries_collection(simulation_id)):
+            self.__indexed_simulations.add(simulation_id)
+
+        elif self.__early_indexes and simulation_id not in self.__indexed_simulations:
+            index_task = asyncio.create_task(self.__add_early_indexes(simulation_id))
+            self.__index_tasks.add(index_task)
+            index_task.add_done_callback(self.__index_tasks.discard)
+
+    async def add_simulation_indexes(self, simulation_id: str):
+        """Adds the indexes to the message collection of the simulation unless they have already been added."""
+        if simulation_id in self.__indexed_simulations:
+            return
+        self.__indexed_simulations.add(simulation_id)
+        await self.__storage.add_simulation_indexes(simulation_id)
+
+    def remove_simulation(self, simulation_id: str):
+        """Removes the simulation from the bookkeeping, e.g. when the simulation is removed from memory."""
+        self.__indexed_simulations.discard(simulation_id)
+
+    async def close(self):
+        """Cancels the pending early index tasks."""
+        for index_task in list(self.__index_tasks):
+            index_task.cancel()
+        await asyncio.gather(*self.__index_tasks, return_exceptions=True)
+
+    async def __add_early_indexes(self, simulation_id: str):
+        """Adds the indexes for the simulation after the early index delay."""
+        await asyncio.sleep(self.__early_index_delay)
+        LOGGER.debug("Adding the early indexes for simulation '{:s}'".format(simulation_id))
+        await self.add_simulation_indexes(simulation_id)
+
+    async def __create_timeseries_collection(self, simulation_id: str) -> bool:
+        """Creates the message collection for the simulation as a time series collection.
+           An already existing collection is used as it is.
+           Returns True, if the message collection for the simulation is a time series collection."""
+        try:
+            collection = get_simulation_collection(simulation_id, self.__database)
+            database = collection.database
+            collection_type = await CollectionManager.__get_collection_type(database, collection.name)
+            if collection_type is None:
+                try:
+                    await database.create_collection(
+                        collection.name,
+                        timeseries={
+                            "timeField": TIMESERIES_TIME_FIELD,
+                            "metaField": TIMESERIES_META_FIELD,
+                            "granularity": cast(str, ENV_VARIABLES[TIMESERIES_GRANULARITY_NAME])
+                        })
+                    LOGGER.info("Created time series collection '{:s}'".format(collection.name))
+                    return True
+
+                except Exception:  # pylint: disable=broad-except
+                    # another worker process might have created the collection at the same time
+                    collection_type = await CollectionManager.__get_collection_type(database, collection.name)
+                    if collection_type is None:
+                        raise
+
+        except Exception as error:  # pylint: disable=broad-except
+            LOGGER.warning("Could not create time series collection for simulation '{:s}': {:s}".format(
+                simulation_id, str(error)))
+            return False
+
+        if collection_type != TIMESERIES_COLLECTION_TYPE:
+            LOGGER.warning("The message collection for simulation '{:s}' is not a time series collection.".format(
+                simulation_id))
+            return False
+        return True
+
+    @staticmethod
+    async def __get_collection_type(database: Any, collection_name: str) -> Optional[str]:
+        """Returns the type of the given collection, e.g. "collection" or "timeseries",
+           or None if the collection does not exist."""
+        collection_cursor = await database.list_collections(filter={"name": collection_name})
+        for collection_info in await collection_cursor.to_list(length=None):
+            return collection_info.get("type", None)
+        return None
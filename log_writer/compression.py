@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 Tampere University and VTT Technical Research Centre of Finland
+# This software was developed as a part of the ProCemPlus project: https://www.senecc.fi/projects/procemplus
+# This source code is licensed under the MIT license. See LICENSE in the repository root directory.
+# Author(s): Ville Heikkilä <ville.heikkila@tuni.fi>
+#            Otto Hylli <otto.hylli@tuni.fi>
+
+"""Module containing the compression of the large payload attributes in the stored message documents.
+
+The compressed attributes are stored as binary data containing the compressed JSON representation of
+the original value. The names of the compressed attributes and the used compression method are stored
+in the CompressedAttributes attribute, so that the original document can be restored using decompress_document.
+The zstd compression requires the zstandard library, zlib is always available."""
+
+import zlib
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple, cast
+
+from tools.tools import FullLogger, load_environmental_variables
+
+from log_writer.json_codec import DEFAULT_CODEC, JsonCodec
+
+LOGGER = FullLogger(__name__)
+
+COMPRESSION_NONE = "none"
+COMPRESSION_ZLIB = "zlib"
+COMPRESSION_ZSTD = "zstd"
+
+PAYLOAD_COMPRESSION_NAME = "PAYLOAD_COMPRESSION"
+PAYLOAD_COMPRESSION_THRESHOLD_NAME = "PAYLOAD_COMPRESSION_THRESHOLD"
+PAYLOAD_COMPRESSION_LEVEL_NAME = "PAYLOAD_COMPRESSION_LEVEL"
+
+ENV_VARIABLES = load_environmental_variables(
+    # the compression method for the large payload attributes: none, zlib or zstd
+    (PAYLOAD_COMPRESSION_NAME, str, COMPRESSION_NONE),
+    # the minimum size in bytes of the JSON representation of an attribute value for it to be compressed
+    (PAYLOAD_COMPRESSION_THRESHOLD_NAME, int, 4096),
+    # the compression level, value -1 uses the default level of the compression method
+    (PAYLOAD_COMPRESSION_LEVEL_NAME, int, -1)
+)
+
+# the attribute that lists the compressed attributes and their compression methods
+COMPRESSED_ATTRIBUTES = "CompressedAttributes"
+
+# the attributes that are used in the indexes and queries are never compressed
+PLAIN_ATTRIBUTES = frozenset([
+    "Type", "SimulationId", "SourceProcessId", "MessageId", "EpochNumber", "Timestamp", "Topic",
+    "TriggeringMessageIds", "LastUpdatedInEpoch", COMPRESSED_ATTRIBUTES
+])
+
+
+class CompressionResult(NamedTuple):
+    """The documents after the compression and the total sizes of the compressed attributes."""
+    documents: List[Tuple[dict, str]]
+    original_bytes: int
+    compressed_bytes: int
+
+
+def get_zstandard_module() -> Any:
+    """Returns the zstandard module or None if it is not installed."""
+    try:
+        import zstandard  # type: ignore  # pylint: disable=import-outside-toplevel
+        return zstandard
+    except ImportError:
+        return None
+
+
+class PayloadCompressor:
+    """Class for compressing the large payload attributes of the message documents before they are stored.
+
+    Each top level attribute that is not one of the plain attributes and whose JSON representation is at least
+    the threshold size is compressed. The compressed value is used only if it is smaller than the original.
+    """
+    def __init__(self, compression: Optional[str] = None, threshold: Optional[int] = None,
+                 level: Optional[int] = None, json_codec: JsonCodec = DEFAULT_CODEC):
+        compression = cast(str, compression if compression is not None
+                           else ENV_VARIABLES[PAYLOAD_COMPRESSION_NAME]).lower()
+        self.__threshold = max(cast(int, threshold if threshold is not None
+                                    else ENV_VARIABLES[PAYLOAD_COMPRESSION_THRESHOLD_NAME]), 1)
+        self.__level = cast(int, level if level is not None else ENV_VARIABLES[PAYLOAD_COMPRESSION_LEVEL_NAME])
+        self.__json_codec = json_codec
+        self.__compress_function = None
+
+        if compression == COMPRESSION_ZSTD:
+            zstandard = get_zstandard_module()
+            if zstandard is not None:
+                compressor = zstandard.ZstdCompressor(level=self.__level if self.__level >= 0 else 3)
+                self.__compress_function = compressor.compress
+            else:
+                LOGGER.warning("The zstandard library is not installed, using zlib for the payload compression.")
+                compression = COMPRESSION_ZLIB
+        if compression == COMPRESSION_ZLIB:
+            self.__compress_function = self.__zlib_compress
+        elif compression not in (COMPRESSION_NONE, COMPRESSION_ZSTD):
+            LOGGER.warning("Unknown payload compression '{:s}', the payloads are not compressed.".format(compression))
+            compression = COMPRESSION_NONE
+        self.__compression = compression
+
+    @property
+    def compression(self) -> str:
+        """The used compression method."""
+        return self.__compression
+
+    @property
+    def threshold(self) -> int:
+        """The minimum size in bytes for an attribute to be compressed."""
+        return self.__threshold
+
+    @property
+    def is_active(self) -> bool:
+        """Returns True, if the payload attributes are compressed."""
+        return self.__compress_function is not None
+
+    def compress_document(self, document: dict) -> Tuple[dict, int, int]:
+        """Returns the document with its large payload attributes compressed and the original and
+           the compressed sizes of the compressed attributes. The given document is not modified."""
+        if self.__compress_function is None:
+            return document, 0, 0
+
+        compressed_attributes = {}
+        original_bytes = 0
+        compressed_bytes = 0
+        for attribute_name, attribute_value in document.items():
+            if attribute_name in PLAIN_ATTRIBUTES or not isinstance(attribute_value, (dict, list, str)):
+                continue
+            if isinstance(attribute_value, str) and len(attribute_value) < self.__threshold:
+                continue
+
+            encoded_value = self.__json_codec.dumps(attribute_value)
+            if len(encoded_value) < self.__threshold:
+                continue
+            compressed_value = cast(bytes, self.__compress_function(encoded_value))
+            if len(compressed_value) < len(encoded_value):
+                compressed_attributes[attribute_name] = compressed_value
+                original_bytes += len(encoded_value)
+                compressed_bytes += len(compressed_value)
+
+        if not compressed_attributes:
+            return document, 0, 0
+        return (
+            {
+                **document,
+                **compressed_attributes,
+                COMPRESSED_ATTRIBUTES: {attribute_name: self.__compression for attribute_name in compressed_attributes}
+            },
+            original_bytes,
+            compressed_bytes
+        )
+
+    def compress_documents(self, documents: List[Tuple[dict, str]]) -> CompressionResult:
+        """Compresses the large payload attributes in the given (document, topic) tuples."""
+        compressed_documents = []
+        original_bytes = 0
+        compressed_bytes = 0
+        for document, topic_name in documents:
+            compressed_document, document_original_bytes, document_compressed_bytes = self.compress_document(document)
+            compressed_documents.append((compressed_document, topic_name))
+            original_bytes += document_original_bytes
+            compressed_bytes += document_compressed_bytes
+        return CompressionResult(compressed_documents, original_bytes, compressed_bytes)
+
+    def __zlib_compress(self, data: bytes) -> bytes:
+        """Compresses the data using zlib."""
+        return zlib.compress(data, self.__level)
+
+
+def decompress_document(document: Dict[str, Any], json_codec: JsonCodec = DEFAULT_CODEC) -> Dict[str, Any]:
+    """Returns the original document from a stored document with compressed attributes.
+       Documents without compressed attributes are returned as they are."""
+    compressed_attributes = document.get(COMPRESSED_ATTRIBUTES, None)
+    if not compressed_attributes:
+        return document
+
+    original_document = {
+        attribute_name: attribute_value
+        for attribute_name, attribute_value in document.items()
+        if attribute_name != COMPRESSED_ATTRIBUTES
+    }
+    for attribute_name, compression in compressed_attributes.items():
+        compressed_value = bytes(document[attribute_name])
+        if compression == COMPRESSION_ZLIB:
+            encoded_value = zlib.decompress(compressed_value)
+        elif compression == COMPRESSION_ZSTD:
+            zstandard = get_zstandard_module()
+            if zstandard is None:
+                raise ValueError("The zstandard library is required to decompress attribute '{:s}'".format(
+                    attribute_name))
+            encoded_value = zstandard.ZstdDecompressor().decompress(compressed_value)
+        else:
+            raise ValueError("Unknown compression '{:s}' for attribute '{:s}'".format(
+                str(compression), attribute_name))
+        original_document[attribute_name] = json_codec.loads(encoded_value)
+    return original_document
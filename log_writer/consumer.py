@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 Tampere University and VTT Technical Research Centre of Finland
+# This software was developed as a part of the ProCemPlus project: https://www.senecc.fi/projects/procemplus
+# This source code is licensed under the MIT license. See LICENSE in the repository root directory.
+# Author(s): Ville Heikkilä <ville.heikkila@tuni.fi>
+#            Otto Hylli <otto.hylli@tuni.fi>
+
+"""Module containing a message bus consumer that gives the received messages forward as raw bytes.
+
+By default the messages are acknowledged as soon as they have been given forward. In the acknowledge after store
+mode (RABBITMQ_ACK_AFTER_STORE) the messages are acknowledged only after their documents have been stored, so that
+the messages that were received but not stored are redelivered. To keep the messages over a log writer restart,
+a durable queue can be given with RABBITMQ_QUEUE."""
+
+import asyncio
+import multiprocessing
+import ssl
+from typing import Any, Awaitable, Callable, List, Optional, Union, cast
+
+import aio_pika
+
+from tools.tools import FullLogger, load_environmental_variables
+
+from log_writer.acknowledgements import CURRENT_DELIVERY, AckTracker
+
+LOGGER = FullLogger(__name__)
+
+RABBITMQ_HOST_NAME = "RABBITMQ_HOST"
+RABBITMQ_PORT_NAME = "RABBITMQ_PORT"
+RABBITMQ_LOGIN_NAME = "RABBITMQ_LOGIN"
+RABBITMQ_PASSWORD_NAME = "RABBITMQ_PASSWORD"
+RABBITMQ_SSL_NAME = "RABBITMQ_SSL"
+RABBITMQ_SSL_VERSION_NAME = "RABBITMQ_SSL_VERSION"
+RABBITMQ_EXCHANGE_NAME = "RABBITMQ_EXCHANGE"
+RABBITMQ_EXCHANGE_AUTODELETE_NAME = "RABBITMQ_EXCHANGE_AUTODELETE"
+RABBITMQ_EXCHANGE_DURABLE_NAME = "RABBITMQ_EXCHANGE_DURABLE"
+RABBITMQ_QUEUE_NAME = "RABBITMQ_QUEUE"
+RABBITMQ_ACK_AFTER_STORE_NAME = "RABBITMQ_ACK_AFTER_STORE"
+RABBITMQ_PREFETCH_COUNT_NAME = "RABBITMQ_PREFETCH_COUNT"
+
+ENV_VARIABLES = load_environmental_variables(
+    (RABBITMQ_HOST_NAME, str, "localhost"),
+    (RABBITMQ_PORT_NAME, int, 5672),
+    (RABBITMQ_LOGIN_NAME, str, ""),
+    (RABBITMQ_PASSWORD_NAME, str, ""),
+    (RABBITMQ_SSL_NAME, bool, False),
+    (RABBITMQ_SSL_VERSION_NAME, str, "PROTOCOL_TLS"),
+    (RABBITMQ_EXCHANGE_NAME, str, ""),
+    (RABBITMQ_EXCHANGE_AUTODELETE_NAME, bool, False),
+    (RABBITMQ_EXCHANGE_DURABLE_NAME, bool, False),
+    # the name of a durable queue for the log writer, empty value uses a temporary exclusive queue
+    (RABBITMQ_QUEUE_NAME, str, ""),
+    # whether the messages are acknowledged only after they have been stored
+    (RABBITMQ_ACK_AFTER_STORE_NAME, bool, False),
+    # the maximum number of unacknowledged messages, value 0 uses twice the maximum batch size
+    # in the acknowledge after store mode and no limit otherwise
+    (RABBITMQ_PREFETCH_COUNT_NAME, int, 0)
+)
+
+# the delays in seconds before trying to connect again after a failed connection, the delay is doubled after
+# each failed attempt up to the maximum delay
+RECONNECT_DELAY = 1.0
+MAX_RECONNECT_DELAY = 60.0
+
+
+class MessageConsumer:
+    """Message bus consumer that calls the callback function with the raw message body and the routing key.
+       Uses the same RabbitMQ connection settings as the RabbitmqClient from the simulation tools.
+
+    In the acknowledge after store mode the delivery for the message is available in CURRENT_DELIVERY while
+    the callback function is running and the delivery is acknowledged when it is completed by its tracker.
+    """
+    def __init__(self, topic_names: Union[str, List[str]],
+                 callback_function: Callable[[bytes, str], Awaitable[None]],
+                 ack_after_store: Optional[bool] = None, prefetch_count: Optional[int] = None):
+        if isinstance(topic_names, str):
+            topic_names = [topic_names]
+        self.__topic_names = topic_names
+        self.__callback_function = callback_function
+        self.__ack_after_store = cast(bool, ack_after_store if ack_after_store is not None
+                                      else ENV_VARIABLES[RABBITMQ_ACK_AFTER_STORE_NAME])
+        self.__prefetch_count = max(cast(int, prefetch_count if prefetch_count is not None
+                                         else ENV_VARIABLES[RABBITMQ_PREFETCH_COUNT_NAME]), 0)
+        self.__ack_tracker = (
+            AckTracker(
+                acknowledge_function=lambda message: message.ack(multiple=True),
+                reject_function=lambda message, requeue: message.nack(requeue=requeue),
+                redelivered_function=lambda message: bool(message.redelivered),
+                delivery_tag_function=lambda message: int(message.delivery_tag))
+            if self.__ack_after_store else None
+        )
+
+        # the robust connection from aio_pika or None if there is no open connection
+        self.__connection: Optional[Any] = None
+        self.__reconnect_delay = RECONNECT_DELAY
+        self.__consumer_task = asyncio.create_task(self.__consume())
+
+    @property
+    def topic_names(self) -> List[str]:
+        """The listened topics."""
+        return self.__topic_names
+
+    @property
+    def ack_tracker(self) -> Union[AckTracker, None]:
+        """The tracker for the unacknowledged deliveries or None if the messages are acknowledged when received."""
+        return self.__ack_tracker
+
+    async def stop_consuming(self):
+        """Stops receiving new messages. The connection is kept open for the acknowledgements of
+           the already received messages."""
+        self.__consumer_task.cancel()
+        await asyncio.gather(self.__consumer_task, return_exceptions=True)
+
+    async def close(self):
+        """Stops the consumer and closes the connection to the message bus."""
+        await self.stop_consuming()
+        if self.__ack_tracker is not None:
+            await self.__ack_tracker.close()
+        await self.__close_connection()
+
+    @staticmethod
+    def get_connection_parameters() -> dict:
+        """Returns the connection parameters for the message bus connection."""
+        connection_parameters = {
+            "host": cast(str, ENV_VARIABLES[RABBITMQ_HOST_NAME]),
+            "port": cast(int, ENV_VARIABLES[RABBITMQ_PORT_NAME])
+        }
+        if ENV_VARIABLES[RABBITMQ_LOGIN_NAME]:
+            connection_parameters["login"] = cast(str, ENV_VARIABLES[RABBITMQ_LOGIN_NAME])
+            connection_parameters["password"] = cast(str, ENV_VARIABLES[RABBITMQ_PASSWORD_NAME])
+        if ENV_VARIABLES[RABBITMQ_SSL_NAME]:
+            connection_parameters["ssl"] = True
+            connection_parameters["ssl_options"] = {
+                "ssl_version": getattr(ssl, cast(str, ENV_VARIABLES[RABBITMQ_SSL_VERSION_NAME]), ssl.PROTOCOL_TLS)
+            }
+        return connection_parameters
+
+    async def __consume(self):
+        """Consumes the messages until cancelled. If the connection cannot be established or the consuming fails,
+           the connection is tried again after a delay."""
+        while True:
+            try:
+                await self.__consume_queue()
+                LOGGER.warning("The message bus consumer stopped unexpectedly")
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:  # pylint: disable=broad-except
+                LOGGER.error("Error in the message bus connection: {:s}".format(str(error)))
+
+            await self.__close_connection()
+            LOGGER.info("Connecting to the message bus again in {:.0f} seconds".format(self.__reconnect_delay))
+            await asyncio.sleep(self.__reconnect_delay)
+            self.__reconnect_delay = min(2 * self.__reconnect_delay, MAX_RECONNECT_DELAY)
+
+    async def __close_connection(self):
+        """Closes the message bus connection, if it is open."""
+        connection = self.__connection
+        self.__connection = None
+        if connection is not None:
+            try:
+                await connection.close()
+            except Exception as error:  # pylint: disable=broad-except
+                LOGGER.warning("Error while closing the message bus connection: {:s}".format(str(error)))
+
+    async def __consume_queue(self):
+        """Listens to the topics and calls the callback function for each received message."""
+        self.__connection = await aio_pika.connect_robust(**MessageConsumer.get_connection_parameters())
+        if self.__ack_tracker is not None:
+            # the deliveries from an earlier connection can no longer be acknowledged
+            self.__ack_tracker.reset()
+        channel = await self.__connection.channel()
+        exchange = await channel.declare_exchange(
+            cast(str, ENV_VARIABLES[RABBITMQ_EXCHANGE_NAME]),
+            aio_pika.ExchangeType.TOPIC,
+            auto_delete=cast(bool, ENV_VARIABLES[RABBITMQ_EXCHANGE_AUTODELETE_NAME]),
+            durable=cast(bool, ENV_VARIABLES[RABBITMQ_EXCHANGE_DURABLE_NAME]))
+        if self.__prefetch_count > 0:
+            await channel.set_qos(prefetch_count=self.__prefetch_count)
+
+        queue_name = get_queue_name()
+        if queue_name:
+            queue = await channel.declare_queue(queue_name, durable=True)
+        else:
+            queue = await channel.declare_queue(exclusive=True, auto_delete=True)
+        for topic_name in self.__topic_names:
+            await queue.bind(exchange, topic_name)
+        LOGGER.info("Listening to topics: {:s}".format(", ".join(self.__topic_names)))
+        self.__reconnect_delay = RECONNECT_DELAY
+
+        async with queue.iterator() as queue_iterator:
+            async for message in queue_iterator:
+                if self.__ack_tracker is not None:
+                    CURRENT_DELIVERY.set(self.__ack_tracker.receive(message))
+                    await self.__handle(message.body, cast(str, message.routing_key))
+                else:
+                    # a message whose handling was cancelled when the consumer was stopped is returned to the queue
+                    async with message.process(requeue=True, ignore_processed=True):
+                        await self.__handle(message.body, cast(str, message.routing_key))
+
+    async def __handle(self, message_body: bytes, routing_key: str):
+        """Calls the callback function and logs any errors so that the consumer keeps on running."""
+        try:
+            await self.__callback_function(message_body, routing_key)
+        except asyncio.CancelledError:
+            # in Python 3.7 the cancellation is an Exception and it must not be caught when the consumer is stopped
+            raise
+        except Exception as error:  # pylint: disable=broad-except
+            LOGGER.error("Error while handling message from topic {:s}: {:s}".format(routing_key, str(error)))
+
+
+def get_queue_name() -> str:
+    """Returns the name of the durable queue or an empty string if a temporary queue is used.
+       In a worker process the process name is added to the queue name, since each worker receives all
+       the messages and selects its own shard of them."""
+    queue_name = cast(str, ENV_VARIABLES[RABBITMQ_QUEUE_NAME])
+    process_name = multiprocessing.current_process().name
+    if queue_name and process_name != "MainProcess":
+        return "{:s}.{:s}".format(queue_name, process_name)
+    return queue_name
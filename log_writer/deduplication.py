@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 Tampere University and VTT Technical Research Centre of Finland
+# This software was developed as a part of the ProCemPlus project: https://www.senecc.fi/projects/procemplus
+# This source code is licensed under the MIT license. See LICENSE in the repository root directory.
+# Author(s): Ville Heikkilä <ville.heikkila@tuni.fi>
+#            Otto Hylli <otto.hylli@tuni.fi>
+
+"""Module containing the duplicate message filter for the redelivered messages.
+
+Each simulation has its own filter that remembers the message ids of the stored messages. A message id is
+remembered only after the message has been written to the database, or to the spool when it is in use, so that
+a message whose write failed is not dropped when it is redelivered. A redelivered copy that arrives while the
+original is still waiting for the write is stored again.
+
+The most recent message ids are kept in an exact window, the older ones in a sequence of Bloom filters whose sizes
+grow with the number of received messages up to DUPLICATE_FILTER_CAPACITY message ids. A message whose id is found
+in the window is certainly a duplicate. A message whose id is found only in the Bloom filters is a duplicate with
+the exception of a fraction of at most DUPLICATE_FILTER_ERROR_RATE of the unique messages, which are dropped
+by mistake.
+
+The Bloom filters use about 1.44 * log2(1 / error rate) bits for each message id, e.g. about 29 bits with
+the default error rate. When the capacity is full, the message ids in the oldest Bloom filter are forgotten.
+The message ids are hashed with the built-in hash function, so the filters are valid only within the process."""
+
+import collections
+import math
+from typing import Deque, Iterator, List, Optional, Set, Tuple, cast
+
+from tools.tools import load_environmental_variables
+
+DUPLICATE_FILTER_NAME = "DUPLICATE_FILTER"
+DUPLICATE_FILTER_CAPACITY_NAME = "DUPLICATE_FILTER_CAPACITY"
+DUPLICATE_FILTER_ERROR_RATE_NAME = "DUPLICATE_FILTER_ERROR_RATE"
+DUPLICATE_FILTER_WINDOW_NAME = "DUPLICATE_FILTER_WINDOW"
+
+ENV_VARIABLES = load_environmental_variables(
+    # whether the messages with an already stored message id are dropped
+    (DUPLICATE_FILTER_NAME, bool, False),
+    # the number of the latest message ids that are remembered for each simulation
+    (DUPLICATE_FILTER_CAPACITY_NAME, int, 1000000),
+    # the maximum fraction of unique messages that are wrongly considered duplicates
+    (DUPLICATE_FILTER_ERROR_RATE_NAME, float, 1e-6),
+    # the number of the latest message ids that are kept in the exact window for each simulation
+    (DUPLICATE_FILTER_WINDOW_NAME, int, 2000)
+)
+
+# the number of message ids in the first Bloom filter, each following filter has twice the capacity
+INITIAL_FILTER_CAPACITY = 10000
+
+HASH_MASK = 0xFFFFFFFF
+HashValues = Tuple[int, int]
+
+
+def get_hash_values(message_id: str) -> HashValues:
+    """Returns the two 32-bit hash values that are combined into the bit indexes of the Bloom filters."""
+    hash_value = hash(message_id)
+    return hash_value & HASH_MASK, (hash_value >> 32) & HASH_MASK
+
+
+class BloomFilter:
+    """Class for a Bloom filter with a fixed capacity and an error rate."""
+    __slots__ = ("__bits", "__size", "__hash_count", "__capacity", "__count")
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.__capacity = max(capacity, 1)
+        self.__size = max(int(math.ceil(-self.__capacity * math.log(error_rate) / math.log(2) ** 2)), 8)
+        self.__hash_count = max(int(round(self.__size / self.__capacity * math.log(2))), 1)
+        self.__bits = bytearray((self.__size + 7) // 8)
+        self.__count = 0
+
+    @property
+    def capacity(self) -> int:
+        """The number of items that can be added to the filter without exceeding the error rate."""
+        return self.__capacity
+
+    @property
+    def count(self) -> int:
+        """The number of items added to the filter."""
+        return self.__count
+
+    @property
+    def is_full(self) -> bool:
+        """Returns True, if the filter contains its capacity of items."""
+        return self.__count >= self.__capacity
+
+    @property
+    def size_bytes(self) -> int:
+        """The size of the bit array in bytes."""
+        return len(self.__bits)
+
+    def add(self, hash_values: HashValues):
+        """Adds the item with the given hash values to the filter."""
+        bits = self.__bits
+        for bit_index in self.__get_bit_indexes(hash_values):
+            bits[bit_index >> 3] |= 1 << (bit_index & 7)
+        self.__count += 1
+
+    def contains(self, hash_values: HashValues) -> bool:
+        """Returns True, if the item with the given hash values has probably been added to the filter."""
+        bits = self.__bits
+        for bit_index in self.__get_bit_indexes(hash_values):
+            if not bits[bit_index >> 3] & (1 << (bit_index & 7)):
+                return False
+        return True
+
+    def __get_bit_indexes(self, hash_values: HashValues) -> Iterator[int]:
+        """Yields the bit indexes for the item using the enhanced double hashing. Unlike with the plain double
+           hashing, the items whose hash values differ only by a shift do not share almost all their bits."""
+        first_hash, second_hash = hash_values
+        size = self.__size
+        first_hash %= size
+        second_hash %= size
+        for round_number in range(self.__hash_count):
+            yield first_hash
+            first_hash = (first_hash + second_hash) % size
+            second_hash = (second_hash + round_number) % size
+
+
+class DuplicateFilter:
+    """Class for detecting the already received message ids within a single simulation."""
+    __slots__ = ("__capacity", "__error_rate", "__window_size", "__window", "__window_ids", "__filters",
+                 "__duplicates")
+
+    def __init__(self, capacity: Optional[int] = None, error_rate: Optional[float] = None,
+                 window_size: Optional[int] = None):
+        self.__capacity = max(cast(int, capacity if capacity is not None
+                                   else ENV_VARIABLES[DUPLICATE_FILTER_CAPACITY_NAME]), 1)
+        error_rate = cast(float, error_rate if error_rate is not None
+                          else ENV_VARIABLES[DUPLICATE_FILTER_ERROR_RATE_NAME])
+        # the error rate is divided between the Bloom filters that can exist at the same time
+        maximum_filters = max(int(math.ceil(math.log2(max(self.__capacity / INITIAL_FILTER_CAPACITY, 1)))), 0) + 2
+        self.__error_rate = min(max(error_rate, 1e-15), 0.5) / maximum_filters
+        self.__window_size = max(cast(int, window_size if window_size is not None
+                                      else ENV_VARIABLES[DUPLICATE_FILTER_WINDOW_NAME]), 0)
+        self.__window: Deque[str] = collections.deque()
+        self.__window_ids: Set[str] = set()
+        # the Bloom filters from the oldest to the newest, the filters are created when they are needed
+        self.__filters: List[BloomFilter] = []
+        self.__duplicates = 0
+
+    @property
+    def duplicates(self) -> int:
+        """The number of message ids that have been detected as duplicates."""
+        return self.__duplicates
+
+    @property
+    def size_bytes(self) -> int:
+        """The total size of the Bloom filter bit arrays in bytes."""
+        return sum(bloom_filter.size_bytes for bloom_filter in self.__filters)
+
+    def is_duplicate(self, message_id: str) -> bool:
+        """Returns True, if the message id has already been stored."""
+        if message_id in self.__window_ids:
+            self.__duplicates += 1
+            return True
+
+        hash_values = get_hash_values(message_id)
+        if any(bloom_filter.contains(hash_values) for bloom_filter in self.__filters):
+            self.__duplicates += 1
+            return True
+        return False
+
+    def add(self, message_id: str):
+        """Remembers the message id of a stored message."""
+        if message_id in self.__window_ids:
+            return
+
+        if self.__window_size > 0:
+            if len(self.__window) >= self.__window_size:
+                self.__window_ids.discard(self.__window.popleft())
+            self.__window.append(message_id)
+            self.__window_ids.add(message_id)
+
+        if not self.__filters or self.__filters[-1].is_full:
+            self.__add_filter()
+        self.__filters[-1].add(get_hash_values(message_id))
+
+    def __add_filter(self):
+        """Adds a new Bloom filter and removes the oldest filters that are not needed for the capacity."""
+        if self.__filters:
+            filter_capacity = min(self.__filters[-1].capacity * 2, max(self.__capacity // 2, INITIAL_FILTER_CAPACITY))
+        else:
+            filter_capacity = min(INITIAL_FILTER_CAPACITY, self.__capacity)
+        while (len(self.__filters) > 1 and
+               sum(bloom_filter.count for bloom_filter in self.__filters[1:]) >= self.__capacity):
+            self.__filters.pop(0)
+        self.__filters.append(BloomFilter(filter_capacity, self.__error_rate))
+
+    def __str__(self) -> str:
+        return "duplicates: {:d}, remembered: {:d}, filter size: {:d} bytes".format(
+            self.__duplicates, sum(bloom_filter.count for bloom_filter in self.__filters), self.size_bytes)
+
+
+def create_duplicate_filter() -> Optional[DuplicateFilter]:
+    """Returns a new duplicate filter or None if the duplicate filter is not in use."""
+    if ENV_VARIABLES[DUPLICATE_FILTER_NAME]:
+        return DuplicateFilter()
+    return None
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 Tampere University and VTT Technical Research Centre of Finland
+# This software was developed as a part of the ProCemPlus project: https://www.senecc.fi/projects/procemplus
+# This source code is licensed under the MIT license. See LICENSE in the repository root directory.
+# Author(s): Ville Heikkilä <ville.heikkila@tuni.fi>
+#            Otto Hylli <otto.hylli@tuni.fi>
+
+"""Module containing the incrementally maintained per epoch summaries of the stored messages.
+
+The summary collection contains one document for each simulation, epoch and topic:
+    {
+        "SimulationId": <simulation id>,
+        "EpochNumber": <epoch number>,
+        "Topic": <topic name>,
+        "MessageCount": <number of messages>,
+        "Processes": [<source process ids>],
+        "FirstTimestamp": <earliest message timestamp>,
+        "LastTimestamp": <latest message timestamp>
+    }
+The documents are updated with upserts that only add the changes since the previous update, so the summaries
+stay correct also when several log writer processes handle messages for the same simulation."""
+
+import datetime
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple, cast
+
+from pymongo import ASCENDING, UpdateOne
+
+from tools.timer import Timer
+from tools.tools import FullLogger, load_environmental_variables
+
+from log_writer.mongodb import get_collection
+
+LOGGER = FullLogger(__name__)
+
+EPOCH_SUMMARY_NAME = "EPOCH_SUMMARY"
+EPOCH_SUMMARY_COLLECTION_NAME = "EPOCH_SUMMARY_COLLECTION"
+EPOCH_SUMMARY_INTERVAL_NAME = "EPOCH_SUMMARY_INTERVAL"
+
+ENV_VARIABLES = load_environmental_variables(
+    # whether the per epoch summaries are written to the database
+    (EPOCH_SUMMARY_NAME, bool, False),
+    # the name of the summary collection
+    (EPOCH_SUMMARY_COLLECTION_NAME, str, "epoch_summaries"),
+    # the maximum time in seconds between two summary updates
+    (EPOCH_SUMMARY_INTERVAL_NAME, float, 5.0)
+)
+
+# the summary updates are written immediately when there are this many changed summary documents
+MAX_PENDING_SUMMARIES = 1000
+
+SummaryKey = Tuple[str, int, str]
+
+
+class EpochSummaryChange:
+    """Class for holding the changes to a single summary document since the previous database update."""
+    __slots__ = ("__message_count", "__processes", "__first_timestamp", "__last_timestamp")
+
+    def __init__(self):
+        self.__message_count = 0
+        self.__processes = set()
+        self.__first_timestamp = None
+        self.__last_timestamp = None
+
+    @property
+    def message_count(self) -> int:
+        """The number of new messages."""
+        return self.__message_count
+
+    @property
+    def processes(self) -> Set[str]:
+        """The source process ids for the new messages."""
+        return self.__processes
+
+    @property
+    def first_timestamp(self) -> Optional[datetime.datetime]:
+        """The earliest timestamp of the new messages."""
+        return self.__first_timestamp
+
+    @property
+    def last_timestamp(self) -> Optional[datetime.datetime]:
+        """The latest timestamp of the new messages."""
+        return self.__last_timestamp
+
+    def add_message(self, source_process_id: Optional[str], timestamp: datetime.datetime):
+        """Adds a message to the changes."""
+        self.__message_count += 1
+        if source_process_id is not None:
+            self.__processes.add(source_process_id)
+        if self.__first_timestamp is None or timestamp < self.__first_timestamp:
+            self.__first_timestamp = timestamp
+        if self.__last_timestamp is None or timestamp > self.__last_timestamp:
+            self.__last_timestamp = timestamp
+
+    def merge(self, other: "EpochSummaryChange"):
+        """Adds the changes from the other change object to this one."""
+        self.__message_count += other.message_count
+        self.__processes.update(other.processes)
+        if other.first_timestamp is not None and (
+                self.__first_timestamp is None or other.first_timestamp < self.__first_timestamp):
+            self.__first_timestamp = other.first_timestamp
+        if other.last_timestamp is not None and (
+                self.__last_timestamp is None or other.last_timestamp > self.__last_timestamp):
+            self.__last_timestamp = other.last_timestamp
+
+    def get_update(self) -> Dict[str, Any]:
+        """Returns the MongoDB update document for the changes."""
+        update = {
+            "$inc": {"MessageCount": self.__message_count},
+            "$min": {"FirstTimestamp": self.__first_timestamp},
+            "$max": {"LastTimestamp": self.__last_timestamp}
+        }
+        if self.__processes:
+            update["$addToSet"] = {"Processes": {"$each": sorted(self.__processes)}}
+        return update
+
+
+class EpochSummaryWriter:
+    """Class for maintaining the per epoch summaries of the messages and writing them to the database in batches.
+
+    The changes are collected in memory and written with a single unordered bulk write either periodically
+    or when there are too many changed summary documents. The changes are removed from memory once they have
+    been given to the database, so the memory usage does not grow with the length of the simulations.
+    If a bulk write fails, its changes are merged back to the pending changes and retried with the next update.
+    """
+    def __init__(self, collection: Any = None, update_interval: Optional[float] = None):
+        self.__collection = collection
+        self.__update_interval = max(
+            cast(float, update_interval if update_interval is not None
+                 else ENV_VARIABLES[EPOCH_SUMMARY_INTERVAL_NAME]), 0.1)
+        self.__changes: Dict[SummaryKey, EpochSummaryChange] = {}
+        self.__update_timer = None
+        self.__indexes_created = False
+        self.__updated_summaries = 0
+        self.__failed_updates = 0
+        # after a failed update the next update is only done by the timer
+        self.__update_failed = False
+
+    @property
+    def pending_summaries(self) -> int:
+        """The number of summary documents with changes that have not been written to the database."""
+        return len(self.__changes)
+
+    @property
+    def updated_summaries(self) -> int:
+        """The total number of summary document updates written to the database."""
+        return self.__updated_summaries
+
+    async def add_message(self, simulation_id: str, epoch_number: int, topic_name: str,
+                          source_process_id: Optional[str], timestamp: datetime.datetime):
+        """Adds a message to the summary for its simulation, epoch and topic."""
+        summary_key = (simulation_id, epoch_number, topic_name)
+        change = self.__changes.get(summary_key, None)
+        if change is None:
+            change = EpochSummaryChange()
+            self.__changes[summary_key] = change
+        change.add_message(source_process_id, timestamp)
+
+        if len(self.__changes) >= MAX_PENDING_SUMMARIES and not self.__update_failed:
+            await self.flush()
+        elif self.__update_timer is None:
+            self.__update_timer = Timer(True, self.__update_interval, self.flush)
+
+    async def flush(self):
+        """Writes all the pending summary changes to the database. The changes are kept for the next update
+           if the database write fails."""
+        if not self.__changes:
+            return
+        changes = self.__changes
+        self.__changes = {}
+
+        collection = self.__get_collection()
+        operations = self.__get_operations(changes)
+        start_time = time.perf_counter()
+        try:
+            if not self.__indexes_created:
+                await collection.create_index(
+                    [("SimulationId", ASCENDING), ("EpochNumber", ASCENDING), ("Topic", ASCENDING)], unique=True)
+                self.__indexes_created = True
+            await collection.bulk_write(operations, ordered=False)
+            self.__updated_summaries += len(operations)
+            self.__update_failed = False
+            LOGGER.debug("Updated {:d} epoch summaries in {:.3f} seconds".format(
+                len(operations), time.perf_counter() - start_time))
+
+        except Exception as error:  # pylint: disable=broad-except
+            self.__failed_updates += len(operations)
+            self.__update_failed = True
+            LOGGER.warning("Error while updating {:d} epoch summaries: {:s}".format(len(operations), str(error)))
+            self.__restore_changes(changes)
+
+    async def close(self):
+        """Stops the periodic updates and writes the pending summary changes to the database."""
+        if self.__update_timer is not None:
+            self.__update_timer.cancel()
+            self.__update_timer = None
+        await self.flush()
+
+    def __str__(self) -> str:
+        return "updated: {:d}, failed: {:d}, pending: {:d}".format(
+            self.__updated_summaries, self.__failed_updates, len(self.__changes))
+
+    def __restore_changes(self, changes: Dict[SummaryKey, EpochSummaryChange]):
+        """Merges the changes from a failed update with the changes that have been added after the update."""
+        for summary_key, change in changes.items():
+            new_change = self.__changes.get(summary_key, None)
+            if new_change is not None:
+                change.merge(new_change)
+            self.__changes[summary_key] = change
+
+    def __get_collection(self) -> Any:
+        """Returns the summary collection. The default collection is used if no collection was given."""
+        if self.__collection is None:
+            self.__collection = get_collection(cast(str, ENV_VARIABLES[EPOCH_SUMMARY_COLLECTION_NAME]))
+        return self.__collection
+
+    @staticmethod
+    def __get_operations(changes: Dict[SummaryKey, EpochSummaryChange]) -> List[UpdateOne]:
+        """Returns the upsert operations for the given summary changes."""
+        return [
+            UpdateOne(
+                {"SimulationId": simulation_id, "EpochNumber": epoch_number, "Topic": topic_name},
+                change.get_update(),
+                upsert=True)
+            for (simulation_id, epoch_number, topic_name), change in changes.items()
+        ]
+
+
+def get_epoch_summary_writer(uses_mongodb: bool = True) -> Optional[EpochSummaryWriter]:
+    """Returns a new summary writer if the epoch summaries are enabled, otherwise None.
+       The summaries are written to MongoDB, so they are not used if the storage backends do not use MongoDB."""
+    if not ENV_VARIABLES[EPOCH_SUMMARY_NAME]:
+        return None
+    if not uses_mongodb:
+        LOGGER.warning("The epoch summaries require the MongoDB storage backend, the summaries are not written.")
+        return None
+    return EpochSummaryWriter()
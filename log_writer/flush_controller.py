@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 Tampere University and VTT Technical Research Centre of Finland
+# This software was developed as a part of the ProCemPlus project: https://www.senecc.fi/projects/procemplus
+# This source code is licensed under the MIT license. See LICENSE in the repository root directory.
+# Author(s): Ville Heikkilä <ville.heikkila@tuni.fi>
+#            Otto Hylli <otto.hylli@tuni.fi>
+
+"""Module containing a controller for adjusting the message buffer flush thresholds."""
+
+import time
+from typing import Optional, Union, cast
+
+from tools.tools import load_environmental_variables
+
+MESSAGE_BUFFER_MAX_DOCUMENTS_NAME = "MESSAGE_BUFFER_MAX_DOCUMENTS"
+MESSAGE_BUFFER_MAX_INTERVAL_NAME = "MESSAGE_BUFFER_MAX_INTERVAL"
+MESSAGE_BUFFER_ADAPTIVE_NAME = "MESSAGE_BUFFER_ADAPTIVE"
+MESSAGE_BUFFER_TARGET_WRITE_LATENCY_NAME = "MESSAGE_BUFFER_TARGET_WRITE_LATENCY"
+MESSAGE_BUFFER_ADAPTIVE_MIN_DOCUMENTS_NAME = "MESSAGE_BUFFER_ADAPTIVE_MIN_DOCUMENTS"
+MESSAGE_BUFFER_ADAPTIVE_MAX_DOCUMENTS_NAME = "MESSAGE_BUFFER_ADAPTIVE_MAX_DOCUMENTS"
+MESSAGE_BUFFER_ADAPTIVE_MIN_INTERVAL_NAME = "MESSAGE_BUFFER_ADAPTIVE_MIN_INTERVAL"
+MESSAGE_BUFFER_ADAPTIVE_MAX_INTERVAL_NAME = "MESSAGE_BUFFER_ADAPTIVE_MAX_INTERVAL"
+
+ENV_VARIABLES = load_environmental_variables(
+    (MESSAGE_BUFFER_MAX_DOCUMENTS_NAME, int, 20),
+    (MESSAGE_BUFFER_MAX_INTERVAL_NAME, float, 10.0),
+    (MESSAGE_BUFFER_ADAPTIVE_NAME, bool, False),
+    (MESSAGE_BUFFER_TARGET_WRITE_LATENCY_NAME, float, 0.5),
+    (MESSAGE_BUFFER_ADAPTIVE_MIN_DOCUMENTS_NAME, int, 10),
+    (MESSAGE_BUFFER_ADAPTIVE_MAX_DOCUMENTS_NAME, int, 1000),
+    (MESSAGE_BUFFER_ADAPTIVE_MIN_INTERVAL_NAME, float, 1.0),
+    (MESSAGE_BUFFER_ADAPTIVE_MAX_INTERVAL_NAME, float, 30.0)
+)
+
+
+class AdaptiveFlushController:
+    """Class for choosing the message buffer size and the flush interval.
+
+    The buffer size is increased while the measured write latency is below the target latency and decreased when
+    it is above the target. The buffer size is kept large enough that, at the observed ingress rate, the writes are
+    not started more often than they can be completed. The flush interval is the time in which the buffer fills at
+    the observed ingress rate, so that the remaining messages are written promptly when the ingress slows down.
+    The flush interval is not made longer than is needed for the interval triggered flushes to keep the database
+    busy for at most the share given by WRITE_UTILIZATION. Only the latencies of the successful writes are used.
+    If the controller is not adaptive, the initial buffer size and flush interval are used as they are.
+    """
+    # the weight of the newest measurement in the exponential moving averages
+    SMOOTHING_FACTOR = 0.3
+    # the minimum time in seconds that is used to calculate a new ingress rate sample
+    RATE_SAMPLE_INTERVAL = 1.0
+    # the largest factor by which the buffer size is changed after a single write
+    MAX_CHANGE_FACTOR = 2.0
+    # the share of the time that the interval triggered writes are allowed to keep the database busy
+    WRITE_UTILIZATION = 0.1
+
+    def __init__(self, max_documents: Optional[int] = None, max_interval: Optional[float] = None,
+                 adaptive: Optional[bool] = None, target_latency: Optional[float] = None):
+        self.__batch_size = cast(int, max_documents if max_documents is not None
+                                 else ENV_VARIABLES[MESSAGE_BUFFER_MAX_DOCUMENTS_NAME])
+        self.__flush_interval = cast(float, max_interval if max_interval is not None
+                                     else ENV_VARIABLES[MESSAGE_BUFFER_MAX_INTERVAL_NAME])
+        self.__adaptive = cast(bool, adaptive if adaptive is not None
+                               else ENV_VARIABLES[MESSAGE_BUFFER_ADAPTIVE_NAME])
+        self.__target_latency = cast(float, target_latency if target_latency is not None
+                                     else ENV_VARIABLES[MESSAGE_BUFFER_TARGET_WRITE_LATENCY_NAME])
+
+        self.__min_documents = max(cast(int, ENV_VARIABLES[MESSAGE_BUFFER_ADAPTIVE_MIN_DOCUMENTS_NAME]), 1)
+        self.__max_documents = max(cast(int, ENV_VARIABLES[MESSAGE_BUFFER_ADAPTIVE_MAX_DOCUMENTS_NAME]),
+                                   self.__min_documents)
+        self.__min_interval = cast(float, ENV_VARIABLES[MESSAGE_BUFFER_ADAPTIVE_MIN_INTERVAL_NAME])
+        self.__max_interval = max(cast(float, ENV_VARIABLES[MESSAGE_BUFFER_ADAPTIVE_MAX_INTERVAL_NAME]),
+                                  self.__min_interval)
+        if self.__adaptive:
+            self.__batch_size = self.__clamp(self.__batch_size, self.__min_documents, self.__max_documents)
+            self.__flush_interval = self.__clamp(self.__flush_interval, self.__min_interval, self.__max_interval)
+
+        self.__ingress_rate = None
+        self.__write_latency = None
+        self.__rate_sample_start = time.monotonic()
+        self.__rate_sample_messages = 0
+
+    @property
+    def adaptive(self) -> bool:
+        """Returns True, if the buffer size and the flush interval are adjusted."""
+        return self.__adaptive
+
+    @property
+    def batch_size(self) -> int:
+        """The number of buffered documents after which the buffer is flushed."""
+        return int(self.__batch_size)
+
+    @property
+    def max_batch_size(self) -> int:
+        """The largest batch size that the controller can choose."""
+        return int(max(self.__batch_size, self.__max_documents) if self.__adaptive else self.__batch_size)
+
+    @property
+    def flush_interval(self) -> float:
+        """The maximum time in seconds that a message is kept in the buffer."""
+        return self.__flush_interval
+
+    @property
+    def ingress_rate(self) -> Union[float, None]:
+        """The smoothed number of received messages per second or None if it has not been measured yet."""
+        return self.__ingress_rate
+
+    @property
+    def write_latency(self) -> Union[float, None]:
+        """The smoothed database write latency in seconds or None if it has not been measured yet."""
+        return self.__write_latency
+
+    def record_message(self):
+        """Registers a received message for the ingress rate calculation."""
+        self.__rate_sample_messages += 1
+        elapsed_time = time.monotonic() - self.__rate_sample_start
+        if elapsed_time >= AdaptiveFlushController.RATE_SAMPLE_INTERVAL:
+            self.__ingress_rate = self.__smooth(self.__ingress_rate, self.__rate_sample_messages / elapsed_time)
+            self.__rate_sample_start += elapsed_time
+            self.__rate_sample_messages = 0
+
+    def record_write(self, latency: float):
+        """Registers a successful database write and adjusts the buffer size and the flush interval."""
+        self.__write_latency = self.__smooth(self.__write_latency, latency)
+        if not self.__adaptive:
+            return
+
+        if self.__write_latency > 0:
+            change_factor = self.__clamp(
+                self.__target_latency / self.__write_latency,
+                1 / AdaptiveFlushController.MAX_CHANGE_FACTOR,
+                AdaptiveFlushController.MAX_CHANGE_FACTOR)
+        else:
+            change_factor = AdaptiveFlushController.MAX_CHANGE_FACTOR
+        batch_size = self.__batch_size * change_factor
+        if self.__ingress_rate is not None:
+            batch_size = max(batch_size, self.__ingress_rate * self.__write_latency)
+        self.__batch_size = self.__clamp(batch_size, self.__min_documents, self.__max_documents)
+
+        flush_interval = self.__write_latency / AdaptiveFlushController.WRITE_UTILIZATION
+        if self.__ingress_rate:
+            flush_interval = min(flush_interval, self.__batch_size / self.__ingress_rate)
+        self.__flush_interval = self.__clamp(flush_interval, self.__min_interval, self.__max_interval)
+
+    def __str__(self) -> str:
+        return "{:d} documents / {:.1f} s ({:s}, ingress: {:s} msg/s, write latency: {:s} s)".format(
+            self.batch_size, self.flush_interval,
+            "adaptive" if self.adaptive else "fixed",
+            "-" if self.ingress_rate is None else "{:.1f}".format(self.ingress_rate),
+            "-" if self.write_latency is None else "{:.3f}".format(self.write_latency))
+
+    @staticmethod
+    def __smooth(old_value: Union[float, None], new_value: float) -> float:
+        """Returns the exponential moving average with the new measurement included."""
+        if old_value is None:
+            return new_value
+        return (
+            AdaptiveFlushController.SMOOTHING_FACTOR * new_value +
+            (1 - AdaptiveFlushController.SMOOTHING_FACTOR) * old_value
+        )
+
+    @staticmethod
+    def __clamp(value, min_value, max_value):
+        """Returns the value limited to the given bounds."""
+        return min(max(value, min_value), max_value)
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 Tampere University and VTT Technical Research Centre of Finland
+# This software was developed as a part of the ProCemPlus project: https://www.senecc.fi/projects/procemplus
+# This source code is licensed under the MIT license. See LICENSE in the repository root directory.
+# Author(s): Ville Heikkilä <ville.heikkila@tuni.fi>
+#            Otto Hylli <otto.hylli@tuni.fi>
+
+"""Module containing a minimal asyncio HTTP server for the local monitoring endpoints of the log writer."""
+
+import asyncio
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set, Union, cast
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from tools.tools import FullLogger
+
+LOGGER = FullLogger(__name__)
+
+
+class HttpRequest:
+    """Class for holding the parts of a received HTTP request that are used by the request handlers."""
+    def __init__(self, method: str, path: str, query: Dict[str, List[str]]):
+        self.__method = method
+        self.__path = path
+        self.__query = query
+
+    @property
+    def method(self) -> str:
+        """The request method."""
+        return self.__method
+
+    @property
+    def path(self) -> str:
+        """The request path without the query string."""
+        return self.__path
+
+    @property
+    def query(self) -> Dict[str, List[str]]:
+        """The query parameters of the request."""
+        return self.__query
+
+    def get_parameter(self, name: str, default: Optional[str] = None) -> Optional[str]:
+        """Returns the first value of the given query parameter or the default if the parameter is not given."""
+        values = self.__query.get(name, None)
+        return values[0] if values else default
+
+
+class HttpResponse:
+    """Class for holding an HTTP response."""
+    REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+               500: "Internal Server Error"}
+
+    def __init__(self, body: bytes, content_type: str = "text/plain; charset=utf-8", status: int = 200):
+        self.__body = body
+        self.__content_type = content_type
+        self.__status = status
+
+    @property
+    def body(self) -> bytes:
+        """The response body."""
+        return self.__body
+
+    @property
+    def content_type(self) -> str:
+        """The content type of the response body."""
+        return self.__content_type
+
+    @property
+    def status(self) -> int:
+        """The HTTP status code of the response."""
+        return self.__status
+
+    def to_bytes(self) -> bytes:
+        """Returns the full response including the status line and the headers."""
+        header = "".join([
+            "HTTP/1.1 {:d} {:s}\r\n".format(self.__status, HttpResponse.REASONS.get(self.__status, "")),
+            "Content-Type: {:s}\r\n".format(self.__content_type),
+            "Content-Length: {:d}\r\n".format(len(self.__body)),
+            "Connection: close\r\n\r\n"
+        ])
+        return header.encode("ascii") + self.__body
+
+
+class HttpStreamResponse:
+    """Class for an HTTP response whose body is written in parts as they become available, e.g. server-sent events.
+       The response ends when the body iterator is exhausted or when the client closes the connection."""
+    def __init__(self, body_parts: AsyncIterator[bytes], content_type: str = "text/event-stream; charset=utf-8",
+                 status: int = 200):
+        self.__body_parts = body_parts
+        self.__content_type = content_type
+        self.__status = status
+
+    @property
+    def body_parts(self) -> AsyncIterator[bytes]:
+        """The iterator for the parts of the response body."""
+        return self.__body_parts
+
+    @property
+    def content_type(self) -> str:
+        """The content type of the response body."""
+        return self.__content_type
+
+    @property
+    def status(self) -> int:
+        """The HTTP status code of the response."""
+        return self.__status
+
+    def header_to_bytes(self) -> bytes:
+        """Returns the status line and the headers of the response."""
+        header = "".join([
+            "HTTP/1.1 {:d} {:s}\r\n".format(self.__status, HttpResponse.REASONS.get(self.__status, "")),
+            "Content-Type: {:s}\r\n".format(self.__content_type),
+            "Cache-Control: no-cache\r\n",
+            "Connection: close\r\n\r\n"
+        ])
+        return header.encode("ascii")
+
+    async def close(self):
+        """Finishes the body iterator, so that it can release its resources."""
+        close_function = getattr(self.__body_parts, "aclose", None)
+        if close_function is not None:
+            await close_function()
+
+
+RequestHandler = Callable[[HttpRequest], Awaitable[Union[HttpResponse, HttpStreamResponse]]]
+
+
+class HttpServer:
+    """Minimal HTTP server that answers GET requests by calling the request handler registered for the path.
+
+    Only the request line is used and each connection handles a single request, which is enough for
+    scraping metrics and for the other local monitoring endpoints. The streamed responses are ended
+    when the server is closed.
+    """
+    # the maximum time in seconds to wait for the request headers
+    REQUEST_TIMEOUT = 10.0
+
+    def __init__(self, host: str, port: int):
+        self.__host = host
+        self.__port = port
+        self.__routes = []
+        self.__server = None
+        # the tasks for the connections that are being handled
+        self.__connection_tasks: Set[asyncio.Task] = set()
+
+    @property
+    def port(self) -> int:
+        """The port that the server listens to."""
+        return self.__port
+
+    def add_route(self, path: str, handler: RequestHandler, prefix: bool = False):
+        """Registers the request handler for the given path. If prefix is True, the handler is used
+           for all the paths starting with the given path. The routes are matched in the order they were added."""
+        self.__routes.append((path, prefix, handler))
+
+    async def start(self):
+        """Starts listening to the connections."""
+        self.__server = await asyncio.start_server(self.__handle_connection, self.__host, self.__port)
+        LOGGER.info("HTTP server listening at {:s}:{:d}".format(self.__host, self.__port))
+
+    async def close(self):
+        """Stops the server."""
+        if self.__server is not None:
+            self.__server.close()
+            for connection_task in list(self.__connection_tasks):
+                connection_task.cancel()
+            await asyncio.gather(*self.__connection_tasks, return_exceptions=True)
+            await self.__server.wait_closed()
+            self.__server = None
+
+    def get_handler(self, path: str) -> Optional[RequestHandler]:
+        """Returns the request handler for the given path or None if there is no matching route."""
+        for route_path, prefix, handler in self.__routes:
+            if path == route_path or (prefix and path.startswith(route_path)):
+                return handler
+        return None
+
+    async def __handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Reads a single request from the connection and writes the response."""
+        # the connection handlers are always run in their own tasks by asyncio.start_server
+        connection_task = cast(asyncio.Task, asyncio.current_task())
+        self.__connection_tasks.add(connection_task)
+        response = None
+        response_started = False
+        try:
+            request = await asyncio.wait_for(self.__read_request(reader), timeout=HttpServer.REQUEST_TIMEOUT)
+            if request is None:
+                response = HttpResponse(b"Bad request\n", status=400)
+            elif request.method != "GET":
+                response = HttpResponse(b"Method not allowed\n", status=405)
+            else:
+                handler = self.get_handler(request.path)
+                if handler is None:
+                    response = HttpResponse(b"Not found\n", status=404)
+                else:
+                    response = await handler(request)
+
+            if isinstance(response, HttpStreamResponse):
+                response_started = True
+                writer.write(response.header_to_bytes())
+                await writer.drain()
+                async for body_part in response.body_parts:
+                    writer.write(body_part)
+                    await writer.drain()
+            elif response is not None:
+                response_started = True
+                writer.write(response.to_bytes())
+                await writer.drain()
+
+        except (asyncio.TimeoutError, asyncio.CancelledError, ConnectionError):
+            pass
+        except Exception as error:  # pylint: disable=broad-except
+            LOGGER.error("Error while handling an HTTP request: {:s}".format(str(error)))
+            # the client gets an error response unless a part of the response has already been sent
+            if not response_started:
+                await self.__send_error_response(writer)
+        finally:
+            if isinstance(response, HttpStreamResponse):
+                await response.close()
+            writer.close()
+            self.__connection_tasks.discard(connection_task)
+
+    @staticmethod
+    async def __send_error_response(writer: asyncio.StreamWriter):
+        """Sends the internal server error response to the client."""
+        try:
+            writer.write(HttpResponse(b"Internal server error\n", status=500).to_bytes())
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+    @staticmethod
+    async def __read_request(reader: asyncio.StreamReader) -> Optional[HttpRequest]:
+        """Reads the request line and the headers. Returns None, if the request line is not valid."""
+        request_line = (await reader.readline()).decode("latin-1").strip()
+        # the headers are not used but they are read so that the client is not left writing to a closed socket
+        while (await reader.readline()).strip():
+            pass
+
+        request_parts = request_line.split(" ")
+        if len(request_parts) != 3:
+            return None
+        method, target, _ = request_parts
+        split_target = urlsplit(target)
+        return HttpRequest(method, unquote(split_target.path), parse_qs(split_target.query))
+
@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 Tampere University and VTT Technical Research Centre of Finland
+# This software was developed as a part of the ProCemPlus project: https://www.senecc.fi/projects/procemplus
+# This source code is licensed under the MIT license. See LICENSE in the repository root directory.
+# Author(s): Ville Heikkilä <ville.heikkila@tuni.fi>
+#            Otto Hylli <otto.hylli@tuni.fi>
+
+"""Command line tool for importing recorded message bus dumps to the database without RabbitMQ.
+
+Each line of a dump file is a JSON object containing the topic and the message body of one message,
+for example {"topic": "Epoch", "body": {"Type": "Epoch", ...}}. The body can also be given as a string
+containing the original message. Files ending with .gz are read as gzip compressed files and "-" reads
+the standard input. The messages are handled in the same way as by the listener, so the simulation metadata
+is the same as it would have been when the messages were received from the message bus."""
+
+import argparse
+import asyncio
+import gzip
+import os
+import sys
+import time
+from typing import Any, Awaitable, Callable, IO, List, Optional, Tuple, Union, cast
+
+from tools.clients import RabbitmqClient
+from tools.db_clients import MongodbClient
+from tools.tools import FullLogger
+
+from log_writer.flush_controller import AdaptiveFlushController
+from log_writer.json_codec import DEFAULT_CODEC, JsonCodec
+from log_writer.listener import ListenerComponent
+from log_writer.spool import SPOOL_DIRECTORY
+from log_writer.storage import MongodbBackend, create_storage_backend
+from log_writer.topic_filter import TopicFilter
+from log_writer.write_queue import WriteQueue
+
+LOGGER = FullLogger(__name__)
+
+TOPIC_ATTRIBUTES = ("topic", "Topic", "routing_key")
+BODY_ATTRIBUTES = ("body", "Body", "message", "Message")
+STDIN_FILE_NAME = "-"
+# the number of messages after which the other tasks, e.g. the database writers, are let to run
+YIELD_INTERVAL = 100
+
+
+class ImportResult:
+    """Class for holding the statistics of an import."""
+    def __init__(self):
+        self.__lines = 0
+        self.__messages = 0
+        self.__skipped_lines = 0
+        self.__start_time = time.monotonic()
+
+    @property
+    def lines(self) -> int:
+        """The number of read lines."""
+        return self.__lines
+
+    @property
+    def messages(self) -> int:
+        """The number of messages given to the listener."""
+        return self.__messages
+
+    @property
+    def skipped_lines(self) -> int:
+        """The number of lines that did not contain a message."""
+        return self.__skipped_lines
+
+    @property
+    def duration(self) -> float:
+        """The time in seconds since the import was started."""
+        return time.monotonic() - self.__start_time
+
+    def add_line(self, is_message: bool):
+        """Registers a read line."""
+        self.__lines += 1
+        if is_message:
+            self.__messages += 1
+        else:
+            self.__skipped_lines += 1
+
+    def __str__(self) -> str:
+        duration = self.duration
+        return "{:d} messages from {:d} lines ({:d} skipped) in {:.1f} seconds ({:.1f} messages/s)".format(
+            self.__messages, self.__lines, self.__skipped_lines, duration,
+            self.__messages / duration if duration > 0 else 0.0)
+
+
+class DumpReader:
+    """Stand-in for the message bus client that gives the messages read from dump files to the listener.
+
+    The next message is read only after the listener has handled the previous one, so the listener's
+    write queue limits the memory usage regardless of the size of the dump files.
+    """
+    def __init__(self, raw_bodies: bool, json_codec: JsonCodec = DEFAULT_CODEC):
+        self.__raw_bodies = raw_bodies
+        self.__json_codec = json_codec
+        self.__listeners = []
+
+    def add_listener(self, topic_names: Union[str, List[str]],
+                     callback_function: Callable[[Any, str], Awaitable[None]]):
+        """Adds a listener that receives all the read messages regardless of the topic names."""
+        del topic_names
+        self.__listeners.append(callback_function)
+
+    async def close(self):
+        """Removes all the listeners."""
+        self.__listeners = []
+
+    async def import_file(self, file_name: str, result: ImportResult, progress_interval: float):
+        """Reads the messages from the given dump file and gives them to the listeners."""
+        next_progress_time = time.monotonic() + progress_interval
+        with open_dump_file(file_name) as dump_file:
+            for line_number, line in enumerate(dump_file, start=1):
+                message = self.__parse_line(line)
+                result.add_line(message is not None)
+                if message is None:
+                    if line.strip():
+                        LOGGER.warning("Skipping line {:d} in {:s}: no topic and message body found".format(
+                            line_number, file_name))
+                    continue
+
+                topic_name, message_body = message
+                for callback_function in self.__listeners:
+                    await callback_function(message_body, topic_name)
+
+                if result.messages % YIELD_INTERVAL == 0:
+                    await asyncio.sleep(0)
+                if progress_interval > 0 and time.monotonic() >= next_progress_time:
+                    LOGGER.info("Imported {:s}".format(str(result)))
+                    next_progress_time = time.monotonic() + progress_interval
+
+    def __parse_line(self, line: bytes) -> Optional[Tuple[str, Union[bytes, str, dict]]]:
+        """Returns the topic and the message body from a dump file line or None if the line is not valid.
+           The body is returned as bytes for the raw bodies, otherwise as a dictionary or as a string."""
+        try:
+            line_json = self.__json_codec.loads(line)
+        except self.__json_codec.decode_errors:
+            return None
+        if not isinstance(line_json, dict):
+            return None
+
+        topic_name = next((line_json[name] for name in TOPIC_ATTRIBUTES if name in line_json), None)
+        message_body = next((line_json[name] for name in BODY_ATTRIBUTES if name in line_json), None)
+        if not isinstance(topic_name, str) or message_body is None:
+            return None
+
+        if self.__raw_bodies:
+            if isinstance(message_body, str):
+                return topic_name, message_body.encode("UTF-8")
+            return topic_name, self.__json_codec.dumps(message_body)
+        return topic_name, message_body
+
+
+def open_dump_file(file_name: str) -> Union[IO[bytes], gzip.GzipFile]:
+    """Opens the dump file for reading in binary mode."""
+    if file_name == STDIN_FILE_NAME:
+        return sys.stdin.buffer
+    if file_name.endswith(".gz"):
+        return gzip.open(file_name, "rb")
+    return open(file_name, "rb")
+
+
+async def ignore_simulation_end():
+    """Used instead of stopping the listener when a simulation ends, since the dump can contain several simulations."""
+
+
+async def import_dumps(file_names: List[str], batch_size: int = 1000, writers: int = 8, queue_size: int = 20000,
+                       raw_storage_mode: bool = False, progress_interval: float = 10.0,
+                       mongo_client: Optional[MongodbClient] = None) -> ImportResult:
+    """Imports the messages from the given dump files to the database and returns the import statistics.
+       The documents are written in batches of batch_size documents with several parallel writes.
+       If mongo_client is not given, the storage backends are given by STORAGE_BACKENDS and the documents
+       are written to MongoDB with unordered bulk inserts unless the message spool is used."""
+    if mongo_client is not None:
+        storage = MongodbBackend(mongo_client)
+    else:
+        if SPOOL_DIRECTORY:
+            # the spool retries the documents after the written ones, which requires the ordered inserts
+            LOGGER.info("Using ordered inserts, since the message spool is in use.")
+        storage = create_storage_backend(ordered=not SPOOL_DIRECTORY)
+    dump_reader = DumpReader(raw_bodies=raw_storage_mode)
+    listener = ListenerComponent(
+        raw_storage_mode=raw_storage_mode,
+        stop_function=ignore_simulation_end,
+        rabbitmq_client=cast(RabbitmqClient, dump_reader),
+        storage=storage,
+        # all the messages in the dumps are imported
+        topic_filter=TopicFilter(listened_topics=["#"], excluded_topics=[], sampling_rules=[]),
+        write_queue=WriteQueue(
+            storage, high_water_mark=queue_size, low_water_mark=queue_size // 2, writers=writers),
+        flush_controller=AdaptiveFlushController(max_documents=batch_size, max_interval=60.0, adaptive=False),
+        invalid_message_rate_limit=0.0)
+
+    result = ImportResult()
+    try:
+        for file_name in file_names:
+            LOGGER.info("Importing messages from {:s}".format(file_name))
+            await dump_reader.import_file(file_name, result, progress_interval)
+    finally:
+        await listener.stop()
+    return result
+
+
+def main():
+    """Parses the command line arguments and imports the given dump files."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="+", help="the dump files to import, - reads the standard input")
+    parser.add_argument("--batch-size", type=int, default=1000,
+                        help="the number of documents in a single database write")
+    parser.add_argument("--writers", type=int, default=8, help="the number of parallel database writes")
+    parser.add_argument("--queue-size", type=int, default=20000,
+                        help="the maximum number of documents waiting for the database writes")
+    parser.add_argument("--raw", action="store_true", help="use the raw storage mode")
+    parser.add_argument("--simulation-id", default=None,
+                        help="the simulation id used for the invalid messages (default: SIMULATION_ID)")
+    parser.add_argument("--progress-interval", type=float, default=10.0,
+                        help="the interval in seconds for the progress reports (0 = no reports)")
+    arguments = parser.parse_args()
+
+    if arguments.simulation_id is not None:
+        os.environ["SIMULATION_ID"] = arguments.simulation_id
+
+    result = asyncio.run(import_dumps(
+        arguments.files, batch_size=max(arguments.batch_size, 1), writers=max(arguments.writers, 1),
+        queue_size=max(arguments.queue_size, 2), raw_storage_mode=arguments.raw,
+        progress_interval=arguments.progress_interval))
+    LOGGER.info("Imported {:s}".format(str(result)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 Tampere University and VTT Technical Research Centre of Finland
+# This software was developed as a part of the ProCemPlus project: https://www.senecc.fi/projects/procemplus
+# This source code is licensed under the MIT license. See LICENSE in the repository root directory.
+# Author(s): Ville Heikkilä <ville.heikkila@tuni.fi>
+#            Otto Hylli <otto.hylli@tuni.fi>
+
+"""Module containing the aggregation and the rate limiting of the received invalid messages."""
+
+import collections
+import datetime
+import hashlib
+import time
+from typing import Awaitable, Callable, Optional, Union, cast
+
+from tools.datetime_tools import to_iso_format_datetime_string, to_utc_datetime_object
+from tools.timer import Timer
+from tools.tools import FullLogger, load_environmental_variables
+
+from log_writer.invalid_message import InvalidMessage
+from log_writer.json_codec import DEFAULT_CODEC, JsonCodec
+from log_writer.metrics import DROPPED_DOCUMENTS
+
+LOGGER = FullLogger(__name__)
+
+INVALID_MESSAGE_WINDOW_NAME = "INVALID_MESSAGE_WINDOW"
+INVALID_MESSAGE_RATE_LIMIT_NAME = "INVALID_MESSAGE_RATE_LIMIT"
+INVALID_MESSAGE_BURST_NAME = "INVALID_MESSAGE_BURST"
+
+ENV_VARIABLES = load_environmental_variables(
+    # the time in seconds during which identical invalid messages are stored as one document (0 = no aggregation)
+    (INVALID_MESSAGE_WINDOW_NAME, float, 0.0),
+    # the maximum sustained number of invalid messages per second for each topic, value 0 means no limit
+    (INVALID_MESSAGE_RATE_LIMIT_NAME, float, 0.0),
+    # the number of invalid messages for each topic that are accepted in a burst above the rate limit
+    (INVALID_MESSAGE_BURST_NAME, int, 100)
+)
+
+# the interval in seconds at which the aggregated invalid messages with an expired window are stored
+AGGREGATION_CHECK_INTERVAL = 5.0
+# the maximum number of different invalid messages that are aggregated at the same time
+MAX_AGGREGATED_MESSAGES = 1000
+# the maximum number of topics for which the rate limits are tracked
+MAX_RATE_LIMITED_TOPICS = 10000
+
+InvalidMessageContent = Union[dict, str]
+
+
+def to_timestamp(epoch_time: float) -> str:
+    """Returns the given time in seconds since the epoch as a simulation platform timestamp string."""
+    return cast(str, to_iso_format_datetime_string(
+        datetime.datetime.fromtimestamp(epoch_time, tz=datetime.timezone.utc)))
+
+
+def create_invalid_message(content: InvalidMessageContent, timestamp: Optional[str], **attributes) -> InvalidMessage:
+    """Returns an invalid message object for either the decoded JSON object or the string that could not be decoded.
+       If the timestamp is None, the current time is used as the timestamp."""
+    content_attribute = "InvalidJsonMessage" if isinstance(content, str) else "InvalidMessage"
+    return InvalidMessage(Timestamp=timestamp, **{content_attribute: content}, **attributes)
+
+
+class AggregatedInvalidMessage:
+    """Class for holding the occurrences of an invalid message within the aggregation window."""
+    __slots__ = ("__content", "__topic_name", "__timestamp", "__window_start", "__first_seen", "__last_seen",
+                 "__occurrence_count")
+
+    def __init__(self, content: InvalidMessageContent, topic_name: str, timestamp: Optional[str]):
+        self.__content = content
+        self.__topic_name = topic_name
+        self.__timestamp = timestamp
+        self.__window_start = time.monotonic()
+        self.__first_seen = time.time()
+        self.__last_seen = self.__first_seen
+        self.__occurrence_count = 1
+
+    @property
+    def topic_name(self) -> str:
+        """The topic of the invalid message."""
+        return self.__topic_name
+
+    @property
+    def window_start(self) -> float:
+        """The monotonic time when the first occurrence was received."""
+        return self.__window_start
+
+    @property
+    def occurrence_count(self) -> int:
+        """The number of times the invalid message has been received."""
+        return self.__occurrence_count
+
+    def add_occurrence(self):
+        """Registers a new occurrence of the invalid message."""
+        self.__occurrence_count += 1
+        self.__last_seen = time.time()
+
+    def to_message(self) -> InvalidMessage:
+        """Returns the aggregated invalid message as an invalid message object."""
+        return create_invalid_message(
+            self.__content, self.__timestamp,
+            OccurrenceCount=self.__occurrence_count,
+            FirstSeen=to_timestamp(self.__first_seen),
+            LastSeen=to_timestamp(self.__last_seen))
+
+
+class InvalidMessageAggregator:
+    """Class for aggregating and rate limiting the invalid messages before they are stored.
+
+    Identical invalid messages with the same topic that are received within the aggregation window are stored
+    as a single document with the occurrence count and the first and last seen timestamps. The aggregated messages
+    are stored once their window has expired or when the aggregator is closed. The invalid messages are also
+    rate limited for each topic with a token bucket, so that a single misbehaving component cannot flood
+    the log writer. The rate limited messages are dropped.
+
+    In the acknowledge after store mode the deliveries of the aggregated invalid messages are acknowledged right
+    after they have been handled and not after the aggregated document has been stored. Holding the deliveries
+    for the whole aggregation window would block the cumulative acknowledgements of all the later messages.
+    As a result, the aggregated occurrences that have not been stored are lost if the log writer crashes.
+    Without aggregation, i.e. with a zero window, the invalid messages are acknowledged after they have been stored.
+    """
+    def __init__(self, store_function: Callable[[InvalidMessage, str], Awaitable[None]],
+                 window: Optional[float] = None, rate_limit: Optional[float] = None, burst: Optional[int] = None,
+                 json_codec: JsonCodec = DEFAULT_CODEC):
+        self.__store_function = store_function
+        self.__window = max(
+            cast(float, window if window is not None else ENV_VARIABLES[INVALID_MESSAGE_WINDOW_NAME]), 0.0)
+        self.__rate_limit = max(
+            cast(float, rate_limit if rate_limit is not None else ENV_VARIABLES[INVALID_MESSAGE_RATE_LIMIT_NAME]), 0.0)
+        self.__burst = max(cast(int, burst if burst is not None else ENV_VARIABLES[INVALID_MESSAGE_BURST_NAME]), 1)
+        self.__json_codec = json_codec
+
+        self.__aggregated_messages = collections.OrderedDict()
+        # the available tokens, the time of the last update and whether the last message was allowed for each topic
+        self.__rate_limiters = collections.OrderedDict()
+        self.__aggregation_timer = None
+        self.__received_messages = 0
+        self.__stored_messages = 0
+        self.__rate_limited_messages = 0
+
+    @property
+    def received_messages(self) -> int:
+        """The number of invalid messages given to the aggregator."""
+        return self.__received_messages
+
+    @property
+    def stored_messages(self) -> int:
+        """The number of invalid message documents that have been stored."""
+        return self.__stored_messages
+
+    @property
+    def rate_limited_messages(self) -> int:
+        """The number of invalid messages that were dropped by the rate limit."""
+        return self.__rate_limited_messages
+
+    @property
+    def pending_messages(self) -> int:
+        """The number of aggregated invalid messages that have not been stored yet."""
+        return len(self.__aggregated_messages)
+
+    async def add(self, content: InvalidMessageContent, topic_name: str):
+        """Adds an invalid message, either the decoded JSON object or the string that could not be decoded."""
+        self.__received_messages += 1
+        if not self.__check_rate_limit(topic_name):
+            self.__rate_limited_messages += 1
+            DROPPED_DOCUMENTS.inc("invalid_rate_limited")
+            return
+
+        if self.__window <= 0.0:
+            await self.__store(create_invalid_message(content, self.__get_timestamp(content)), topic_name)
+            return
+
+        message_key = self.__get_message_key(content, topic_name)
+        aggregated_message = self.__aggregated_messages.get(message_key, None)
+        if aggregated_message is not None:
+            aggregated_message.add_occurrence()
+            return
+
+        # the timestamp is only checked for the first occurrence of each invalid message
+        self.__aggregated_messages[message_key] = AggregatedInvalidMessage(
+            content, topic_name, self.__get_timestamp(content))
+        if self.__aggregation_timer is None:
+            self.__aggregation_timer = Timer(True, AGGREGATION_CHECK_INTERVAL, self.__store_expired_messages)
+        if len(self.__aggregated_messages) > MAX_AGGREGATED_MESSAGES:
+            _, oldest_message = self.__aggregated_messages.popitem(last=False)
+            await self.__store(oldest_message.to_message(), oldest_message.topic_name)
+
+    async def close(self):
+        """Stops the aggregation and stores all the aggregated invalid messages."""
+        if self.__aggregation_timer is not None:
+            self.__aggregation_timer.cancel()
+            self.__aggregation_timer = None
+        while self.__aggregated_messages:
+            _, aggregated_message = self.__aggregated_messages.popitem(last=False)
+            await self.__store(aggregated_message.to_message(), aggregated_message.topic_name)
+
+    def __str__(self) -> str:
+        return "received: {:d}, stored: {:d}, rate limited: {:d}, pending: {:d}".format(
+            self.__received_messages, self.__stored_messages, self.__rate_limited_messages,
+            len(self.__aggregated_messages))
+
+    async def __store_expired_messages(self):
+        """Stores the aggregated invalid messages whose aggregation window has expired.
+           The errors are logged here, since an exception would stop the repeating aggregation timer."""
+        expired_time = time.monotonic() - self.__window
+        # the messages are in the order of their first occurrence
+        while self.__aggregated_messages:
+            message_key, aggregated_message = next(iter(self.__aggregated_messages.items()))
+            if aggregated_message.window_start > expired_time:
+                break
+            del self.__aggregated_messages[message_key]
+            try:
+                await self.__store(aggregated_message.to_message(), aggregated_message.topic_name)
+            except Exception as error:  # pylint: disable=broad-except
+                LOGGER.error("Failed to store an aggregated invalid message with topic '{:s}': {:s}".format(
+                    aggregated_message.topic_name, str(error)))
+                DROPPED_DOCUMENTS.inc("invalid_store_failed", amount=aggregated_message.occurrence_count)
+
+    async def __store(self, invalid_message: InvalidMessage, topic_name: str):
+        """Stores the invalid message using the store function."""
+        self.__stored_messages += 1
+        await self.__store_function(invalid_message, topic_name)
+
+    def __check_rate_limit(self, topic_name: str) -> bool:
+        """Returns True, if an invalid message with the given topic is allowed by the rate limit."""
+        if self.__rate_limit <= 0.0:
+            return True
+
+        current_time = time.monotonic()
+        tokens, update_time, was_allowed = self.__rate_limiters.pop(
+            topic_name, (float(self.__burst), current_time, True))
+        tokens = min(tokens + (current_time - update_time) * self.__rate_limit, float(self.__burst))
+        allowed = tokens >= 1.0
+        if allowed:
+            tokens -= 1.0
+        elif was_allowed:
+            LOGGER.warning("Invalid messages with topic '{:s}' exceed the rate limit, dropping messages.".format(
+                topic_name))
+        self.__rate_limiters[topic_name] = (tokens, current_time, allowed)
+        if len(self.__rate_limiters) > MAX_RATE_LIMITED_TOPICS:
+            self.__rate_limiters.popitem(last=False)
+        return allowed
+
+    def __get_message_key(self, content: InvalidMessageContent, topic_name: str) -> bytes:
+        """Returns the hash that identifies identical invalid messages."""
+        message_hash = hashlib.blake2b(topic_name.encode(errors="replace"), digest_size=16)
+        if isinstance(content, str):
+            message_hash.update(b"\x00s")
+            message_hash.update(content.encode(errors="replace"))
+        else:
+            message_hash.update(b"\x00j")
+            try:
+                message_hash.update(self.__json_codec.dumps(content))
+            except (TypeError, ValueError):
+                message_hash.update(repr(content).encode(errors="replace"))
+        return message_hash.digest()
+
+    @staticmethod
+    def __get_timestamp(content: InvalidMessageContent) -> Optional[str]:
+        """Returns the timestamp of the invalid message if it has a valid one, otherwise None."""
+        if not isinstance(content, dict):
+            return None
+        timestamp = content.get("Timestamp", None)
+        if timestamp is not None:
+            try:
+                to_utc_datetime_object(timestamp)
+
+            except (ValueError, TypeError):
+                # timestamp is not valid so it will be created from current time
+                # when the invalid message object is created
+                timestamp = None
+        return timestamp
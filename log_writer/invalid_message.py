@@ -9,6 +9,7 @@
 
 from typing import Any, Dict, Optional, Union
 
+from tools.datetime_tools import to_iso_format_datetime_string
 from tools.messages import BaseMessage
 from tools.tools import FullLogger
 from tools.exceptions.messages import MessageValueError
@@ -26,11 +27,17 @@ class InvalidMessage(BaseMessage):
 
     MESSAGE_ATTRIBUTES = {
         "InvalidMessage": "invalid_message",
-        "InvalidJsonMessage": "invalid_json_message"
+        "InvalidJsonMessage": "invalid_json_message",
+        "OccurrenceCount": "occurrence_count",
+        "FirstSeen": "first_seen",
+        "LastSeen": "last_seen"
     }
 
     # Type and SimulationId are optional or in fact not used here.
-    OPTIONAL_ATTRIBUTES = ["InvalidMessage", "InvalidJsonMessage", "SimulationId", "Type"]
+    # The occurrence count and the first and last seen timestamps are only used for aggregated invalid messages.
+    OPTIONAL_ATTRIBUTES = [
+        "InvalidMessage", "InvalidJsonMessage", "SimulationId", "Type", "OccurrenceCount", "FirstSeen", "LastSeen"
+    ]
 
     QUANTITY_BLOCK_ATTRIBUTES = {}
 
@@ -69,6 +76,22 @@ class InvalidMessage(BaseMessage):
         If the message is valid JSON this is None and the message can be found from the invalid_message property."""
         return self.__invalid_json_message
 
+    @property
+    def occurrence_count(self) -> Optional[int]:
+        """The number of times the same invalid message was received within the aggregation window.
+        None if the message was not aggregated."""
+        return self.__occurrence_count
+
+    @property
+    def first_seen(self) -> Optional[str]:
+        """The time when the aggregated invalid message was first received. None if the message was not aggregated."""
+        return self.__first_seen
+
+    @property
+    def last_seen(self) -> Optional[str]:
+        """The time when the aggregated invalid message was last received. None if the message was not aggregated."""
+        return self.__last_seen
+
     @property
     def simulation_id(self) -> None:
         """Invalid messages do not contain a simulation id so this is always None."""
@@ -95,6 +118,30 @@ class InvalidMessage(BaseMessage):
         else:
             raise MessageValueError("Invalid value for invalid json message, should be string or None.")
 
+    @occurrence_count.setter
+    def occurrence_count(self, occurrence_count: Optional[int]):
+        """Set the occurrence count value."""
+        if self._check_occurrence_count(occurrence_count):
+            self.__occurrence_count = occurrence_count
+        else:
+            raise MessageValueError("Occurrence count should be a positive integer or None.")
+
+    @first_seen.setter
+    def first_seen(self, first_seen: Optional[str]):
+        """Set the first seen timestamp."""
+        if self._check_seen_timestamp(first_seen):
+            self.__first_seen = to_iso_format_datetime_string(first_seen) if first_seen is not None else None
+        else:
+            raise MessageValueError("Invalid value for first seen timestamp: {:s}".format(str(first_seen)))
+
+    @last_seen.setter
+    def last_seen(self, last_seen: Optional[str]):
+        """Set the last seen timestamp."""
+        if self._check_seen_timestamp(last_seen):
+            self.__last_seen = to_iso_format_datetime_string(last_seen) if last_seen is not None else None
+        else:
+            raise MessageValueError("Invalid value for last seen timestamp: {:s}".format(str(last_seen)))
+
     @simulation_id.setter
     def simulation_id(self, simulation_id: Any):
         """Setter for simulation id. Only None is accepted."""
@@ -117,7 +164,10 @@ class InvalidMessage(BaseMessage):
             super().__eq__(other) and
             isinstance(other, InvalidMessage) and
             self.invalid_message == other.invalid_message and
-            self.invalid_json_message == other.invalid_json_message
+            self.invalid_json_message == other.invalid_json_message and
+            self.occurrence_count == other.occurrence_count and
+            self.first_seen == other.first_seen and
+            self.last_seen == other.last_seen
         )
 
     @classmethod
@@ -130,6 +180,17 @@ class InvalidMessage(BaseMessage):
         """Check that invalid json message is string or None."""
         return invalid_json_message is None or isinstance(invalid_json_message, str)
 
+    @classmethod
+    def _check_occurrence_count(cls, occurrence_count: Optional[int]) -> bool:
+        """Check that occurrence count is a positive integer or None."""
+        return occurrence_count is None or (
+            isinstance(occurrence_count, int) and not isinstance(occurrence_count, bool) and occurrence_count > 0)
+
+    @classmethod
+    def _check_seen_timestamp(cls, timestamp: Optional[str]) -> bool:
+        """Check that the first or last seen timestamp is a valid timestamp or None."""
+        return timestamp is None or to_iso_format_datetime_string(timestamp) is not None
+
     @classmethod
     def _check_simulation_id(cls, simulation_id: Any) -> bool:
         """Check that simulation id is None."""
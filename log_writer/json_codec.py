@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 Tampere University and VTT Technical Research Centre of Finland
+# This software was developed as a part of the ProCemPlus project: https://www.senecc.fi/projects/procemplus
+# This source code is licensed under the MIT license. See LICENSE in the repository root directory.
+# Author(s): Ville Heikkilä <ville.heikkila@tuni.fi>
+#            Otto Hylli <otto.hylli@tuni.fi>
+
+"""Module containing the JSON decoder that is used for the received messages.
+   The standard library json module is used by default. The orjson library can be used instead if it is installed.
+   The orjson library does not accept NaN or Infinity values, so the messages that orjson cannot decode are decoded
+   with the standard library json module. The objects with integers larger than 64 bits are encoded with the json
+   module, but orjson decodes such integers as floats without an error, so they lose their precision."""
+
+import json
+from typing import Any, Callable, Tuple, Type, Union, cast
+
+from tools.tools import EnvironmentVariable, FullLogger
+
+LOGGER = FullLogger(__name__)
+
+JSON_CODEC_STDLIB = "json"
+JSON_CODEC_ORJSON = "orjson"
+JSON_CODEC_AUTO = "auto"
+
+# Which JSON library to use: "json", "orjson" or "auto" (orjson if it is installed)
+JSON_CODEC = cast(str, EnvironmentVariable("JSON_CODEC", str, JSON_CODEC_STDLIB).value)
+
+
+class JsonCodec:
+    """Class for decoding and encoding JSON using either the orjson library or the standard library json module."""
+    def __init__(self, codec_name: str = JSON_CODEC):
+        codec_name = codec_name.lower()
+        self.__name = JSON_CODEC_STDLIB
+        self.__loads = cast(Callable[[Union[bytes, str]], Any], json.loads)
+        self.__dumps = self.__stdlib_dumps
+        self.__decode_errors = cast(Tuple[Type[Exception], ...], (json.decoder.JSONDecodeError, UnicodeDecodeError))
+
+        if codec_name in (JSON_CODEC_AUTO, JSON_CODEC_ORJSON):
+            try:
+                import orjson  # pylint: disable=import-outside-toplevel
+
+                self.__name = JSON_CODEC_ORJSON
+                self.__orjson_loads = orjson.loads
+                self.__orjson_dumps = orjson.dumps
+                self.__orjson_decode_error = orjson.JSONDecodeError
+                self.__orjson_encode_error = orjson.JSONEncodeError
+                self.__loads = self.__orjson_loads_with_fallback
+                self.__dumps = self.__orjson_dumps_with_fallback
+
+            except ImportError:
+                if codec_name == JSON_CODEC_ORJSON:
+                    LOGGER.warning("The orjson library is not installed, using the standard library json module.")
+
+        elif codec_name != JSON_CODEC_STDLIB:
+            LOGGER.warning("Unknown JSON codec '{:s}', using the standard library json module.".format(codec_name))
+
+    @property
+    def name(self) -> str:
+        """The name of the used JSON library."""
+        return self.__name
+
+    @property
+    def decode_errors(self) -> Tuple[Type[Exception], ...]:
+        """The exception types that are raised when the input cannot be decoded."""
+        return self.__decode_errors
+
+    def loads(self, message: Union[bytes, str]) -> Any:
+        """Decodes the given JSON string or bytes."""
+        return self.__loads(message)
+
+    def dumps(self, json_object: Any) -> bytes:
+        """Encodes the given object to JSON as UTF-8 encoded bytes."""
+        return self.__dumps(json_object)
+
+    def __orjson_loads_with_fallback(self, message: Union[bytes, str]) -> Any:
+        """Decodes the given JSON using orjson and the standard library json module if orjson fails."""
+        try:
+            return self.__orjson_loads(message)
+        except self.__orjson_decode_error:
+            # for example, NaN and Infinity values and very large integers are only accepted by json
+            return json.loads(message)
+
+    def __orjson_dumps_with_fallback(self, json_object: Any) -> bytes:
+        """Encodes the given object using orjson and the standard library json module if orjson fails."""
+        try:
+            return self.__orjson_dumps(json_object)
+        except self.__orjson_encode_error:
+            return self.__stdlib_dumps(json_object)
+
+    @staticmethod
+    def __stdlib_dumps(json_object: Any) -> bytes:
+        """Encodes the given object using the standard library json module."""
+        return json.dumps(json_object, separators=(",", ":"), ensure_ascii=False).encode("UTF-8")
+
+
+DEFAULT_CODEC = JsonCodec()
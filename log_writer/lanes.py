@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 Tampere University and VTT Technical Research Centre of Finland
+# This software was developed as a part of the ProCemPlus project: https://www.senecc.fi/projects/procemplus
+# This source code is licensed under the MIT license. See LICENSE in the repository root directory.
+# Author(s): Ville Heikkilä <ville.heikkila@tuni.fi>
+#            Otto Hylli <otto.hylli@tuni.fi>
+
+"""Module containing the priority lanes for the message intake.
+
+The received messages are divided by their topic into two lanes that are handled by separate tasks:
+- the control lane for the SimulationState, Epoch and Status messages
+- the bulk lane for all the other messages, e.g. the result messages
+The control lane is unbounded and its messages are handled as soon as they are received, so a burst of large
+result messages does not delay the metadata updates that follow the control messages. The bulk lane is bounded,
+and when it is full, the message bus client is blocked until there is room in the lane.
+
+A SimulationState message is handled only after the bulk messages received before it have been handled,
+so that the messages of an ended simulation are included in its final metadata."""
+
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Optional, Tuple, cast
+
+from tools.tools import FullLogger, load_environmental_variables
+
+from log_writer.acknowledgements import CURRENT_DELIVERY, Delivery
+from log_writer.metrics import INTAKE_WAIT
+
+LOGGER = FullLogger(__name__)
+
+PRIORITY_LANES_NAME = "PRIORITY_LANES"
+BULK_LANE_SIZE_NAME = "BULK_LANE_SIZE"
+
+ENV_VARIABLES = load_environmental_variables(
+    # whether the control messages are handled separately from the other messages, turned off by default
+    (PRIORITY_LANES_NAME, bool, False),
+    # the maximum number of received messages waiting in the bulk lane
+    (BULK_LANE_SIZE_NAME, int, 1000)
+)
+
+CONTROL_LANE = "control"
+BULK_LANE = "bulk"
+
+SIMULATION_STATE_TOPIC = "SimulationState"
+CONTROL_TOPICS = frozenset((SIMULATION_STATE_TOPIC, "Epoch", "Status"))
+STATUS_TOPIC_PREFIX = "Status."
+
+# (message, topic name, sequence number of the last bulk message received before it, receive time,
+#  message bus delivery for the acknowledgement)
+LaneItem = Tuple[Any, str, int, float, Optional[Delivery]]
+
+
+def is_control_topic(topic_name: str) -> bool:
+    """Returns True, if messages with the given topic are handled in the control lane."""
+    return topic_name in CONTROL_TOPICS or topic_name.startswith(STATUS_TOPIC_PREFIX)
+
+
+class PriorityLanes:
+    """Class for dividing the received messages into the control lane and the bulk lane.
+
+    The messages are given to the lanes with the put method instead of directly to the message handler.
+    """
+    def __init__(self, message_handler: Callable[[Any, str], Awaitable[None]], bulk_lane_size: Optional[int] = None):
+        self.__message_handler = message_handler
+        self.__control_lane = asyncio.Queue()
+        self.__bulk_lane = asyncio.Queue(maxsize=max(cast(int, bulk_lane_size if bulk_lane_size is not None
+                                                          else ENV_VARIABLES[BULK_LANE_SIZE_NAME]), 1))
+        # the number of bulk messages that have been received and that have been handled
+        self.__bulk_received = 0
+        self.__bulk_handled = 0
+        # the sequence number and the future for a control message that waits for the earlier bulk messages
+        self.__barrier = 0
+        self.__barrier_future = None
+        self.__control_task = None
+        self.__bulk_task = None
+        self.__closing = False
+        # the lane whose handler closed the lanes, its remaining messages are not handled
+        self.__stopped_lane = None
+
+    @property
+    def control_pending(self) -> int:
+        """The number of messages waiting in the control lane."""
+        return self.__control_lane.qsize()
+
+    @property
+    def bulk_pending(self) -> int:
+        """The number of messages waiting in the bulk lane."""
+        return self.__bulk_lane.qsize()
+
+    async def put(self, message: Any, topic_name: str):
+        """Adds the received message to the lane for its topic.
+           Waits until there is room in the bulk lane, if the bulk lane is full."""
+        if self.__closing:
+            return
+        self.__start_tasks()
+        if is_control_topic(topic_name):
+            self.__control_lane.put_nowait(
+                (message, topic_name, self.__bulk_received, time.perf_counter(), CURRENT_DELIVERY.get()))
+        else:
+            self.__bulk_received += 1
+            await self.__bulk_lane.put(
+                (message, topic_name, self.__bulk_received, time.perf_counter(), CURRENT_DELIVERY.get()))
+
+    async def close(self):
+        """Handles the messages already in the lanes and stops the lane tasks. If called from a message handler,
+           the lane of the calling handler is stopped after the current message without handling the rest."""
+        self.__closing = True
+        current_task = asyncio.current_task()
+        for lane_name, lane, task in (
+                (BULK_LANE, self.__bulk_lane, self.__bulk_task),
+                (CONTROL_LANE, self.__control_lane, self.__control_task)):
+            if task is None:
+                continue
+            if task is current_task:
+                self.__stopped_lane = lane_name
+                continue
+            await lane.join()
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    def __str__(self) -> str:
+        return "control: {:d}, bulk: {:d}".format(self.control_pending, self.bulk_pending)
+
+    def __start_tasks(self):
+        """Starts the lane tasks if they are not already running."""
+        if self.__control_task is None:
+            self.__control_task = asyncio.create_task(self.__handle_lane(self.__control_lane, CONTROL_LANE))
+            self.__bulk_task = asyncio.create_task(self.__handle_lane(self.__bulk_lane, BULK_LANE))
+
+    async def __handle_lane(self, lane: asyncio.Queue, lane_name: str):
+        """Gives the messages from the lane to the message handler in the order they were received."""
+        is_bulk_lane = lane_name == BULK_LANE
+        while self.__stopped_lane != lane_name:
+            message, topic_name, sequence_number, receive_time, delivery = cast(LaneItem, await lane.get())
+            # the delivery is made available for the message handler in the same way as in the message consumer
+            CURRENT_DELIVERY.set(delivery)
+            try:
+                if not is_bulk_lane and topic_name == SIMULATION_STATE_TOPIC:
+                    await self.__wait_for_bulk_messages(sequence_number)
+                INTAKE_WAIT.observe(time.perf_counter() - receive_time, lane_name)
+                await self.__message_handler(message, topic_name)
+
+            except Exception as error:  # pylint: disable=broad-except
+                LOGGER.error("Error while handling message from topic {:s}: {:s}".format(topic_name, str(error)))
+
+            finally:
+                lane.task_done()
+                if is_bulk_lane:
+                    self.__bulk_handled = sequence_number
+                    if self.__barrier_future is not None and self.__bulk_handled >= self.__barrier:
+                        self.__barrier_future.set_result(None)
+                        self.__barrier_future = None
+
+    async def __wait_for_bulk_messages(self, sequence_number: int):
+        """Waits until the bulk messages up to the given sequence number have been handled."""
+        if self.__bulk_handled >= sequence_number:
+            return
+        self.__barrier = sequence_number
+        self.__barrier_future = asyncio.get_running_loop().create_future()
+        await self.__barrier_future
@@ -8,37 +8,126 @@
 """This module contains a listener simulation component that prints out all messages from the message bus."""
 
 import asyncio
-import json
 import logging
-from typing import cast, List, Union
+import signal
+from typing import Any, Awaitable, Callable, Dict, Optional, cast, List, Union
 
 from tools.callbacks import LOGGER as callback_logger
 from tools.clients import RabbitmqClient
-from tools.datetime_tools import to_utc_datetime_object
-from tools.messages import BaseMessage, AbstractMessage, GeneralMessage
+from tools.db_clients import MongodbClient
+from tools.messages import BaseMessage, AbstractMessage
 from tools.tools import EnvironmentVariable, FullLogger
 
+from log_writer.batcher import MessageBatcher
+from log_writer.acknowledgements import acknowledge_when_handled
+from log_writer.consumer import (
+    ENV_VARIABLES as CONSUMER_ENV_VARIABLES, RABBITMQ_ACK_AFTER_STORE_NAME, RABBITMQ_PREFETCH_COUNT_NAME,
+    MessageConsumer)
+from log_writer.epoch_summary import EpochSummaryWriter
+from log_writer.flush_controller import AdaptiveFlushController
+from log_writer.invalid_aggregator import InvalidMessageAggregator, InvalidMessageContent
 from log_writer.invalid_message import InvalidMessage
-from log_writer.simulation import SimulationMetadata, SimulationMetadataCollection
+from log_writer.json_codec import DEFAULT_CODEC, JSON_CODEC_STDLIB, JsonCodec
+from log_writer.lanes import (
+    ENV_VARIABLES as LANES_ENV_VARIABLES, PRIORITY_LANES_NAME, SIMULATION_STATE_TOPIC, PriorityLanes)
+from log_writer.live_tail import LiveTail, LiveTailServer, get_live_tail_port
+from log_writer.metrics import DROPPED_DOCUMENTS, INVALID_MESSAGES, MetricsExporter
+from log_writer.profiling import STAGE_DECODE, STAGE_TIMERS, STAGE_VALIDATION, add_profiling_signal_handlers
+from log_writer.raw_message import RawMessage
+from log_writer.shard import ShardFilter
+from log_writer.simulation import SimulationMetadata, SimulationMetadataCollection, get_epoch_number
+from log_writer.storage import StorageBackend
+from log_writer.topic_filter import TopicFilter
+from log_writer.validation import MessageValidatorCache
+from log_writer.write_queue import WriteQueue
 
 # No info logs about each received message stored.
 callback_logger.level = max(callback_logger.level, logging.WARNING)
 LOGGER = FullLogger(__name__)
 
 STATISTICS_DISPLAY_INTERVAL = cast(int, EnvironmentVariable("STATISTICS_DISPLAY_INTERVAL", int, 60).value)
-STOP_WAIT_TIMER = 15
+# In the raw storage mode the messages are stored as they were received without converting them to message objects.
+RAW_STORAGE_MODE = cast(bool, EnvironmentVariable("RAW_STORAGE_MODE", bool, False).value)
+# In the raw storage mode every Nth message is fully validated. Value 0 turns off the validation.
+RAW_VALIDATION_INTERVAL = cast(int, EnvironmentVariable("RAW_VALIDATION_INTERVAL", int, 100).value)
+# The maximum time in seconds to wait for the pending database writes when the log writer is stopped.
+STOP_DRAIN_TIMEOUT = cast(float, EnvironmentVariable("STOP_DRAIN_TIMEOUT", float, 60.0).value)
 
 
 class ListenerComponent:
     """Class for the message bus listener component."""
-    LISTENED_TOPICS = "#"
+    def __init__(self, raw_storage_mode: bool = RAW_STORAGE_MODE,
+                 raw_validation_interval: int = RAW_VALIDATION_INTERVAL,
+                 json_codec: JsonCodec = DEFAULT_CODEC,
+                 shard: Optional[ShardFilter] = None,
+                 stop_function: Optional[Callable[[], Awaitable[None]]] = None,
+                 metadata_function: Optional[Callable[[SimulationMetadata], Awaitable[bool]]] = None,
+                 rabbitmq_client: Optional[RabbitmqClient] = None,
+                 mongo_client: Optional[MongodbClient] = None,
+                 topic_filter: Optional[TopicFilter] = None,
+                 write_queue: Optional[WriteQueue] = None,
+                 flush_controller: Optional[AdaptiveFlushController] = None,
+                 invalid_message_rate_limit: Optional[float] = None,
+                 storage: Optional[StorageBackend] = None,
+                 priority_lanes: Optional[bool] = None,
+                 ack_after_store: Optional[bool] = None):
+        self.__json_codec = json_codec
+        self.__topic_filter = topic_filter if topic_filter is not None else TopicFilter()
+        self.__validator = MessageValidatorCache()
+        self.__raw_storage_mode = raw_storage_mode
+        self.__raw_validation_interval = max(raw_validation_interval, 0)
+        self.__raw_message_count = 0
+        self.__shard = shard
+        # the stop function is called when a simulation has ended, by default the log writer is stopped
+        self.__metadata_collection = SimulationMetadataCollection(
+            stop_function=stop_function if stop_function is not None else self.stop,
+            metadata_function=metadata_function,
+            mongo_client=mongo_client,
+            write_queue=write_queue,
+            flush_controller=flush_controller,
+            storage=storage)
 
-    def __init__(self):
-        self.__rabbitmq_client = RabbitmqClient()
-        self.__rabbitmq_client.add_listener(ListenerComponent.LISTENED_TOPICS, self.simulation_message_handler)
+        # the raw message bodies are needed for the raw storage mode and for the shard selection
+        # and the acknowledgements after the store are only available with the message consumer
+        if ack_after_store is None:
+            ack_after_store = cast(bool, CONSUMER_ENV_VARIABLES[RABBITMQ_ACK_AFTER_STORE_NAME])
+        ack_after_store = ack_after_store and rabbitmq_client is None
+        # the simulation-tools client decodes and validates the messages itself with the standard library json
+        # module, so the raw message bodies are also used when another JSON codec has been selected
+        use_raw_bodies = (
+            raw_storage_mode or shard is not None or ack_after_store or
+            (rabbitmq_client is None and json_codec.name != JSON_CODEC_STDLIB)
+        )
+        message_handler = self.raw_body_handler if use_raw_bodies else self.simulation_message_handler
+        if ack_after_store:
+            message_handler = acknowledge_when_handled(message_handler)
+        # with the priority lanes the control messages are not handled after the earlier bulk messages
+        if cast(bool, priority_lanes if priority_lanes is not None else LANES_ENV_VARIABLES[PRIORITY_LANES_NAME]):
+            self.__lanes = PriorityLanes(message_handler)
+            message_handler = self.__lanes.put
+        else:
+            self.__lanes = None
+        if rabbitmq_client is not None:
+            # a given client is used as it is, and it is expected to give the raw message bodies when they are needed
+            self.__rabbitmq_client = rabbitmq_client
+            self.__rabbitmq_client.add_listener(self.__topic_filter.listened_topics, message_handler)
+        elif use_raw_bodies:
+            # the prefetch count is sized to the batches, so that the next batch can be received
+            # while the previous batch is being written
+            self.__rabbitmq_client = MessageConsumer(
+                self.__topic_filter.listened_topics, message_handler, ack_after_store=ack_after_store,
+                prefetch_count=(
+                    cast(int, CONSUMER_ENV_VARIABLES[RABBITMQ_PREFETCH_COUNT_NAME]) or
+                    (2 * self.__metadata_collection.batcher.flush_controller.max_batch_size if ack_after_store else 0)
+                ))
+        else:
+            self.__rabbitmq_client = RabbitmqClient()
+            self.__rabbitmq_client.add_listener(self.__topic_filter.listened_topics, message_handler)
 
-        self.__metadata_collection = SimulationMetadataCollection(stop_function=self.stop)
-        self.__is_stopped = False
+        self.__invalid_message_aggregator = InvalidMessageAggregator(
+            self.__store_invalid_message, rate_limit=invalid_message_rate_limit, json_codec=json_codec)
+        self.__stopping = False
+        self.__stopped = asyncio.Event()
 
         # default simulation id is used when a invalid simulation message is received
         simulation_id = EnvironmentVariable('SIMULATION_ID', str, None).value
@@ -48,10 +137,33 @@ class ListenerComponent:
             self.__default_simulation_id = simulation_id
 
     async def stop(self) -> None:
-        """Stops the log writer."""
+        """Stops the log writer. The intake of new messages is stopped first and then all the buffered
+           messages are written to the database. The waiting for the database writes is limited by
+           STOP_DRAIN_TIMEOUT."""
+        if self.__stopping:
+            return
+        self.__stopping = True
+
         LOGGER.info("Stopping the log writer.")
-        await self.__rabbitmq_client.close()
-        self.__is_stopped = True
+        # the message consumer connection is kept open for the acknowledgements until the messages have been written
+        if isinstance(self.__rabbitmq_client, MessageConsumer):
+            await self.__rabbitmq_client.stop_consuming()
+        else:
+            await self.__rabbitmq_client.close()
+        if self.__lanes is not None:
+            await self.__lanes.close()
+        await self.__invalid_message_aggregator.close()
+
+        drain_result = await self.__metadata_collection.close(STOP_DRAIN_TIMEOUT)
+        LOGGER.info("Wrote {:d} pending documents to the database in {:.2f} seconds.".format(
+            drain_result.drained_documents, drain_result.duration))
+        if drain_result.remaining_documents > 0:
+            LOGGER.warning("{:d} documents were not written to the database within {:.1f} seconds.".format(
+                drain_result.remaining_documents, STOP_DRAIN_TIMEOUT))
+        if isinstance(self.__rabbitmq_client, MessageConsumer):
+            await self.__rabbitmq_client.close()
+
+        self.__stopped.set()
 
     @property
     def simulations(self) -> List[str]:
@@ -61,59 +173,170 @@ class ListenerComponent:
     @property
     def is_stopped(self) -> bool:
         """Returns True, if the log writer has been stopped and is not listening to messages anymore."""
-        return self.__is_stopped
+        return self.__stopped.is_set()
+
+    async def wait_for_stop(self, timeout: float) -> bool:
+        """Waits at most timeout seconds for the log writer to be stopped.
+           Returns True, if the log writer has been stopped."""
+        try:
+            await asyncio.wait_for(self.__stopped.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self.is_stopped
+
+    @property
+    def message_buffer(self) -> MessageBatcher:
+        """The shared message buffer that is used to store the messages to the database."""
+        return self.__metadata_collection.batcher
+
+    @property
+    def epoch_summary(self) -> Union[EpochSummaryWriter, None]:
+        """The writer for the per epoch summaries or None if the summaries are not used."""
+        return self.__metadata_collection.epoch_summary
+
+    @property
+    def invalid_messages(self) -> InvalidMessageAggregator:
+        """The aggregator that stores the received invalid messages."""
+        return self.__invalid_message_aggregator
+
+    @property
+    def lanes(self) -> Union[PriorityLanes, None]:
+        """The priority lanes for the received messages or None if the lanes are not used."""
+        return self.__lanes
+
+    @property
+    def live_tail(self) -> Union[LiveTail, None]:
+        """The ring buffers for the latest received messages or None if the live tail is not used."""
+        return self.__metadata_collection.live_tail
+
+    @property
+    def topic_filter(self) -> TopicFilter:
+        """The filter that selects the stored messages based on their topics."""
+        return self.__topic_filter
 
     def get_metadata(self, simulation_id: str) -> Union[SimulationMetadata, None]:
         """Returns the simulation metadata object corresponding to the given simulation identifier."""
         return self.__metadata_collection.get_simulation(simulation_id)
 
+    async def raw_body_handler(self, message_body: bytes, message_routing_key: str):
+        """Handles the raw message bodies received by the message consumer."""
+        if not self.__topic_filter.accepts_topic(message_routing_key):
+            DROPPED_DOCUMENTS.inc("excluded_topic")
+            return
+        if self.__shard is not None and not self.__shard.accepts(message_body, message_routing_key):
+            # every worker receives the end of the simulation, so that each worker stops only after
+            # it has handled its own messages that were received before the end
+            if self.__is_simulation_end(message_body, message_routing_key):
+                self.__metadata_collection.notify_simulation_end()
+            return
+
+        if self.__raw_storage_mode:
+            await self.raw_message_handler(message_body, message_routing_key)
+        else:
+            await self.simulation_message_handler(message_body.decode(errors="replace"), message_routing_key)
+
+    def __is_simulation_end(self, message_body: bytes, message_routing_key: str) -> bool:
+        """Returns True, if the raw message body is a simulation state message for the end of the simulation."""
+        if message_routing_key != SIMULATION_STATE_TOPIC:
+            return False
+        try:
+            message_json = self.__json_codec.loads(message_body)
+        except self.__json_codec.decode_errors:
+            return False
+        return (
+            isinstance(message_json, dict) and
+            message_json.get("SimulationState", None) == SimulationMetadata.SIMULATION_ENDED
+        )
+
+    async def raw_message_handler(self, message_body: bytes, message_routing_key: str):
+        """Handles the received simulation messages in the raw storage mode.
+           The messages are stored as they were received and only the sampled messages are fully validated.
+           Messages that do not contain the attributes required for the simulation metadata
+           are handled in the same way as in the normal mode."""
+        stage_start = STAGE_TIMERS.start(STAGE_DECODE)
+        try:
+            message_json = self.__json_codec.loads(message_body)
+        except self.__json_codec.decode_errors:
+            STAGE_TIMERS.stop(STAGE_DECODE, stage_start)
+            await self.simulation_message_handler(message_body.decode(errors="replace"), message_routing_key)
+            return
+        STAGE_TIMERS.stop(STAGE_DECODE, stage_start)
+
+        if not isinstance(message_json, dict):
+            await self.simulation_message_handler(message_body.decode(errors="replace"), message_routing_key)
+            return
+
+        self.__raw_message_count += 1
+        stage_start = STAGE_TIMERS.start(STAGE_VALIDATION)
+        if (self.__raw_validation_interval > 0 and
+                self.__raw_message_count % self.__raw_validation_interval == 0 and
+                self.__validator.validate(message_json) is None):
+            message_object = None
+        else:
+            message_object = RawMessage.from_json(message_json)
+        STAGE_TIMERS.stop(STAGE_VALIDATION, stage_start)
+
+        if message_object is None:
+            await self.simulation_message_handler(message_json, message_routing_key)
+            return
+
+        if not self.__sample(message_object, message_routing_key):
+            return
+        LOGGER.debug("{:s} : {:s} : {:s}".format(
+            message_routing_key, message_object.simulation_id, str(message_object.message_id)))
+        await self.__metadata_collection.add_message(message_object, message_routing_key)
+
     async def simulation_message_handler(self, message_object: Union[BaseMessage, dict, str],
                                          message_routing_key: str):
         """Handles the received simulation messages."""
+        if not self.__topic_filter.accepts_topic(message_routing_key):
+            DROPPED_DOCUMENTS.inc("excluded_topic")
+            return
+
         # if message is a string see if it can be decoded as json
         if isinstance(message_object, str):
+            stage_start = STAGE_TIMERS.start(STAGE_DECODE)
             try:
-                message_json = json.loads(message_object)
+                message_json = self.__json_codec.loads(message_object)
                 if isinstance(message_json, dict):
                     message_object = message_json
+                STAGE_TIMERS.stop(STAGE_DECODE, stage_start)
 
-            except json.decoder.JSONDecodeError:
-                # create invalid message object from the invalid json string
+            except self.__json_codec.decode_errors:
+                STAGE_TIMERS.stop(STAGE_DECODE, stage_start)
+                # the invalid json string is stored as an invalid message
                 LOGGER.debug("Received message could not be decoded into JSON format: {:s}".format(message_object))
-                message_object = InvalidMessage(InvalidJsonMessage=message_object)
+                await self.__handle_invalid_message(message_object, message_routing_key)
+                return
 
         # see if valid json is a a valid simulation platform message"
         if isinstance(message_object, dict):
-            # use the GeneralMessage type when dealing with possible unknown message type
-            actual_message_object = GeneralMessage.from_json(message_object)
+            # the required attributes are checked using the message type specific cached checks
+            stage_start = STAGE_TIMERS.start(STAGE_VALIDATION)
+            actual_message_object = self.__validator.validate(message_object)
+            STAGE_TIMERS.stop(STAGE_VALIDATION, stage_start)
             if actual_message_object is None:
                 # invalid message
                 LOGGER.debug("Could not create a valid message object from the received message: {:s}".format(
                     str(message_object)))
-                # check if there is a valid timestamp
-                timestamp = message_object.get("Timestamp", None)
-                # if there is a valid timestamp it is used as the invalid message timestamp
-                if timestamp is not None:
-                    try:
-                        to_utc_datetime_object(timestamp)
-
-                    except ValueError:
-                        # timestamp is not valid so it will be created from current time
-                        # when the invalid message object is created
-                        timestamp = None
-
-                actual_message_object = InvalidMessage(Timestamp=timestamp, InvalidMessage=message_object)
+                await self.__handle_invalid_message(message_object, message_routing_key)
+                return
             message_object = actual_message_object
 
         if isinstance(message_object, AbstractMessage):
+            if not self.__sample(message_object, message_routing_key):
+                return
             LOGGER.debug("{:s} : {:s} : {:s}".format(
                 message_routing_key, message_object.simulation_id, message_object.message_id))
             await self.__metadata_collection.add_message(message_object, message_routing_key)
 
         elif isinstance(message_object, BaseMessage):
-            if isinstance(message_object, InvalidMessage) and self.__default_simulation_id is None:
-                LOGGER.warning("Unable to log an invalid message since default simulation id has not been given.")
-                return
+            if isinstance(message_object, InvalidMessage):
+                INVALID_MESSAGES.inc(message_routing_key)
+                if self.__default_simulation_id is None:
+                    LOGGER.warning("Unable to log an invalid message since default simulation id has not been given.")
+                    DROPPED_DOCUMENTS.inc("no_simulation_id")
+                    return
 
             # if message is invalid default simulation id is used
             simulation_id = (
@@ -128,24 +351,102 @@ class ListenerComponent:
             LOGGER.warning("Received '{:s}' message when expecting for simulation platform compatible message".format(
                 str(message_object)))
 
+    async def __handle_invalid_message(self, message_content: InvalidMessageContent, message_routing_key: str):
+        """Gives the invalid message to the invalid message aggregator, if it can be stored."""
+        INVALID_MESSAGES.inc(message_routing_key)
+        if self.__default_simulation_id is None:
+            LOGGER.warning("Unable to log an invalid message since default simulation id has not been given.")
+            DROPPED_DOCUMENTS.inc("no_simulation_id")
+            return
+        await self.__invalid_message_aggregator.add(message_content, message_routing_key)
+
+    async def __store_invalid_message(self, invalid_message: InvalidMessage, message_routing_key: str):
+        """Stores an invalid message using the default simulation id."""
+        LOGGER.debug("{:s} : {:s}".format(message_routing_key, str(self.__default_simulation_id)))
+        await self.__metadata_collection.add_message(
+            invalid_message, message_routing_key, cast(str, self.__default_simulation_id))
+
+    def __sample(self, message_object: Union[AbstractMessage, RawMessage], message_routing_key: str) -> bool:
+        """Returns True, if the message is kept by the topic sampling rules."""
+        if self.__topic_filter.sample(
+                message_routing_key, message_object.simulation_id, get_epoch_number(message_object)):
+            return True
+        DROPPED_DOCUMENTS.inc("sampled_out")
+        return False
+
+
+def log_statistics(message_listener: ListenerComponent):
+    """Writes the statistics for the listened simulations to the log."""
+    log_message = "\nSimulations listened:\n=====================\n"
+    log_message += "\n".join([
+        str(message_listener.get_metadata(simulation_id))
+        for simulation_id in message_listener.simulations
+    ])
+    log_message += "\nMessage buffer: {:s}".format(str(message_listener.message_buffer))
+    if message_listener.invalid_messages.received_messages > 0:
+        log_message += "\nInvalid messages: {:s}".format(str(message_listener.invalid_messages))
+    if message_listener.epoch_summary is not None:
+        log_message += "\nEpoch summaries: {:s}".format(str(message_listener.epoch_summary))
+    if message_listener.lanes is not None:
+        log_message += "\nIntake lanes: {:s}".format(str(message_listener.lanes))
+    if message_listener.live_tail is not None:
+        log_message += "\nLive tail: {:s}".format(str(message_listener.live_tail))
+    if message_listener.topic_filter.is_active:
+        log_message += "\nTopic filter: {:s}".format(str(message_listener.topic_filter))
+    if STAGE_TIMERS.enabled:
+        log_message += "\nStage timers: {:s}".format(str(STAGE_TIMERS))
+    LOGGER.info(log_message)
+
+
+def get_live_tail_server(message_listener: ListenerComponent,
+                         worker_index: Optional[int] = None) -> Union[LiveTailServer, None]:
+    """Returns the server for the live tail endpoints of the listener or None if the live tail is not used."""
+    live_tail = message_listener.live_tail
+    if live_tail is None:
+        return None
+
+    def get_simulation_snapshot(simulation_id: str) -> Union[Dict[str, Any], None]:
+        simulation_metadata = message_listener.get_metadata(simulation_id)
+        return simulation_metadata.get_snapshot() if simulation_metadata is not None else None
+
+    return LiveTailServer(
+        live_tail, lambda: message_listener.simulations, get_simulation_snapshot, port=get_live_tail_port(worker_index))
+
+
+def add_stop_signal_handlers(stop_callback: Callable[[], Any]):
+    """Calls the stop callback when the process receives SIGTERM or SIGINT, so that the buffered messages
+       are written to the database also when the log writer is stopped from outside, e.g. in the service mode."""
+    loop = asyncio.get_running_loop()
+    for signal_number in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signal_number, stop_callback)
+
 
 async def start_listener_component():
     """Start a listener component for the simulation platform."""
     message_listener = ListenerComponent()
+    metrics_exporter = MetricsExporter()
+    await metrics_exporter.start()
+    live_tail_server = get_live_tail_server(message_listener)
+    if live_tail_server is not None:
+        await live_tail_server.start()
+    add_stop_signal_handlers(lambda: asyncio.create_task(message_listener.stop()))
+    add_profiling_signal_handlers()
 
     while not message_listener.is_stopped:
-        # print out the statistics every two minutes
-        await asyncio.sleep(STATISTICS_DISPLAY_INTERVAL)
-        log_message = "\nSimulations listened:\n=====================\n"
-        log_message += "\n".join([
-            str(message_listener.get_metadata(simulation_id))
-            for simulation_id in message_listener.simulations
-        ])
-        LOGGER.info(log_message)
+        # print out the statistics at regular intervals and once more after the log writer has been stopped
+        await message_listener.wait_for_stop(STATISTICS_DISPLAY_INTERVAL)
+        log_statistics(message_listener)
 
-    # short wait before exiting to allow all database writes to finish properly.
-    await asyncio.sleep(STOP_WAIT_TIMER)
+    if live_tail_server is not None:
+        await live_tail_server.close()
+    await metrics_exporter.close()
 
 
 if __name__ == "__main__":
-    asyncio.run(start_listener_component())
+    # pylint: disable=ungrouped-imports
+    from log_writer.supervisor import WORKER_PROCESSES, start_supervisor
+
+    if WORKER_PROCESSES > 1:
+        asyncio.run(start_supervisor(WORKER_PROCESSES))
+    else:
+        asyncio.run(start_listener_component())
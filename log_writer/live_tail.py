@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 Tampere University and VTT Technical Research Centre of Finland
+# This software was developed as a part of the ProCemPlus project: https://www.senecc.fi/projects/procemplus
+# This source code is licensed under the MIT license. See LICENSE in the repository root directory.
+# Author(s): Ville Heikkilä <ville.heikkila@tuni.fi>
+#            Otto Hylli <otto.hylli@tuni.fi>
+
+"""Module containing the live tail of the recently received messages and the HTTP endpoints for it.
+
+The latest LIVE_TAIL_BUFFER_SIZE messages for each topic of each simulation are kept in memory, so that
+the monitoring tools can follow a running simulation without querying the database. When LIVE_TAIL_PORT
+is given, the following endpoints are available:
+- /simulations: the ids of the simulations in memory
+- /simulations/<simulation id>: the current metadata and message counts for the simulation
+- /simulations/<simulation id>/messages?topic=<topic pattern>&limit=<n>: the latest n messages, oldest first
+- /simulations/<simulation id>/stream?topic=<topic pattern>: the new messages as server-sent events
+The topic pattern uses the RabbitMQ syntax and matches all the topics by default."""
+
+import asyncio
+import collections
+from typing import Any, AsyncIterator, Callable, Deque, Dict, List, Optional, Pattern, Set, Tuple, Union, cast
+
+from tools.tools import load_environmental_variables
+
+from log_writer.http_server import HttpRequest, HttpResponse, HttpServer, HttpStreamResponse
+from log_writer.json_codec import DEFAULT_CODEC, JsonCodec
+from log_writer.storage import to_json_compatible
+from log_writer.topic_filter import topic_pattern_to_regex
+
+LIVE_TAIL_PORT_NAME = "LIVE_TAIL_PORT"
+LIVE_TAIL_HOST_NAME = "LIVE_TAIL_HOST"
+LIVE_TAIL_BUFFER_SIZE_NAME = "LIVE_TAIL_BUFFER_SIZE"
+
+ENV_VARIABLES = load_environmental_variables(
+    # the port for the live tail endpoints, value 0 means that the live tail is not used
+    (LIVE_TAIL_PORT_NAME, int, 0),
+    # the host address for the live tail endpoints, by default only local connections are accepted
+    (LIVE_TAIL_HOST_NAME, str, "127.0.0.1"),
+    # the number of the latest messages kept in memory for each topic of each simulation
+    (LIVE_TAIL_BUFFER_SIZE_NAME, int, 100)
+)
+
+SIMULATIONS_PATH = "/simulations"
+MESSAGES_PATH = "messages"
+STREAM_PATH = "stream"
+JSON_CONTENT_TYPE = "application/json"
+
+# the maximum number of messages waiting to be sent to a single stream client
+SUBSCRIPTION_QUEUE_SIZE = 1000
+# the interval in seconds for the keep-alive comments in the streams, used to detect the closed connections
+KEEPALIVE_INTERVAL = 15.0
+
+# (sequence number, topic name, message object)
+LiveTailEntry = Tuple[int, str, Any]
+
+
+def get_live_tail_port(worker_index: Optional[int] = None) -> int:
+    """Returns the port for the live tail endpoints. The worker processes use the ports following the live tail port.
+       Returns 0, if the live tail is not used."""
+    port = cast(int, ENV_VARIABLES[LIVE_TAIL_PORT_NAME])
+    if port > 0 and worker_index is not None:
+        return port + worker_index + 1
+    return port
+
+
+def get_live_tail() -> Optional["LiveTail"]:
+    """Returns a new live tail or None if the live tail is not used."""
+    if get_live_tail_port() > 0:
+        return LiveTail()
+    return None
+
+
+def to_live_tail_document(entry: LiveTailEntry) -> Dict[str, Any]:
+    """Returns a JSON compatible document for the live tail entry."""
+    sequence_number, topic_name, message_object = entry
+    # the database client can add the _id attribute to the stored document
+    message_document = dict(message_object.json())
+    message_document.pop("_id", None)
+    return {"Sequence": sequence_number, "Topic": topic_name, "Message": to_json_compatible(message_document)}
+
+
+class LiveTailSubscription:
+    """Class for receiving the new messages of a simulation for a single stream client."""
+    __slots__ = ("__simulation_id", "__topic_regex", "__queue", "__dropped", "__closed")
+
+    def __init__(self, simulation_id: str, topic_regex: Optional[Pattern]):
+        self.__simulation_id = simulation_id
+        self.__topic_regex = topic_regex
+        self.__queue = asyncio.Queue(maxsize=SUBSCRIPTION_QUEUE_SIZE)
+        self.__dropped = 0
+        self.__closed = False
+
+    @property
+    def simulation_id(self) -> str:
+        """The simulation identifier."""
+        return self.__simulation_id
+
+    @property
+    def dropped(self) -> int:
+        """The number of messages that were not delivered because the client was too slow."""
+        return self.__dropped
+
+    @property
+    def closed(self) -> bool:
+        """Returns True, if no more messages will be received."""
+        return self.__closed
+
+    def put(self, entry: LiveTailEntry):
+        """Adds the message to the subscription, if its topic matches the topic pattern."""
+        if self.__topic_regex is not None and not self.__topic_regex.match(entry[1]):
+            return
+        try:
+            self.__queue.put_nowait(entry)
+        except asyncio.QueueFull:
+            self.__dropped += 1
+
+    def close(self):
+        """Ends the subscription after the messages already in the queue."""
+        if self.__queue.full():
+            self.__queue.get_nowait()
+            self.__dropped += 1
+        self.__queue.put_nowait(None)
+
+    async def get(self, timeout: float) -> Optional[LiveTailEntry]:
+        """Returns the next message or None, if there was no message within the timeout or the subscription
+           has been closed."""
+        if self.__closed:
+            return None
+        try:
+            entry = await asyncio.wait_for(self.__queue.get(), timeout=timeout)
+        except asyncio.TimeoutError:
+            return None
+        if entry is None:
+            self.__closed = True
+        return entry
+
+
+class LiveTail:
+    """Class for keeping the latest messages for each topic of each simulation in fixed-size ring buffers
+       and for delivering the new messages to the subscriptions."""
+    def __init__(self, buffer_size: Optional[int] = None):
+        self.__buffer_size = max(cast(int, buffer_size if buffer_size is not None
+                                      else ENV_VARIABLES[LIVE_TAIL_BUFFER_SIZE_NAME]), 1)
+        self.__buffers: Dict[str, Dict[str, Deque[LiveTailEntry]]] = {}
+        self.__subscriptions: Dict[str, Set[LiveTailSubscription]] = {}
+        self.__sequence_number = 0
+
+    @property
+    def buffer_size(self) -> int:
+        """The number of messages kept for each topic of each simulation."""
+        return self.__buffer_size
+
+    @property
+    def subscriptions(self) -> int:
+        """The number of active subscriptions."""
+        return sum(len(subscriptions) for subscriptions in self.__subscriptions.values())
+
+    def add_message(self, simulation_id: str, message_object: Any, topic_name: str):
+        """Adds the message to the ring buffer for its simulation and topic and to the subscriptions."""
+        self.__sequence_number += 1
+        entry = (self.__sequence_number, topic_name, message_object)
+        topic_buffers = self.__buffers.get(simulation_id, None)
+        if topic_buffers is None:
+            topic_buffers = {}
+            self.__buffers[simulation_id] = topic_buffers
+        topic_buffer = topic_buffers.get(topic_name, None)
+        if topic_buffer is None:
+            topic_buffer = collections.deque(maxlen=self.__buffer_size)
+            topic_buffers[topic_name] = topic_buffer
+        topic_buffer.append(entry)
+
+        for subscription in self.__subscriptions.get(simulation_id, ()):
+            subscription.put(entry)
+
+    def get_messages(self, simulation_id: str, topic_pattern: Optional[str] = None,
+                     limit: Optional[int] = None) -> List[LiveTailEntry]:
+        """Returns the latest messages for the simulation with topics matching the topic pattern
+           in the order they were received. At most limit messages are returned, if the limit is given."""
+        topic_regex = topic_pattern_to_regex(topic_pattern) if topic_pattern else None
+        entries = [
+            entry
+            for topic_name, topic_buffer in self.__buffers.get(simulation_id, {}).items()
+            if topic_regex is None or topic_regex.match(topic_name)
+            for entry in topic_buffer
+        ]
+        entries.sort(key=lambda entry: entry[0])
+        if limit is not None:
+            entries = entries[max(len(entries) - limit, 0):]
+        return entries
+
+    def subscribe(self, simulation_id: str, topic_pattern: Optional[str] = None) -> LiveTailSubscription:
+        """Returns a new subscription for the messages of the simulation with topics matching the topic pattern."""
+        subscription = LiveTailSubscription(
+            simulation_id, topic_pattern_to_regex(topic_pattern) if topic_pattern else None)
+        self.__subscriptions.setdefault(simulation_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: LiveTailSubscription):
+        """Removes the subscription."""
+        subscriptions = self.__subscriptions.get(subscription.simulation_id, None)
+        if subscriptions is not None:
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self.__subscriptions[subscription.simulation_id]
+
+    def remove_simulation(self, simulation_id: str):
+        """Removes the messages of the simulation from memory and ends its subscriptions."""
+        self.__buffers.pop(simulation_id, None)
+        for subscription in self.__subscriptions.pop(simulation_id, ()):
+            subscription.close()
+
+    def close(self):
+        """Ends all the subscriptions."""
+        for simulation_id in list(self.__subscriptions):
+            for subscription in self.__subscriptions.pop(simulation_id):
+                subscription.close()
+
+    def __str__(self) -> str:
+        return "simulations: {:d}, messages: {:d}, subscriptions: {:d}".format(
+            len(self.__buffers),
+            sum(len(topic_buffer) for topic_buffers in self.__buffers.values()
+                for topic_buffer in topic_buffers.values()),
+            self.subscriptions)
+
+
+class LiveTailServer:
+    """Class for the HTTP endpoints for the live tail and the simulation metadata.
+
+    The simulations function returns the ids of the simulations in memory and the metadata function
+    returns the metadata for a simulation or None if the simulation is not found.
+    """
+    def __init__(self, live_tail: LiveTail, simulations_function: Callable[[], List[str]],
+                 metadata_function: Callable[[str], Optional[Dict[str, Any]]],
+                 port: Optional[int] = None, json_codec: JsonCodec = DEFAULT_CODEC):
+        self.__live_tail = live_tail
+        self.__simulations_function = simulations_function
+        self.__metadata_function = metadata_function
+        self.__port = port if port is not None else get_live_tail_port()
+        self.__json_codec = json_codec
+        self.__server = None
+
+    @property
+    def server(self) -> Optional[HttpServer]:
+        """The HTTP server for the endpoints or None if the server has not been started."""
+        return self.__server
+
+    async def start(self):
+        """Starts the HTTP server, if the port has been configured."""
+        if self.__port > 0:
+            self.__server = HttpServer(cast(str, ENV_VARIABLES[LIVE_TAIL_HOST_NAME]), self.__port)
+            self.__server.add_route(SIMULATIONS_PATH, self.__handle_simulations_request)
+            self.__server.add_route(SIMULATIONS_PATH + "/", self.__handle_simulation_request, prefix=True)
+            await self.__server.start()
+
+    async def close(self):
+        """Ends the streams and stops the HTTP server."""
+        self.__live_tail.close()
+        if self.__server is not None:
+            await self.__server.close()
+            self.__server = None
+
+    def __to_json_response(self, json_object: Any, status: int = 200) -> HttpResponse:
+        """Returns a response with the given object encoded as JSON."""
+        return HttpResponse(self.__json_codec.dumps(json_object), JSON_CONTENT_TYPE, status)
+
+    async def __handle_simulations_request(self, request: HttpRequest) -> HttpResponse:
+        """Returns the ids of the simulations in memory."""
+        del request
+        return self.__to_json_response(self.__simulations_function())
+
+    async def __handle_simulation_request(self, request: HttpRequest) -> Union[HttpResponse, HttpStreamResponse]:
+        """Returns the metadata, the latest messages or the message stream for a simulation."""
+        path_parts = request.path[len(SIMULATIONS_PATH) + 1:].rstrip("/").split("/")
+        simulation_id = path_parts[0]
+        metadata = self.__metadata_function(simulation_id) if simulation_id else None
+        if metadata is None:
+            return self.__to_json_response({"Error": "Simulation not found"}, status=404)
+        topic_pattern = request.get_parameter("topic", None)
+
+        if len(path_parts) == 1:
+            return self.__to_json_response(to_json_compatible(metadata))
+
+        if len(path_parts) == 2 and path_parts[1] == MESSAGES_PATH:
+            try:
+                limit = int(cast(str, request.get_parameter("limit", str(self.__live_tail.buffer_size))))
+            except ValueError:
+                return self.__to_json_response({"Error": "The limit must be an integer"}, status=400)
+            return self.__to_json_response([
+                to_live_tail_document(entry)
+                for entry in self.__live_tail.get_messages(simulation_id, topic_pattern, max(limit, 0))
+            ])
+
+        if len(path_parts) == 2 and path_parts[1] == STREAM_PATH:
+            return HttpStreamResponse(self.__stream_messages(self.__live_tail.subscribe(simulation_id, topic_pattern)))
+
+        return self.__to_json_response({"Error": "Not found"}, status=404)
+
+    async def __stream_messages(self, subscription: LiveTailSubscription) -> AsyncIterator[bytes]:
+        """Yields the new messages from the subscription as server-sent events."""
+        dropped = 0
+        try:
+            while not subscription.closed:
+                entry = await subscription.get(KEEPALIVE_INTERVAL)
+                if subscription.dropped > dropped:
+                    yield b"event: dropped\ndata: " + self.__json_codec.dumps(
+                        {"Dropped": subscription.dropped - dropped}) + b"\n\n"
+                    dropped = subscription.dropped
+                if entry is None:
+                    if not subscription.closed:
+                        yield b": keep-alive\n\n"
+                    continue
+                yield "id: {:d}\nevent: message\ndata: ".format(entry[0]).encode("ascii") + \
+                    self.__json_codec.dumps(to_live_tail_document(entry)) + b"\n\n"
+        finally:
+            self.__live_tail.unsubscribe(subscription)
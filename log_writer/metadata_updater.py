@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 Tampere University and VTT Technical Research Centre of Finland
+# This software was developed as a part of the ProCemPlus project: https://www.senecc.fi/projects/procemplus
+# This source code is licensed under the MIT license. See LICENSE in the repository root directory.
+# Author(s): Ville Heikkilä <ville.heikkila@tuni.fi>
+#            Otto Hylli <otto.hylli@tuni.fi>
+
+"""Module containing a class for coalescing the simulation metadata updates to the database."""
+
+import asyncio
+import time
+from typing import Awaitable, Callable, Optional, cast
+
+from tools.timer import Timer
+from tools.tools import EnvironmentVariable
+
+# the minimum time in seconds between two metadata updates for the same simulation
+METADATA_UPDATE_INTERVAL = cast(float, EnvironmentVariable("METADATA_UPDATE_INTERVAL", float, 5.0).value)
+
+
+class MetadataUpdater:
+    """Class for coalescing the metadata update requests for a simulation.
+
+    The update function always writes the current state of the metadata, so all the changes requested
+    between two updates are included in the next update. The updates are done at most once per update interval
+    unless an update is explicitly flushed.
+    """
+    __slots__ = (
+        "__update_function", "__update_interval", "__lock", "__update_timer", "__last_update",
+        "__update_pending", "__update_count"
+    )
+
+    def __init__(self, update_function: Callable[[], Awaitable[None]], update_interval: Optional[float] = None):
+        self.__update_function = update_function
+        self.__update_interval = update_interval if update_interval is not None else METADATA_UPDATE_INTERVAL
+
+        self.__lock = asyncio.Lock()
+        self.__update_timer = None
+        self.__last_update = None
+        self.__update_pending = False
+        self.__update_count = 0
+
+    @property
+    def update_pending(self) -> bool:
+        """Returns True, if there are requested changes that have not yet been written."""
+        return self.__update_pending
+
+    @property
+    def update_count(self) -> int:
+        """The number of metadata updates that have been written."""
+        return self.__update_count
+
+    def request_update(self):
+        """Requests a metadata update. The update is done once the update interval since the previous update
+           has passed. Requests made before the scheduled update are combined to it."""
+        self.__update_pending = True
+        if self.__update_timer is not None:
+            return
+
+        if self.__last_update is None:
+            delay = 0.0
+        else:
+            delay = max(self.__update_interval - (time.monotonic() - self.__last_update), 0.0)
+        self.__update_timer = Timer(False, delay, self.__timed_update)
+
+    async def flush(self):
+        """Writes the metadata immediately and cancels any scheduled update."""
+        if self.__update_timer is not None:
+            self.__update_timer.cancel()
+            self.__update_timer = None
+        await self.__update()
+
+    async def __timed_update(self):
+        """Writes the metadata when the scheduled update is due."""
+        self.__update_timer = None
+        await self.__update()
+
+    async def __update(self):
+        """Writes the current metadata to the database."""
+        async with self.__lock:
+            self.__update_pending = False
+            self.__last_update = time.monotonic()
+            self.__update_count += 1
+            await self.__update_function()
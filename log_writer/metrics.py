@@ -0,0 +1,439 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 Tampere University and VTT Technical Research Centre of Finland
+# This software was developed as a part of the ProCemPlus project: https://www.senecc.fi/projects/procemplus
+# This source code is licensed under the MIT license. See LICENSE in the repository root directory.
+# Author(s): Ville Heikkilä <ville.heikkila@tuni.fi>
+#            Otto Hylli <otto.hylli@tuni.fi>
+
+"""Module containing the metrics for monitoring the log writer.
+
+The metrics can be scraped in the Prometheus text format from an HTTP endpoint and/or they can be written
+periodically to a JSON file. Both are turned off by default."""
+
+import abc
+import asyncio
+import bisect
+import json
+import math
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union, cast
+
+from tools.tools import FullLogger, load_environmental_variables
+
+from log_writer.http_server import HttpRequest, HttpResponse, HttpServer
+
+LOGGER = FullLogger(__name__)
+
+METRICS_HOST_NAME = "METRICS_HOST"
+METRICS_PORT_NAME = "METRICS_PORT"
+METRICS_FILE_NAME = "METRICS_FILE"
+METRICS_FILE_INTERVAL_NAME = "METRICS_FILE_INTERVAL"
+
+ENV_VARIABLES = load_environmental_variables(
+    (METRICS_HOST_NAME, str, "0.0.0.0"),
+    # the port for the Prometheus metrics endpoint, value 0 turns off the endpoint
+    (METRICS_PORT_NAME, int, 0),
+    # the file to which the metrics are written in JSON format, empty value turns off the file
+    (METRICS_FILE_NAME, str, ""),
+    (METRICS_FILE_INTERVAL_NAME, float, 15.0)
+)
+
+METRICS_PATH = "/metrics"
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+STAGE_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1, 1.0)
+SIZE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+LabelValues = Tuple[str, ...]
+
+
+def format_value(value: Union[int, float]) -> str:
+    """Returns the given metric value in the Prometheus text format."""
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def format_labels(label_names: Sequence[str], label_values: Sequence[str]) -> str:
+    """Returns the labels in the Prometheus text format."""
+    if not label_names:
+        return ""
+    return "{" + ",".join(
+        '{:s}="{:s}"'.format(
+            label_name, str(label_value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for label_name, label_value in zip(label_names, label_values)
+    ) + "}"
+
+
+class Metric(abc.ABC):
+    """Base class for the metrics. Each metric holds a separate value for each combination of the label values."""
+    METRIC_TYPE = "untyped"
+
+    def __init__(self, name: str, description: str, label_names: Sequence[str] = ()):
+        self.__name = name
+        self.__description = description
+        self.__label_names = tuple(label_names)
+
+    @property
+    def name(self) -> str:
+        """The name of the metric."""
+        return self.__name
+
+    @property
+    def description(self) -> str:
+        """The description of the metric."""
+        return self.__description
+
+    @property
+    def label_names(self) -> Tuple[str, ...]:
+        """The names of the labels of the metric."""
+        return self.__label_names
+
+    @abc.abstractmethod
+    def samples(self) -> List[Tuple[str, LabelValues, Union[int, float]]]:
+        """Returns the current samples as a list of (sample name suffix, label values, value) tuples."""
+
+    def to_prometheus_text(self) -> str:
+        """Returns the metric in the Prometheus text format."""
+        lines = [
+            "# HELP {:s} {:s}".format(self.name, self.description),
+            "# TYPE {:s} {:s}".format(self.name, self.METRIC_TYPE)
+        ]
+        for suffix, label_values, value in self.samples():
+            label_names = self.label_names
+            if suffix == "_bucket":
+                label_names = label_names + ("le",)
+            lines.append("{:s}{:s}{:s} {:s}".format(
+                self.name, suffix, format_labels(label_names, label_values), format_value(value)))
+        return "\n".join(lines)
+
+    @abc.abstractmethod
+    def to_json(self) -> Any:
+        """Returns the metric as a JSON compatible object."""
+
+
+class Counter(Metric):
+    """Metric for a value that only increases, for example the number of received messages."""
+    METRIC_TYPE = "counter"
+
+    def __init__(self, name: str, description: str, label_names: Sequence[str] = ()):
+        super().__init__(name, description, label_names)
+        self.__values = {}
+
+    def inc(self, *label_values: str, amount: Union[int, float] = 1):
+        """Increases the counter for the given label values."""
+        self.__values[label_values] = self.__values.get(label_values, 0) + amount
+
+    def get(self, *label_values: str) -> Union[int, float]:
+        """Returns the counter value for the given label values."""
+        return self.__values.get(label_values, 0)
+
+    def remove(self, label_name: str, label_value: str):
+        """Removes the values for all the label combinations in which the given label has the given value."""
+        label_index = self.label_names.index(label_name)
+        removed_label_values = [
+            label_values for label_values in self.__values if label_values[label_index] == label_value]
+        for label_values in removed_label_values:
+            del self.__values[label_values]
+
+    def samples(self) -> List[Tuple[str, LabelValues, Union[int, float]]]:
+        return [("", label_values, value) for label_values, value in self.__values.items()]
+
+    def to_json(self) -> Any:
+        if not self.label_names:
+            return self.get()
+        return [
+            dict(zip(self.label_names, label_values), value=value)
+            for label_values, value in self.__values.items()
+        ]
+
+
+class Gauge(Metric):
+    """Metric for a value that can go up and down, for example the number of buffered documents.
+       The value can be given either by setting it or by a function that is called when the metric is read."""
+    METRIC_TYPE = "gauge"
+
+    def __init__(self, name: str, description: str, label_names: Sequence[str] = ()):
+        super().__init__(name, description, label_names)
+        self.__values = {}
+        self.__function = None
+
+    def set(self, value: Union[int, float], *label_values: str):
+        """Sets the gauge value for the given label values."""
+        self.__values[label_values] = value
+
+    def set_function(self, function: Optional[Callable[[], Union[int, float]]]):
+        """Sets the function that gives the value for the gauge without labels."""
+        self.__function = function
+
+    def get(self, *label_values: str) -> Union[int, float]:
+        """Returns the gauge value for the given label values."""
+        if not label_values and self.__function is not None:
+            return self.__function()
+        return self.__values.get(label_values, 0)
+
+    def samples(self) -> List[Tuple[str, LabelValues, Union[int, float]]]:
+        if self.__function is not None:
+            return [("", (), self.__function())]
+        return [("", label_values, value) for label_values, value in self.__values.items()]
+
+    def to_json(self) -> Any:
+        if not self.label_names:
+            return self.get()
+        return [
+            dict(zip(self.label_names, label_values), value=value)
+            for _, label_values, value in self.samples()
+        ]
+
+
+class Histogram(Metric):
+    """Metric for the distribution of observed values, for example the database write latencies."""
+    METRIC_TYPE = "histogram"
+
+    def __init__(self, name: str, description: str, buckets: Sequence[Union[int, float]],
+                 label_names: Sequence[str] = ()):
+        super().__init__(name, description, label_names)
+        self.__buckets = tuple(sorted(buckets))
+        # for each label value combination: [bucket counts..., sum, count]
+        self.__values: Dict[LabelValues, List[Union[int, float]]] = {}
+
+    @property
+    def buckets(self) -> Tuple[Union[int, float], ...]:
+        """The upper bounds of the histogram buckets."""
+        return self.__buckets
+
+    def observe(self, value: Union[int, float], *label_values: str):
+        """Adds an observed value to the histogram."""
+        values = self.__values.get(label_values, None)
+        if values is None:
+            values = self.__values.setdefault(label_values, [0] * (len(self.__buckets) + 2))
+        bucket_index = bisect.bisect_left(self.__buckets, value)
+        if bucket_index < len(self.__buckets):
+            values[bucket_index] += 1
+        values[-2] += value
+        values[-1] += 1
+
+    def get_count(self, *label_values: str) -> int:
+        """Returns the number of observed values."""
+        return int(self.__values.get(label_values, [0])[-1])
+
+    def get_sum(self, *label_values: str) -> Union[int, float]:
+        """Returns the sum of the observed values."""
+        values = self.__values.get(label_values, None)
+        return values[-2] if values is not None else 0
+
+    def samples(self) -> List[Tuple[str, LabelValues, Union[int, float]]]:
+        samples = []
+        for label_values, values in self.__values.items():
+            cumulative_count = 0
+            for upper_bound, bucket_count in zip(self.__buckets, values):
+                cumulative_count += bucket_count
+                samples.append(("_bucket", label_values + (format_value(upper_bound),), cumulative_count))
+            samples.append(("_bucket", label_values + ("+Inf",), values[-1]))
+            samples.append(("_sum", label_values, values[-2]))
+            samples.append(("_count", label_values, values[-1]))
+        return samples
+
+    def to_json(self) -> Any:
+        histograms = []
+        for label_values, values in self.__values.items():
+            histogram: Dict[str, Any] = dict(zip(self.label_names, label_values))
+            histogram["count"] = values[-1]
+            histogram["sum"] = values[-2]
+            histogram["mean"] = values[-2] / values[-1] if values[-1] else None
+            histogram["buckets"] = {
+                format_value(upper_bound): bucket_count
+                for upper_bound, bucket_count in zip(self.__buckets, values)
+            }
+            histograms.append(histogram)
+        return histograms
+
+
+class MetricsRegistry:
+    """Class for holding all the metrics of the log writer."""
+    def __init__(self):
+        self.__metrics = {}
+
+    @property
+    def metrics(self) -> List[Metric]:
+        """The registered metrics in the registration order."""
+        return list(self.__metrics.values())
+
+    def register(self, metric: Metric) -> Metric:
+        """Registers the metric. If a metric with the same name has already been registered, it is returned."""
+        return self.__metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, description: str, label_names: Sequence[str] = ()) -> Counter:
+        """Registers and returns a counter."""
+        return cast(Counter, self.register(Counter(name, description, label_names)))
+
+    def gauge(self, name: str, description: str, label_names: Sequence[str] = ()) -> Gauge:
+        """Registers and returns a gauge."""
+        return cast(Gauge, self.register(Gauge(name, description, label_names)))
+
+    def histogram(self, name: str, description: str, buckets: Sequence[Union[int, float]],
+                  label_names: Sequence[str] = ()) -> Histogram:
+        """Registers and returns a histogram."""
+        return cast(Histogram, self.register(Histogram(name, description, buckets, label_names)))
+
+    def to_prometheus_text(self) -> str:
+        """Returns all the metrics in the Prometheus text format."""
+        return "\n".join(metric.to_prometheus_text() for metric in self.__metrics.values()) + "\n"
+
+    def to_json(self) -> Dict[str, Any]:
+        """Returns all the metrics as a JSON compatible dictionary."""
+        return {metric.name: metric.to_json() for metric in self.__metrics.values()}
+
+
+REGISTRY = MetricsRegistry()
+
+MESSAGES = REGISTRY.counter(
+    "log_writer_messages_total", "The number of received messages", ("simulation_id", "topic"))
+INVALID_MESSAGES = REGISTRY.counter(
+    "log_writer_invalid_messages_total", "The number of received invalid messages", ("topic",))
+DROPPED_DOCUMENTS = REGISTRY.counter(
+    "log_writer_dropped_documents_total", "The number of messages that were not stored", ("reason",))
+FAILED_DOCUMENTS = REGISTRY.counter(
+    "log_writer_failed_documents_total", "The number of documents for which the database write failed")
+BUFFERED_DOCUMENTS = REGISTRY.gauge(
+    "log_writer_buffered_documents", "The number of documents waiting in the message buffer")
+WRITE_QUEUE_DOCUMENTS = REGISTRY.gauge(
+    "log_writer_write_queue_documents", "The number of documents waiting in the database write queue")
+SIMULATIONS = REGISTRY.gauge(
+    "log_writer_simulations", "The number of simulations the log writer is keeping track of")
+FLUSH_SIZE = REGISTRY.histogram(
+    "log_writer_flush_batch_size", "The number of documents in a single database write", SIZE_BUCKETS)
+STORE_LATENCY = REGISTRY.histogram(
+    "log_writer_store_messages_seconds", "The duration of the message document writes", LATENCY_BUCKETS)
+METADATA_LATENCY = REGISTRY.histogram(
+    "log_writer_update_metadata_seconds", "The duration of the simulation metadata updates", LATENCY_BUCKETS)
+COMPRESSED_PAYLOAD_BYTES = REGISTRY.counter(
+    "log_writer_compressed_payload_bytes_total", "The sizes of the compressed payload attributes", ("state",))
+INTAKE_WAIT = REGISTRY.histogram(
+    "log_writer_intake_wait_seconds", "The time the received messages wait in the intake lanes", LATENCY_BUCKETS,
+    ("lane",))
+STAGE_DURATION = REGISTRY.histogram(
+    "log_writer_stage_duration_seconds", "The sampled durations of the message handling stages", STAGE_BUCKETS,
+    ("stage",))
+
+
+class MetricsFileWriter:
+    """Class for writing the metrics periodically to a JSON file.
+
+    Besides the metric values, the file contains the per second rates of the counters calculated over
+    the interval since the previous write. The file is replaced atomically so that readers never see
+    a partially written file.
+    """
+    def __init__(self, file_name: str, registry: MetricsRegistry = REGISTRY):
+        self.__file_name = file_name
+        self.__registry = registry
+        self.__previous_counters = {}
+        self.__previous_time = time.monotonic()
+
+    @property
+    def file_name(self) -> str:
+        """The name of the metrics file."""
+        return self.__file_name
+
+    def get_rates(self) -> Dict[str, Any]:
+        """Returns the per second rates of the counters since the previous call."""
+        current_time = time.monotonic()
+        duration = max(current_time - self.__previous_time, 1e-9)
+        rates = {}
+        # only the current label combinations are kept, so that the removed ones do not accumulate
+        current_counters = {}
+        for metric in self.__registry.metrics:
+            if not isinstance(metric, Counter):
+                continue
+            metric_rates = []
+            for _, label_values, value in metric.samples():
+                previous_value = self.__previous_counters.get((metric.name, label_values), 0)
+                current_counters[(metric.name, label_values)] = value
+                metric_rates.append(
+                    dict(zip(metric.label_names, label_values), rate=(value - previous_value) / duration))
+            rates[metric.name] = metric_rates
+        self.__previous_counters = current_counters
+        self.__previous_time = current_time
+        return rates
+
+    def write(self):
+        """Writes the current metrics to the file."""
+        metrics_json = {
+            "Timestamp": time.time(),
+            "Metrics": self.__registry.to_json(),
+            "Rates": self.get_rates()
+        }
+        temporary_file_name = self.__file_name + ".tmp"
+        try:
+            with open(temporary_file_name, mode="w", encoding="UTF-8") as metrics_file:
+                json.dump(metrics_json, metrics_file, default=str)
+            os.replace(temporary_file_name, self.__file_name)
+        except OSError as error:
+            LOGGER.warning("Could not write the metrics file {:s}: {:s}".format(self.__file_name, str(error)))
+
+    async def run(self, interval: float):
+        """Writes the metrics file at the given interval until cancelled."""
+        while True:
+            await asyncio.sleep(interval)
+            self.write()
+
+
+class MetricsExporter:
+    """Class for publishing the metrics through the Prometheus HTTP endpoint and the JSON file."""
+    def __init__(self, port: Optional[int] = None, file_name: Optional[str] = None,
+                 registry: MetricsRegistry = REGISTRY):
+        self.__port = port if port is not None else cast(int, ENV_VARIABLES[METRICS_PORT_NAME])
+        self.__file_name = file_name if file_name is not None else cast(str, ENV_VARIABLES[METRICS_FILE_NAME])
+        self.__registry = registry
+
+        self.__server = None
+        self.__file_writer = None
+        self.__file_task = None
+
+    @property
+    def server(self) -> Optional[HttpServer]:
+        """The HTTP server for the metrics endpoint or None if the endpoint is not used."""
+        return self.__server
+
+    async def start(self):
+        """Starts the HTTP endpoint and the file writer if they have been configured."""
+        if self.__port > 0:
+            self.__server = HttpServer(cast(str, ENV_VARIABLES[METRICS_HOST_NAME]), self.__port)
+            self.__server.add_route(METRICS_PATH, self.__handle_metrics_request)
+            await self.__server.start()
+        if self.__file_name:
+            self.__file_writer = MetricsFileWriter(self.__file_name, self.__registry)
+            self.__file_task = asyncio.create_task(
+                self.__file_writer.run(cast(float, ENV_VARIABLES[METRICS_FILE_INTERVAL_NAME])))
+
+    async def close(self):
+        """Stops the HTTP endpoint and writes the metrics file one last time."""
+        if self.__server is not None:
+            await self.__server.close()
+            self.__server = None
+        if self.__file_task is not None:
+            self.__file_task.cancel()
+            await asyncio.gather(self.__file_task, return_exceptions=True)
+            self.__file_task = None
+        if self.__file_writer is not None:
+            self.__file_writer.write()
+            self.__file_writer = None
+
+    async def __handle_metrics_request(self, request: HttpRequest) -> HttpResponse:
+        """Returns the metrics in the Prometheus text format."""
+        del request
+        return HttpResponse(self.__registry.to_prometheus_text().encode("UTF-8"), PROMETHEUS_CONTENT_TYPE)
+
+
+def get_worker_exporter(worker_index: int) -> MetricsExporter:
+    """Returns the metrics exporter for a worker process. The workers use the ports following the metrics port
+       and the worker index is added to the name of the metrics file."""
+    port = cast(int, ENV_VARIABLES[METRICS_PORT_NAME])
+    file_name = cast(str, ENV_VARIABLES[METRICS_FILE_NAME])
+    return MetricsExporter(
+        port=port + worker_index + 1 if port > 0 else 0,
+        file_name="{:s}.{:d}".format(file_name, worker_index) if file_name else "")
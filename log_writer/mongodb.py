@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 Tampere University and VTT Technical Research Centre of Finland
+# This software was developed as a part of the ProCemPlus project: https://www.senecc.fi/projects/procemplus
+# This source code is licensed under the MIT license. See LICENSE in the repository root directory.
+# Author(s): Ville Heikkilä <ville.heikkila@tuni.fi>
+#            Otto Hylli <otto.hylli@tuni.fi>
+
+"""Module containing the access to the MongoDB database for the collections that are not handled by MongodbClient.
+
+The connection uses the configuration of the MongodbClient from simulation-tools, i.e. the same MONGODB_*
+environment variables with the same default values. The motor library is only imported when the first collection
+is requested."""
+
+import urllib.parse
+from typing import Any, cast
+
+from tools.db_clients import MongodbClient
+from tools.tools import FullLogger, load_environmental_variables
+
+LOGGER = FullLogger(__name__)
+
+MONGODB_HOST_NAME = "MONGODB_HOST"
+MONGODB_PORT_NAME = "MONGODB_PORT"
+MONGODB_USERNAME_NAME = "MONGODB_USERNAME"
+MONGODB_PASSWORD_NAME = "MONGODB_PASSWORD"
+MONGODB_APPNAME_NAME = "MONGODB_APPNAME"
+MONGODB_TZ_AWARE_NAME = "MONGODB_TZ_AWARE"
+MONGODB_DATABASE_NAME = "MONGODB_DATABASE"
+MONGODB_ADMIN_NAME = "MONGODB_ADMIN"
+MONGODB_MESSAGES_COLLECTION_PREFIX_NAME = "MONGODB_MESSAGES_COLLECTION_PREFIX"
+MONGODB_COLLECTION_IDENTIFIER_NAME = "MONGODB_COLLECTION_IDENTIFIER"
+
+# the variables are read with the definitions from MongodbClient, so that the same collections are used
+ENV_VARIABLES = load_environmental_variables(*MongodbClient.DEFAULT_ENV_VARIABLE_VALUES)
+
+# the client is shared by all the users within the process
+_MOTOR_CLIENT = None
+
+
+def get_connection_string() -> str:
+    """Returns the MongoDB connection string based on the environmental variables."""
+    username = cast(str, ENV_VARIABLES[MONGODB_USERNAME_NAME])
+    password = cast(str, ENV_VARIABLES[MONGODB_PASSWORD_NAME])
+    host_string = "{:s}:{:d}".format(
+        cast(str, ENV_VARIABLES[MONGODB_HOST_NAME]), cast(int, ENV_VARIABLES[MONGODB_PORT_NAME]))
+
+    if not username:
+        return "mongodb://{:s}".format(host_string)
+
+    # the admin users are authenticated against the admin database, the other users against the used database
+    authentication_database = (
+        "admin" if ENV_VARIABLES[MONGODB_ADMIN_NAME] else cast(str, ENV_VARIABLES[MONGODB_DATABASE_NAME]))
+    return "mongodb://{:s}:{:s}@{:s}/?authSource={:s}".format(
+        urllib.parse.quote_plus(username), urllib.parse.quote_plus(password), host_string, authentication_database)
+
+
+def get_motor_client() -> Any:
+    """Returns the asynchronous MongoDB client for the process. The client is created on the first call."""
+    global _MOTOR_CLIENT  # pylint: disable=global-statement
+    if _MOTOR_CLIENT is None:
+        import motor.motor_asyncio  # pylint: disable=import-outside-toplevel
+
+        _MOTOR_CLIENT = motor.motor_asyncio.AsyncIOMotorClient(
+            get_connection_string(),
+            appname=cast(str, ENV_VARIABLES[MONGODB_APPNAME_NAME]) or None,
+            tz_aware=cast(bool, ENV_VARIABLES[MONGODB_TZ_AWARE_NAME]))
+        LOGGER.debug("Created a MongoDB client for {:s}:{:d}".format(
+            cast(str, ENV_VARIABLES[MONGODB_HOST_NAME]), cast(int, ENV_VARIABLES[MONGODB_PORT_NAME])))
+    return _MOTOR_CLIENT
+
+
+def get_database() -> Any:
+    """Returns the database given by MONGODB_DATABASE."""
+    return get_motor_client()[cast(str, ENV_VARIABLES[MONGODB_DATABASE_NAME])]
+
+
+def get_collection(collection_name: str) -> Any:
+    """Returns the collection with the given name from the database given by MONGODB_DATABASE."""
+    return get_database()[collection_name]
+
+
+def get_collection_identifier() -> str:
+    """Returns the document attribute whose value determines the message collection for the document,
+       i.e. the attribute given by MONGODB_COLLECTION_IDENTIFIER."""
+    return cast(str, ENV_VARIABLES[MONGODB_COLLECTION_IDENTIFIER_NAME])
+
+
+def get_simulation_collection(simulation_id: str, database: Any = None) -> Any:
+    """Returns the message collection for the given simulation, i.e. the collection that MongodbClient uses
+       for the messages of the simulation. If database is not given, the default database is used."""
+    if database is None:
+        database = get_database()
+    return database[cast(str, ENV_VARIABLES[MONGODB_MESSAGES_COLLECTION_PREFIX_NAME]) + simulation_id]
@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 Tampere University and VTT Technical Research Centre of Finland
+# This software was developed as a part of the ProCemPlus project: https://www.senecc.fi/projects/procemplus
+# This source code is licensed under the MIT license. See LICENSE in the repository root directory.
+# Author(s): Ville Heikkilä <ville.heikkila@tuni.fi>
+#            Otto Hylli <otto.hylli@tuni.fi>
+
+"""Module containing the profiling hooks for the message handling hot path.
+
+The stage timers measure the duration of every PROFILING_SAMPLE_INTERVAL:th call of each message handling stage:
+JSON decoding, message validation, simulation metadata update, document serialization and the database write.
+The durations are published in the log_writer_stage_duration_seconds metric and in the statistics log.
+The timers are turned on with the PROFILING environmental variable or toggled with the SIGUSR1 signal.
+
+The SIGUSR2 signal starts a sampling profiler that records the call stacks of the main thread for
+PROFILER_DURATION seconds and writes the report to PROFILER_DIRECTORY, by default the log file directory.
+The report lists the functions with the most samples and the sampled call stacks in the collapsed format
+used by the flame graph tools."""
+
+import asyncio
+import collections
+import datetime
+import os
+import signal
+import time
+from types import FrameType
+from typing import Counter, Dict, List, Optional, Tuple, cast
+
+from tools.tools import EnvironmentVariable, FullLogger, load_environmental_variables
+
+from log_writer.metrics import STAGE_DURATION
+
+LOGGER = FullLogger(__name__)
+
+PROFILING_NAME = "PROFILING"
+PROFILING_SAMPLE_INTERVAL_NAME = "PROFILING_SAMPLE_INTERVAL"
+PROFILER_DURATION_NAME = "PROFILER_DURATION"
+PROFILER_SAMPLING_INTERVAL_NAME = "PROFILER_SAMPLING_INTERVAL"
+PROFILER_DIRECTORY_NAME = "PROFILER_DIRECTORY"
+
+ENV_VARIABLES = load_environmental_variables(
+    # whether the stage timers are on when the log writer is started
+    (PROFILING_NAME, bool, False),
+    # the duration of every n:th call of each stage is measured
+    (PROFILING_SAMPLE_INTERVAL_NAME, int, 100),
+    # the duration in seconds of a single sampling profiler run
+    (PROFILER_DURATION_NAME, float, 30.0),
+    # the CPU time in seconds between two call stack samples
+    (PROFILER_SAMPLING_INTERVAL_NAME, float, 0.005),
+    # the directory for the profiler reports, empty value uses the directory of the log file
+    (PROFILER_DIRECTORY_NAME, str, "")
+)
+
+STAGE_DECODE = "decode"
+STAGE_VALIDATION = "validation"
+STAGE_METADATA = "metadata"
+STAGE_SERIALIZATION = "serialization"
+STAGE_STORE = "store"
+
+# the number of functions listed in the profiler report
+REPORT_TOP_FUNCTIONS = 40
+
+StackFrame = str
+CallStack = Tuple[StackFrame, ...]
+
+
+class StageTimers:
+    """Class for the sampled timing of the message handling stages.
+
+    Usage in a stage:
+        start_time = STAGE_TIMERS.start(STAGE_DECODE)
+        ...
+        STAGE_TIMERS.stop(STAGE_DECODE, start_time)
+    When the timers are off or the call is not sampled, start returns None and stop does nothing.
+    """
+    def __init__(self, enabled: Optional[bool] = None, sample_interval: Optional[int] = None):
+        self.__enabled = cast(bool, enabled if enabled is not None else ENV_VARIABLES[PROFILING_NAME])
+        self.__sample_interval = max(cast(int, sample_interval if sample_interval is not None
+                                          else ENV_VARIABLES[PROFILING_SAMPLE_INTERVAL_NAME]), 1)
+        # the number of calls since the previous sample for each stage
+        self.__calls: Dict[str, int] = {}
+        # the number of samples and the total sampled duration for each stage
+        self.__samples: Dict[str, int] = {}
+        self.__durations: Dict[str, float] = {}
+
+    @property
+    def enabled(self) -> bool:
+        """Returns True, if the stage durations are measured."""
+        return self.__enabled
+
+    @enabled.setter
+    def enabled(self, enabled: bool):
+        """Turns the stage timers on or off."""
+        self.__enabled = enabled
+
+    @property
+    def sample_interval(self) -> int:
+        """The duration of every n:th call of each stage is measured."""
+        return self.__sample_interval
+
+    def toggle(self):
+        """Turns the stage timers on if they are off and vice versa."""
+        self.__enabled = not self.__enabled
+        LOGGER.info("Stage timers turned {:s}".format("on" if self.__enabled else "off"))
+
+    def start(self, stage: str) -> Optional[float]:
+        """Returns the start time, if the call of the given stage is measured, otherwise None."""
+        if not self.__enabled:
+            return None
+        calls = self.__calls.get(stage, 0) + 1
+        if calls < self.__sample_interval:
+            self.__calls[stage] = calls
+            return None
+        self.__calls[stage] = 0
+        return time.perf_counter()
+
+    def stop(self, stage: str, start_time: Optional[float]):
+        """Registers the duration of the stage, if the start time was given."""
+        if start_time is None:
+            return
+        duration = time.perf_counter() - start_time
+        STAGE_DURATION.observe(duration, stage)
+        self.__samples[stage] = self.__samples.get(stage, 0) + 1
+        self.__durations[stage] = self.__durations.get(stage, 0.0) + duration
+
+    def __str__(self) -> str:
+        return ", ".join(
+            "{:s}: {:.1f} us ({:d} samples)".format(
+                stage, self.__durations[stage] / samples * 1e6, samples)
+            for stage, samples in self.__samples.items()
+        )
+
+
+class SamplingProfiler:
+    """Class for a sampling profiler that records the call stacks of the main thread for a bounded time.
+
+    The samples are taken in a SIGPROF signal handler that is triggered by an interval timer measuring
+    the CPU time of the process, so the samples show where the CPU time is spent and the profiled code
+    does not need to cooperate. The profiler must be started from the main thread within the event loop.
+    """
+    def __init__(self, directory: Optional[str] = None, duration: Optional[float] = None,
+                 sampling_interval: Optional[float] = None):
+        if directory is None:
+            directory = cast(str, ENV_VARIABLES[PROFILER_DIRECTORY_NAME])
+        if not directory:
+            log_file = cast(str, EnvironmentVariable("SIMULATION_LOG_FILE", str, "logs/logfile.log").value)
+            directory = os.path.dirname(log_file) or "."
+        self.__directory = directory
+        self.__duration = max(cast(float, duration if duration is not None
+                                   else ENV_VARIABLES[PROFILER_DURATION_NAME]), 0.0)
+        self.__sampling_interval = max(cast(float, sampling_interval if sampling_interval is not None
+                                            else ENV_VARIABLES[PROFILER_SAMPLING_INTERVAL_NAME]), 0.001)
+        self.__stacks: Counter[CallStack] = collections.Counter()
+        self.__start_time = 0.0
+        self.__previous_handler = None
+        self.__is_running = False
+
+    @property
+    def directory(self) -> str:
+        """The directory for the profiler reports."""
+        return self.__directory
+
+    @property
+    def is_running(self) -> bool:
+        """Returns True, if the profiler is currently sampling."""
+        return self.__is_running
+
+    def start(self) -> bool:
+        """Starts the sampling. The sampling is stopped and the report is written after the profiler duration.
+           Returns False, if the profiler was already running or if the platform does not support it."""
+        if self.__is_running:
+            LOGGER.warning("The sampling profiler is already running")
+            return False
+        if not hasattr(signal, "setitimer") or not hasattr(signal, "SIGPROF"):
+            LOGGER.warning("The sampling profiler is not supported on this platform")
+            return False
+
+        self.__stacks = collections.Counter()
+        self.__start_time = time.monotonic()
+        self.__previous_handler = signal.signal(signal.SIGPROF, self.__take_sample)
+        signal.setitimer(signal.ITIMER_PROF, self.__sampling_interval, self.__sampling_interval)
+        self.__is_running = True
+        asyncio.get_running_loop().call_later(self.__duration, self.stop)
+        LOGGER.info("Started the sampling profiler for {:.1f} seconds".format(self.__duration))
+        return True
+
+    def stop(self):
+        """Stops the sampling and writes the report in the default executor."""
+        if not self.__is_running:
+            return
+        signal.setitimer(signal.ITIMER_PROF, 0.0)
+        signal.signal(signal.SIGPROF, self.__previous_handler)
+        self.__is_running = False
+        asyncio.get_running_loop().run_in_executor(
+            None, self.__write_report, self.__stacks, time.monotonic() - self.__start_time)
+
+    def __take_sample(self, signal_number: int, frame: Optional[FrameType]):
+        """Adds the call stack of the interrupted frame to the samples."""
+        del signal_number
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append("{:s}:{:s}:{:d}".format(os.path.basename(code.co_filename), code.co_name, code.co_firstlineno))
+            frame = frame.f_back
+        self.__stacks[tuple(reversed(stack))] += 1
+
+    def __write_report(self, stacks: Counter[CallStack], duration: float):
+        """Writes the profiler report to the profiler directory."""
+        total_samples = sum(stacks.values())
+        own_samples: Counter[StackFrame] = collections.Counter()
+        total_function_samples: Counter[StackFrame] = collections.Counter()
+        for stack, samples in stacks.items():
+            own_samples[stack[-1]] += samples
+            for stack_frame in set(stack):
+                total_function_samples[stack_frame] += samples
+
+        lines: List[str] = [
+            "Sampling profile of process {:d}: {:d} samples in {:.1f} seconds ({:.3f} seconds of CPU time each)".format(
+                os.getpid(), total_samples, duration, self.__sampling_interval),
+            "",
+            "{:>8s} {:>7s} {:>8s} {:>7s}  function".format("own", "own%", "total", "total%")
+        ]
+        for stack_frame, samples in own_samples.most_common(REPORT_TOP_FUNCTIONS):
+            lines.append("{:8d} {:6.1f}% {:8d} {:6.1f}%  {:s}".format(
+                samples, 100.0 * samples / total_samples, total_function_samples[stack_frame],
+                100.0 * total_function_samples[stack_frame] / total_samples, stack_frame))
+        lines += ["", "Collapsed call stacks:"]
+        lines += [
+            "{:s} {:d}".format(";".join(stack), samples)
+            for stack, samples in stacks.most_common()
+        ]
+
+        file_name = os.path.join(self.__directory, "profile_{:d}_{:s}.txt".format(
+            os.getpid(), datetime.datetime.now().strftime("%Y%m%dT%H%M%S")))
+        try:
+            os.makedirs(self.__directory, exist_ok=True)
+            with open(file_name, "w", encoding="UTF-8") as report_file:
+                report_file.write("\n".join(lines) + "\n")
+            LOGGER.info("Wrote the profiler report with {:d} samples to {:s}".format(total_samples, file_name))
+        except OSError as error:
+            LOGGER.error("Could not write the profiler report: {:s}".format(str(error)))
+
+
+# the stage timers and the profiler are shared by all the components within the process
+STAGE_TIMERS = StageTimers()
+PROFILER = SamplingProfiler()
+
+
+def add_profiling_signal_handlers():
+    """Toggles the stage timers when the process receives SIGUSR1 and starts the sampling profiler
+       when the process receives SIGUSR2. Does nothing on the platforms without these signals."""
+    loop = asyncio.get_running_loop()
+    toggle_signal = getattr(signal, "SIGUSR1", None)
+    profiler_signal = getattr(signal, "SIGUSR2", None)
+    if toggle_signal is not None:
+        loop.add_signal_handler(toggle_signal, STAGE_TIMERS.toggle)
+    if profiler_signal is not None:
+        loop.add_signal_handler(profiler_signal, PROFILER.start)
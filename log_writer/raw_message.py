@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 Tampere University and VTT Technical Research Centre of Finland
+# This software was developed as a part of the ProCemPlus project: https://www.senecc.fi/projects/procemplus
+# This source code is licensed under the MIT license. See LICENSE in the repository root directory.
+# Author(s): Ville Heikkilä <ville.heikkila@tuni.fi>
+#            Otto Hylli <otto.hylli@tuni.fi>
+
+"""Module containing a lightweight message class for storing the received messages without full validation."""
+
+from typing import Any, Dict, Optional, Union
+
+from tools.datetime_tools import to_utc_datetime_object
+from tools.messages import EpochMessage, SimulationStateMessage
+
+
+class RawMessage:
+    """
+    Represents a received message that is stored to the database as it was received.
+    Only the attributes that are needed for the simulation metadata are read from the message and
+    the message content is otherwise not validated.
+    """
+    __slots__ = (
+        "__message", "__message_type", "__simulation_id", "__timestamp", "__source_process_id",
+        "__message_id", "__epoch_number", "__simulation_state", "__name", "__description"
+    )
+
+    def __init__(self, message: Dict[str, Any]):
+        self.__message = message
+        self.__message_type = message.get("Type", None)
+        self.__simulation_id = message.get("SimulationId", None)
+        self.__timestamp = message.get("Timestamp", None)
+        self.__source_process_id = message.get("SourceProcessId", None)
+        self.__message_id = message.get("MessageId", None)
+        self.__epoch_number = message.get("EpochNumber", None)
+
+        # the name and the description are only used from the simulation state messages
+        if self.__message_type == SimulationStateMessage.CLASS_MESSAGE_TYPE:
+            self.__simulation_state = message.get("SimulationState", None)
+            self.__name = message.get("Name", None)
+            self.__description = message.get("Description", None)
+        else:
+            self.__simulation_state = None
+            self.__name = None
+            self.__description = None
+
+    @property
+    def message_type(self) -> Union[str, None]:
+        """The message type."""
+        return self.__message_type
+
+    @property
+    def simulation_id(self) -> Optional[str]:
+        """The simulation identifier or None if the message does not have it."""
+        return self.__simulation_id
+
+    @property
+    def timestamp(self) -> Optional[str]:
+        """The message timestamp or None if the message does not have it."""
+        return self.__timestamp
+
+    @property
+    def source_process_id(self) -> Union[str, None]:
+        """The source process identifier or None if the message does not have it."""
+        return self.__source_process_id
+
+    @property
+    def message_id(self) -> Union[str, None]:
+        """The message identifier or None if the message does not have it."""
+        return self.__message_id
+
+    @property
+    def epoch_number(self) -> Union[int, None]:
+        """The epoch number or None if the message does not have it."""
+        return self.__epoch_number
+
+    @property
+    def simulation_state(self) -> Union[str, None]:
+        """The simulation state for simulation state messages, otherwise None."""
+        return self.__simulation_state
+
+    @property
+    def name(self) -> Union[str, None]:
+        """The simulation name for simulation state messages, otherwise None."""
+        return self.__name
+
+    @property
+    def description(self) -> Union[str, None]:
+        """The simulation description for simulation state messages, otherwise None."""
+        return self.__description
+
+    @property
+    def is_simulation_state_message(self) -> bool:
+        """Returns True, if the message is a simulation state message."""
+        return self.__message_type == SimulationStateMessage.CLASS_MESSAGE_TYPE
+
+    @property
+    def is_epoch_message(self) -> bool:
+        """Returns True, if the message is an epoch message."""
+        return self.__message_type == EpochMessage.CLASS_MESSAGE_TYPE
+
+    def json(self) -> Dict[str, Any]:
+        """Returns the message as it was received."""
+        return self.__message
+
+    @classmethod
+    def from_json(cls, json_message: Dict[str, Any]) -> Optional["RawMessage"]:
+        """Creates a raw message from a dictionary.
+           Returns None, if the attributes needed for the simulation metadata are missing or invalid."""
+        if not isinstance(json_message.get("Type", None), str):
+            return None
+        if not isinstance(json_message.get("SimulationId", None), str):
+            return None
+        if not isinstance(json_message.get("SourceProcessId", ""), str):
+            return None
+        # the message id is used by the duplicate filter
+        if not isinstance(json_message.get("MessageId", ""), str):
+            return None
+        epoch_number = json_message.get("EpochNumber", None)
+        if epoch_number is not None and (not isinstance(epoch_number, int) or isinstance(epoch_number, bool)):
+            return None
+        if (json_message["Type"] == SimulationStateMessage.CLASS_MESSAGE_TYPE and
+                json_message.get("SimulationState", None) not in SimulationStateMessage.SIMULATION_STATES):
+            return None
+
+        timestamp = json_message.get("Timestamp", None)
+        if not isinstance(timestamp, str):
+            return None
+        try:
+            to_utc_datetime_object(timestamp)
+        except ValueError:
+            return None
+
+        return cls(json_message)
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 Tampere University and VTT Technical Research Centre of Finland
+# This software was developed as a part of the ProCemPlus project: https://www.senecc.fi/projects/procemplus
+# This source code is licensed under the MIT license. See LICENSE in the repository root directory.
+# Author(s): Ville Heikkilä <ville.heikkila@tuni.fi>
+#            Otto Hylli <otto.hylli@tuni.fi>
+
+"""Module containing the filter that selects the messages handled by a single worker process."""
+
+import re
+import zlib
+
+SHARD_BY_ROUTING_KEY = "routing_key"
+SHARD_BY_SIMULATION_ID = "simulation_id"
+SHARD_MODES = (SHARD_BY_ROUTING_KEY, SHARD_BY_SIMULATION_ID)
+
+
+class ShardFilter:
+    """Class for selecting the messages for one shard out of shard_count shards.
+
+    The messages are partitioned either by the routing key or by the simulation id using a stable hash,
+    so that the same key always belongs to the same shard. The simulation id is read from the raw message
+    without decoding the whole message. Messages without a simulation id belong to the same shard as
+    the empty simulation id.
+    """
+    SIMULATION_ID_PATTERN = re.compile(rb'"SimulationId"\s*:\s*"((?:[^"\\]|\\.)*)"')
+
+    def __init__(self, shard_index: int, shard_count: int, shard_by: str = SHARD_BY_SIMULATION_ID):
+        if shard_count < 1 or not 0 <= shard_index < shard_count:
+            raise ValueError("Invalid shard {:d} out of {:d} shards".format(shard_index, shard_count))
+        if shard_by not in SHARD_MODES:
+            raise ValueError("Unknown shard mode '{:s}', expected one of: {:s}".format(
+                shard_by, ", ".join(SHARD_MODES)))
+
+        self.__shard_index = shard_index
+        self.__shard_count = shard_count
+        self.__shard_by = shard_by
+
+    @property
+    def shard_index(self) -> int:
+        """The index of the shard that the filter accepts."""
+        return self.__shard_index
+
+    @property
+    def shard_count(self) -> int:
+        """The total number of shards."""
+        return self.__shard_count
+
+    @property
+    def shard_by(self) -> str:
+        """The message property that is used to partition the messages."""
+        return self.__shard_by
+
+    def accepts(self, message_body: bytes, routing_key: str) -> bool:
+        """Returns True, if the given message belongs to the shard."""
+        if self.__shard_count == 1:
+            return True
+
+        if self.__shard_by == SHARD_BY_ROUTING_KEY:
+            shard_key = routing_key.encode("UTF-8")
+        else:
+            match = ShardFilter.SIMULATION_ID_PATTERN.search(message_body)
+            shard_key = match.group(1) if match is not None else b""
+
+        return zlib.crc32(shard_key) % self.__shard_count == self.__shard_index
@@ -8,8 +8,11 @@
 """Module containing classes for holding the simulation metadata for the simulation platform."""
 
 import asyncio
+import collections
 import datetime
-from typing import Awaitable, Callable, Dict, List, Optional, Set, Union, cast
+import sys
+import time
+from typing import Any, Awaitable, Callable, Dict, FrozenSet, List, NamedTuple, Optional, Set, Union, cast
 
 from tools.datetime_tools import to_utc_datetime_object, to_iso_format_datetime_string
 from tools.db_clients import MongodbClient
@@ -17,24 +20,121 @@ from tools.messages import AbstractMessage, AbstractResultMessage, BaseMessage,
 from tools.timer import Timer
 from tools.tools import FullLogger, load_environmental_variables
 
+from log_writer.batcher import MessageBatcher
+from log_writer.collection_manager import CollectionManager
+from log_writer.deduplication import DuplicateFilter, create_duplicate_filter
+from log_writer.epoch_summary import EpochSummaryWriter, get_epoch_summary_writer
+from log_writer.flush_controller import AdaptiveFlushController
 from log_writer.invalid_message import InvalidMessage
+from log_writer.live_tail import LiveTail, get_live_tail
+from log_writer.metadata_updater import MetadataUpdater
+from log_writer.metrics import (
+    BUFFERED_DOCUMENTS, DROPPED_DOCUMENTS, MESSAGES, METADATA_LATENCY, SIMULATIONS, WRITE_QUEUE_DOCUMENTS)
+from log_writer.profiling import STAGE_METADATA, STAGE_TIMERS
+from log_writer.raw_message import RawMessage
+from log_writer.spool import SPOOL_DIRECTORY, MessageSpool
+from log_writer.storage import MongodbBackend, StorageBackend, create_storage_backend
+from log_writer.write_queue import WriteQueue
 
 LOGGER = FullLogger(__name__)
 
-MESSAGE_BUFFER_MAX_DOCUMENTS_NAME = "MESSAGE_BUFFER_MAX_DOCUMENTS"
-MESSAGE_BUFFER_MAX_INTERVAL_NAME = "MESSAGE_BUFFER_MAX_INTERVAL"
+SERVICE_MODE_NAME = "SERVICE_MODE"
+SIMULATION_RETENTION_TIME_NAME = "SIMULATION_RETENTION_TIME"
+SIMULATION_IDLE_TIMEOUT_NAME = "SIMULATION_IDLE_TIMEOUT"
+MAX_SIMULATIONS_NAME = "MAX_SIMULATIONS"
+MAX_SIMULATION_TOMBSTONES_NAME = "MAX_SIMULATION_TOMBSTONES"
 
 ENV_VARIABLES = load_environmental_variables(
-    (MESSAGE_BUFFER_MAX_DOCUMENTS_NAME, int, 20),
-    (MESSAGE_BUFFER_MAX_INTERVAL_NAME, float, 10.0)
+    # in the service mode the log writer is not stopped when a simulation ends
+    (SERVICE_MODE_NAME, bool, False),
+    # the time in seconds that an ended simulation is kept in memory in the service mode
+    (SIMULATION_RETENTION_TIME_NAME, float, 300.0),
+    # the time in seconds after which a simulation without new messages is removed from memory in the service mode
+    (SIMULATION_IDLE_TIMEOUT_NAME, float, 3600.0),
+    # the maximum number of simulations kept in memory in the service mode, value 0 means no limit
+    (MAX_SIMULATIONS_NAME, int, 1000),
+    # the maximum number of removed simulations whose metadata is remembered in the service mode, so that
+    # a removed simulation that receives new messages continues from its earlier metadata
+    (MAX_SIMULATION_TOMBSTONES_NAME, int, 10000)
 )
 
+# the interval in seconds at which the simulations are checked for removal in the service mode
+EVICTION_CHECK_INTERVAL = 10.0
+
+
+class SimulationTombstone(NamedTuple):
+    """The metadata of a simulation that has been removed from memory."""
+    start_time: Optional[datetime.datetime]
+    start_flag: bool
+    end_time: Optional[datetime.datetime]
+    end_flag: bool
+    epoch_min: Optional[int]
+    epoch_max: Optional[int]
+    name: Optional[str]
+    description: Optional[str]
+    components: FrozenSet[str]
+    topic_messages: Dict[str, int]
+
+
+class DrainResult(NamedTuple):
+    """The result of writing the pending documents to the database when the log writer is stopped."""
+    drained_documents: int
+    remaining_documents: int
+    duration: float
+
+
+def is_simulation_state_message(message_object: Union[BaseMessage, RawMessage]) -> bool:
+    """Returns True, if the given message is a simulation state message."""
+    if isinstance(message_object, RawMessage):
+        return message_object.is_simulation_state_message
+    return isinstance(message_object, SimulationStateMessage)
+
+
+def is_epoch_message(message_object: Union[BaseMessage, RawMessage]) -> bool:
+    """Returns True, if the given message is an epoch message."""
+    if isinstance(message_object, RawMessage):
+        return message_object.is_epoch_message
+    return isinstance(message_object, EpochMessage)
+
+
+def get_source_process_id(message_object: Union[BaseMessage, RawMessage]) -> Union[str, None]:
+    """Returns the source process id for the given message or None if the message does not have one."""
+    if isinstance(message_object, (AbstractMessage, RawMessage)):
+        return message_object.source_process_id
+    return None
+
+
+def get_message_id(message_object: Union[BaseMessage, RawMessage]) -> Union[str, None]:
+    """Returns the message id for the given message or None if the message does not have one."""
+    if isinstance(message_object, (AbstractMessage, RawMessage)):
+        return message_object.message_id
+    return None
+
+
+def get_epoch_number(message_object: Union[BaseMessage, RawMessage]) -> Union[int, None]:
+    """Returns the epoch number for the given message or None if the message does not have one."""
+    if isinstance(message_object, (AbstractResultMessage, RawMessage)):
+        return message_object.epoch_number
+    return None
+
 
 class SimulationMetadata:
-    """Class for holding simulation metadata and to store the simulation messages to MongoDB."""
+    """Class for holding simulation metadata and to store the simulation messages to the database."""
     SIMULATION_STARTED, SIMULATION_ENDED = SimulationStateMessage.SIMULATION_STATES
 
-    def __init__(self, simulation_id: str, mongo_client: MongodbClient):
+    # the metadata objects are kept in memory for every active simulation, so they do not use instance dictionaries
+    __slots__ = (
+        "__simulation_id", "__name", "__description", "__components", "__topic_messages",
+        "__start_time", "__start_flag", "__end_time", "__end_flag", "__epoch_min", "__epoch_max",
+        "__last_activity", "__storage", "__batcher", "__metadata_updater", "__metadata_function",
+        "__epoch_summary", "__collection_manager", "__duplicate_filter", "__index_task"
+    )
+
+    def __init__(self, simulation_id: str, storage: StorageBackend, batcher: Optional[MessageBatcher] = None,
+                 metadata_function: Optional[Callable[["SimulationMetadata"], Awaitable[bool]]] = None,
+                 epoch_summary: Optional[EpochSummaryWriter] = None,
+                 collection_manager: Optional[CollectionManager] = None,
+                 duplicate_filter: Optional[DuplicateFilter] = None):
         self.__simulation_id = simulation_id
         self.__name = None
         self.__description = None
@@ -48,14 +148,21 @@ class SimulationMetadata:
 
         self.__epoch_min = None
         self.__epoch_max = None
-
-        self.__lock = asyncio.Lock()
-        self.__message_buffer = []
-        self.__buffer_timer = None
-        self.__buffer_max_documents = cast(int, ENV_VARIABLES[MESSAGE_BUFFER_MAX_DOCUMENTS_NAME])
-        self.__buffer_max_interval = cast(float, ENV_VARIABLES[MESSAGE_BUFFER_MAX_INTERVAL_NAME])
-
-        self.__mongo_client = mongo_client
+        self.__last_activity = time.monotonic()
+
+        self.__storage = storage
+        self.__batcher = batcher if batcher is not None else MessageBatcher(WriteQueue(storage))
+        self.__metadata_updater = MetadataUpdater(self.update_database_metadata)
+        # if given, the metadata function is used instead of writing the metadata directly to the database
+        self.__metadata_function = metadata_function
+        # if given, the per epoch summaries are maintained for the messages
+        self.__epoch_summary = epoch_summary
+        # if given, the collection manager is used to add the indexes only once for the simulation
+        self.__collection_manager = collection_manager
+        # if given, the messages with an already received message id are not logged
+        self.__duplicate_filter = duplicate_filter
+        # the task that adds the indexes once the messages of the simulation have been written
+        self.__index_task = None
 
     @property
     def simulation_id(self) -> str:
@@ -107,6 +214,11 @@ class SimulationMetadata:
         """Returns the simulation component names as a list."""
         return self.__components
 
+    @property
+    def last_activity(self) -> float:
+        """The monotonic time when the latest message for the simulation was received."""
+        return self.__last_activity
+
     @property
     def total_messages(self) -> int:
         """Returns the total number of messages logged for the simulation."""
@@ -118,50 +230,78 @@ class SimulationMetadata:
            the total number of messages logged for that topic as values."""
         return self.__topic_messages
 
-    async def clear_buffer(self):
-        """Sends all the messages from the buffer to the database."""
-        async with self.__lock:
-            if len(self.__message_buffer) >= 1:
-                # valid and invalid messages are stored separately so sort buffer to two lists.
-                valid_messages = []
-                invalid_messages = []
-                for message, topic in self.__message_buffer:
-                    if isinstance(message, InvalidMessage):
-                        invalid_messages.append((message.json(), topic))
-                    else:
-                        valid_messages.append((message.json(), topic))
-
-                # store both kinds of messages and check if the process succeeded.
-                store_valid_task = asyncio.create_task(self.__mongo_client.store_messages(valid_messages))
-                store_invalid_task = asyncio.create_task(self.__mongo_client.store_messages(
-                    invalid_messages, invalid=True, default_simulation_id=self.simulation_id))
-                for task, messages, message_type in [
-                        (store_valid_task, valid_messages, "valid"),
-                        (store_invalid_task, invalid_messages, "invalid")
-                ]:
-                    stored_messages = await task
-
-                    if len(stored_messages) != len(messages):
-                        LOGGER.warning(
-                            "Only {:d} {:s} message documents out of {:d} written to simulation {:s}.".format(
-                                len(stored_messages), message_type, len(messages), self.__simulation_id))
-                    else:
-                        LOGGER.debug("{:d} {:s} documents written to simulation {:s}".format(
-                            len(stored_messages), message_type, self.__simulation_id))
-
-            self.__message_buffer = []
-            self.__buffer_timer = None
-
-    async def add_message(self, message_object: BaseMessage, message_topic: str):
+    @property
+    def duplicate_messages(self) -> int:
+        """Returns the number of messages that were not logged because their message id had already been received."""
+        if self.__duplicate_filter is None:
+            return 0
+        return self.__duplicate_filter.duplicates
+
+    def get_tombstone(self) -> SimulationTombstone:
+        """Returns the metadata that is remembered after the simulation has been removed from memory."""
+        return SimulationTombstone(
+            start_time=self.__start_time,
+            start_flag=self.__start_flag,
+            end_time=self.__end_time,
+            end_flag=self.__end_flag,
+            epoch_min=self.__epoch_min,
+            epoch_max=self.__epoch_max,
+            name=self.__name,
+            description=self.__description,
+            components=frozenset(self.__components),
+            topic_messages=dict(self.__topic_messages))
+
+    def restore(self, tombstone: SimulationTombstone):
+        """Continues from the metadata of the removed simulation, so that the metadata written to the database
+           contains also the messages that were logged before the removal."""
+        self.__start_time = tombstone.start_time
+        self.__start_flag = tombstone.start_flag
+        self.__end_time = tombstone.end_time
+        self.__end_flag = tombstone.end_flag
+        self.__epoch_min = tombstone.epoch_min
+        self.__epoch_max = tombstone.epoch_max
+        self.__name = tombstone.name
+        self.__description = tombstone.description
+        self.__components = set(tombstone.components)
+        self.__topic_messages = dict(tombstone.topic_messages)
+
+    def remember_messages(self, message_objects: List[Union[BaseMessage, RawMessage]]):
+        """Remembers the message ids of the stored messages for the duplicate filter."""
+        if self.__duplicate_filter is None:
+            return
+        for message_object in message_objects:
+            message_id = get_message_id(message_object)
+            if message_id is not None:
+                self.__duplicate_filter.add(message_id)
+
+    def is_duplicate(self, message_object: Union[BaseMessage, RawMessage]) -> bool:
+        """Returns True, if a message with the same message id has already been stored to the simulation."""
+        if self.__duplicate_filter is None:
+            return False
+        message_id = get_message_id(message_object)
+        return message_id is not None and self.__duplicate_filter.is_duplicate(message_id)
+
+    async def clear_buffer(self) -> List[asyncio.Future]:
+        """Sends all the pending messages for the simulation to the database write queue.
+           Returns a list of futures that are done when the messages have been written to the database."""
+        return await self.__batcher.flush(self.simulation_id)
+
+    async def add_message(self, message_object: Union[BaseMessage, RawMessage], message_topic: str):
         """Logs the message to the simulation."""
+        stage_start = STAGE_TIMERS.start(STAGE_METADATA)
+        self.__last_activity = time.monotonic()
+        is_state_message = is_simulation_state_message(message_object)
+        is_control_message = is_state_message or is_epoch_message(message_object)
+
         # Check for the start or end flags.
-        if isinstance(message_object, SimulationStateMessage):
-            if message_object.simulation_state == SimulationMetadata.SIMULATION_STARTED:
+        if is_state_message:
+            state_message = cast(SimulationStateMessage, message_object)
+            if state_message.simulation_state == SimulationMetadata.SIMULATION_STARTED:
                 self.__start_flag = True
-            elif message_object.simulation_state == SimulationMetadata.SIMULATION_ENDED:
+            elif state_message.simulation_state == SimulationMetadata.SIMULATION_ENDED:
                 self.__end_flag = True
-            self.__name = message_object.name
-            self.__description = message_object.description
+            self.__name = state_message.name
+            self.__description = state_message.description
 
         # Check the timestamp for the earliest or the latest messages.
         message_timestamp = to_utc_datetime_object(message_object.timestamp)
@@ -171,46 +311,78 @@ class SimulationMetadata:
             self.__end_time = message_timestamp
 
         # Add to the simulation component list.
-        if isinstance(message_object, AbstractMessage):
-            self.__components.add(message_object.source_process_id)
+        source_process_id = get_source_process_id(message_object)
+        if source_process_id is not None and source_process_id not in self.__components:
+            # the same component names and topics are used in many simulations
+            self.__components.add(sys.intern(source_process_id))
 
         # Check for the smallest or the largest epoch.
-        if isinstance(message_object, AbstractResultMessage):
-            if self.epoch_min is None or message_object.epoch_number < self.epoch_min:
-                self.__epoch_min = message_object.epoch_number
-            if self.epoch_max is None or message_object.epoch_number > self.epoch_max:
-                self.__epoch_max = message_object.epoch_number
+        epoch_number = get_epoch_number(message_object)
+        if epoch_number is not None:
+            if self.epoch_min is None or epoch_number < self.epoch_min:
+                self.__epoch_min = epoch_number
+            if self.epoch_max is None or epoch_number > self.epoch_max:
+                self.__epoch_max = epoch_number
 
         # Add to topic message count.
         if message_topic not in self.__topic_messages:
+            message_topic = sys.intern(message_topic)
             self.__topic_messages[message_topic] = 0
         self.__topic_messages[message_topic] += 1
+        MESSAGES.inc(self.__simulation_id, message_topic)
+        STAGE_TIMERS.stop(STAGE_METADATA, stage_start)
+
+        # Add to the per epoch summary.
+        if epoch_number is not None and self.__epoch_summary is not None:
+            await self.__epoch_summary.add_message(
+                self.__simulation_id, epoch_number, message_topic, source_process_id, message_timestamp)
 
-        # Store the message to the message buffer
-        async with self.__lock:
-            self.__message_buffer.append((message_object, message_topic))
-            if self.__buffer_timer is None:
-                self.__buffer_timer = Timer(False, cast(float, self.__buffer_max_interval), self.clear_buffer)
+        # Store the message to the shared message buffer that is flushed when it is full.
+        write_futures = await self.__batcher.add_message(
+            self.simulation_id, message_object, message_topic, priority=is_control_message)
 
-        # Clear the message buffer if the buffer is full or
-        # if the last message was a simulation state or an epoch message.
-        if (len(self.__message_buffer) >= self.__buffer_max_documents or
-                isinstance(message_object, (SimulationStateMessage, EpochMessage))):
-            await self.clear_buffer()
+        # Clear the message buffer for the simulation if the last message was a simulation state or an epoch message.
+        if is_control_message:
+            write_futures += await self.clear_buffer()
 
         # Update the metadata to the database if the message was simulation state or epoch message.
         # The first and the last message for a simulation should be simulation state message.
-        if isinstance(message_object, (SimulationStateMessage, EpochMessage)):
-            await self.update_database_metadata()
+        # The updates are coalesced except for the final update after the simulation has ended.
+        is_end_message = (
+            is_state_message and
+            cast(SimulationStateMessage, message_object).simulation_state == SimulationMetadata.SIMULATION_ENDED
+        )
+        if is_end_message:
+            await self.__metadata_updater.flush()
+        elif is_control_message:
+            self.__metadata_updater.request_update()
 
         # Add indexes to the simulation specific collection after the simulation has ended.
-        if (isinstance(message_object, SimulationStateMessage) and
-                message_object.simulation_state == SimulationStateMessage.SIMULATION_STATES[-1] and
-                message_object.simulation_id is not None):
-            await self.__mongo_client.add_simulation_indexes(message_object.simulation_id)
-
-    async def update_database_metadata(self):
-        """Updates the metadata into the database."""
+        if is_end_message and message_object.simulation_id is not None:
+            self.__start_index_task(write_futures)
+
+    async def flush_metadata(self):
+        """Writes the metadata to the database if there are changes that have not yet been written."""
+        if self.__metadata_updater.update_pending:
+            await self.__metadata_updater.flush()
+
+    async def finalize(self):
+        """Writes all the buffered messages and the pending metadata for the simulation to the database.
+           If the simulation was started but its end was not received, the indexes are added to the simulation
+           specific collection once the messages have been written."""
+        write_futures = await self.clear_buffer()
+        await self.flush_metadata()
+        if self.start_flag and not self.end_flag:
+            self.__start_index_task(write_futures)
+        await self.wait_for_indexes()
+
+    async def wait_for_indexes(self):
+        """Waits until the indexes for the ended simulation have been added."""
+        if self.__index_task is not None:
+            await self.__index_task
+
+    def get_metadata_attributes(self) -> Dict[str, Any]:
+        """Returns the metadata attributes that are written to the database."""
         metadata_attributes = {
             "StartTime": self.start_time,
             "Name": self.__name,
@@ -220,13 +392,49 @@ class SimulationMetadata:
         }
         if self.end_flag:
             metadata_attributes["EndTime"] = self.end_time
+        return metadata_attributes
+
+    def get_snapshot(self) -> Dict[str, Any]:
+        """Returns the current metadata and the message counts for the simulation."""
+        return {
+            "SimulationId": self.__simulation_id,
+            **self.get_metadata_attributes(),
+            "EndTime": self.end_time,
+            "StartFlag": self.start_flag,
+            "EndFlag": self.end_flag,
+            "TotalMessages": self.total_messages,
+            "TopicMessages": dict(self.__topic_messages),
+            "DuplicateMessages": self.duplicate_messages
+        }
 
-        db_result = await self.__mongo_client.update_metadata(self.__simulation_id, **metadata_attributes)
+    async def update_database_metadata(self):
+        """Updates the metadata into the database."""
+        start_time = time.perf_counter()
+        if self.__metadata_function is not None:
+            db_result = await self.__metadata_function(self)
+        else:
+            db_result = await self.__storage.update_metadata(
+                self.__simulation_id, **self.get_metadata_attributes())
+            METADATA_LATENCY.observe(time.perf_counter() - start_time)
         if db_result:
             LOGGER.info("Database metadata update successful for '{:s}'".format(self.simulation_id))
         else:
             LOGGER.warning("Database metadata update failed for '{:s}'".format(self.simulation_id))
 
+    def __start_index_task(self, write_futures: List[asyncio.Future]):
+        """Starts a task that adds the indexes once the given writes are done. The message handling is not blocked
+           while waiting for the writes, since with the spool the writes can wait for the database indefinitely."""
+        if self.__index_task is None or self.__index_task.done():
+            self.__index_task = asyncio.ensure_future(self.__add_simulation_indexes(write_futures))
+
+    async def __add_simulation_indexes(self, write_futures: List[asyncio.Future]):
+        """Adds the indexes to the simulation specific message collection after the given writes are done."""
+        await asyncio.gather(*write_futures)
+        if self.__collection_manager is not None:
+            await self.__collection_manager.add_simulation_indexes(self.__simulation_id)
+        else:
+            await self.__storage.add_simulation_indexes(self.__simulation_id)
+
     def __str__(self) -> str:
         start_time_str = str(to_iso_format_datetime_string(str(self.start_time)))
         end_time_str = str(to_iso_format_datetime_string(str(self.end_time)))
@@ -240,18 +448,68 @@ class SimulationMetadata:
             "components: {:s}".format(", ".join(self.components)),
             "epochs: {:s} - {:s}".format(str(self.epoch_min), str(self.epoch_max)),
             "total messages: {:d}".format(self.total_messages),
-            "topic messages: {:s}".format(str(self.topic_messages))
+            "topic messages: {:s}".format(str(self.topic_messages)),
+            "duplicate messages: {:d}".format(self.duplicate_messages)
         ])
 
 
 class SimulationMetadataCollection:
-    """Class for containing metadata and storing the information to MongoDB for several simulations."""
-    def __init__(self, stop_function: Callable[..., Awaitable[None]] = None):
-        self.__simulations = {}
-
-        self.__mongo_client = MongodbClient()
+    """Class for containing metadata and storing the information to the database for several simulations.
+
+    In the service mode the log writer is not stopped when a simulation ends. Instead, the simulations are
+    removed from memory: the ended simulations after the retention time, the simulations without new messages
+    after the idle timeout and the least recently active simulations when there are more than the maximum number
+    of simulations. The messages and the metadata of a removed simulation are written to the database in
+    a background task. A small tombstone with the metadata is kept for the removed simulations, so that
+    a simulation that receives new messages after its removal continues from its earlier metadata instead of
+    overwriting it in the database.
+    """
+    def __init__(self, stop_function: Callable[..., Awaitable[None]] = None,
+                 metadata_function: Optional[Callable[[SimulationMetadata], Awaitable[bool]]] = None,
+                 mongo_client: Optional[MongodbClient] = None, service_mode: Optional[bool] = None,
+                 write_queue: Optional[WriteQueue] = None, flush_controller: Optional[AdaptiveFlushController] = None,
+                 storage: Optional[StorageBackend] = None):
+        # the simulations are kept in the order of their latest activity, the least recently active first
+        self.__simulations = collections.OrderedDict()
+        self.__metadata_function = metadata_function
+
+        self.__service_mode = cast(bool, service_mode if service_mode is not None
+                                   else ENV_VARIABLES[SERVICE_MODE_NAME])
+        self.__retention_time = cast(float, ENV_VARIABLES[SIMULATION_RETENTION_TIME_NAME])
+        self.__idle_timeout = cast(float, ENV_VARIABLES[SIMULATION_IDLE_TIMEOUT_NAME])
+        self.__max_simulations = cast(int, ENV_VARIABLES[MAX_SIMULATIONS_NAME])
+        self.__eviction_timer = None
+        self.__evicted_simulations = 0
+        self.__eviction_tasks = set()
+        # the metadata of the removed simulations, the least recently removed first
+        self.__tombstones = collections.OrderedDict()
+        self.__max_tombstones = max(cast(int, ENV_VARIABLES[MAX_SIMULATION_TOMBSTONES_NAME]), 0)
+
+        # a given MongoDB client is used as the only storage backend,
+        # otherwise the backends are given by the STORAGE_BACKENDS environmental variable
+        if storage is not None:
+            self.__storage = storage
+        elif mongo_client is not None:
+            self.__storage = MongodbBackend(mongo_client)
+        else:
+            self.__storage = create_storage_backend()
+        self.__write_queue = write_queue if write_queue is not None else WriteQueue(self.__storage)
+        # with the spool the messages are first written to disk and then drained to the write queue
+        if SPOOL_DIRECTORY:
+            self.__batcher = MessageBatcher(MessageSpool(SPOOL_DIRECTORY, self.__write_queue), flush_controller)
+        else:
+            self.__batcher = MessageBatcher(self.__write_queue, flush_controller)
+        self.__batcher.add_stored_callback(self.__remember_stored_messages)
+        self.__epoch_summary = get_epoch_summary_writer(self.__storage.uses_mongodb)
+        self.__collection_manager = CollectionManager(self.__storage)
+        # if the live tail is used, the latest messages for each simulation are also kept in memory
+        self.__live_tail = get_live_tail()
         self.__first_message = False
 
+        BUFFERED_DOCUMENTS.set_function(lambda: self.__batcher.pending_documents)
+        WRITE_QUEUE_DOCUMENTS.set_function(lambda: self.__batcher.write_queue.pending_documents)
+        SIMULATIONS.set_function(lambda: len(self.__simulations))
+
         # the function that is called when receiving a simulation state message "stopped"
         self.__stop_function = stop_function
 
@@ -260,30 +518,194 @@ class SimulationMetadataCollection:
         """The simulation ids as a list."""
         return list(self.__simulations.keys())
 
+    @property
+    def service_mode(self) -> bool:
+        """Returns True, if the collection is used in the service mode."""
+        return self.__service_mode
+
+    @property
+    def evicted_simulations(self) -> int:
+        """The number of simulations that have been removed from memory in the service mode."""
+        return self.__evicted_simulations
+
+    @property
+    def batcher(self) -> MessageBatcher:
+        """The shared message buffer that is used to store the messages from all the simulations to the database."""
+        return self.__batcher
+
+    @property
+    def epoch_summary(self) -> Union[EpochSummaryWriter, None]:
+        """The writer for the per epoch summaries or None if the summaries are not used."""
+        return self.__epoch_summary
+
+    @property
+    def live_tail(self) -> Union[LiveTail, None]:
+        """The ring buffers for the latest messages or None if the live tail is not used."""
+        return self.__live_tail
+
+    @property
+    def pending_documents(self) -> int:
+        """The number of received documents that have not yet been written to the database."""
+        return self.__batcher.pending_documents + self.__batcher.write_queue.pending_documents
+
     def get_simulation(self, simulation_id: str) -> Union[SimulationMetadata, None]:
         """Returns the metadata object for simulation with the id simulation_id.
            Returns None, if the metadata is not found."""
         return self.__simulations.get(simulation_id, None)
 
-    async def add_message(self, message_object: BaseMessage, message_topic: str, simulation_id: Optional[str] = None):
+    async def add_message(self, message_object: Union[BaseMessage, RawMessage], message_topic: str,
+                          simulation_id: Optional[str] = None):
         """Logs the message to the simulation collection.
         Invalid messages do not have a simulation id so simulation_id is used with them."""
         if not self.__first_message:
-            await self.__mongo_client.update_metadata_indexes()
+            await self.__storage.update_metadata_indexes()
             self.__first_message = True
 
         if not isinstance(message_object, InvalidMessage):
             simulation_id = message_object.simulation_id
-        elif simulation_id is None:
-            LOGGER.warning("Cannot store invalid message without simulation id")
+        if simulation_id is None:
+            LOGGER.warning("Cannot store message without simulation id")
+            DROPPED_DOCUMENTS.inc("no_simulation_id")
             return
 
-        if simulation_id is not None and simulation_id not in self.__simulations:
-            self.__simulations[simulation_id] = SimulationMetadata(simulation_id, self.__mongo_client)
-            LOGGER.info("New simulation started: '{:s}'".format(simulation_id))
-        await self.__simulations[simulation_id].add_message(message_object, message_topic)
+        simulation = self.__simulations.get(simulation_id, None)
+        if simulation is None:
+            simulation = SimulationMetadata(
+                simulation_id, self.__storage, self.__batcher, self.__metadata_function, self.__epoch_summary,
+                self.__collection_manager, create_duplicate_filter())
+            tombstone = self.__tombstones.pop(simulation_id, None)
+            if tombstone is not None:
+                simulation.restore(tombstone)
+            self.__simulations[simulation_id] = simulation
+            await self.__collection_manager.prepare_simulation(simulation_id)
+            if tombstone is not None:
+                LOGGER.info("Removed simulation '{:s}' received new messages".format(simulation_id))
+            else:
+                LOGGER.info("New simulation started: '{:s}'".format(simulation_id))
+            if self.__service_mode:
+                self.__evict_least_recent_simulations()
+        else:
+            self.__simulations.move_to_end(simulation_id)
 
-        if (isinstance(message_object, SimulationStateMessage) and
-                self.__stop_function is not None and
-                message_object.simulation_state == SimulationMetadata.SIMULATION_ENDED):
+        # a redelivered message is dropped before it is counted or buffered
+        if simulation.is_duplicate(message_object):
+            LOGGER.debug("Dropping duplicate message '{:s}' for simulation '{:s}'".format(
+                str(get_message_id(message_object)), simulation_id))
+            DROPPED_DOCUMENTS.inc("duplicate")
+            return
+        await simulation.add_message(message_object, message_topic)
+        if self.__live_tail is not None:
+            self.__live_tail.add_message(simulation_id, message_object, message_topic)
+
+        if self.__service_mode:
+            if self.__eviction_timer is None:
+                self.__eviction_timer = Timer(True, EVICTION_CHECK_INTERVAL, self.__evict_inactive_simulations)
+
+        elif (is_simulation_state_message(message_object) and
+                cast(SimulationStateMessage, message_object).simulation_state == SimulationMetadata.SIMULATION_ENDED):
+            self.notify_simulation_end()
+
+    def notify_simulation_end(self):
+        """Calls the stop function after the end of a simulation has been received.
+           The stop function is not used in the service mode."""
+        if not self.__service_mode and self.__stop_function is not None:
             asyncio.create_task(self.__stop_function())
+
+    async def close(self, timeout: float) -> DrainResult:
+        """Writes all the buffered messages and the pending metadata updates to the database and
+           stops the database writers. Waits at most timeout seconds for the whole drain to finish."""
+        start_time = time.monotonic()
+        pending_documents = self.pending_documents
+        if self.__eviction_timer is not None:
+            self.__eviction_timer.cancel()
+            self.__eviction_timer = None
+        await self.__collection_manager.close()
+
+        try:
+            await asyncio.wait_for(self.__drain(), timeout=max(timeout, 0.0))
+        except asyncio.TimeoutError:
+            LOGGER.warning("The log writer could not write everything to the database in {:.1f} seconds.".format(
+                timeout))
+
+        remaining_documents = self.pending_documents
+        if remaining_documents > 0:
+            DROPPED_DOCUMENTS.inc("stop_timeout", amount=remaining_documents)
+        if self.__batcher.write_queue is not self.__write_queue:
+            await self.__batcher.write_queue.close()
+        await self.__write_queue.close()
+        await self.__storage.close()
+
+        return DrainResult(
+            drained_documents=max(pending_documents - remaining_documents, 0),
+            remaining_documents=remaining_documents,
+            duration=time.monotonic() - start_time)
+
+    async def __drain(self):
+        """Writes the buffered messages, the pending metadata and the epoch summaries to the database and waits until
+           the write queue is empty and the indexes for the ended simulations have been added."""
+        await asyncio.gather(*self.__eviction_tasks)
+        await asyncio.gather(
+            self.__batcher.flush(),
+            *(simulation.flush_metadata() for simulation in self.__simulations.values())
+        )
+        if self.__epoch_summary is not None:
+            await self.__epoch_summary.close()
+        await self.__batcher.write_queue.join()
+        await asyncio.gather(*(simulation.wait_for_indexes() for simulation in self.__simulations.values()))
+
+    def __remember_stored_messages(self, simulation_id: str,
+                                   message_objects: List[Union[BaseMessage, RawMessage]]):
+        """Gives the stored messages to the duplicate filter of the simulation, if it is still in memory."""
+        simulation = self.__simulations.get(simulation_id, None)
+        if simulation is not None:
+            simulation.remember_messages(message_objects)
+
+    async def __evict_inactive_simulations(self):
+        """Removes the ended simulations whose retention time has passed and the idle simulations from memory."""
+        current_time = time.monotonic()
+        inactive_simulations = [
+            simulation_id
+            for simulation_id, simulation in self.__simulations.items()
+            if current_time - simulation.last_activity >= (
+                self.__retention_time if simulation.end_flag else self.__idle_timeout)
+        ]
+        for simulation_id in inactive_simulations:
+            self.__evict_simulation(simulation_id)
+
+    def __evict_least_recent_simulations(self):
+        """Removes the least recently active simulations from memory while there are too many simulations."""
+        while 0 < self.__max_simulations < len(self.__simulations):
+            self.__evict_simulation(next(iter(self.__simulations)))
+
+    def __evict_simulation(self, simulation_id: str):
+        """Removes the simulation from memory and writes its pending data to the database in a background task,
+           so that the message handling is not blocked by the writes."""
+        simulation = self.__simulations.pop(simulation_id, None)
+        if simulation is None:
+            return
+
+        if self.__max_tombstones > 0:
+            self.__tombstones[simulation_id] = simulation.get_tombstone()
+            while len(self.__tombstones) > self.__max_tombstones:
+                self.__tombstones.popitem(last=False)
+        if self.__live_tail is not None:
+            self.__live_tail.remove_simulation(simulation_id)
+        MESSAGES.remove("simulation_id", simulation_id)
+        self.__evicted_simulations += 1
+        LOGGER.info("Simulation '{:s}' removed from memory with {:d} messages.".format(
+            simulation_id, simulation.total_messages))
+
+        eviction_task = asyncio.ensure_future(self.__finalize_evicted_simulation(simulation))
+        self.__eviction_tasks.add(eviction_task)
+        eviction_task.add_done_callback(self.__eviction_tasks.discard)
+
+    async def __finalize_evicted_simulation(self, simulation: SimulationMetadata):
+        """Writes the pending data for the removed simulation to the database."""
+        try:
+            await simulation.finalize()
+        except Exception as error:  # pylint: disable=broad-except
+            LOGGER.error("Error while writing the data for the removed simulation '{:s}': {:s}".format(
+                simulation.simulation_id, str(error)))
+        # the simulation can have received new messages after it was removed
+        if simulation.simulation_id not in self.__simulations:
+            self.__collection_manager.remove_simulation(simulation.simulation_id)
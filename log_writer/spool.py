@@ -0,0 +1,442 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 Tampere University and VTT Technical Research Centre of Finland
+# This software was developed as a part of the ProCemPlus project: https://www.senecc.fi/projects/procemplus
+# This source code is licensed under the MIT license. See LICENSE in the repository root directory.
+# Author(s): Ville Heikkilä <ville.heikkila@tuni.fi>
+#            Otto Hylli <otto.hylli@tuni.fi>
+
+"""Module containing an on-disk append-only spool for the message documents that are waiting for the database writes.
+
+The spool consists of segment files that contain one JSON encoded write job per line. For each segment file there is
+an acknowledgement file that contains the line numbers of the jobs that have been written to the database.
+A segment file is removed once it has been rotated and all its jobs have been acknowledged. Any segment files left
+when the log writer is started are replayed, skipping the acknowledged jobs. A job is acknowledged only after all
+its documents have been written, so the documents of a partially written job can be written again on replay."""
+
+import asyncio
+import os
+from typing import Callable, Dict, List, Optional, Set, Tuple, Union, cast
+
+from tools.tools import FullLogger, load_environmental_variables
+
+from log_writer.json_codec import DEFAULT_CODEC, JsonCodec
+from log_writer.write_queue import WriteJob, WriteQueue
+
+LOGGER = FullLogger(__name__)
+
+SPOOL_DIRECTORY_NAME = "SPOOL_DIRECTORY"
+SPOOL_SEGMENT_MAX_BYTES_NAME = "SPOOL_SEGMENT_MAX_BYTES"
+SPOOL_FSYNC_NAME = "SPOOL_FSYNC"
+SPOOL_RETRY_INTERVAL_NAME = "SPOOL_RETRY_INTERVAL"
+
+ENV_VARIABLES = load_environmental_variables(
+    (SPOOL_DIRECTORY_NAME, str, ""),
+    (SPOOL_SEGMENT_MAX_BYTES_NAME, int, 64 * 1024 * 1024),
+    (SPOOL_FSYNC_NAME, bool, False),
+    (SPOOL_RETRY_INTERVAL_NAME, float, 5.0)
+)
+
+# the directory for the spool files, the spool is not used if the directory is not given
+SPOOL_DIRECTORY = cast(str, ENV_VARIABLES[SPOOL_DIRECTORY_NAME])
+
+SEGMENT_FILE_PREFIX = "segment-"
+SEGMENT_FILE_SUFFIX = ".log"
+ACK_FILE_SUFFIX = ".ack"
+
+
+class SpoolSegment:
+    """Class for a single spool segment file and its acknowledgement file."""
+    def __init__(self, directory: str, number: int, existing: bool = False):
+        self.__number = number
+        base_name = os.path.join(directory, "{:s}{:012d}".format(SEGMENT_FILE_PREFIX, number))
+        self.__path = base_name + SEGMENT_FILE_SUFFIX
+        self.__ack_path = base_name + ACK_FILE_SUFFIX
+
+        self.__replayed = existing
+        self.__acknowledged = SpoolSegment.__read_acknowledgements(self.__ack_path) if existing else set()
+
+        self.__write_file = None if existing else open(self.__path, "ab")
+        self.__size = os.path.getsize(self.__path)
+        self.__line_count = 0
+        self.__ack_file = open(self.__ack_path, "a")
+
+        self.__read_file = open(self.__path, "rb")
+        self.__read_index = 0
+        self.__outstanding = 0
+
+    @property
+    def number(self) -> int:
+        """The running number of the segment."""
+        return self.__number
+
+    @property
+    def replayed(self) -> bool:
+        """Returns True, if the segment was left from an earlier run of the log writer."""
+        return self.__replayed
+
+    @property
+    def size(self) -> int:
+        """The size of the segment file in bytes."""
+        return self.__size
+
+    @property
+    def line_count(self) -> int:
+        """The number of jobs appended to the segment, i.e. the line number for the next appended job."""
+        return self.__line_count
+
+    @property
+    def is_open(self) -> bool:
+        """Returns True, if new jobs can still be appended to the segment."""
+        return self.__write_file is not None
+
+    @property
+    def is_finished(self) -> bool:
+        """Returns True, if the segment has been rotated, read completely and all its jobs have been acknowledged."""
+        return not self.is_open and self.__read_file is None and self.__outstanding == 0
+
+    def append(self, record: bytes):
+        """Appends an encoded job to the end of the segment."""
+        if self.__write_file is None:
+            raise ValueError("Spool segment {:d} has already been rotated.".format(self.__number))
+        self.__write_file.write(record + b"\n")
+        self.__write_file.flush()
+        self.__size += len(record) + 1
+        self.__line_count += 1
+
+    def sync(self):
+        """Forces the appended jobs to the disk."""
+        if self.__write_file is not None:
+            os.fsync(self.__write_file.fileno())
+
+    def rotate(self):
+        """Closes the segment for new jobs."""
+        if self.__write_file is not None:
+            self.__write_file.close()
+            self.__write_file = None
+
+    def read(self) -> Union[Tuple[int, int, bytes], None]:
+        """Returns the next unacknowledged job as a tuple (line number, file position, encoded job) or None,
+           if there are no complete jobs available. Once a rotated segment has been read completely,
+           the read file is closed."""
+        while self.__read_file is not None:
+            position = self.__read_file.tell()
+            record = self.__read_file.readline()
+            if not record.endswith(b"\n"):
+                if self.is_open:
+                    # the rest of the job has not yet been written
+                    self.__read_file.seek(position)
+                    return None
+                if record:
+                    LOGGER.warning("Ignoring an incomplete job at the end of spool segment {:d}.".format(
+                        self.__number))
+                self.__read_file.close()
+                self.__read_file = None
+                return None
+
+            line_number = self.__read_index
+            self.__read_index += 1
+            if line_number not in self.__acknowledged:
+                self.__outstanding += 1
+                return line_number, position, record
+        return None
+
+    def read_at(self, position: int) -> bytes:
+        """Returns the encoded job that starts at the given file position."""
+        with open(self.__path, "rb") as read_file:
+            read_file.seek(position)
+            return read_file.readline()
+
+    def acknowledge(self, line_number: int):
+        """Marks the job at the given line number as written to the database."""
+        self.__ack_file.write("{:d}\n".format(line_number))
+        self.__ack_file.flush()
+        self.__acknowledged.add(line_number)
+        self.__outstanding -= 1
+
+    def close(self):
+        """Closes all the files for the segment."""
+        self.rotate()
+        for open_file in (self.__read_file, self.__ack_file):
+            if open_file is not None:
+                open_file.close()
+        self.__read_file = None
+
+    def remove(self):
+        """Closes and removes the segment files."""
+        self.close()
+        for path in (self.__path, self.__ack_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    @staticmethod
+    def __read_acknowledgements(ack_path: str) -> Set[int]:
+        """Returns the acknowledged line numbers from the given acknowledgement file."""
+        acknowledged = set()
+        if os.path.exists(ack_path):
+            with open(ack_path, "r") as ack_file:
+                for line in ack_file:
+                    line = line.strip()
+                    if line.isdigit():
+                        acknowledged.add(int(line))
+        return acknowledged
+
+
+class MessageSpool:
+    """On-disk spool between the message batcher and the write queue.
+
+    The jobs given to the spool are appended to the current segment file and are then considered persisted.
+    A drainer task reads the jobs back from the segment files and gives them to the write queue, so the memory use
+    is bounded by the write queue regardless of how slow the database is. Only the done future of each job is kept
+    in memory after the append. The documents that could not be written are read again from the segment file and
+    retried after the retry interval. While a job is being retried, no new jobs are read from the segment files.
+    The storage backends write the documents in order and stop at the first failure, so the documents after
+    the written ones are retried.
+
+    The persisted future of a job given to the spool is done when the job has been appended to the spool and
+    its done future when all its documents have been written to the database. The priority jobs are not spooled
+    but given directly to the write queue, so that they are not written after all the spooled jobs.
+    """
+    # the interval in seconds for checking whether all the spooled jobs have been written
+    JOIN_CHECK_INTERVAL = 0.1
+
+    def __init__(self, directory: str, write_queue: WriteQueue, segment_max_bytes: Optional[int] = None,
+                 fsync: Optional[bool] = None, json_codec: JsonCodec = DEFAULT_CODEC):
+        self.__directory = directory
+        self.__write_queue = write_queue
+        self.__segment_max_bytes = cast(int, segment_max_bytes if segment_max_bytes is not None
+                                        else ENV_VARIABLES[SPOOL_SEGMENT_MAX_BYTES_NAME])
+        self.__fsync = cast(bool, fsync if fsync is not None else ENV_VARIABLES[SPOOL_FSYNC_NAME])
+        self.__retry_interval = cast(float, ENV_VARIABLES[SPOOL_RETRY_INTERVAL_NAME])
+        self.__json_codec = json_codec
+
+        os.makedirs(self.__directory, exist_ok=True)
+        existing_numbers = MessageSpool.__find_segment_numbers(self.__directory)
+        self.__segments = [
+            SpoolSegment(self.__directory, number, existing=True)
+            for number in existing_numbers
+        ]
+        if self.__segments:
+            LOGGER.info("Replaying {:d} spool segments from {:s}".format(len(self.__segments), self.__directory))
+        self.__active_segment = SpoolSegment(self.__directory, max(existing_numbers, default=0) + 1)
+        self.__segments.append(self.__active_segment)
+
+        self.__pending_documents = 0
+        # the done futures and the document counts of the jobs given to the spool in this run
+        # by their (segment number, line number)
+        self.__waiting_jobs: Dict[Tuple[int, int], Tuple[asyncio.Future, int]] = {}
+        # the (segment number, line number) pairs of the jobs whose writes are being retried
+        self.__retried_jobs: Set[Tuple[int, int]] = set()
+        self.__retry_tasks: Set[asyncio.Future] = set()
+        self.__closed = False
+        self.__put_lock = asyncio.Lock()
+        self.__data_available = asyncio.Event()
+        self.__drainer = asyncio.create_task(self.__drain())
+
+    @property
+    def directory(self) -> str:
+        """The directory for the spool segment files."""
+        return self.__directory
+
+    @property
+    def pending_documents(self) -> int:
+        """The number of documents that have been spooled but not yet written to the database.
+           Documents from the replayed segments are counted once they have been read."""
+        return self.__pending_documents
+
+    @property
+    def segment_count(self) -> int:
+        """The number of segment files in the spool."""
+        return len(self.__segments)
+
+    def add_write_callback(self, callback: Callable[[WriteJob], None]):
+        """Adds a callback that is called with each job after its documents have been written."""
+        self.__write_queue.add_write_callback(callback)
+
+    async def put(self, job: WriteJob) -> asyncio.Future:
+        """Appends the job to the spool and resolves its persisted future.
+           Returns a future that is done when the documents of the job have been written to the database.
+           A priority job is given directly to the write queue and its persisted future is resolved
+           once it has been written to the database."""
+        if job.priority:
+            return await self.__write_queue.put(job)
+
+        record = self.__json_codec.dumps({
+            "SimulationId": job.simulation_id,
+            "Invalid": job.invalid,
+            "Documents": job.documents
+        })
+        async with self.__put_lock:
+            if (self.__active_segment.size > 0 and
+                    self.__active_segment.size + len(record) > self.__segment_max_bytes):
+                self.__active_segment.rotate()
+                self.__active_segment = SpoolSegment(self.__directory, self.__active_segment.number + 1)
+                self.__segments.append(self.__active_segment)
+
+            # the job is registered before the append, since the drainer can read it right after the append
+            job_key = (self.__active_segment.number, self.__active_segment.line_count)
+            self.__waiting_jobs[job_key] = (job.done, job.size)
+            try:
+                self.__active_segment.append(record)
+            except Exception:
+                self.__waiting_jobs.pop(job_key, None)
+                raise
+            job.queued = True
+            self.__pending_documents += job.size
+            self.__data_available.set()
+
+            if self.__fsync:
+                # fsync can take a long time, so it is not called in the event loop
+                await asyncio.get_running_loop().run_in_executor(None, self.__active_segment.sync)
+
+        if not job.persisted.done():
+            job.persisted.set_result(job.size)
+        return job.done
+
+    async def join(self):
+        """Waits until all the spooled jobs have been written to the database."""
+        while self.__pending_documents > 0 or len(self.__segments) > 1:
+            self.__data_available.set()
+            await asyncio.sleep(MessageSpool.JOIN_CHECK_INTERVAL)
+        await self.__write_queue.join()
+
+    async def close(self):
+        """Stops the drainer and the retries and closes the segment files. Unwritten jobs are replayed on
+           the next start and the done futures of their original jobs are resolved with zero written documents."""
+        self.__closed = True
+        self.__drainer.cancel()
+        for retry_task in self.__retry_tasks:
+            retry_task.cancel()
+        await asyncio.gather(self.__drainer, *self.__retry_tasks, return_exceptions=True)
+        self.__retry_tasks.clear()
+
+        for done_future, _ in self.__waiting_jobs.values():
+            if not done_future.done():
+                done_future.set_result(0)
+        self.__waiting_jobs.clear()
+        for segment in self.__segments:
+            segment.close()
+
+    async def __drain(self):
+        """Reads the jobs from the segment files in order and gives them to the write queue.
+           No new jobs are read while some jobs are being retried, e.g. during a database outage."""
+        while True:
+            self.__data_available.clear()
+            self.__remove_finished_segments()
+
+            next_job = None
+            if not self.__retried_jobs:
+                for segment in self.__segments:
+                    next_job = segment.read()
+                    if next_job is not None:
+                        await self.__put_to_write_queue(segment, *next_job)
+                        break
+
+            if next_job is None:
+                await self.__data_available.wait()
+
+    async def __put_to_write_queue(self, segment: SpoolSegment, line_number: int, position: int, record: bytes):
+        """Decodes the job and gives it to the write queue."""
+        try:
+            job = self.__decode_job(record)
+        except (KeyError, TypeError, ValueError) as error:
+            LOGGER.error("Ignoring an invalid job in spool segment {:d}: {:s}".format(segment.number, str(error)))
+            self.__acknowledge(segment, line_number, False)
+            return
+
+        if segment.replayed:
+            # the documents from the earlier runs are counted as pending only when they are read
+            self.__pending_documents += job.size
+        await self.__write(segment, line_number, position, 0, job)
+
+    def __decode_job(self, record: bytes, written_documents: int = 0) -> WriteJob:
+        """Returns a write job for the documents in the encoded job that come after the already written ones."""
+        job_json = self.__json_codec.loads(record)
+        return WriteJob(
+            job_json["SimulationId"],
+            [(document, topic) for document, topic in job_json["Documents"][written_documents:]],
+            job_json["Invalid"])
+
+    async def __write(self, segment: SpoolSegment, line_number: int, position: int, written_documents: int,
+                      job: WriteJob):
+        """Gives the job to the write queue and handles the result once the job has been written."""
+        write_future = await self.__write_queue.put(job)
+        write_future.add_done_callback(
+            self.__get_acknowledge_callback(segment, line_number, position, written_documents, job.size))
+
+    def __get_acknowledge_callback(self, segment: SpoolSegment, line_number: int, position: int,
+                                   written_documents: int, job_size: int) -> Callable[[asyncio.Future], None]:
+        """Returns a callback that acknowledges the job or schedules a retry for the documents that were not written.
+           The callback does not hold the documents, they are read again from the segment file for the retry."""
+        def acknowledge_callback(write_future: asyncio.Future):
+            job_key = (segment.number, line_number)
+            new_documents = (
+                0 if write_future.cancelled() or write_future.exception() is not None
+                else min(max(write_future.result(), 0), job_size)
+            )
+            self.__pending_documents -= new_documents
+            if new_documents < job_size:
+                self.__retried_jobs.add(job_key)
+                # the spool is used only with the ordered inserts, so the written documents are the first ones
+                if not self.__closed:
+                    self.__start_retry(segment, line_number, position, written_documents + new_documents,
+                                       job_size - new_documents)
+                return
+            self.__retried_jobs.discard(job_key)
+            self.__acknowledge(segment, line_number, True)
+            self.__data_available.set()
+        return acknowledge_callback
+
+    def __start_retry(self, segment: SpoolSegment, line_number: int, position: int, written_documents: int,
+                      unwritten_documents: int):
+        """Starts a tracked task that retries the job after the retry interval."""
+        retry_task = asyncio.ensure_future(
+            self.__retry(segment, line_number, position, written_documents, unwritten_documents))
+        self.__retry_tasks.add(retry_task)
+        retry_task.add_done_callback(self.__retry_tasks.discard)
+
+    async def __retry(self, segment: SpoolSegment, line_number: int, position: int, written_documents: int,
+                      unwritten_documents: int):
+        """Reads the job again from the segment file and gives the documents that were not written
+           back to the write queue after the retry interval."""
+        LOGGER.warning("Retrying the job at line {:d} of spool segment {:d} in {:.1f} seconds.".format(
+            line_number, segment.number, self.__retry_interval))
+        await asyncio.sleep(self.__retry_interval)
+        try:
+            job = self.__decode_job(segment.read_at(position), written_documents)
+        except (OSError, KeyError, TypeError, ValueError) as error:
+            LOGGER.error("Could not read the job at line {:d} of spool segment {:d}: {:s}".format(
+                line_number, segment.number, str(error)))
+            self.__pending_documents -= unwritten_documents
+            self.__retried_jobs.discard((segment.number, line_number))
+            self.__acknowledge(segment, line_number, False)
+            self.__data_available.set()
+            return
+        await self.__write(segment, line_number, position, written_documents, job)
+
+    def __acknowledge(self, segment: SpoolSegment, line_number: int, written: bool):
+        """Marks the job as handled in the spool and resolves the done future of the original job,
+           if the job was given to the spool in this run."""
+        segment.acknowledge(line_number)
+        done_future, job_size = self.__waiting_jobs.pop((segment.number, line_number), (None, 0))
+        if done_future is not None and not done_future.done():
+            done_future.set_result(job_size if written else 0)
+
+    def __remove_finished_segments(self):
+        """Removes the rotated segments whose jobs have all been written."""
+        for segment in list(self.__segments):
+            if segment.is_finished:
+                segment.remove()
+                self.__segments.remove(segment)
+
+    @staticmethod
+    def __find_segment_numbers(directory: str) -> List[int]:
+        """Returns the numbers of the existing segment files in the given directory in ascending order."""
+        numbers = []
+        for file_name in os.listdir(directory):
+            if file_name.startswith(SEGMENT_FILE_PREFIX) and file_name.endswith(SEGMENT_FILE_SUFFIX):
+                number = file_name[len(SEGMENT_FILE_PREFIX):-len(SEGMENT_FILE_SUFFIX)]
+                if number.isdigit():
+                    numbers.append(int(number))
+        return sorted(numbers)
@@ -0,0 +1,386 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 Tampere University and VTT Technical Research Centre of Finland
+# This software was developed as a part of the ProCemPlus project: https://www.senecc.fi/projects/procemplus
+# This source code is licensed under the MIT license. See LICENSE in the repository root directory.
+# Author(s): Ville Heikkilä <ville.heikkila@tuni.fi>
+#            Otto Hylli <otto.hylli@tuni.fi>
+
+"""Module containing the storage backends for the message documents and the simulation metadata.
+
+The backends are selected with the STORAGE_BACKENDS environmental variable:
+- mongodb: the documents and the metadata are written to MongoDB using the MongodbClient from simulation-tools
+- file: the documents are appended to gzip compressed JSON lines files in a separate directory for each simulation,
+  the files are rotated when they reach FILE_STORAGE_MAX_BYTES and the metadata is written to metadata.json
+If several backends are given, the documents and the metadata are written to all of them. The first backend
+is the primary one whose results are used, the errors from the other backends are only logged."""
+
+import abc
+import asyncio
+import base64
+import datetime
+import gzip
+import json
+import multiprocessing
+import os
+import re
+from typing import Any, Dict, List, Optional, Tuple, cast
+
+from tools.datetime_tools import to_utc_datetime_object
+from tools.db_clients import MongodbClient
+from tools.tools import FullLogger, load_environmental_variables
+
+from log_writer.json_codec import DEFAULT_CODEC, JsonCodec
+from log_writer.mongodb import get_collection_identifier, get_database, get_simulation_collection
+
+LOGGER = FullLogger(__name__)
+
+STORAGE_BACKEND_MONGODB = "mongodb"
+STORAGE_BACKEND_FILE = "file"
+
+STORAGE_BACKENDS_NAME = "STORAGE_BACKENDS"
+FILE_STORAGE_DIRECTORY_NAME = "FILE_STORAGE_DIRECTORY"
+FILE_STORAGE_MAX_BYTES_NAME = "FILE_STORAGE_MAX_BYTES"
+FILE_STORAGE_COMPRESSION_LEVEL_NAME = "FILE_STORAGE_COMPRESSION_LEVEL"
+
+ENV_VARIABLES = load_environmental_variables(
+    # comma separated list of the used storage backends: mongodb and file
+    (STORAGE_BACKENDS_NAME, str, STORAGE_BACKEND_MONGODB),
+    # the directory for the file storage backend
+    (FILE_STORAGE_DIRECTORY_NAME, str, "messages"),
+    # the size in bytes after which a new message file is started
+    (FILE_STORAGE_MAX_BYTES_NAME, int, 268435456),
+    # the gzip compression level for the message files
+    (FILE_STORAGE_COMPRESSION_LEVEL_NAME, int, 6)
+)
+
+MESSAGE_FILE_PREFIX = "messages"
+MESSAGE_FILE_SUFFIX = ".jsonl.gz"
+METADATA_FILE_NAME = "metadata.json"
+# the characters that are replaced in the simulation ids when they are used as directory names
+UNSAFE_PATH_CHARACTERS = re.compile(r"[^A-Za-z0-9._:-]")
+
+
+class StorageBackend(abc.ABC):
+    """Base class for the storage backends. The interface follows the MongodbClient from simulation-tools."""
+    @property
+    def uses_mongodb(self) -> bool:
+        """Returns True, if the backend writes to MongoDB."""
+        return False
+
+    @abc.abstractmethod
+    async def store_messages(self, documents: List[Tuple[dict, str]], invalid: bool = False,
+                             default_simulation_id: Optional[str] = None) -> List[Any]:
+        """Stores the given (document, topic) tuples and returns the identifiers for the stored documents.
+           For the invalid messages, the default simulation id is used as the simulation id."""
+
+    @abc.abstractmethod
+    async def update_metadata(self, simulation_id: str, **attributes: Any) -> bool:
+        """Updates the metadata for the given simulation. Returns True, if the update was successful."""
+
+    async def update_metadata_indexes(self):
+        """Adds the indexes for the simulation metadata if the backend uses them."""
+
+    async def add_simulation_indexes(self, simulation_id: str):
+        """Adds the indexes for the messages of the given simulation if the backend uses them."""
+
+    async def close(self):
+        """Releases the resources used by the backend."""
+
+
+def to_mongodb_document(document: Dict[str, Any], topic_name: str) -> Dict[str, Any]:
+    """Returns a copy of the document in the form in which MongodbClient stores it,
+       i.e. with the topic in the Topic attribute and the Timestamp as a datetime object."""
+    mongodb_document = {**document, "Topic": topic_name}
+    timestamp = mongodb_document.get("Timestamp", None)
+    if isinstance(timestamp, str):
+        mongodb_document["Timestamp"] = to_utc_datetime_object(timestamp)
+    return mongodb_document
+
+
+class MongodbBackend(StorageBackend):
+    """Storage backend that writes the documents and the metadata to MongoDB.
+
+    If ordered is False, the valid message documents are written directly with unordered bulk inserts, so that
+    MongoDB does not have to insert the documents one after another and a failing document does not prevent
+    the insertion of the rest of the batch. The stored documents are then not necessarily the first documents of
+    the batch, so the unordered writes must not be used with the message spool that retries the documents after
+    the written ones. The invalid messages and the metadata are always written using MongodbClient.
+    """
+    def __init__(self, mongo_client: Optional[MongodbClient] = None, ordered: bool = True, database: Any = None):
+        self.__mongo_client = mongo_client if mongo_client is not None else MongodbClient()
+        self.__ordered = ordered
+        # if not given, the database from the MONGODB_DATABASE environmental variable is used
+        self.__database = database
+
+    @property
+    def uses_mongodb(self) -> bool:
+        return True
+
+    @property
+    def mongo_client(self) -> MongodbClient:
+        """The used MongoDB client."""
+        return self.__mongo_client
+
+    @property
+    def ordered(self) -> bool:
+        """Returns True, if the documents of a batch are inserted in order."""
+        return self.__ordered
+
+    async def store_messages(self, documents: List[Tuple[dict, str]], invalid: bool = False,
+                             default_simulation_id: Optional[str] = None) -> List[Any]:
+        if invalid:
+            return await self.__mongo_client.store_messages(
+                documents, invalid=True, default_simulation_id=default_simulation_id)
+        if not self.__ordered:
+            return await self.__store_unordered(documents)
+        return await self.__mongo_client.store_messages(documents)
+
+    async def update_metadata(self, simulation_id: str, **attributes: Any) -> bool:
+        return await self.__mongo_client.update_metadata(simulation_id, **attributes)
+
+    async def update_metadata_indexes(self):
+        await self.__mongo_client.update_metadata_indexes()
+
+    async def add_simulation_indexes(self, simulation_id: str):
+        await self.__mongo_client.add_simulation_indexes(simulation_id)
+
+    async def __store_unordered(self, documents: List[Tuple[dict, str]]) -> List[Any]:
+        """Stores the documents with an unordered bulk insert for each simulation collection
+           and returns the identifiers for the inserted documents."""
+        import pymongo.errors  # pylint: disable=import-outside-toplevel
+
+        if self.__database is None:
+            self.__database = get_database()
+        collection_identifier = get_collection_identifier()
+        simulation_documents: Dict[str, List[Dict[str, Any]]] = {}
+        for document, topic_name in documents:
+            simulation_id = document.get(collection_identifier, None)
+            if simulation_id is None:
+                continue
+            simulation_documents.setdefault(simulation_id, []).append(to_mongodb_document(document, topic_name))
+
+        inserted_ids = []
+        for simulation_id, collection_documents in simulation_documents.items():
+            collection = get_simulation_collection(simulation_id, self.__database)
+            try:
+                write_result = await collection.insert_many(collection_documents, ordered=False)
+                inserted_ids.extend(write_result.inserted_ids)
+
+            except pymongo.errors.BulkWriteError as error:
+                # the other documents were inserted even though some of the documents could not be inserted
+                write_errors = (error.details or {}).get("writeErrors", [])
+                failed_indexes = {write_error["index"] for write_error in write_errors}
+                LOGGER.warning("{:d} documents could not be inserted to simulation '{:s}': {:s}".format(
+                    len(failed_indexes), simulation_id, str(error)))
+                inserted_ids.extend(
+                    document["_id"]
+                    for document_index, document in enumerate(collection_documents)
+                    if document_index not in failed_indexes
+                )
+        return inserted_ids
+
+
+def to_json_compatible(document: Dict[str, Any]) -> Dict[str, Any]:
+    """Returns the document with the top level datetime and binary values converted to JSON compatible values.
+       The binary values, e.g. the compressed payloads, are stored as {"$binary": <base64 encoded data>}."""
+    if not any(isinstance(value, (bytes, datetime.datetime)) for value in document.values()):
+        return document
+    return {
+        name: (
+            {"$binary": base64.b64encode(value).decode("ascii")} if isinstance(value, bytes)
+            else value.isoformat() if isinstance(value, datetime.datetime)
+            else value
+        )
+        for name, value in document.items()
+    }
+
+
+class FileBackend(StorageBackend):
+    """Storage backend that appends the documents to gzip compressed JSON lines files.
+
+    Each simulation has its own directory containing the message files and the metadata file. Each line in
+    the message files is one document with the topic in the Topic attribute. Each write is appended to
+    the current message file as a separate gzip member, so the files are readable with any gzip reader even if
+    the log writer was stopped in the middle of a write. The file writes are done in the default executor.
+    In a worker process the process name is added to the file names, so that the workers do not write
+    to the same files.
+    """
+    def __init__(self, directory: Optional[str] = None, max_bytes: Optional[int] = None,
+                 compression_level: Optional[int] = None, json_codec: JsonCodec = DEFAULT_CODEC):
+        self.__directory = cast(str, directory if directory is not None
+                                else ENV_VARIABLES[FILE_STORAGE_DIRECTORY_NAME])
+        self.__max_bytes = max(cast(int, max_bytes if max_bytes is not None
+                                    else ENV_VARIABLES[FILE_STORAGE_MAX_BYTES_NAME]), 1)
+        self.__compression_level = min(max(cast(int, compression_level if compression_level is not None
+                                                else ENV_VARIABLES[FILE_STORAGE_COMPRESSION_LEVEL_NAME]), 0), 9)
+        self.__json_codec = json_codec
+
+        process_name = multiprocessing.current_process().name
+        self.__file_prefix = (
+            MESSAGE_FILE_PREFIX if process_name == "MainProcess"
+            else "{:s}-{:s}".format(MESSAGE_FILE_PREFIX, UNSAFE_PATH_CHARACTERS.sub("_", process_name))
+        )
+        # the current file number for each simulation
+        self.__file_numbers: Dict[str, int] = {}
+        self.__metadata: Dict[str, Dict[str, Any]] = {}
+        # the writes for the same simulation are done one at a time
+        self.__locks: Dict[str, asyncio.Lock] = {}
+
+    @property
+    def directory(self) -> str:
+        """The directory under which the simulation directories are created."""
+        return self.__directory
+
+    async def store_messages(self, documents: List[Tuple[dict, str]], invalid: bool = False,
+                             default_simulation_id: Optional[str] = None) -> List[Any]:
+        simulation_documents: Dict[str, List[bytes]] = {}
+        for document, topic_name in documents:
+            simulation_id = default_simulation_id if invalid else document.get("SimulationId", None)
+            if simulation_id is None:
+                continue
+            simulation_documents.setdefault(simulation_id, []).append(
+                self.__json_codec.dumps({**to_json_compatible(document), "Topic": topic_name}))
+
+        loop = asyncio.get_running_loop()
+        stored_documents = 0
+        for simulation_id, lines in simulation_documents.items():
+            async with self.__get_lock(simulation_id):
+                await loop.run_in_executor(None, self.__write_lines, simulation_id, b"\n".join(lines) + b"\n")
+            stored_documents += len(lines)
+        return list(range(stored_documents))
+
+    async def update_metadata(self, simulation_id: str, **attributes: Any) -> bool:
+        metadata = self.__metadata.setdefault(simulation_id, {})
+        metadata.update(to_json_compatible(attributes))
+        try:
+            async with self.__get_lock(simulation_id):
+                await asyncio.get_running_loop().run_in_executor(
+                    None, self.__write_metadata, simulation_id, dict(metadata))
+            return True
+        except OSError as error:
+            LOGGER.warning("Could not write the metadata file for simulation '{:s}': {:s}".format(
+                simulation_id, str(error)))
+            return False
+
+    def __get_lock(self, simulation_id: str) -> asyncio.Lock:
+        """Returns the lock for the file writes for the given simulation."""
+        lock = self.__locks.get(simulation_id, None)
+        if lock is None:
+            lock = asyncio.Lock()
+            self.__locks[simulation_id] = lock
+        return lock
+
+    def __get_simulation_directory(self, simulation_id: str) -> str:
+        """Returns the directory for the given simulation and creates it if it does not exist."""
+        simulation_directory = os.path.join(self.__directory, UNSAFE_PATH_CHARACTERS.sub("_", simulation_id))
+        os.makedirs(simulation_directory, exist_ok=True)
+        return simulation_directory
+
+    def __get_file_name(self, simulation_directory: str, file_number: int) -> str:
+        """Returns the name of the message file with the given number."""
+        return os.path.join(simulation_directory, "{:s}-{:06d}{:s}".format(
+            self.__file_prefix, file_number, MESSAGE_FILE_SUFFIX))
+
+    def __write_lines(self, simulation_id: str, data: bytes):
+        """Appends the data to the current message file for the simulation and starts a new file if needed."""
+        simulation_directory = self.__get_simulation_directory(simulation_id)
+        file_number = self.__file_numbers.get(simulation_id, None)
+        if file_number is None:
+            # continue from the latest existing file, e.g. after a restart
+            file_pattern = re.compile(
+                re.escape(self.__file_prefix) + r"-(\d+)" + re.escape(MESSAGE_FILE_SUFFIX) + "$")
+            file_number = max(
+                [
+                    int(match.group(1))
+                    for match in (file_pattern.match(file_name) for file_name in os.listdir(simulation_directory))
+                    if match is not None
+                ],
+                default=1)
+
+        file_name = self.__get_file_name(simulation_directory, file_number)
+        with gzip.open(file_name, "ab", compresslevel=self.__compression_level) as message_file:
+            message_file.write(data)
+        if os.path.getsize(file_name) >= self.__max_bytes:
+            file_number += 1
+        self.__file_numbers[simulation_id] = file_number
+
+    def __write_metadata(self, simulation_id: str, metadata: Dict[str, Any]):
+        """Writes the metadata file for the simulation, replacing the earlier file."""
+        file_name = os.path.join(self.__get_simulation_directory(simulation_id), METADATA_FILE_NAME)
+        temporary_file_name = file_name + ".tmp"
+        with open(temporary_file_name, "w", encoding="UTF-8") as metadata_file:
+            json.dump({"SimulationId": simulation_id, **metadata}, metadata_file, indent=4)
+        os.replace(temporary_file_name, file_name)
+
+
+class TeeBackend(StorageBackend):
+    """Storage backend that writes to several backends at the same time.
+
+    The first backend is the primary backend whose results are returned and whose errors are raised.
+    The errors from the other backends are logged.
+    """
+    def __init__(self, backends: List[StorageBackend]):
+        if not backends:
+            raise ValueError("At least one storage backend is required")
+        self.__backends = backends
+
+    @property
+    def backends(self) -> List[StorageBackend]:
+        """The backends, the primary backend first."""
+        return self.__backends
+
+    @property
+    def uses_mongodb(self) -> bool:
+        return any(backend.uses_mongodb for backend in self.__backends)
+
+    async def store_messages(self, documents: List[Tuple[dict, str]], invalid: bool = False,
+                             default_simulation_id: Optional[str] = None) -> List[Any]:
+        return await self.__call_all(
+            "store_messages", documents, invalid=invalid, default_simulation_id=default_simulation_id)
+
+    async def update_metadata(self, simulation_id: str, **attributes: Any) -> bool:
+        return await self.__call_all("update_metadata", simulation_id, **attributes)
+
+    async def update_metadata_indexes(self):
+        await self.__call_all("update_metadata_indexes")
+
+    async def add_simulation_indexes(self, simulation_id: str):
+        await self.__call_all("add_simulation_indexes", simulation_id)
+
+    async def close(self):
+        await self.__call_all("close")
+
+    async def __call_all(self, method_name: str, *args: Any, **kwargs: Any) -> Any:
+        """Calls the given method for all the backends and returns the result from the primary backend."""
+        results = await asyncio.gather(
+            *(getattr(backend, method_name)(*args, **kwargs) for backend in self.__backends),
+            return_exceptions=True)
+        for backend, result in zip(self.__backends[1:], results[1:]):
+            if isinstance(result, Exception):
+                LOGGER.warning("Error in {:s} for storage backend {:s}: {:s}".format(
+                    method_name, type(backend).__name__, str(result)))
+        if isinstance(results[0], BaseException):
+            raise results[0]
+        return results[0]
+
+
+def create_storage_backend(mongo_client: Optional[MongodbClient] = None,
+                           backend_names: Optional[str] = None, ordered: bool = True) -> StorageBackend:
+    """Returns the storage backend given by STORAGE_BACKENDS. If mongo_client is given,
+       it is used for the MongoDB backend. If ordered is False, the MongoDB backend uses unordered inserts."""
+    backend_names = cast(str, backend_names if backend_names is not None else ENV_VARIABLES[STORAGE_BACKENDS_NAME])
+    backends = []
+    for backend_name in (name.strip().lower() for name in backend_names.split(",")):
+        if backend_name == STORAGE_BACKEND_MONGODB:
+            backends.append(MongodbBackend(mongo_client, ordered=ordered))
+        elif backend_name == STORAGE_BACKEND_FILE:
+            backends.append(FileBackend())
+        elif backend_name:
+            LOGGER.warning("Unknown storage backend '{:s}'".format(backend_name))
+
+    if not backends:
+        LOGGER.warning("No valid storage backends given, using '{:s}'".format(STORAGE_BACKEND_MONGODB))
+        backends.append(MongodbBackend(mongo_client, ordered=ordered))
+    if len(backends) == 1:
+        return backends[0]
+    return TeeBackend(backends)
@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 Tampere University and VTT Technical Research Centre of Finland
+# This software was developed as a part of the ProCemPlus project: https://www.senecc.fi/projects/procemplus
+# This source code is licensed under the MIT license. See LICENSE in the repository root directory.
+# Author(s): Ville Heikkilä <ville.heikkila@tuni.fi>
+#            Otto Hylli <otto.hylli@tuni.fi>
+
+"""Module containing the supervisor that runs the log writer as several worker processes.
+
+Each worker process runs its own listener component for a shard of the messages. The simulation metadata from
+the workers is sent to the supervisor which combines it and is the only process that writes the metadata to
+the database."""
+
+import asyncio
+import functools
+import multiprocessing
+import multiprocessing.connection
+import queue
+import time
+from typing import Any, Dict, List, cast
+
+from tools.tools import EnvironmentVariable, FullLogger
+
+from log_writer.listener import (
+    STATISTICS_DISPLAY_INTERVAL, ListenerComponent, add_stop_signal_handlers, get_live_tail_server, log_statistics)
+from log_writer.metadata_updater import MetadataUpdater
+from log_writer.metrics import METADATA_LATENCY, MetricsExporter, get_worker_exporter
+from log_writer.profiling import add_profiling_signal_handlers
+from log_writer.shard import SHARD_BY_SIMULATION_ID, ShardFilter
+from log_writer.simulation import (
+    ENV_VARIABLES as SIMULATION_ENV_VARIABLES, EVICTION_CHECK_INTERVAL, SIMULATION_IDLE_TIMEOUT_NAME,
+    SIMULATION_RETENTION_TIME_NAME, SimulationMetadata)
+from log_writer.storage import StorageBackend, create_storage_backend
+
+LOGGER = FullLogger(__name__)
+
+# the number of worker processes, with a value of 1 the log writer is run as a single process
+WORKER_PROCESSES = cast(int, EnvironmentVariable("WORKER_PROCESSES", int, 1).value)
+# the message property used to select the worker: simulation_id or routing_key
+SHARD_BY = cast(str, EnvironmentVariable("SHARD_BY", str, SHARD_BY_SIMULATION_ID).value)
+
+# the maximum time in seconds that the supervisor waits for a message from the workers at a time
+QUEUE_POLL_INTERVAL = 1.0
+# the interval in seconds at which the workers check whether they should stop
+STOP_CHECK_INTERVAL = 0.5
+# the time in seconds without metadata from the workers after which the supervisor forgets a simulation,
+# the workers have removed the simulation from their memory by then
+INACTIVE_SIMULATION_TIME = 2 * max(
+    cast(float, SIMULATION_ENV_VARIABLES[SIMULATION_IDLE_TIMEOUT_NAME]),
+    cast(float, SIMULATION_ENV_VARIABLES[SIMULATION_RETENTION_TIME_NAME]))
+
+METADATA_MESSAGE = "metadata"
+SIMULATION_ENDED_MESSAGE = "simulation_ended"
+WORKER_STOPPED_MESSAGE = "worker_stopped"
+WORKER_EXITED_MESSAGE = "worker_exited"
+
+
+def get_metadata_snapshot(simulation_metadata: SimulationMetadata) -> Dict[str, Any]:
+    """Returns the metadata values for a simulation as seen by a single worker."""
+    return {
+        "StartTime": simulation_metadata.start_time,
+        "EndTime": simulation_metadata.end_time,
+        "EndFlag": simulation_metadata.end_flag,
+        "Name": simulation_metadata.name,
+        "Description": simulation_metadata.description,
+        "Epochs": simulation_metadata.epoch_max,
+        "Processes": sorted(simulation_metadata.components)
+    }
+
+
+class MetadataCoordinator:
+    """Class for combining the simulation metadata received from the workers and writing it to the database.
+
+    The latest metadata snapshot from each worker is kept for each simulation and the combined metadata
+    is written using a metadata updater, so that the updates from all the workers are coalesced.
+    """
+    def __init__(self, storage: StorageBackend):
+        self.__storage = storage
+        self.__snapshots = {}
+        self.__metadata_updaters = {}
+        self.__latest_snapshot_times = {}
+
+    @property
+    def simulations(self):
+        """The simulation ids for which metadata has been received."""
+        return list(self.__snapshots.keys())
+
+    def add_snapshot(self, worker_index: int, simulation_id: str, snapshot: Dict[str, Any]):
+        """Registers the metadata snapshot for a simulation from a worker and requests a metadata update.
+           The update is done immediately if the worker has received the end of the simulation."""
+        self.__snapshots.setdefault(simulation_id, {})[worker_index] = snapshot
+        self.__latest_snapshot_times[simulation_id] = time.monotonic()
+
+        metadata_updater = self.__metadata_updaters.get(simulation_id, None)
+        if metadata_updater is None:
+            metadata_updater = MetadataUpdater(functools.partial(self.__update_metadata, simulation_id))
+            self.__metadata_updaters[simulation_id] = metadata_updater
+
+        if snapshot["EndFlag"]:
+            asyncio.create_task(metadata_updater.flush())
+        else:
+            metadata_updater.request_update()
+
+    def get_metadata_attributes(self, simulation_id: str) -> Dict[str, Any]:
+        """Returns the metadata attributes for a simulation combined from the snapshots from all the workers."""
+        snapshots = list(self.__snapshots.get(simulation_id, {}).values())
+
+        def combine(attribute_name: str, function):
+            values = [snapshot[attribute_name] for snapshot in snapshots if snapshot[attribute_name] is not None]
+            return function(values) if values else None
+
+        metadata_attributes = {
+            "StartTime": combine("StartTime", min),
+            "Name": combine("Name", lambda values: values[0]),
+            "Description": combine("Description", lambda values: values[0]),
+            "Epochs": combine("Epochs", max),
+            "Processes": sorted(set().union(*(snapshot["Processes"] for snapshot in snapshots)))
+        }
+        if any(snapshot["EndFlag"] for snapshot in snapshots):
+            metadata_attributes["EndTime"] = combine("EndTime", max)
+        return metadata_attributes
+
+    def remove_inactive_simulations(self, inactive_time: float) -> int:
+        """Forgets the simulations for which no metadata has been received within the given time and that
+           have no pending metadata updates. Returns the number of removed simulations."""
+        current_time = time.monotonic()
+        inactive_simulations = [
+            simulation_id
+            for simulation_id, latest_snapshot_time in self.__latest_snapshot_times.items()
+            if current_time - latest_snapshot_time >= inactive_time and
+            not self.__metadata_updaters[simulation_id].update_pending
+        ]
+        for simulation_id in inactive_simulations:
+            del self.__snapshots[simulation_id]
+            del self.__metadata_updaters[simulation_id]
+            del self.__latest_snapshot_times[simulation_id]
+        return len(inactive_simulations)
+
+    async def close(self):
+        """Writes all the pending metadata updates to the database."""
+        await asyncio.gather(*(
+            metadata_updater.flush()
+            for metadata_updater in self.__metadata_updaters.values()
+            if metadata_updater.update_pending
+        ))
+
+    async def __update_metadata(self, simulation_id: str):
+        """Writes the combined metadata for the given simulation to the database."""
+        start_time = time.perf_counter()
+        db_result = await self.__storage.update_metadata(
+            simulation_id, **self.get_metadata_attributes(simulation_id))
+        METADATA_LATENCY.observe(time.perf_counter() - start_time)
+        if db_result:
+            LOGGER.info("Database metadata update successful for '{:s}'".format(simulation_id))
+        else:
+            LOGGER.warning("Database metadata update failed for '{:s}'".format(simulation_id))
+
+
+async def start_worker(worker_index: int, worker_count: int, shard_by: str,
+                       worker_queue: multiprocessing.Queue, stop_event):
+    """Runs the listener component for a single shard until the supervisor asks the worker to stop."""
+    async def send_metadata(simulation_metadata: SimulationMetadata) -> bool:
+        worker_queue.put((
+            METADATA_MESSAGE, worker_index, simulation_metadata.simulation_id,
+            get_metadata_snapshot(simulation_metadata)
+        ))
+        return True
+
+    async def send_simulation_ended():
+        worker_queue.put((SIMULATION_ENDED_MESSAGE, worker_index))
+
+    message_listener = ListenerComponent(
+        shard=ShardFilter(worker_index, worker_count, shard_by),
+        stop_function=send_simulation_ended,
+        metadata_function=send_metadata)
+    metrics_exporter = get_worker_exporter(worker_index)
+    await metrics_exporter.start()
+    live_tail_server = get_live_tail_server(message_listener, worker_index)
+    if live_tail_server is not None:
+        await live_tail_server.start()
+    # a signal to any of the processes stops all the workers in a controlled manner
+    add_stop_signal_handlers(stop_event.set)
+    # the profiling signals are handled separately by each worker
+    add_profiling_signal_handlers()
+    LOGGER.info("Worker {:d} started for shard {:d}/{:d} by {:s}".format(
+        worker_index, worker_index + 1, worker_count, shard_by))
+
+    last_statistics_time = time.monotonic()
+    while not stop_event.is_set():
+        await asyncio.sleep(STOP_CHECK_INTERVAL)
+        if time.monotonic() - last_statistics_time >= STATISTICS_DISPLAY_INTERVAL:
+            log_statistics(message_listener)
+            last_statistics_time = time.monotonic()
+
+    await message_listener.stop()
+    log_statistics(message_listener)
+    if live_tail_server is not None:
+        await live_tail_server.close()
+    await metrics_exporter.close()
+    worker_queue.put((WORKER_STOPPED_MESSAGE, worker_index))
+
+
+async def monitor_workers(workers: List[Any], worker_queue: multiprocessing.Queue):
+    """Waits for the worker processes to exit and sends a message about each exited worker to the worker queue.
+       The processes are monitored with their sentinels, so that an exit is noticed even when the queue is busy.
+       The stopped message from a worker is in the queue before the exited message, since it was sent before
+       the process exited."""
+    loop = asyncio.get_running_loop()
+    sentinels = {worker.sentinel: worker_index for worker_index, worker in enumerate(workers)}
+    while sentinels:
+        exited_sentinels = await loop.run_in_executor(
+            None, multiprocessing.connection.wait, list(sentinels), QUEUE_POLL_INTERVAL)
+        for sentinel in exited_sentinels:
+            worker_index = sentinels.pop(sentinel)
+            # the exit code is available only after the process has been joined
+            await loop.run_in_executor(None, workers[worker_index].join)
+            worker_queue.put((WORKER_EXITED_MESSAGE, worker_index, workers[worker_index].exitcode))
+
+
+def run_worker(worker_index: int, worker_count: int, shard_by: str,
+               worker_queue: multiprocessing.Queue, stop_event):
+    """The entry point for the worker processes."""
+    asyncio.run(start_worker(worker_index, worker_count, shard_by, worker_queue, stop_event))
+
+
+async def start_supervisor(worker_count: int, shard_by: str = SHARD_BY):
+    """Starts the worker processes and writes the combined simulation metadata until all the workers have stopped.
+       The workers are stopped when every running worker has received the end of the simulation or if any of them
+       exits unexpectedly."""
+    context = multiprocessing.get_context("spawn")
+    worker_queue = context.Queue()
+    stop_event = context.Event()
+    workers = [
+        context.Process(
+            target=run_worker, args=(worker_index, worker_count, shard_by, worker_queue, stop_event),
+            name="log_writer_worker_{:d}".format(worker_index))
+        for worker_index in range(worker_count)
+    ]
+    for worker in workers:
+        worker.start()
+    LOGGER.info("Started {:d} worker processes with shards selected by {:s}".format(worker_count, shard_by))
+
+    storage = create_storage_backend()
+    await storage.update_metadata_indexes()
+    coordinator = MetadataCoordinator(storage)
+    # the supervisor publishes only the metadata update metrics, the workers publish their own metrics
+    metrics_exporter = MetricsExporter()
+    await metrics_exporter.start()
+    add_stop_signal_handlers(stop_event.set)
+
+    loop = asyncio.get_running_loop()
+    monitor_task = asyncio.create_task(monitor_workers(workers, worker_queue))
+    last_eviction_time = time.monotonic()
+    running_workers = set(range(worker_count))
+    ended_workers = set()
+    while running_workers:
+        if time.monotonic() - last_eviction_time >= EVICTION_CHECK_INTERVAL:
+            coordinator.remove_inactive_simulations(INACTIVE_SIMULATION_TIME)
+            last_eviction_time = time.monotonic()
+
+        try:
+            worker_message = await loop.run_in_executor(None, worker_queue.get, True, QUEUE_POLL_INTERVAL)
+        except queue.Empty:
+            continue
+
+        message_type, worker_index = worker_message[0], worker_message[1]
+        if message_type == METADATA_MESSAGE:
+            coordinator.add_snapshot(worker_index, worker_message[2], worker_message[3])
+        elif message_type == SIMULATION_ENDED_MESSAGE and not stop_event.is_set():
+            # each worker has received the end after the messages that were sent before it
+            ended_workers.add(worker_index)
+            LOGGER.info("Worker {:d} received the end of the simulation ({:d}/{:d} workers).".format(
+                worker_index, len(ended_workers & running_workers), len(running_workers)))
+            if running_workers <= ended_workers:
+                LOGGER.info("All workers received the end of the simulation, stopping all workers.")
+                stop_event.set()
+        elif message_type == WORKER_STOPPED_MESSAGE:
+            running_workers.discard(worker_index)
+        elif message_type == WORKER_EXITED_MESSAGE and worker_index in running_workers:
+            LOGGER.error("Worker {:d} exited unexpectedly with exit code {:s}, stopping all workers.".format(
+                worker_index, str(worker_message[2])))
+            running_workers.discard(worker_index)
+            stop_event.set()
+
+    for worker in workers:
+        await loop.run_in_executor(None, worker.join)
+    await monitor_task
+    await coordinator.close()
+    await storage.close()
+    await metrics_exporter.close()
+    LOGGER.info("All worker processes have stopped.")
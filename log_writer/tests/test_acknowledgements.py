@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 Tampere University and VTT Technical Research Centre of Finland
+# This software was developed as a part of the ProCemPlus project: https://www.senecc.fi/projects/procemplus
+# This source code is licensed under the MIT license. See LICENSE in the repository root directory.
+# Author(s): Ville Heikkilä <ville.heikkila@tuni.fi>
+#            Otto Hylli <otto.hylli@tuni.fi>
+
+"""Unit tests for the acknowledgement tracking of the message bus deliveries."""
+
+import asyncio
+import unittest
+from typing import List, NamedTuple, Tuple
+
+from log_writer.acknowledgements import AckTracker
+
+
+class DeliveredMessage(NamedTuple):
+    """Stand-in for a delivered message from the message bus client."""
+    delivery_tag: int
+    redelivered: bool = False
+
+
+class RecordingTracker:
+    """Helper for creating an acknowledgement tracker that records the acknowledgements and the rejections."""
+    def __init__(self):
+        self.acknowledged: List[int] = []
+        self.rejected: List[Tuple[int, bool]] = []
+        self.tracker = AckTracker(
+            self.__acknowledge, self.__reject,
+            redelivered_function=lambda message: message.redelivered,
+            delivery_tag_function=lambda message: message.delivery_tag)
+
+    async def __acknowledge(self, message: DeliveredMessage):
+        self.acknowledged.append(message.delivery_tag)
+
+    async def __reject(self, message: DeliveredMessage, requeue: bool):
+        self.rejected.append((message.delivery_tag, requeue))
+
+
+class TestAckTracker(unittest.TestCase):
+    """Unit tests for the AckTracker class."""
+
+    def test_acknowledgement_order(self):
+        """Unit test for acknowledging the deliveries cumulatively in the delivery order."""
+        async def run_test():
+            recorder = RecordingTracker()
+            tracker = recorder.tracker
+            deliveries = [tracker.receive(DeliveredMessage(delivery_tag)) for delivery_tag in range(1, 5)]
+
+            # the later deliveries are not acknowledged before the earlier ones have been stored
+            tracker.complete([deliveries[1], deliveries[2]], True)
+            await tracker.close()
+            self.assertEqual(recorder.acknowledged, [])
+            self.assertEqual(tracker.pending_deliveries, 4)
+
+            tracker.complete([deliveries[0]], True)
+            await tracker.close()
+            self.assertEqual(recorder.acknowledged, [3])
+            self.assertEqual(tracker.pending_deliveries, 1)
+
+            tracker.complete([deliveries[3]], True)
+            await tracker.close()
+            self.assertEqual(recorder.acknowledged, [3, 4])
+            self.assertEqual(tracker.acknowledged_deliveries, 4)
+            self.assertEqual(tracker.pending_deliveries, 0)
+
+        asyncio.run(run_test())
+
+    def test_rejection_and_requeue(self):
+        """Unit test for rejecting the deliveries that were not stored and requeuing them only once."""
+        async def run_test():
+            recorder = RecordingTracker()
+            tracker = recorder.tracker
+            first = tracker.receive(DeliveredMessage(1))
+            redelivered = tracker.receive(DeliveredMessage(2, redelivered=True))
+            stored = tracker.receive(DeliveredMessage(3))
+
+            tracker.complete([first, redelivered], False)
+            tracker.complete([stored], True)
+            # completing an already completed delivery has no effect
+            tracker.complete([first], True)
+            await tracker.close()
+
+            self.assertEqual(recorder.rejected, [(1, True), (2, False)])
+            # the rejected deliveries do not block the acknowledgement of the later deliveries
+            self.assertEqual(recorder.acknowledged, [3])
+            self.assertEqual(tracker.rejected_deliveries, 2)
+            self.assertEqual(tracker.acknowledged_deliveries, 1)
+            self.assertFalse(first.stored)
+            self.assertTrue(stored.stored)
+
+        asyncio.run(run_test())
+
+    def test_reset_on_new_channel(self):
+        """Unit test for forgetting the pending deliveries when the delivery tags start again from the beginning."""
+        async def run_test():
+            recorder = RecordingTracker()
+            tracker = recorder.tracker
+            old_deliveries = [tracker.receive(DeliveredMessage(delivery_tag)) for delivery_tag in range(1, 4)]
+            tracker.complete([old_deliveries[1]], True)
+
+            new_delivery = tracker.receive(DeliveredMessage(1))
+            self.assertEqual(tracker.pending_deliveries, 1)
+            self.assertTrue(all(delivery.completed for delivery in old_deliveries))
+
+            # the old deliveries are neither acknowledged nor rejected, since the message bus redelivers them
+            tracker.complete(old_deliveries, True)
+            tracker.complete([new_delivery], True)
+            await tracker.close()
+            self.assertEqual(recorder.acknowledged, [1])
+            self.assertEqual(recorder.rejected, [])
+            self.assertEqual(tracker.pending_deliveries, 0)
+
+        asyncio.run(run_test())
+
+
+if __name__ == '__main__':
+    unittest.main()
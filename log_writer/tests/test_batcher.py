@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 Tampere University and VTT Technical Research Centre of Finland
+# This software was developed as a part of the ProCemPlus project: https://www.senecc.fi/projects/procemplus
+# This source code is licensed under the MIT license. See LICENSE in the repository root directory.
+# Author(s): Ville Heikkilä <ville.heikkila@tuni.fi>
+#            Otto Hylli <otto.hylli@tuni.fi>
+
+"""Unit tests for the message batcher."""
+
+import asyncio
+import unittest
+from typing import Any, List, Optional, Tuple
+
+from log_writer.batcher import MessageBatcher
+from log_writer.compression import PayloadCompressor
+from log_writer.flush_controller import AdaptiveFlushController
+from log_writer.raw_message import RawMessage
+from log_writer.storage import StorageBackend
+from log_writer.write_queue import WriteQueue
+
+
+class BlockingStorage(StorageBackend):
+    """Storage backend that waits for the release event before each write."""
+    def __init__(self):
+        self.release = asyncio.Event()
+        self.stored_documents: List[Tuple[str, int]] = []
+
+    async def store_messages(self, documents: List[Tuple[dict, str]], invalid: bool = False,
+                             default_simulation_id: Optional[str] = None) -> List[Any]:
+        await self.release.wait()
+        self.stored_documents.extend((document["SimulationId"], document["Index"]) for document, _ in documents)
+        return list(range(len(documents)))
+
+    async def update_metadata(self, simulation_id: str, **attributes: Any) -> bool:
+        return True
+
+
+def create_message(simulation_id: str, index: int) -> RawMessage:
+    """Returns a result message with the given index."""
+    raw_message = RawMessage.from_json({
+        "Type": "Result", "SimulationId": simulation_id, "MessageId": "message-{:d}".format(index),
+        "Timestamp": "2021-01-01T00:00:00.000Z", "Index": index
+    })
+    assert raw_message is not None
+    return raw_message
+
+
+class TestMessageBatcher(unittest.TestCase):
+    """Unit tests for the MessageBatcher class."""
+
+    def test_cancelled_flush(self):
+        """Unit test for returning the batches that were not accepted by the write queue when the flush is cancelled.
+           The returned messages are written before the messages that were added after the flush."""
+        async def run_test():
+            storage = BlockingStorage()
+            # the first batch fills the write queue, so the flush waits for the queue with the second batch
+            write_queue = WriteQueue(storage, high_water_mark=2, low_water_mark=1, writers=1,
+                                     compressor=PayloadCompressor(compression="none"))
+            batcher = MessageBatcher(write_queue, AdaptiveFlushController(max_documents=100, adaptive=False))
+            await batcher.add_message("simulation-1", create_message("simulation-1", 0), "Result")
+            await batcher.add_message("simulation-1", create_message("simulation-1", 1), "Result")
+            await batcher.add_message("simulation-2", create_message("simulation-2", 2), "Result")
+
+            flush_task = asyncio.ensure_future(batcher.flush())
+            await asyncio.sleep(0.01)
+            self.assertFalse(flush_task.done())
+            flush_task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await flush_task
+
+            # only the batch that was not accepted by the write queue is pending again
+            self.assertEqual(batcher.pending_documents, 1)
+            await batcher.add_message("simulation-2", create_message("simulation-2", 3), "Result")
+            self.assertEqual(batcher.pending_documents, 2)
+
+            storage.release.set()
+            write_futures = await batcher.flush()
+            self.assertEqual(await asyncio.wait_for(asyncio.gather(*write_futures), timeout=5.0), [2])
+            await write_queue.join()
+            self.assertEqual(storage.stored_documents, [
+                ("simulation-1", 0), ("simulation-1", 1), ("simulation-2", 2), ("simulation-2", 3)])
+            self.assertEqual(batcher.pending_documents, 0)
+            await write_queue.close()
+
+        asyncio.run(run_test())
+
+
+if __name__ == '__main__':
+    unittest.main()
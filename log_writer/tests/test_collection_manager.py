@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 Tampere University and VTT Technical Research Centre of Finland
+# This software was developed as a part of the ProCemPlus project: https://www.senecc.fi/projects/procemplus
+# This source code is licensed under the MIT license. See LICENSE in the repository root directory.
+# Author(s): Ville Heikkilä <ville.heikkila@tuni.fi>
+#            Otto Hylli <otto.hylli@tuni.fi>
+
+"""Unit tests for preparing the simulation specific message collections."""
+
+import asyncio
+import unittest
+from typing import Any, Dict, List, Optional, Tuple
+
+from log_writer.collection_manager import (
+    COLLECTION_MODE_DOCUMENT, COLLECTION_MODE_TIMESERIES, TIMESERIES_COLLECTION_TYPE, CollectionManager)
+from log_writer.mongodb import get_simulation_collection
+from log_writer.storage import StorageBackend
+
+
+class IndexStorage(StorageBackend):
+    """Storage backend that records the simulations whose indexes have been added."""
+    def __init__(self, uses_mongodb: bool = True):
+        self.__uses_mongodb = uses_mongodb
+        self.indexed_simulations: List[str] = []
+
+    @property
+    def uses_mongodb(self) -> bool:
+        return self.__uses_mongodb
+
+    async def store_messages(self, documents: List[Tuple[dict, str]], invalid: bool = False,
+                             default_simulation_id: Optional[str] = None) -> List[Any]:
+        return list(range(len(documents)))
+
+    async def update_metadata(self, simulation_id: str, **attributes: Any) -> bool:
+        return True
+
+    async def add_simulation_indexes(self, simulation_id: str):
+        self.indexed_simulations.append(simulation_id)
+
+
+class CollectionCursor:
+    """Stand-in for the cursor for the collection information."""
+    def __init__(self, collection_infos: List[Dict[str, Any]]):
+        self.__collection_infos = collection_infos
+
+    async def to_list(self, length: Optional[int]) -> List[Dict[str, Any]]:
+        del length
+        return self.__collection_infos
+
+
+class Collection:
+    """Stand-in for a database collection."""
+    def __init__(self, database: "Database", name: str):
+        self.database = database
+        self.name = name
+
+
+class Database:
+    """Stand-in for the database that keeps the collection types in memory. If the time series collections
+       are not supported, creating them fails."""
+    def __init__(self, timeseries_supported: bool = True):
+        self.__timeseries_supported = timeseries_supported
+        self.collection_types: Dict[str, str] = {}
+
+    def __getitem__(self, collection_name: str) -> Collection:
+        return Collection(self, collection_name)
+
+    async def list_collections(self, filter: Dict[str, Any]) -> CollectionCursor:  # pylint: disable=redefined-builtin
+        collection_name = filter["name"]
+        return CollectionCursor(
+            [{"name": collection_name, "type": self.collection_types[collection_name]}]
+            if collection_name in self.collection_types else [])
+
+    async def create_collection(self, collection_name: str, **options: Any):
+        if not self.__timeseries_supported:
+            raise ValueError("time series collections are not supported")
+        self.collection_types[collection_name] = TIMESERIES_COLLECTION_TYPE if "timeseries" in options else "collection"
+
+
+class TestCollectionManager(unittest.TestCase):
+    """Unit tests for the CollectionManager class."""
+
+    def prepare_simulation(self, collection_manager: CollectionManager, storage: IndexStorage) -> List[str]:
+        """Prepares the collection for a simulation and adds its indexes. Returns the indexed simulations."""
+        async def run_test():
+            await collection_manager.prepare_simulation("simulation")
+            await collection_manager.add_simulation_indexes("simulation")
+            await collection_manager.close()
+
+        asyncio.run(run_test())
+        return storage.indexed_simulations
+
+    def test_timeseries_collection(self):
+        """Unit test for not adding separate indexes to the created time series collections."""
+        storage = IndexStorage()
+        database = Database()
+        collection_manager = CollectionManager(storage, COLLECTION_MODE_TIMESERIES, database=database)
+        self.assertEqual(self.prepare_simulation(collection_manager, storage), [])
+        self.assertEqual(list(database.collection_types.values()), [TIMESERIES_COLLECTION_TYPE])
+
+    def test_unsupported_timeseries(self):
+        """Unit test for adding the indexes when the time series collection cannot be created."""
+        storage = IndexStorage()
+        collection_manager = CollectionManager(
+            storage, COLLECTION_MODE_TIMESERIES, database=Database(timeseries_supported=False))
+        self.assertEqual(self.prepare_simulation(collection_manager, storage), ["simulation"])
+
+    def test_existing_collection(self):
+        """Unit test for adding the indexes when an ordinary collection already exists for the simulation."""
+        storage = IndexStorage()
+        database = Database()
+        database.collection_types[get_simulation_collection("simulation", database).name] = "collection"
+        collection_manager = CollectionManager(storage, COLLECTION_MODE_TIMESERIES, database=database)
+        self.assertEqual(self.prepare_simulation(collection_manager, storage), ["simulation"])
+
+    def test_document_mode_without_mongodb(self):
+        """Unit test for using the document mode when the storage backend does not use MongoDB."""
+        storage = IndexStorage(uses_mongodb=False)
+        collection_manager = CollectionManager(storage, COLLECTION_MODE_TIMESERIES, database=Database())
+        self.assertEqual(collection_manager.collection_mode, COLLECTION_MODE_DOCUMENT)
+        self.assertEqual(self.prepare_simulation(collection_manager, storage), ["simulation"])
+
+    def test_early_indexes(self):
+        """Unit test for adding the indexes once in the background soon after the simulation has started."""
+        async def run_test():
+            storage = IndexStorage()
+            collection_manager = CollectionManager(
+                storage, COLLECTION_MODE_DOCUMENT, early_indexes=True, early_index_delay=0.0)
+            await collection_manager.prepare_simulation("simulation")
+            await asyncio.sleep(0.01)
+            self.assertEqual(storage.indexed_simulations, ["simulation"])
+            await collection_manager.add_simulation_indexes("simulation")
+            self.assertEqual(storage.indexed_simulations, ["simulation"])
+            await collection_manager.close()
+
+        asyncio.run(run_test())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 Tampere University and VTT Technical Research Centre of Finland
+# This software was developed as a part of the ProCemPlus project: https://www.senecc.fi/projects/procemplus
+# This source code is licensed under the MIT license. See LICENSE in the repository root directory.
+# Author(s): Ville Heikkilä <ville.heikkila@tuni.fi>
+#            Otto Hylli <otto.hylli@tuni.fi>
+
+"""Unit tests for the compression of the large payload attributes."""
+
+import unittest
+
+from log_writer.compression import (
+    COMPRESSED_ATTRIBUTES, COMPRESSION_NONE, COMPRESSION_ZLIB, COMPRESSION_ZSTD, PayloadCompressor,
+    decompress_document, get_zstandard_module)
+
+ZSTANDARD_AVAILABLE = get_zstandard_module() is not None
+
+
+def create_document() -> dict:
+    """Returns a result message document with a large and a small payload attribute."""
+    return {
+        "Type": "Result",
+        "SimulationId": "simulation",
+        "MessageId": "component-1",
+        "Timestamp": "2021-01-01T00:00:00.000Z",
+        "TriggeringMessageIds": ["manager-{:d}".format(index) for index in range(1000)],
+        "Values": [{"Node": index, "Voltage": 1.0} for index in range(1000)],
+        "Unit": "kV"
+    }
+
+
+class TestPayloadCompressor(unittest.TestCase):
+    """Unit tests for the PayloadCompressor class and the decompress_document function."""
+
+    def check_round_trip(self, compression: str):
+        """Checks that only the large payload attribute is compressed and that the original document is restored."""
+        compressor = PayloadCompressor(compression=compression, threshold=1024)
+        document = create_document()
+        compressed_document, original_bytes, compressed_bytes = compressor.compress_document(document)
+
+        self.assertEqual(compressed_document[COMPRESSED_ATTRIBUTES], {"Values": compressor.compression})
+        self.assertIsInstance(compressed_document["Values"], bytes)
+        # the plain attributes are not compressed even when they are large
+        self.assertEqual(compressed_document["TriggeringMessageIds"], document["TriggeringMessageIds"])
+        self.assertEqual(compressed_document["Unit"], "kV")
+        self.assertLess(compressed_bytes, original_bytes)
+        self.assertEqual(len(compressed_document["Values"]), compressed_bytes)
+        # the original document is not modified
+        self.assertEqual(document, create_document())
+
+        self.assertEqual(decompress_document(compressed_document), document)
+
+    def test_zlib_round_trip(self):
+        """Unit test for compressing and decompressing a document with zlib."""
+        self.check_round_trip(COMPRESSION_ZLIB)
+
+    @unittest.skipUnless(ZSTANDARD_AVAILABLE, "zstandard is not installed")
+    def test_zstd_round_trip(self):
+        """Unit test for compressing and decompressing a document with zstd."""
+        self.check_round_trip(COMPRESSION_ZSTD)
+
+    @unittest.skipIf(ZSTANDARD_AVAILABLE, "zstandard is installed")
+    def test_missing_zstandard(self):
+        """Unit test for using zlib when the zstandard library is not installed."""
+        compressor = PayloadCompressor(compression=COMPRESSION_ZSTD, threshold=1024)
+        self.assertEqual(compressor.compression, COMPRESSION_ZLIB)
+        compressed_document = {"Type": "Result", "Values": b"zstd data", COMPRESSED_ATTRIBUTES: {"Values": "zstd"}}
+        with self.assertRaises(ValueError):
+            decompress_document(compressed_document)
+
+    def test_small_values(self):
+        """Unit test for leaving the values below the threshold and the numeric values as they are."""
+        compressor = PayloadCompressor(compression=COMPRESSION_ZLIB, threshold=1024)
+        document = {"Type": "Result", "Small": "x" * 100, "List": [1, 2, 3], "Value": 10 ** 100}
+        self.assertEqual(compressor.compress_document(document), (document, 0, 0))
+
+        result = compressor.compress_documents([(document, "Result"), (create_document(), "Result")])
+        self.assertIs(result.documents[0][0], document)
+        self.assertIn(COMPRESSED_ATTRIBUTES, result.documents[1][0])
+        self.assertGreater(result.original_bytes, result.compressed_bytes)
+
+    def test_no_compression(self):
+        """Unit test for the documents without compressed attributes."""
+        compressor = PayloadCompressor(compression=COMPRESSION_NONE)
+        self.assertFalse(compressor.is_active)
+        document = create_document()
+        self.assertIs(compressor.compress_document(document)[0], document)
+        self.assertIs(decompress_document(document), document)
+        self.assertEqual(PayloadCompressor(compression="unknown").compression, COMPRESSION_NONE)
+
+    def test_unknown_compression(self):
+        """Unit test for decompressing an attribute with an unknown compression method."""
+        with self.assertRaises(ValueError):
+            decompress_document({"Values": b"data", COMPRESSED_ATTRIBUTES: {"Values": "lz4"}})
+
+
+if __name__ == '__main__':
+    unittest.main()
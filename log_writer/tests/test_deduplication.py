@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 Tampere University and VTT Technical Research Centre of Finland
+# This software was developed as a part of the ProCemPlus project: https://www.senecc.fi/projects/procemplus
+# This source code is licensed under the MIT license. See LICENSE in the repository root directory.
+# Author(s): Ville Heikkilä <ville.heikkila@tuni.fi>
+#            Otto Hylli <otto.hylli@tuni.fi>
+
+"""Unit tests for the duplicate message filter."""
+
+import unittest
+
+from log_writer.deduplication import DuplicateFilter
+
+
+class TestDuplicateFilter(unittest.TestCase):
+    """Unit tests for the DuplicateFilter class."""
+
+    def test_false_positive_rate(self):
+        """Unit test for the share of unique message ids that are wrongly detected as duplicates."""
+        error_rate = 0.01
+        stored_count = 50000
+        checked_count = 50000
+        duplicate_filter = DuplicateFilter(capacity=stored_count, error_rate=error_rate, window_size=0)
+        for message_index in range(stored_count):
+            duplicate_filter.add("stored-{:d}".format(message_index))
+
+        # all the stored message ids are detected, i.e. the Bloom filters have no false negatives
+        self.assertTrue(all(
+            duplicate_filter.is_duplicate("stored-{:d}".format(message_index))
+            for message_index in range(stored_count)
+        ))
+
+        false_positives = sum(
+            1 for message_index in range(checked_count)
+            if duplicate_filter.is_duplicate("unique-{:d}".format(message_index))
+        )
+        self.assertLessEqual(false_positives / checked_count, error_rate)
+        self.assertEqual(duplicate_filter.duplicates, stored_count + false_positives)
+
+    def test_exact_window(self):
+        """Unit test for detecting the latest message ids with the exact window."""
+        duplicate_filter = DuplicateFilter(capacity=1000, error_rate=0.01, window_size=10)
+        self.assertFalse(duplicate_filter.is_duplicate("message"))
+        duplicate_filter.add("message")
+        self.assertTrue(duplicate_filter.is_duplicate("message"))
+        # adding the same message id again does not remember it twice
+        duplicate_filter.add("message")
+        self.assertEqual(duplicate_filter.duplicates, 1)
+
+    def test_requeued_message(self):
+        """Unit test for a redelivered message whose first write failed: the message id is remembered only after
+           the message has been stored, so the redelivered copy is not dropped."""
+        duplicate_filter = DuplicateFilter(capacity=1000, error_rate=0.01, window_size=10)
+        self.assertFalse(duplicate_filter.is_duplicate("requeued"))
+        # the write of the first copy failed, so the message id was not added
+        self.assertFalse(duplicate_filter.is_duplicate("requeued"))
+
+        duplicate_filter.add("requeued")
+        self.assertTrue(duplicate_filter.is_duplicate("requeued"))
+        self.assertEqual(duplicate_filter.duplicates, 1)
+
+    def test_capacity(self):
+        """Unit test for forgetting the oldest message ids once the capacity is full."""
+        duplicate_filter = DuplicateFilter(capacity=10000, error_rate=0.001, window_size=0)
+        for message_index in range(100000):
+            duplicate_filter.add("message-{:d}".format(message_index))
+
+        self.assertTrue(duplicate_filter.is_duplicate("message-99999"))
+        forgotten = sum(
+            1 for message_index in range(1000)
+            if not duplicate_filter.is_duplicate("message-{:d}".format(message_index))
+        )
+        self.assertGreater(forgotten, 990)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 Tampere University and VTT Technical Research Centre of Finland
+# This software was developed as a part of the ProCemPlus project: https://www.senecc.fi/projects/procemplus
+# This source code is licensed under the MIT license. See LICENSE in the repository root directory.
+# Author(s): Ville Heikkilä <ville.heikkila@tuni.fi>
+#            Otto Hylli <otto.hylli@tuni.fi>
+
+"""Unit tests for the per epoch message summaries."""
+
+import asyncio
+import datetime
+import unittest
+from typing import Any, List
+from unittest import mock
+
+from log_writer import epoch_summary
+from log_writer.epoch_summary import EpochSummaryChange, EpochSummaryWriter, get_epoch_summary_writer
+
+
+def get_timestamp(second: int) -> datetime.datetime:
+    """Returns a timestamp with the given second."""
+    return datetime.datetime(2021, 1, 1, 12, 0, second, tzinfo=datetime.timezone.utc)
+
+
+class SummaryCollection:
+    """Stand-in for the summary collection that records the bulk writes and can be set to fail."""
+    def __init__(self):
+        self.failing = False
+        self.bulk_writes: List[List[Any]] = []
+
+    async def create_index(self, *args: Any, **kwargs: Any):
+        del args, kwargs
+
+    async def bulk_write(self, operations: List[Any], ordered: bool = True):
+        del ordered
+        if self.failing:
+            raise ConnectionError("database unavailable")
+        self.bulk_writes.append(operations)
+
+
+class TestEpochSummary(unittest.TestCase):
+    """Unit tests for the EpochSummaryChange and EpochSummaryWriter classes."""
+
+    def test_summary_update(self):
+        """Unit test for the update document of the summary changes."""
+        change = EpochSummaryChange()
+        change.add_message("process 1", get_timestamp(10))
+        change.add_message("process 2", get_timestamp(5))
+        change.add_message(None, get_timestamp(20))
+
+        self.assertEqual(change.get_update(), {
+            "$inc": {"MessageCount": 3},
+            "$min": {"FirstTimestamp": get_timestamp(5)},
+            "$max": {"LastTimestamp": get_timestamp(20)},
+            "$addToSet": {"Processes": {"$each": ["process 1", "process 2"]}}
+        })
+
+    def test_merge(self):
+        """Unit test for merging two summary changes."""
+        change = EpochSummaryChange()
+        change.add_message("process 1", get_timestamp(10))
+        other_change = EpochSummaryChange()
+        other_change.add_message("process 2", get_timestamp(30))
+        other_change.add_message("process 2", get_timestamp(2))
+
+        change.merge(other_change)
+        self.assertEqual(change.message_count, 3)
+        self.assertEqual(change.processes, {"process 1", "process 2"})
+        self.assertEqual(change.first_timestamp, get_timestamp(2))
+        self.assertEqual(change.last_timestamp, get_timestamp(30))
+
+        # merging an empty change does not change the timestamps
+        change.merge(EpochSummaryChange())
+        self.assertEqual(change.first_timestamp, get_timestamp(2))
+        self.assertEqual(change.last_timestamp, get_timestamp(30))
+
+    def test_failed_update(self):
+        """Unit test for keeping the changes of a failed update for the next update."""
+        async def run_test():
+            collection = SummaryCollection()
+            writer = EpochSummaryWriter(collection, update_interval=60.0)
+            await writer.add_message("simulation", 1, "Result", "process 1", get_timestamp(10))
+            await writer.add_message("simulation", 2, "Result", "process 1", get_timestamp(20))
+
+            collection.failing = True
+            await writer.flush()
+            self.assertEqual(writer.pending_summaries, 2)
+            self.assertEqual(writer.updated_summaries, 0)
+
+            # the new changes to the same summary are merged with the failed ones
+            await writer.add_message("simulation", 1, "Result", "process 2", get_timestamp(5))
+            self.assertEqual(writer.pending_summaries, 2)
+
+            collection.failing = False
+            await writer.close()
+            self.assertEqual(writer.pending_summaries, 0)
+            self.assertEqual(writer.updated_summaries, 2)
+            self.assertEqual(len(collection.bulk_writes), 1)
+
+        asyncio.run(run_test())
+
+    def test_disabled_without_mongodb(self):
+        """Unit test for not creating the summary writer when the storage backends do not use MongoDB."""
+        with mock.patch.dict(epoch_summary.ENV_VARIABLES, {epoch_summary.EPOCH_SUMMARY_NAME: True}):
+            self.assertIsInstance(get_epoch_summary_writer(True), EpochSummaryWriter)
+            self.assertIsNone(get_epoch_summary_writer(False))
+        with mock.patch.dict(epoch_summary.ENV_VARIABLES, {epoch_summary.EPOCH_SUMMARY_NAME: False}):
+            self.assertIsNone(get_epoch_summary_writer(True))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 Tampere University and VTT Technical Research Centre of Finland
+# This software was developed as a part of the ProCemPlus project: https://www.senecc.fi/projects/procemplus
+# This source code is licensed under the MIT license. See LICENSE in the repository root directory.
+# Author(s): Ville Heikkilä <ville.heikkila@tuni.fi>
+#            Otto Hylli <otto.hylli@tuni.fi>
+
+"""Unit tests for the adaptive message buffer flush thresholds."""
+
+import unittest
+from typing import cast
+from unittest import mock
+
+from log_writer import flush_controller
+from log_writer.flush_controller import AdaptiveFlushController
+
+BOUNDS = {
+    flush_controller.MESSAGE_BUFFER_ADAPTIVE_MIN_DOCUMENTS_NAME: 10,
+    flush_controller.MESSAGE_BUFFER_ADAPTIVE_MAX_DOCUMENTS_NAME: 1000,
+    flush_controller.MESSAGE_BUFFER_ADAPTIVE_MIN_INTERVAL_NAME: 1.0,
+    flush_controller.MESSAGE_BUFFER_ADAPTIVE_MAX_INTERVAL_NAME: 30.0
+}
+
+
+class TestAdaptiveFlushController(unittest.TestCase):
+    """Unit tests for the AdaptiveFlushController class."""
+
+    def test_fixed_thresholds(self):
+        """Unit test for keeping the given thresholds when the controller is not adaptive."""
+        controller = AdaptiveFlushController(max_documents=5000, max_interval=0.1, adaptive=False)
+        for _ in range(10):
+            controller.record_write(10.0)
+        self.assertEqual(controller.batch_size, 5000)
+        self.assertEqual(controller.max_batch_size, 5000)
+        self.assertEqual(controller.flush_interval, 0.1)
+        self.assertAlmostEqual(cast(float, controller.write_latency), 10.0)
+
+    def test_initial_bounds(self):
+        """Unit test for limiting the initial thresholds to the adaptive bounds."""
+        with mock.patch.dict(flush_controller.ENV_VARIABLES, BOUNDS):
+            controller = AdaptiveFlushController(max_documents=5000, max_interval=0.1, adaptive=True)
+        self.assertEqual(controller.batch_size, 1000)
+        self.assertEqual(controller.flush_interval, 1.0)
+
+    def test_fast_writes(self):
+        """Unit test for growing the batch size at most by the maximum factor up to the upper bound."""
+        with mock.patch.dict(flush_controller.ENV_VARIABLES, BOUNDS):
+            controller = AdaptiveFlushController(max_documents=20, max_interval=10.0, adaptive=True,
+                                                 target_latency=0.5)
+        controller.record_write(0.001)
+        self.assertEqual(controller.batch_size, 40)
+        for _ in range(20):
+            controller.record_write(0.001)
+        self.assertEqual(controller.batch_size, 1000)
+        self.assertEqual(controller.max_batch_size, 1000)
+        self.assertEqual(controller.flush_interval, 1.0)
+
+    def test_slow_writes(self):
+        """Unit test for shrinking the batch size down to the lower bound when the writes are slow."""
+        with mock.patch.dict(flush_controller.ENV_VARIABLES, BOUNDS):
+            controller = AdaptiveFlushController(max_documents=800, max_interval=10.0, adaptive=True,
+                                                 target_latency=0.5)
+        controller.record_write(5.0)
+        self.assertEqual(controller.batch_size, 400)
+        for _ in range(20):
+            controller.record_write(5.0)
+        self.assertEqual(controller.batch_size, 10)
+        self.assertEqual(controller.flush_interval, 30.0)
+
+    def test_ingress_rate(self):
+        """Unit test for keeping the batch size large enough for the observed ingress rate."""
+        current_time = [100.0]
+        with mock.patch.dict(flush_controller.ENV_VARIABLES, BOUNDS), \
+                mock.patch.object(flush_controller.time, "monotonic", lambda: current_time[0]):
+            controller = AdaptiveFlushController(max_documents=20, max_interval=10.0, adaptive=True,
+                                                 target_latency=0.5)
+            for _ in range(200):
+                controller.record_message()
+            current_time[0] += 1.0
+            controller.record_message()
+            self.assertAlmostEqual(cast(float, controller.ingress_rate), 201.0)
+
+            # the slow write would shrink the batch, but the batch must hold the messages received during a write
+            controller.record_write(2.0)
+            self.assertEqual(controller.batch_size, 402)
+            # the buffer is flushed at least as often as it fills at the ingress rate
+            self.assertAlmostEqual(controller.flush_interval, 2.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
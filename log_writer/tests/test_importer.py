@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 Tampere University and VTT Technical Research Centre of Finland
+# This software was developed as a part of the ProCemPlus project: https://www.senecc.fi/projects/procemplus
+# This source code is licensed under the MIT license. See LICENSE in the repository root directory.
+# Author(s): Ville Heikkilä <ville.heikkila@tuni.fi>
+#            Otto Hylli <otto.hylli@tuni.fi>
+
+"""Unit tests for reading the recorded message bus dumps."""
+
+import asyncio
+import gzip
+import os
+import tempfile
+import unittest
+from typing import Any, List, Tuple
+
+from log_writer.importer import DumpReader, ImportResult
+
+DUMP_LINES = [
+    b'{"topic": "Epoch", "body": {"Type": "Epoch", "EpochNumber": 1}}',
+    b'',
+    b'not json',
+    b'{"routing_key": "Result", "message": "{\\"Type\\": \\"Result\\"}"}',
+    b'{"topic": "Status", "other": {}}',
+    b'["Epoch", {}]',
+]
+
+
+def write_dump_file(directory: str, file_name: str) -> str:
+    """Writes the test dump lines to the given file and returns the path to the file."""
+    path = os.path.join(directory, file_name)
+    open_function = gzip.open if file_name.endswith(".gz") else open
+    with open_function(path, "wb") as dump_file:
+        dump_file.write(b"\n".join(DUMP_LINES) + b"\n")
+    return path
+
+
+class TestDumpReader(unittest.TestCase):
+    """Unit tests for the DumpReader class."""
+
+    def read_messages(self, file_name: str, raw_bodies: bool) -> Tuple[List[Tuple[Any, str]], ImportResult]:
+        """Returns the messages given to the listener and the import statistics for the given dump file."""
+        async def run_test(path: str) -> Tuple[List[Tuple[Any, str]], ImportResult]:
+            messages: List[Tuple[Any, str]] = []
+
+            async def listener(message_body: Any, topic_name: str):
+                messages.append((message_body, topic_name))
+
+            reader = DumpReader(raw_bodies)
+            reader.add_listener("#", listener)
+            result = ImportResult()
+            await reader.import_file(path, result, progress_interval=0.0)
+            await reader.close()
+            return messages, result
+
+        with tempfile.TemporaryDirectory() as directory:
+            return asyncio.run(run_test(write_dump_file(directory, file_name)))
+
+    def test_decoded_bodies(self):
+        """Unit test for reading the messages from a gzip compressed dump file."""
+        messages, result = self.read_messages("dump.jsonl.gz", raw_bodies=False)
+        self.assertEqual(messages, [
+            ({"Type": "Epoch", "EpochNumber": 1}, "Epoch"),
+            ('{"Type": "Result"}', "Result")
+        ])
+        self.assertEqual(result.lines, len(DUMP_LINES))
+        self.assertEqual(result.messages, 2)
+        self.assertEqual(result.skipped_lines, len(DUMP_LINES) - 2)
+
+    def test_raw_bodies(self):
+        """Unit test for giving the message bodies as bytes in the raw storage mode."""
+        messages, result = self.read_messages("dump.jsonl", raw_bodies=True)
+        self.assertEqual([topic_name for _, topic_name in messages], ["Epoch", "Result"])
+        self.assertTrue(all(isinstance(message_body, bytes) for message_body, _ in messages))
+        self.assertEqual(messages[1][0], b'{"Type": "Result"}')
+        self.assertEqual(result.messages, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
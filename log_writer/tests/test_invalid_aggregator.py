@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 Tampere University and VTT Technical Research Centre of Finland
+# This software was developed as a part of the ProCemPlus project: https://www.senecc.fi/projects/procemplus
+# This source code is licensed under the MIT license. See LICENSE in the repository root directory.
+# Author(s): Ville Heikkilä <ville.heikkila@tuni.fi>
+#            Otto Hylli <otto.hylli@tuni.fi>
+
+"""Unit tests for the aggregation and the rate limiting of the invalid messages."""
+
+import asyncio
+import unittest
+from typing import List, Tuple
+from unittest import mock
+
+from log_writer import invalid_aggregator
+from log_writer.invalid_aggregator import InvalidMessageAggregator
+from log_writer.invalid_message import InvalidMessage
+
+
+class RecordingAggregator:
+    """Helper for creating an invalid message aggregator that records the stored invalid messages."""
+    def __init__(self, **kwargs):
+        self.stored: List[Tuple[InvalidMessage, str]] = []
+        self.aggregator = InvalidMessageAggregator(self.__store, **kwargs)
+
+    async def __store(self, invalid_message: InvalidMessage, topic_name: str):
+        self.stored.append((invalid_message, topic_name))
+
+
+class TestInvalidMessageAggregator(unittest.TestCase):
+    """Unit tests for the InvalidMessageAggregator class."""
+
+    def test_disabled(self):
+        """Unit test for storing each invalid message separately when the aggregation and the rate limit are off."""
+        async def run_test():
+            recorder = RecordingAggregator()
+            for _ in range(200):
+                await recorder.aggregator.add("not json", "Result")
+            self.assertEqual(len(recorder.stored), 200)
+            self.assertEqual(recorder.aggregator.rate_limited_messages, 0)
+            self.assertEqual(recorder.stored[0][0].invalid_json_message, "not json")
+            await recorder.aggregator.close()
+
+        disabled_values = {
+            invalid_aggregator.INVALID_MESSAGE_WINDOW_NAME: 0.0,
+            invalid_aggregator.INVALID_MESSAGE_RATE_LIMIT_NAME: 0.0
+        }
+        with mock.patch.dict(invalid_aggregator.ENV_VARIABLES, disabled_values):
+            asyncio.run(run_test())
+
+    def test_aggregation(self):
+        """Unit test for storing the identical invalid messages as a single document with the occurrence count."""
+        async def run_test():
+            recorder = RecordingAggregator(window=60.0, rate_limit=0.0)
+            for _ in range(3):
+                await recorder.aggregator.add({"Type": "Result", "Timestamp": "invalid"}, "Result")
+            await recorder.aggregator.add({"Type": "Result", "Timestamp": "invalid"}, "Result.Other")
+            await recorder.aggregator.add("not json", "Result")
+            self.assertEqual(recorder.stored, [])
+            self.assertEqual(recorder.aggregator.pending_messages, 3)
+
+            await recorder.aggregator.close()
+            self.assertEqual([topic_name for _, topic_name in recorder.stored], ["Result", "Result.Other", "Result"])
+            self.assertEqual([message.occurrence_count for message, _ in recorder.stored], [3, 1, 1])
+            self.assertEqual(recorder.stored[0][0].invalid_message, {"Type": "Result", "Timestamp": "invalid"})
+            self.assertEqual(recorder.aggregator.received_messages, 5)
+            self.assertEqual(recorder.aggregator.stored_messages, 3)
+
+        asyncio.run(run_test())
+
+    def test_rate_limit(self):
+        """Unit test for dropping the invalid messages above the rate limit for each topic."""
+        async def run_test():
+            recorder = RecordingAggregator(window=0.0, rate_limit=0.001, burst=5)
+            for _ in range(10):
+                await recorder.aggregator.add("not json", "Result")
+            await recorder.aggregator.add("not json", "Status")
+
+            self.assertEqual(len(recorder.stored), 6)
+            self.assertEqual(recorder.aggregator.rate_limited_messages, 5)
+            self.assertEqual(recorder.stored[-1][1], "Status")
+            await recorder.aggregator.close()
+
+        asyncio.run(run_test())
+
+
+if __name__ == '__main__':
+    unittest.main()
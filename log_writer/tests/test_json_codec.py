@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 Tampere University and VTT Technical Research Centre of Finland
+# This software was developed as a part of the ProCemPlus project: https://www.senecc.fi/projects/procemplus
+# This source code is licensed under the MIT license. See LICENSE in the repository root directory.
+# Author(s): Ville Heikkilä <ville.heikkila@tuni.fi>
+#            Otto Hylli <otto.hylli@tuni.fi>
+
+"""Unit tests for the JSON codec used for the received messages."""
+
+import importlib.util
+import math
+import unittest
+
+from log_writer.json_codec import JSON_CODEC_ORJSON, JSON_CODEC_STDLIB, JsonCodec
+
+ORJSON_AVAILABLE = importlib.util.find_spec("orjson") is not None
+
+
+class TestJsonCodec(unittest.TestCase):
+    """Unit tests for the JsonCodec class."""
+
+    def test_stdlib_codec(self):
+        """Unit test for decoding and encoding with the standard library json module."""
+        codec = JsonCodec(JSON_CODEC_STDLIB)
+        self.assertEqual(codec.name, JSON_CODEC_STDLIB)
+        self.assertEqual(codec.loads(b'{"Value": 1.5}'), {"Value": 1.5})
+        self.assertEqual(codec.dumps({"Name": "ä", "Value": [1, 2]}), '{"Name":"ä","Value":[1,2]}'.encode("UTF-8"))
+
+    def test_unknown_codec(self):
+        """Unit test for using the standard library json module for an unknown codec name."""
+        self.assertEqual(JsonCodec("unknown").name, JSON_CODEC_STDLIB)
+
+    @unittest.skipUnless(ORJSON_AVAILABLE, "orjson is not installed")
+    def test_orjson_fallback(self):
+        """Unit test for falling back to the standard library json module for the values that orjson rejects."""
+        codec = JsonCodec(JSON_CODEC_ORJSON)
+        self.assertEqual(codec.name, JSON_CODEC_ORJSON)
+        self.assertEqual(codec.loads(b'{"Value": 1.5}'), {"Value": 1.5})
+
+        # NaN values are only decoded and integers larger than 64 bits only encoded by the json module
+        nan_message = codec.loads(b'{"Value": NaN}')
+        self.assertTrue(math.isnan(nan_message["Value"]))
+        self.assertEqual(codec.dumps({"Value": 123456789012345678901234567890}),
+                         b'{"Value":123456789012345678901234567890}')
+
+    @unittest.skipUnless(ORJSON_AVAILABLE, "orjson is not installed")
+    def test_orjson_decode_error(self):
+        """Unit test for raising one of the decode errors for invalid JSON also when the fallback fails."""
+        codec = JsonCodec(JSON_CODEC_ORJSON)
+        with self.assertRaises(codec.decode_errors):
+            codec.loads(b"{not json")
+        with self.assertRaises(codec.decode_errors):
+            codec.loads(b'{"Value": "\\xff"')
+
+
+if __name__ == '__main__':
+    unittest.main()
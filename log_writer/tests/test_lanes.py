@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 Tampere University and VTT Technical Research Centre of Finland
+# This software was developed as a part of the ProCemPlus project: https://www.senecc.fi/projects/procemplus
+# This source code is licensed under the MIT license. See LICENSE in the repository root directory.
+# Author(s): Ville Heikkilä <ville.heikkila@tuni.fi>
+#            Otto Hylli <otto.hylli@tuni.fi>
+
+"""Unit tests for the priority lanes of the message intake."""
+
+import asyncio
+import unittest
+from typing import Any, List
+
+from log_writer.lanes import PriorityLanes, is_control_topic
+
+
+class TestPriorityLanes(unittest.TestCase):
+    """Unit tests for the PriorityLanes class."""
+
+    def test_control_topics(self):
+        """Unit test for selecting the lane by the topic."""
+        self.assertTrue(is_control_topic("SimulationState"))
+        self.assertTrue(is_control_topic("Epoch"))
+        self.assertTrue(is_control_topic("Status.Ready"))
+        self.assertFalse(is_control_topic("Result"))
+        self.assertFalse(is_control_topic("ResultStatus"))
+
+    def test_barrier_ordering(self):
+        """Unit test for handling the control messages before the bulk messages, except for the simulation state
+           messages that wait for the bulk messages received before them."""
+        async def run_test():
+            handled_messages: List[Any] = []
+            bulk_release = asyncio.Event()
+
+            async def message_handler(message: Any, topic_name: str):
+                if topic_name == "Result":
+                    await bulk_release.wait()
+                handled_messages.append(message)
+
+            lanes = PriorityLanes(message_handler, bulk_lane_size=10)
+            await lanes.put("result 1", "Result")
+            await lanes.put("result 2", "Result")
+            await lanes.put("epoch", "Epoch")
+            await lanes.put("state", "SimulationState")
+            await lanes.put("result 3", "Result")
+            await asyncio.sleep(0.01)
+
+            # the epoch is handled while the bulk messages are waiting,
+            # but the simulation state waits for the bulk messages received before it
+            self.assertEqual(handled_messages, ["epoch"])
+
+            bulk_release.set()
+            await asyncio.wait_for(lanes.close(), timeout=1.0)
+            self.assertEqual(handled_messages[:1], ["epoch"])
+            self.assertLess(handled_messages.index("result 2"), handled_messages.index("state"))
+            self.assertEqual(sorted(handled_messages), ["epoch", "result 1", "result 2", "result 3", "state"])
+
+        asyncio.run(run_test())
+
+    def test_bulk_lane_limit(self):
+        """Unit test for blocking the message intake when the bulk lane is full."""
+        async def run_test():
+            bulk_release = asyncio.Event()
+
+            async def message_handler(message: Any, topic_name: str):
+                del message, topic_name
+                await bulk_release.wait()
+
+            lanes = PriorityLanes(message_handler, bulk_lane_size=2)
+            # the first message is taken by the lane task, the next two fill the lane
+            for message_index in range(3):
+                await lanes.put(message_index, "Result")
+                await asyncio.sleep(0)
+            self.assertEqual(lanes.bulk_pending, 2)
+
+            blocked_put = asyncio.ensure_future(lanes.put(3, "Result"))
+            # the control messages are not blocked by the full bulk lane
+            await asyncio.wait_for(lanes.put("epoch", "Epoch"), timeout=1.0)
+            await asyncio.sleep(0.01)
+            self.assertFalse(blocked_put.done())
+
+            bulk_release.set()
+            await asyncio.wait_for(blocked_put, timeout=1.0)
+            await asyncio.wait_for(lanes.close(), timeout=1.0)
+
+        asyncio.run(run_test())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 Tampere University and VTT Technical Research Centre of Finland
+# This software was developed as a part of the ProCemPlus project: https://www.senecc.fi/projects/procemplus
+# This source code is licensed under the MIT license. See LICENSE in the repository root directory.
+# Author(s): Ville Heikkilä <ville.heikkila@tuni.fi>
+#            Otto Hylli <otto.hylli@tuni.fi>
+
+"""Unit tests for the message handling of the listener component."""
+
+import asyncio
+import json
+import unittest
+from typing import Any, List, Optional, Tuple
+from unittest import mock
+
+from log_writer import listener
+from log_writer.listener import ListenerComponent
+from log_writer.shard import SHARD_BY_ROUTING_KEY, ShardFilter
+from log_writer.storage import StorageBackend
+
+
+class RecordingTimers:
+    """Stand-in for the stage timers that records the started and the stopped stages."""
+    def __init__(self):
+        self.started: List[str] = []
+        self.stopped: List[str] = []
+
+    def start(self, stage: str) -> Optional[float]:
+        self.started.append(stage)
+        return float(len(self.started))
+
+    def stop(self, stage: str, start_time: Optional[float]):
+        if start_time is not None:
+            self.stopped.append(stage)
+
+
+class StubClient:
+    """Stand-in for the message bus client."""
+    def add_listener(self, topic_names: Any, handler: Any):
+        del topic_names, handler
+
+    async def close(self):
+        pass
+
+
+class NullStorage(StorageBackend):
+    """Storage backend that does not store anything."""
+    async def store_messages(self, documents: List[Tuple[dict, str]], invalid: bool = False,
+                             default_simulation_id: Optional[str] = None) -> List[Any]:
+        return list(range(len(documents)))
+
+    async def update_metadata(self, simulation_id: str, **attributes: Any) -> bool:
+        return True
+
+
+class TestDecodeTimers(unittest.TestCase):
+    """Unit tests for stopping the decode stage timers also for the messages that cannot be decoded."""
+
+    def check_timers(self, handler_name: str, message: Any):
+        """Checks that every started stage timer is stopped when the given message is handled."""
+        async def run_test() -> RecordingTimers:
+            timers = RecordingTimers()
+            with mock.patch.object(listener, "STAGE_TIMERS", timers):
+                component = ListenerComponent(
+                    rabbitmq_client=StubClient(), storage=NullStorage(), priority_lanes=False)  # type: ignore
+                await getattr(component, handler_name)(message, "Result")
+                await component.stop()
+            return timers
+
+        timers = asyncio.run(run_test())
+        self.assertIn(listener.STAGE_DECODE, timers.started)
+        self.assertEqual(timers.started, timers.stopped)
+
+    def test_invalid_json_string(self):
+        """Unit test for a message string that is not valid JSON."""
+        self.check_timers("simulation_message_handler", "{not json")
+
+    def test_invalid_raw_body(self):
+        """Unit test for a raw message body that is not valid JSON in the raw storage mode."""
+        self.check_timers("raw_message_handler", b"{not json")
+
+    def test_non_object_raw_body(self):
+        """Unit test for a raw message body that is valid JSON but not a JSON object."""
+        self.check_timers("raw_message_handler", b"[1, 2]")
+
+
+class TestShardedSimulationEnd(unittest.TestCase):
+    """Unit tests for noticing the end of the simulation in a worker that does not handle the end message."""
+
+    def test_end_in_other_shard(self):
+        """Unit test for calling the stop function for the end message that belongs to another shard."""
+        async def run_test():
+            stop_calls: List[str] = []
+
+            async def stop_function():
+                stop_calls.append("stop")
+
+            # with two shards by the routing key, the simulation state messages belong to the second shard
+            shard = ShardFilter(0, 2, SHARD_BY_ROUTING_KEY)
+            self.assertFalse(shard.accepts(b"", "SimulationState"))
+            component = ListenerComponent(
+                rabbitmq_client=StubClient(), storage=NullStorage(), priority_lanes=False,  # type: ignore
+                shard=shard, stop_function=stop_function)
+
+            for simulation_state in ["running", "stopped"]:
+                message_body = json.dumps({
+                    "Type": "SimulationState", "SimulationId": "simulation", "SimulationState": simulation_state
+                }).encode("UTF-8")
+                await component.raw_body_handler(message_body, "SimulationState")
+                await asyncio.sleep(0)
+                self.assertEqual(stop_calls, ["stop"] if simulation_state == "stopped" else [])
+
+            # the end message is not stored by the worker
+            self.assertEqual(component.simulations, [])
+            await component.stop()
+
+        asyncio.run(run_test())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 Tampere University and VTT Technical Research Centre of Finland
+# This software was developed as a part of the ProCemPlus project: https://www.senecc.fi/projects/procemplus
+# This source code is licensed under the MIT license. See LICENSE in the repository root directory.
+# Author(s): Ville Heikkilä <ville.heikkila@tuni.fi>
+#            Otto Hylli <otto.hylli@tuni.fi>
+
+"""Unit tests for the live tail of the recently received messages."""
+
+import asyncio
+import unittest
+from typing import Any, Dict, List
+from unittest import mock
+
+from log_writer import live_tail
+from log_writer.live_tail import LiveTail, LiveTailEntry, to_live_tail_document
+
+
+class StoredMessage:
+    """Stand-in for a message object whose JSON document has been given to the database client."""
+    def __init__(self, index: int):
+        self.__document = {"_id": "object id", "Type": "Result", "Index": index}
+
+    def json(self) -> Dict[str, Any]:
+        return self.__document
+
+
+def get_indexes(entries: List[LiveTailEntry]) -> List[int]:
+    """Returns the message indexes of the live tail entries."""
+    return [entry[2].json()["Index"] for entry in entries]
+
+
+class TestLiveTail(unittest.TestCase):
+    """Unit tests for the LiveTail class."""
+
+    def test_ring_buffers(self):
+        """Unit test for keeping only the latest messages for each topic and returning them in the received order."""
+        tail = LiveTail(buffer_size=3)
+        for index in range(10):
+            tail.add_message("simulation", StoredMessage(index), "Result" if index % 2 == 0 else "Status.Ready")
+        tail.add_message("other", StoredMessage(100), "Result")
+
+        self.assertEqual(get_indexes(tail.get_messages("simulation")), [4, 5, 6, 7, 8, 9])
+        self.assertEqual(get_indexes(tail.get_messages("simulation", "Result")), [4, 6, 8])
+        self.assertEqual(get_indexes(tail.get_messages("simulation", "Status.*")), [5, 7, 9])
+        self.assertEqual(get_indexes(tail.get_messages("unknown")), [])
+
+    def test_limit(self):
+        """Unit test for returning at most the given number of the latest messages."""
+        tail = LiveTail(buffer_size=10)
+        for index in range(5):
+            tail.add_message("simulation", StoredMessage(index), "Result")
+        self.assertEqual(get_indexes(tail.get_messages("simulation", limit=2)), [3, 4])
+        self.assertEqual(get_indexes(tail.get_messages("simulation", limit=0)), [])
+        self.assertEqual(get_indexes(tail.get_messages("simulation", limit=100)), [0, 1, 2, 3, 4])
+
+    def test_remove_simulation(self):
+        """Unit test for forgetting the messages and ending the subscriptions of a removed simulation."""
+        async def run_test():
+            tail = LiveTail(buffer_size=10)
+            subscription = tail.subscribe("simulation", "Result")
+            tail.add_message("simulation", StoredMessage(0), "Epoch")
+            tail.add_message("simulation", StoredMessage(1), "Result")
+            tail.remove_simulation("simulation")
+
+            self.assertEqual(tail.get_messages("simulation"), [])
+            self.assertEqual(tail.subscriptions, 0)
+            # the subscription receives only the matching message before its end
+            entry = await subscription.get(1.0)
+            self.assertIsNotNone(entry)
+            self.assertEqual(get_indexes([entry]), [1])  # type: ignore
+            self.assertIsNone(await subscription.get(1.0))
+            self.assertTrue(subscription.closed)
+
+        asyncio.run(run_test())
+
+    def test_slow_subscription(self):
+        """Unit test for dropping the messages for a subscription whose queue is full."""
+        async def run_test():
+            tail = LiveTail(buffer_size=10)
+            subscription = tail.subscribe("simulation")
+            for index in range(5):
+                tail.add_message("simulation", StoredMessage(index), "Result")
+            self.assertEqual(subscription.dropped, 3)
+
+            # the end of the subscription replaces the oldest waiting message when the queue is full
+            tail.close()
+            self.assertEqual(subscription.dropped, 4)
+            entry = await subscription.get(1.0)
+            self.assertEqual(get_indexes([entry]), [1])  # type: ignore
+            self.assertIsNone(await subscription.get(1.0))
+            self.assertTrue(subscription.closed)
+
+        with mock.patch.object(live_tail, "SUBSCRIPTION_QUEUE_SIZE", 2):
+            asyncio.run(run_test())
+
+    def test_live_tail_document(self):
+        """Unit test for leaving out the database object id from the live tail documents."""
+        document = to_live_tail_document((5, "Result", StoredMessage(1)))
+        self.assertEqual(document, {"Sequence": 5, "Topic": "Result", "Message": {"Type": "Result", "Index": 1}})
+
+
+if __name__ == '__main__':
+    unittest.main()
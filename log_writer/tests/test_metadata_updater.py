@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 Tampere University and VTT Technical Research Centre of Finland
+# This software was developed as a part of the ProCemPlus project: https://www.senecc.fi/projects/procemplus
+# This source code is licensed under the MIT license. See LICENSE in the repository root directory.
+# Author(s): Ville Heikkilä <ville.heikkila@tuni.fi>
+#            Otto Hylli <otto.hylli@tuni.fi>
+
+"""Unit tests for coalescing the simulation metadata updates."""
+
+import asyncio
+import unittest
+from typing import List
+
+from log_writer.metadata_updater import MetadataUpdater
+
+
+class UpdateRecorder:
+    """Helper for recording the metadata update calls."""
+    def __init__(self):
+        self.updates: List[int] = []
+        self.state = 0
+
+    async def update(self):
+        self.updates.append(self.state)
+
+
+class TestMetadataUpdater(unittest.TestCase):
+    """Unit tests for the MetadataUpdater class."""
+
+    def test_coalesced_updates(self):
+        """Unit test for combining the update requests made within the update interval to a single update."""
+        async def run_test():
+            recorder = UpdateRecorder()
+            updater = MetadataUpdater(recorder.update, update_interval=0.1)
+
+            # the first request is written immediately
+            recorder.state = 1
+            updater.request_update()
+            await asyncio.sleep(0.01)
+            self.assertEqual(recorder.updates, [1])
+            self.assertFalse(updater.update_pending)
+
+            # the requests within the update interval are combined and the latest state is written
+            for state in range(2, 6):
+                recorder.state = state
+                updater.request_update()
+                await asyncio.sleep(0.01)
+            self.assertEqual(recorder.updates, [1])
+            self.assertTrue(updater.update_pending)
+
+            await asyncio.sleep(0.15)
+            self.assertEqual(recorder.updates, [1, 5])
+            self.assertEqual(updater.update_count, 2)
+            self.assertFalse(updater.update_pending)
+
+        asyncio.run(run_test())
+
+    def test_flush(self):
+        """Unit test for writing the metadata immediately and cancelling the scheduled update."""
+        async def run_test():
+            recorder = UpdateRecorder()
+            updater = MetadataUpdater(recorder.update, update_interval=0.1)
+            updater.request_update()
+            await asyncio.sleep(0.01)
+
+            recorder.state = 1
+            updater.request_update()
+            await updater.flush()
+            self.assertEqual(recorder.updates, [0, 1])
+            self.assertFalse(updater.update_pending)
+
+            # the cancelled update is not written later
+            await asyncio.sleep(0.15)
+            self.assertEqual(recorder.updates, [0, 1])
+
+        asyncio.run(run_test())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 Tampere University and VTT Technical Research Centre of Finland
+# This software was developed as a part of the ProCemPlus project: https://www.senecc.fi/projects/procemplus
+# This source code is licensed under the MIT license. See LICENSE in the repository root directory.
+# Author(s): Ville Heikkilä <ville.heikkila@tuni.fi>
+#            Otto Hylli <otto.hylli@tuni.fi>
+
+"""Unit tests for the metrics and their Prometheus text format."""
+
+import unittest
+
+from log_writer.metrics import MetricsRegistry, format_value
+
+
+class TestMetrics(unittest.TestCase):
+    """Unit tests for the metrics registry."""
+
+    def test_format_value(self):
+        """Unit test for the metric values in the Prometheus text format."""
+        self.assertEqual(format_value(3), "3")
+        self.assertEqual(format_value(2.0), "2")
+        self.assertEqual(format_value(0.25), "0.25")
+        self.assertEqual(format_value(float("inf")), "+Inf")
+
+    def test_prometheus_text(self):
+        """Unit test for writing the counters, gauges and histograms in the Prometheus text format."""
+        registry = MetricsRegistry()
+        messages = registry.counter("messages_total", "The number of messages", ("simulation_id", "topic"))
+        pending = registry.gauge("pending_documents", "The number of pending documents")
+        latency = registry.histogram("store_seconds", "The write latency", (0.1, 1.0))
+
+        messages.inc("simulation", "Result")
+        messages.inc("simulation", "Result", amount=2)
+        messages.inc('a "quoted"\\name', "Epoch")
+        pending.set_function(lambda: 5)
+        latency.observe(0.05)
+        latency.observe(0.5)
+        latency.observe(2.5)
+
+        self.assertEqual(registry.to_prometheus_text(), "\n".join([
+            "# HELP messages_total The number of messages",
+            "# TYPE messages_total counter",
+            'messages_total{simulation_id="simulation",topic="Result"} 3',
+            'messages_total{simulation_id="a \\"quoted\\"\\\\name",topic="Epoch"} 1',
+            "# HELP pending_documents The number of pending documents",
+            "# TYPE pending_documents gauge",
+            "pending_documents 5",
+            "# HELP store_seconds The write latency",
+            "# TYPE store_seconds histogram",
+            'store_seconds_bucket{le="0.1"} 1',
+            'store_seconds_bucket{le="1"} 2',
+            'store_seconds_bucket{le="+Inf"} 3',
+            "store_seconds_sum 3.05",
+            "store_seconds_count 3",
+        ]) + "\n")
+
+    def test_json(self):
+        """Unit test for the JSON form of the metrics."""
+        registry = MetricsRegistry()
+        registry.counter("messages_total", "The number of messages").inc(amount=4)
+        registry.histogram("flush_size", "The flush sizes", (10, 100)).observe(20)
+
+        self.assertEqual(registry.to_json(), {
+            "messages_total": 4,
+            "flush_size": [{"count": 1, "sum": 20, "mean": 20.0, "buckets": {"10": 0, "100": 1}}]
+        })
+
+
+if __name__ == '__main__':
+    unittest.main()
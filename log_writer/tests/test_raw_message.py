@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 Tampere University and VTT Technical Research Centre of Finland
+# This software was developed as a part of the ProCemPlus project: https://www.senecc.fi/projects/procemplus
+# This source code is licensed under the MIT license. See LICENSE in the repository root directory.
+# Author(s): Ville Heikkilä <ville.heikkila@tuni.fi>
+#            Otto Hylli <otto.hylli@tuni.fi>
+
+"""Unit tests for the raw messages of the raw storage mode."""
+
+import asyncio
+import copy
+import unittest
+from typing import Any, List, Optional, Tuple
+
+from log_writer.batcher import MessageBatcher
+from log_writer.compression import PayloadCompressor
+from log_writer.json_codec import JsonCodec
+from log_writer.raw_message import RawMessage
+from log_writer.storage import StorageBackend
+from log_writer.write_queue import WriteQueue
+
+RESULT_MESSAGE = {
+    "Type": "Result",
+    "SimulationId": "2021-01-01T12:00:00.000Z",
+    "SourceProcessId": "component",
+    "MessageId": "component-10",
+    "EpochNumber": 3,
+    "TriggeringMessageIds": ["manager-3"],
+    "Timestamp": "2021-01-01T12:00:03.000Z",
+    "Value": {"UnitOfMeasure": "kW", "Value": 1.5},
+    "Extra": [1, 2, {"Nested": None}]
+}
+
+
+class RecordingStorage(StorageBackend):
+    """Storage backend that records the written documents."""
+    def __init__(self):
+        self.stored_documents: List[Tuple[dict, str]] = []
+
+    async def store_messages(self, documents: List[Tuple[dict, str]], invalid: bool = False,
+                             default_simulation_id: Optional[str] = None) -> List[Any]:
+        self.stored_documents.extend(documents)
+        return list(range(len(documents)))
+
+    async def update_metadata(self, simulation_id: str, **attributes: Any) -> bool:
+        return True
+
+
+class TestRawMessage(unittest.TestCase):
+    """Unit tests for the RawMessage class."""
+
+    def test_attributes(self):
+        """Unit test for reading the metadata attributes from the received message."""
+        raw_message = RawMessage.from_json(copy.deepcopy(RESULT_MESSAGE))
+        assert raw_message is not None
+        self.assertEqual(raw_message.message_type, "Result")
+        self.assertEqual(raw_message.simulation_id, RESULT_MESSAGE["SimulationId"])
+        self.assertEqual(raw_message.timestamp, RESULT_MESSAGE["Timestamp"])
+        self.assertEqual(raw_message.source_process_id, "component")
+        self.assertEqual(raw_message.message_id, "component-10")
+        self.assertEqual(raw_message.epoch_number, 3)
+        self.assertFalse(raw_message.is_simulation_state_message)
+        self.assertIsNone(raw_message.simulation_state)
+
+    def test_invalid_messages(self):
+        """Unit test for rejecting the messages without valid metadata attributes."""
+        for attribute_name, invalid_value in [
+                ("Type", None), ("SimulationId", 12), ("SourceProcessId", ["component"]),
+                ("MessageId", 10), ("EpochNumber", "3"), ("EpochNumber", True),
+                ("Timestamp", None), ("Timestamp", "yesterday")]:
+            message = {**RESULT_MESSAGE, attribute_name: invalid_value}
+            self.assertIsNone(RawMessage.from_json(message), "{:s}: {:s}".format(attribute_name, str(invalid_value)))
+
+    def test_storage_round_trip(self):
+        """Unit test for storing the received message as it was received."""
+        async def run_test():
+            storage = RecordingStorage()
+            write_queue = WriteQueue(storage, high_water_mark=100, low_water_mark=50, writers=1,
+                                     compressor=PayloadCompressor(compression="none"))
+            batcher = MessageBatcher(write_queue)
+            json_codec = JsonCodec("json")
+
+            message_body = json_codec.dumps(RESULT_MESSAGE)
+            raw_message = RawMessage.from_json(json_codec.loads(message_body))
+            assert raw_message is not None
+            await batcher.add_message(RESULT_MESSAGE["SimulationId"], raw_message, "Result.Power")
+            self.assertEqual(await asyncio.wait_for(asyncio.gather(*await batcher.flush()), timeout=5.0), [1])
+
+            self.assertEqual(storage.stored_documents, [(RESULT_MESSAGE, "Result.Power")])
+            await write_queue.close()
+
+        asyncio.run(run_test())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 Tampere University and VTT Technical Research Centre of Finland
+# This software was developed as a part of the ProCemPlus project: https://www.senecc.fi/projects/procemplus
+# This source code is licensed under the MIT license. See LICENSE in the repository root directory.
+# Author(s): Ville Heikkilä <ville.heikkila@tuni.fi>
+#            Otto Hylli <otto.hylli@tuni.fi>
+
+"""Unit tests for the shard selection of the worker processes."""
+
+import json
+import unittest
+from typing import List
+
+from log_writer.shard import SHARD_BY_ROUTING_KEY, SHARD_BY_SIMULATION_ID, ShardFilter
+
+
+def create_message_body(simulation_id: str) -> bytes:
+    """Returns a raw message body with the given simulation id."""
+    return json.dumps({"Type": "Result", "SimulationId": simulation_id, "MessageId": "result-1"}).encode("UTF-8")
+
+
+def get_shard_indexes(shards: List[ShardFilter], message_body: bytes, routing_key: str) -> List[int]:
+    """Returns the indexes of the shards that accept the given message."""
+    return [shard.shard_index for shard in shards if shard.accepts(message_body, routing_key)]
+
+
+class TestShardFilter(unittest.TestCase):
+    """Unit tests for the ShardFilter class."""
+
+    def test_simulation_id_assignment(self):
+        """Unit test for assigning each simulation to exactly one shard regardless of the routing key."""
+        shard_count = 4
+        shards = [ShardFilter(shard_index, shard_count, SHARD_BY_SIMULATION_ID) for shard_index in range(shard_count)]
+        assigned_shards = set()
+        for simulation_index in range(100):
+            message_body = create_message_body("simulation-{:d}".format(simulation_index))
+            shard_indexes = get_shard_indexes(shards, message_body, "Result")
+            self.assertEqual(len(shard_indexes), 1)
+            self.assertEqual(get_shard_indexes(shards, message_body, "Status.Ready"), shard_indexes)
+            assigned_shards.update(shard_indexes)
+
+        # the simulations are spread over all the shards
+        self.assertEqual(assigned_shards, set(range(shard_count)))
+
+    def test_routing_key_assignment(self):
+        """Unit test for assigning each routing key to exactly one shard regardless of the simulation."""
+        shard_count = 3
+        shards = [ShardFilter(shard_index, shard_count, SHARD_BY_ROUTING_KEY) for shard_index in range(shard_count)]
+        for routing_key in ["Result", "Epoch", "SimulationState", "Status.Ready"]:
+            shard_indexes = get_shard_indexes(shards, create_message_body("simulation-1"), routing_key)
+            self.assertEqual(len(shard_indexes), 1)
+            self.assertEqual(get_shard_indexes(shards, create_message_body("simulation-2"), routing_key),
+                             shard_indexes)
+
+    def test_stable_assignment(self):
+        """Unit test for assigning the same simulation to the same shard in every process."""
+        # the shard is selected using CRC-32 which, unlike the built-in hash, does not depend on the process
+        message_body = create_message_body("simulation-1")
+        self.assertTrue(ShardFilter(0, 4).accepts(message_body, "Result"))
+        self.assertTrue(ShardFilter(0, 1).accepts(message_body, "Result"))
+
+    def test_missing_simulation_id(self):
+        """Unit test for assigning the messages without a simulation id to the shard of the empty simulation id."""
+        shards = [ShardFilter(shard_index, 2) for shard_index in range(2)]
+        self.assertEqual(get_shard_indexes(shards, b"not json", "Result"),
+                         get_shard_indexes(shards, create_message_body(""), "Result"))
+
+    def test_invalid_shard(self):
+        """Unit test for the invalid shard parameters."""
+        with self.assertRaises(ValueError):
+            ShardFilter(2, 2)
+        with self.assertRaises(ValueError):
+            ShardFilter(0, 0)
+        with self.assertRaises(ValueError):
+            ShardFilter(0, 2, "message_id")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 Tampere University and VTT Technical Research Centre of Finland
+# This software was developed as a part of the ProCemPlus project: https://www.senecc.fi/projects/procemplus
+# This source code is licensed under the MIT license. See LICENSE in the repository root directory.
+# Author(s): Ville Heikkilä <ville.heikkila@tuni.fi>
+#            Otto Hylli <otto.hylli@tuni.fi>
+
+"""Unit tests for the simulation metadata collection."""
+
+import asyncio
+import unittest
+from typing import Any, List, Optional, Tuple
+from unittest import mock
+
+from log_writer import simulation
+from log_writer.raw_message import RawMessage
+from log_writer.simulation import SimulationMetadataCollection
+from log_writer.storage import StorageBackend
+
+
+class NullStorage(StorageBackend):
+    """Storage backend that does not store anything."""
+    async def store_messages(self, documents: List[Tuple[dict, str]], invalid: bool = False,
+                             default_simulation_id: Optional[str] = None) -> List[Any]:
+        return list(range(len(documents)))
+
+    async def update_metadata(self, simulation_id: str, **attributes: Any) -> bool:
+        return True
+
+
+class RecordingStorage(NullStorage):
+    """Storage backend that records the stored documents and the metadata updates. The writes wait for
+       the release event, which is set by default."""
+    def __init__(self):
+        self.release = asyncio.Event()
+        self.release.set()
+        self.stored_documents: List[dict] = []
+        self.metadata_updates: List[str] = []
+
+    async def store_messages(self, documents: List[Tuple[dict, str]], invalid: bool = False,
+                             default_simulation_id: Optional[str] = None) -> List[Any]:
+        await self.release.wait()
+        self.stored_documents.extend(document for document, _ in documents)
+        return list(range(len(documents)))
+
+    async def update_metadata(self, simulation_id: str, **attributes: Any) -> bool:
+        self.metadata_updates.append(simulation_id)
+        return True
+
+
+def create_message(simulation_id: str, message_index: int, epoch_number: int) -> RawMessage:
+    """Returns a result message for the given simulation."""
+    raw_message = RawMessage.from_json({
+        "Type": "Result", "SimulationId": simulation_id, "SourceProcessId": "component",
+        "MessageId": "component-{:d}".format(message_index), "EpochNumber": epoch_number,
+        "Timestamp": "2021-01-01T00:00:{:02d}.000Z".format(message_index)
+    })
+    assert raw_message is not None
+    return raw_message
+
+
+def create_epoch_message(simulation_id: str, epoch_number: int) -> RawMessage:
+    """Returns an epoch message for the given simulation."""
+    raw_message = RawMessage.from_json({
+        "Type": "Epoch", "SimulationId": simulation_id, "SourceProcessId": "manager",
+        "MessageId": "manager-{:d}".format(epoch_number), "EpochNumber": epoch_number,
+        "Timestamp": "2021-01-01T00:00:00.000Z"
+    })
+    assert raw_message is not None
+    return raw_message
+
+
+async def add_messages(collection: SimulationMetadataCollection, simulation_id: str, topic_name: str,
+                       first_index: int, message_count: int):
+    """Adds the given number of messages for the simulation to the collection."""
+    for message_index in range(first_index, first_index + message_count):
+        await collection.add_message(create_message(simulation_id, message_index, message_index), topic_name)
+
+
+class TestSimulationEviction(unittest.TestCase):
+    """Unit tests for the eviction of the simulations and the tombstones of the evicted simulations."""
+
+    def test_least_recent_eviction(self):
+        """Unit test for removing the least recently active simulation when there are too many simulations."""
+        async def run_test():
+            collection = SimulationMetadataCollection(storage=NullStorage(), service_mode=True)
+            await add_messages(collection, "simulation-1", "Result", 0, 1)
+            await add_messages(collection, "simulation-2", "Result", 0, 1)
+            await add_messages(collection, "simulation-1", "Result", 1, 1)
+            await add_messages(collection, "simulation-3", "Result", 0, 1)
+
+            self.assertEqual(collection.simulations, ["simulation-1", "simulation-3"])
+            await collection.close(5.0)
+
+        with mock.patch.dict(simulation.ENV_VARIABLES, {simulation.MAX_SIMULATIONS_NAME: 2}):
+            asyncio.run(run_test())
+
+    def test_tombstone_restore(self):
+        """Unit test for continuing from the metadata and the message counts of a removed simulation."""
+        async def run_test():
+            collection = SimulationMetadataCollection(storage=NullStorage(), service_mode=True)
+            await add_messages(collection, "simulation-1", "Result", 0, 3)
+            await add_messages(collection, "simulation-1", "Status.Ready", 3, 2)
+            await add_messages(collection, "simulation-2", "Result", 0, 1)
+            self.assertIsNone(collection.get_simulation("simulation-1"))
+
+            await add_messages(collection, "simulation-1", "Result", 5, 1)
+            restored_simulation = collection.get_simulation("simulation-1")
+            self.assertIsNotNone(restored_simulation)
+            assert restored_simulation is not None
+            self.assertEqual(restored_simulation.topic_messages, {"Result": 4, "Status.Ready": 2})
+            self.assertEqual(restored_simulation.total_messages, 6)
+            self.assertEqual(restored_simulation.epoch_min, 0)
+            self.assertEqual(restored_simulation.epoch_max, 5)
+            self.assertEqual(restored_simulation.components, {"component"})
+            await collection.close(5.0)
+
+        with mock.patch.dict(simulation.ENV_VARIABLES, {simulation.MAX_SIMULATIONS_NAME: 1}):
+            asyncio.run(run_test())
+
+    def test_tombstone_limit(self):
+        """Unit test for forgetting the oldest tombstones when there are too many of them."""
+        async def run_test():
+            collection = SimulationMetadataCollection(storage=NullStorage(), service_mode=True)
+            for simulation_index in range(3):
+                await add_messages(collection, "simulation-{:d}".format(simulation_index), "Result", 0, 2)
+
+            # only the tombstone of the latest removed simulation is remembered
+            await add_messages(collection, "simulation-0", "Result", 2, 1)
+            first_simulation = collection.get_simulation("simulation-0")
+            assert first_simulation is not None
+            self.assertEqual(first_simulation.topic_messages, {"Result": 1})
+
+            # the simulation that was removed when the first simulation was added again is remembered
+            await add_messages(collection, "simulation-2", "Result", 2, 1)
+            last_simulation = collection.get_simulation("simulation-2")
+            assert last_simulation is not None
+            self.assertEqual(last_simulation.topic_messages, {"Result": 3})
+            await collection.close(5.0)
+
+        with mock.patch.dict(simulation.ENV_VARIABLES, {
+                simulation.MAX_SIMULATIONS_NAME: 1, simulation.MAX_SIMULATION_TOMBSTONES_NAME: 1}):
+            asyncio.run(run_test())
+
+
+class TestStopDrain(unittest.TestCase):
+    """Unit tests for writing the pending documents to the database when the log writer is stopped."""
+
+    def test_drain(self):
+        """Unit test for writing the buffered messages and the metadata before the collection is closed."""
+        async def run_test():
+            storage = RecordingStorage()
+            collection = SimulationMetadataCollection(storage=storage, service_mode=False)
+            # the first epoch is written to the metadata immediately and the second one is left pending
+            for epoch_number in range(1, 3):
+                await collection.add_message(create_epoch_message("simulation", epoch_number), "Epoch")
+                await asyncio.sleep(0.01)
+            await add_messages(collection, "simulation", "Result", 0, 5)
+            self.assertEqual(storage.metadata_updates, ["simulation"])
+            # the control messages are written immediately and the result messages are buffered
+            self.assertEqual(collection.pending_documents, 5)
+
+            drain_result = await collection.close(5.0)
+            self.assertEqual(drain_result.drained_documents, 5)
+            self.assertEqual(drain_result.remaining_documents, 0)
+            self.assertEqual(len(storage.stored_documents), 7)
+            self.assertEqual(storage.metadata_updates, ["simulation", "simulation"])
+
+        asyncio.run(run_test())
+
+    def test_drain_timeout(self):
+        """Unit test for giving up the drain after the timeout when the database does not respond."""
+        async def run_test():
+            storage = RecordingStorage()
+            storage.release.clear()
+            collection = SimulationMetadataCollection(storage=storage, service_mode=False)
+            await add_messages(collection, "simulation", "Result", 0, 5)
+
+            drain_result = await asyncio.wait_for(collection.close(0.1), timeout=5.0)
+            self.assertEqual(drain_result.remaining_documents, 5)
+            self.assertEqual(drain_result.drained_documents, 0)
+            self.assertLess(drain_result.duration, 5.0)
+            self.assertEqual(storage.stored_documents, [])
+
+        asyncio.run(run_test())
+
+
+if __name__ == '__main__':
+    unittest.main()
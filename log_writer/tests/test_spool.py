@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 Tampere University and VTT Technical Research Centre of Finland
+# This software was developed as a part of the ProCemPlus project: https://www.senecc.fi/projects/procemplus
+# This source code is licensed under the MIT license. See LICENSE in the repository root directory.
+# Author(s): Ville Heikkilä <ville.heikkila@tuni.fi>
+#            Otto Hylli <otto.hylli@tuni.fi>
+
+"""Unit tests for the on-disk message spool."""
+
+import asyncio
+import os
+import tempfile
+import unittest
+from typing import Any, List, Optional, Tuple
+from unittest import mock
+
+from log_writer import spool
+from log_writer.compression import PayloadCompressor
+from log_writer.spool import MessageSpool
+from log_writer.storage import StorageBackend
+from log_writer.write_queue import WriteJob, WriteQueue
+
+
+class PartialStorage(StorageBackend):
+    """Storage backend that writes the documents in order but stops after the given number of documents
+       for each write. The negative numbers write all the documents."""
+    def __init__(self, *write_limits: int):
+        self.__write_limits = list(write_limits)
+        self.stored_documents: List[dict] = []
+        self.write_sizes: List[int] = []
+
+    async def store_messages(self, documents: List[Tuple[dict, str]], invalid: bool = False,
+                             default_simulation_id: Optional[str] = None) -> List[Any]:
+        write_limit = self.__write_limits.pop(0) if self.__write_limits else -1
+        written_documents = documents if write_limit < 0 else documents[:write_limit]
+        self.write_sizes.append(len(documents))
+        self.stored_documents.extend(document for document, _ in written_documents)
+        return list(range(len(written_documents)))
+
+    async def update_metadata(self, simulation_id: str, **attributes: Any) -> bool:
+        return True
+
+
+def create_job(simulation_id: str, size: int) -> WriteJob:
+    """Returns a write job with numbered documents."""
+    return WriteJob(
+        simulation_id, [({"SimulationId": simulation_id, "Index": index}, "Result") for index in range(size)])
+
+
+def create_write_queue(storage: StorageBackend) -> WriteQueue:
+    """Returns a write queue with a single writer that does not compress the documents."""
+    return WriteQueue(storage, high_water_mark=100, low_water_mark=50, writers=1,
+                      compressor=PayloadCompressor(compression="none"))
+
+
+def get_spool_files(directory: str) -> List[str]:
+    """Returns the names of the segment files in the spool directory."""
+    return sorted(
+        file_name for file_name in os.listdir(directory)
+        if file_name.endswith(spool.SEGMENT_FILE_SUFFIX)
+    )
+
+
+class TestMessageSpool(unittest.TestCase):
+    """Unit tests for the MessageSpool class."""
+
+    def test_write_through_spool(self):
+        """Unit test for writing the jobs through the spool and removing the finished segments."""
+        async def run_test(directory: str):
+            storage = PartialStorage()
+            write_queue = create_write_queue(storage)
+            message_spool = MessageSpool(directory, write_queue, segment_max_bytes=200, fsync=False)
+            jobs = [create_job("simulation", 3) for _ in range(5)]
+            done_futures = [await message_spool.put(job) for job in jobs]
+
+            self.assertTrue(all(job.persisted.done() and job.queued for job in jobs))
+            self.assertGreater(message_spool.segment_count, 1)
+            self.assertEqual(await asyncio.wait_for(asyncio.gather(*done_futures), timeout=5.0), [3] * 5)
+
+            await asyncio.wait_for(message_spool.join(), timeout=5.0)
+            self.assertEqual(message_spool.pending_documents, 0)
+            self.assertEqual(len(storage.stored_documents), 15)
+            await message_spool.close()
+            await write_queue.close()
+            # only the active segment is left
+            self.assertEqual(len(get_spool_files(directory)), 1)
+
+        with tempfile.TemporaryDirectory() as directory:
+            asyncio.run(run_test(directory))
+
+    def test_partial_write_retry(self):
+        """Unit test for retrying only the documents after the written ones after a partial write."""
+        async def run_test(directory: str):
+            storage = PartialStorage(2, 1)
+            write_queue = create_write_queue(storage)
+            message_spool = MessageSpool(directory, write_queue, fsync=False)
+            job = create_job("simulation", 5)
+            done_future = await message_spool.put(job)
+
+            self.assertEqual(await asyncio.wait_for(done_future, timeout=5.0), 5)
+            self.assertEqual(storage.write_sizes, [5, 3, 2])
+            self.assertEqual([document["Index"] for document in storage.stored_documents], [0, 1, 2, 3, 4])
+            self.assertEqual(message_spool.pending_documents, 0)
+            await message_spool.close()
+            await write_queue.close()
+
+        with tempfile.TemporaryDirectory() as directory:
+            with mock.patch.dict(spool.ENV_VARIABLES, {spool.SPOOL_RETRY_INTERVAL_NAME: 0.01}):
+                asyncio.run(run_test(directory))
+
+    def test_no_reads_during_retry(self):
+        """Unit test for keeping the later jobs in the segment files while an earlier job is being retried."""
+        async def run_test(directory: str):
+            storage = PartialStorage(0)
+            write_queue = create_write_queue(storage)
+            message_spool = MessageSpool(directory, write_queue, fsync=False)
+            first_future = await message_spool.put(create_job("simulation", 2))
+            while not storage.write_sizes:
+                await asyncio.sleep(0.001)
+            second_future = await message_spool.put(create_job("simulation", 3))
+
+            self.assertEqual(await asyncio.wait_for(asyncio.gather(first_future, second_future), timeout=5.0), [2, 3])
+            # the second job was read only after the retry of the first job had been written
+            self.assertEqual(storage.write_sizes, [2, 2, 3])
+            await message_spool.close()
+            await write_queue.close()
+
+        with tempfile.TemporaryDirectory() as directory:
+            with mock.patch.dict(spool.ENV_VARIABLES, {spool.SPOOL_RETRY_INTERVAL_NAME: 0.05}):
+                asyncio.run(run_test(directory))
+
+    def test_priority_job(self):
+        """Unit test for giving the priority jobs directly to the write queue instead of the spool."""
+        async def run_test(directory: str):
+            storage = PartialStorage()
+            write_queue = create_write_queue(storage)
+            message_spool = MessageSpool(directory, write_queue, fsync=False)
+            job = WriteJob("simulation", [({"SimulationId": "simulation", "Index": 0}, "Epoch")], priority=True)
+            done_future = await message_spool.put(job)
+
+            self.assertEqual(await asyncio.wait_for(done_future, timeout=5.0), 1)
+            self.assertEqual(await job.persisted, 1)
+            self.assertEqual(message_spool.pending_documents, 0)
+            self.assertEqual(os.path.getsize(os.path.join(directory, get_spool_files(directory)[0])), 0)
+            await message_spool.close()
+            await write_queue.close()
+
+        with tempfile.TemporaryDirectory() as directory:
+            asyncio.run(run_test(directory))
+
+    def test_replay(self):
+        """Unit test for replaying the unwritten jobs left in the spool by an earlier run."""
+        async def write_with_failing_storage(directory: str):
+            storage = PartialStorage(*([0] * 10))
+            write_queue = create_write_queue(storage)
+            message_spool = MessageSpool(directory, write_queue, fsync=False)
+            done_future = await message_spool.put(create_job("simulation", 4))
+            await asyncio.sleep(0.05)
+
+            await message_spool.close()
+            await write_queue.close()
+            # the job was persisted to the spool, but it could not be written in this run
+            self.assertEqual(await done_future, 0)
+            self.assertEqual(storage.stored_documents, [])
+
+        async def replay(directory: str):
+            storage = PartialStorage()
+            write_queue = create_write_queue(storage)
+            message_spool = MessageSpool(directory, write_queue, fsync=False)
+            self.assertEqual(message_spool.segment_count, 2)
+            await asyncio.wait_for(message_spool.join(), timeout=5.0)
+
+            self.assertEqual([document["Index"] for document in storage.stored_documents], [0, 1, 2, 3])
+            await message_spool.close()
+            await write_queue.close()
+
+        async def replay_again(directory: str):
+            # the acknowledged jobs are not written again
+            storage = PartialStorage()
+            write_queue = create_write_queue(storage)
+            message_spool = MessageSpool(directory, write_queue, fsync=False)
+            await asyncio.wait_for(message_spool.join(), timeout=5.0)
+            self.assertEqual(storage.stored_documents, [])
+            await message_spool.close()
+            await write_queue.close()
+
+        with tempfile.TemporaryDirectory() as directory:
+            with mock.patch.dict(spool.ENV_VARIABLES, {spool.SPOOL_RETRY_INTERVAL_NAME: 0.01}):
+                asyncio.run(write_with_failing_storage(directory))
+                asyncio.run(replay(directory))
+                asyncio.run(replay_again(directory))
+
+
+if __name__ == '__main__':
+    unittest.main()
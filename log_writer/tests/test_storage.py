@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 Tampere University and VTT Technical Research Centre of Finland
+# This software was developed as a part of the ProCemPlus project: https://www.senecc.fi/projects/procemplus
+# This source code is licensed under the MIT license. See LICENSE in the repository root directory.
+# Author(s): Ville Heikkilä <ville.heikkila@tuni.fi>
+#            Otto Hylli <otto.hylli@tuni.fi>
+
+"""Unit tests for the storage backends."""
+
+import asyncio
+import gzip
+import json
+import os
+import tempfile
+import unittest
+from typing import Any, Dict, List, Optional
+
+from pymongo.errors import BulkWriteError
+
+from log_writer.storage import FileBackend, MongodbBackend
+
+
+def create_documents(simulation_id: str, count: int) -> List[Any]:
+    """Returns a list of numbered (document, topic) tuples for the given simulation."""
+    return [({"SimulationId": simulation_id, "Index": index}, "Result") for index in range(count)]
+
+
+def read_message_files(simulation_directory: str) -> Dict[str, List[dict]]:
+    """Returns the documents in each message file of the simulation directory."""
+    return {
+        file_name: [json.loads(line) for line in gzip.open(os.path.join(simulation_directory, file_name), "rt")]
+        for file_name in sorted(os.listdir(simulation_directory))
+        if file_name.endswith(".jsonl.gz")
+    }
+
+
+class InsertResult:
+    """Stand-in for the result of insert_many."""
+    def __init__(self, inserted_ids: List[Any]):
+        self.inserted_ids = inserted_ids
+
+
+class FailingCollection:
+    """Stand-in for a MongoDB collection that fails to insert the documents with the given indexes."""
+    def __init__(self, name: str, failed_indexes: List[int], error_details: Optional[dict]):
+        self.name = name
+        self.__failed_indexes = failed_indexes
+        self.__error_details = error_details
+        self.documents: List[dict] = []
+
+    async def insert_many(self, documents: List[dict], ordered: bool = True) -> InsertResult:
+        del ordered
+        for index, document in enumerate(documents):
+            document["_id"] = "{:s}-{:d}".format(self.name, index)
+            if index not in self.__failed_indexes:
+                self.documents.append(document)
+        if self.__failed_indexes:
+            raise BulkWriteError(self.__error_details)  # type: ignore
+        return InsertResult([document["_id"] for document in documents])
+
+
+class FailingDatabase:
+    """Stand-in for a MongoDB database whose collections fail to insert the second document of each insert."""
+    def __init__(self, error_details: Optional[dict]):
+        self.__error_details = error_details
+        self.collections: Dict[str, FailingCollection] = {}
+
+    def __getitem__(self, name: str) -> FailingCollection:
+        return self.collections.setdefault(name, FailingCollection(name, [1], self.__error_details))
+
+
+class TestFileBackend(unittest.TestCase):
+    """Unit tests for the FileBackend class."""
+
+    def test_rotation(self):
+        """Unit test for starting a new message file once the current file has reached the maximum size."""
+        async def run_test(directory: str):
+            backend = FileBackend(directory, max_bytes=1)
+            self.assertEqual(len(await backend.store_messages(create_documents("simulation", 3))), 3)
+            self.assertEqual(len(await backend.store_messages(create_documents("simulation", 2))), 2)
+
+            message_files = read_message_files(os.path.join(directory, "simulation"))
+            self.assertEqual(list(message_files), ["messages-000001.jsonl.gz", "messages-000002.jsonl.gz"])
+            self.assertEqual([document["Index"] for document in message_files["messages-000001.jsonl.gz"]],
+                             [0, 1, 2])
+            self.assertEqual(message_files["messages-000002.jsonl.gz"][0]["Topic"], "Result")
+
+            # a new backend, e.g. after a restart, continues from the latest file
+            restarted_backend = FileBackend(directory, max_bytes=1024 * 1024)
+            await restarted_backend.store_messages(create_documents("simulation", 1))
+            message_files = read_message_files(os.path.join(directory, "simulation"))
+            self.assertEqual(len(message_files), 2)
+            self.assertEqual(len(message_files["messages-000002.jsonl.gz"]), 3)
+
+        with tempfile.TemporaryDirectory() as directory:
+            asyncio.run(run_test(directory))
+
+    def test_metadata(self):
+        """Unit test for writing the combined metadata updates to the metadata file."""
+        async def run_test(directory: str):
+            backend = FileBackend(directory)
+            self.assertTrue(await backend.update_metadata("simulation", Name="test"))
+            self.assertTrue(await backend.update_metadata("simulation", Epochs=3))
+            with open(os.path.join(directory, "simulation", "metadata.json"), encoding="UTF-8") as metadata_file:
+                self.assertEqual(json.load(metadata_file), {"SimulationId": "simulation", "Name": "test", "Epochs": 3})
+
+        with tempfile.TemporaryDirectory() as directory:
+            asyncio.run(run_test(directory))
+
+
+class TestMongodbBackend(unittest.TestCase):
+    """Unit tests for the unordered inserts of the MongodbBackend class."""
+
+    def test_partial_unordered_insert(self):
+        """Unit test for returning the identifiers of the inserted documents when some of the documents fail."""
+        async def run_test(error_details: Optional[dict], expected_ids: List[str]):
+            database = FailingDatabase(error_details)
+            backend = MongodbBackend(mongo_client=object(), ordered=False, database=database)  # type: ignore
+            self.assertEqual(await backend.store_messages(create_documents("simulation", 3)), expected_ids)
+            self.assertEqual(list(database.collections), ["simulation_simulation"])
+
+        asyncio.run(run_test({"writeErrors": [{"index": 1}]}, ["simulation_simulation-0", "simulation_simulation-2"]))
+        # without the error details none of the documents are known to have failed
+        asyncio.run(run_test(None, ["simulation_simulation-0", "simulation_simulation-1", "simulation_simulation-2"]))
+
+
+if __name__ == '__main__':
+    unittest.main()
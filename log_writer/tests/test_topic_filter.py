@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 Tampere University and VTT Technical Research Centre of Finland
+# This software was developed as a part of the ProCemPlus project: https://www.senecc.fi/projects/procemplus
+# This source code is licensed under the MIT license. See LICENSE in the repository root directory.
+# Author(s): Ville Heikkilä <ville.heikkila@tuni.fi>
+#            Otto Hylli <otto.hylli@tuni.fi>
+
+"""Unit tests for the topic pattern handling of the topic filter."""
+
+import unittest
+
+from log_writer.topic_filter import split_topic_patterns, topic_pattern_to_regex
+
+
+class TestTopicPatterns(unittest.TestCase):
+    """Unit tests for converting the RabbitMQ topic patterns to regular expressions."""
+
+    def assert_matches(self, topic_pattern: str, matching_topics, other_topics):
+        """Checks that the regular expression for the topic pattern matches exactly the given topics."""
+        topic_regex = topic_pattern_to_regex(topic_pattern)
+        for topic_name in matching_topics:
+            self.assertIsNotNone(topic_regex.match(topic_name), "{:s} should match {:s}".format(
+                topic_pattern, topic_name))
+        for topic_name in other_topics:
+            self.assertIsNone(topic_regex.match(topic_name), "{:s} should not match {:s}".format(
+                topic_pattern, topic_name))
+
+    def test_exact_topic(self):
+        """Unit test for a topic pattern without wildcards."""
+        self.assert_matches("Result.Grid", ["Result.Grid"], ["Result", "Result.Grid.Voltage", "ResultXGrid"])
+
+    def test_single_word_wildcard(self):
+        """Unit test for the '*' wildcard that matches exactly one word."""
+        self.assert_matches("Result.*", ["Result.Grid", "Result.x"], ["Result", "Result.Grid.Voltage", "Results.x"])
+        self.assert_matches("*.Error", ["Status.Error"], ["Error", "Status.Ready.Error"])
+
+    def test_multiple_word_wildcard(self):
+        """Unit test for the '#' wildcard that matches zero or more words."""
+        self.assert_matches("#", ["Epoch", "Result.Grid.Voltage"], [])
+        self.assert_matches("Result.#", ["Result", "Result.Grid", "Result.Grid.Voltage"], ["Results", "Epoch"])
+        self.assert_matches("#.Error", ["Error", "Status.Error", "a.b.Error"], ["Status.Errors", "Error.x"])
+        self.assert_matches("Status.#.Error", ["Status.Error", "Status.a.b.Error"], ["Status", "StatusError"])
+
+    def test_special_characters(self):
+        """Unit test for escaping the regular expression special characters in the topic words."""
+        self.assert_matches("a+b.(c)", ["a+b.(c)"], ["aab.c", "ab.(c)"])
+
+    def test_split_topic_patterns(self):
+        """Unit test for splitting a comma separated list of topic patterns."""
+        self.assertEqual(split_topic_patterns(" Result.*, ,Status.# ,"), ["Result.*", "Status.#"])
+
+
+if __name__ == '__main__':
+    unittest.main()
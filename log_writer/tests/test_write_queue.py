@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 Tampere University and VTT Technical Research Centre of Finland
+# This software was developed as a part of the ProCemPlus project: https://www.senecc.fi/projects/procemplus
+# This source code is licensed under the MIT license. See LICENSE in the repository root directory.
+# Author(s): Ville Heikkilä <ville.heikkila@tuni.fi>
+#            Otto Hylli <otto.hylli@tuni.fi>
+
+"""Unit tests for the bounded write queue."""
+
+import asyncio
+import unittest
+from typing import Any, List, Optional, Tuple
+
+from log_writer.compression import PayloadCompressor
+from log_writer.storage import StorageBackend
+from log_writer.write_queue import WriteJob, WriteQueue
+
+
+class GatedStorage(StorageBackend):
+    """Storage backend that records the written jobs and writes only as many jobs as it has been allowed to."""
+    def __init__(self):
+        self.__permits = asyncio.Semaphore(0)
+        self.written_simulations: List[str] = []
+
+    def allow(self, job_count: int):
+        """Allows the given number of jobs to be written."""
+        for _ in range(job_count):
+            self.__permits.release()
+
+    async def store_messages(self, documents: List[Tuple[dict, str]], invalid: bool = False,
+                             default_simulation_id: Optional[str] = None) -> List[Any]:
+        await self.__permits.acquire()
+        self.written_simulations.append(documents[0][0]["SimulationId"])
+        return list(range(len(documents)))
+
+    async def update_metadata(self, simulation_id: str, **attributes: Any) -> bool:
+        return True
+
+
+def create_job(simulation_id: str, size: int, priority: bool = False) -> WriteJob:
+    """Returns a write job with the given number of documents."""
+    return WriteJob(
+        simulation_id, [({"SimulationId": simulation_id}, "Result") for _ in range(size)], priority=priority)
+
+
+def create_write_queue(storage: StorageBackend, high_water_mark: int, low_water_mark: int,
+                       writers: int) -> WriteQueue:
+    """Returns a write queue that does not compress the documents."""
+    return WriteQueue(storage, high_water_mark=high_water_mark, low_water_mark=low_water_mark, writers=writers,
+                      compressor=PayloadCompressor(compression="none"))
+
+
+class TestWriteQueue(unittest.TestCase):
+    """Unit tests for the WriteQueue class."""
+
+    def test_water_marks(self):
+        """Unit test for blocking the new jobs between the high and the low water mark."""
+        async def run_test():
+            storage = GatedStorage()
+            write_queue = create_write_queue(storage, high_water_mark=10, low_water_mark=4, writers=1)
+            self.assertEqual(write_queue.high_water_mark, 10)
+            self.assertEqual(write_queue.low_water_mark, 4)
+
+            first_futures = [await write_queue.put(create_job("first", 5)) for _ in range(2)]
+            self.assertEqual(write_queue.pending_documents, 10)
+            self.assertTrue(write_queue.is_blocking)
+
+            blocked_put = asyncio.ensure_future(write_queue.put(create_job("blocked", 1)))
+            await asyncio.sleep(0.01)
+            self.assertFalse(blocked_put.done())
+
+            # the priority jobs are accepted above the high water mark
+            priority_future = await write_queue.put(create_job("priority", 1, priority=True))
+            self.assertEqual(write_queue.pending_documents, 11)
+
+            storage.allow(4)
+            await asyncio.gather(*first_futures, priority_future)
+            blocked_future = await asyncio.wait_for(blocked_put, timeout=1.0)
+            self.assertEqual(await blocked_future, 1)
+            self.assertFalse(write_queue.is_blocking)
+            self.assertEqual(write_queue.pending_documents, 0)
+            await write_queue.close()
+
+        asyncio.run(run_test())
+
+    def test_release_at_low_water_mark(self):
+        """Unit test for releasing the blocked jobs only after the low water mark has been reached."""
+        async def run_test():
+            storage = GatedStorage()
+            write_queue = create_write_queue(storage, high_water_mark=6, low_water_mark=2, writers=1)
+            for _ in range(3):
+                await write_queue.put(create_job("first", 2))
+            self.assertTrue(write_queue.is_blocking)
+
+            blocked_put = asyncio.ensure_future(write_queue.put(create_job("blocked", 1)))
+            # writing one job lowers the pending documents to 4 which is still above the low water mark
+            storage.allow(1)
+            await asyncio.sleep(0.01)
+            self.assertEqual(len(storage.written_simulations), 1)
+            self.assertFalse(blocked_put.done())
+
+            storage.allow(3)
+            await asyncio.wait_for(blocked_put, timeout=1.0)
+            await write_queue.join()
+            self.assertEqual(storage.written_simulations, ["first", "first", "first", "blocked"])
+            await write_queue.close()
+
+        asyncio.run(run_test())
+
+    def test_priority_order(self):
+        """Unit test for writing the priority jobs before the other jobs in the queue."""
+        async def run_test():
+            storage = GatedStorage()
+            write_queue = create_write_queue(storage, high_water_mark=100, low_water_mark=50, writers=1)
+            await write_queue.put(create_job("started", 1))
+            # let the writer start writing the first job
+            await asyncio.sleep(0)
+            await write_queue.put(create_job("normal 1", 1))
+            await write_queue.put(create_job("normal 2", 1))
+            await write_queue.put(create_job("priority 1", 1, priority=True))
+            await write_queue.put(create_job("priority 2", 1, priority=True))
+
+            storage.allow(5)
+            await write_queue.join()
+            self.assertEqual(
+                storage.written_simulations,
+                ["started", "priority 1", "priority 2", "normal 1", "normal 2"])
+            await write_queue.close()
+
+        asyncio.run(run_test())
+
+    def test_close_resolves_queued_jobs(self):
+        """Unit test for resolving the futures of the unwritten jobs when the queue is closed."""
+        async def run_test():
+            storage = GatedStorage()
+            write_queue = create_write_queue(storage, high_water_mark=100, low_water_mark=50, writers=1)
+            job = create_job("queued", 3)
+            futures = [await write_queue.put(create_job("started", 1)), await write_queue.put(job)]
+            await asyncio.sleep(0)
+
+            await write_queue.close()
+            self.assertEqual(await futures[1], 0)
+            self.assertEqual(await job.persisted, 0)
+            self.assertTrue(all(future.done() for future in futures))
+
+        asyncio.run(run_test())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 Tampere University and VTT Technical Research Centre of Finland
+# This software was developed as a part of the ProCemPlus project: https://www.senecc.fi/projects/procemplus
+# This source code is licensed under the MIT license. See LICENSE in the repository root directory.
+# Author(s): Ville Heikkilä <ville.heikkila@tuni.fi>
+#            Otto Hylli <otto.hylli@tuni.fi>
+
+"""Module containing the topic filter that selects which of the messages on the message bus are stored."""
+
+import collections
+import re
+from typing import List, Optional, Pattern, Tuple, Union, cast
+
+from tools.tools import FullLogger, load_environmental_variables
+
+LOGGER = FullLogger(__name__)
+
+LISTENED_TOPICS_NAME = "LISTENED_TOPICS"
+EXCLUDED_TOPICS_NAME = "EXCLUDED_TOPICS"
+TOPIC_SAMPLING_NAME = "TOPIC_SAMPLING"
+
+ENV_VARIABLES = load_environmental_variables(
+    # comma separated list of topic patterns that are bound to the exchange
+    (LISTENED_TOPICS_NAME, str, "#"),
+    # comma separated list of topic patterns for messages that are not stored
+    (EXCLUDED_TOPICS_NAME, str, ""),
+    # comma separated list of sampling rules: <pattern>=1/<N> or <pattern>=<X>/epoch
+    (TOPIC_SAMPLING_NAME, str, "")
+)
+
+# the messages with these topics are always received and stored, since the simulation metadata depends on them
+CONTROL_TOPICS = ("SimulationState", "Epoch")
+
+# the maximum number of (simulation, topic) pairs for which the per epoch message counts are kept
+MAX_EPOCH_COUNTERS = 10000
+
+
+def topic_pattern_to_regex(topic_pattern: str) -> Pattern:
+    """Returns a compiled regular expression corresponding to the given RabbitMQ topic pattern.
+       In the pattern, '*' matches exactly one word and '#' matches zero or more words."""
+    if topic_pattern == "#":
+        return re.compile(".*$")
+
+    regex = ""
+    separator = ""
+    for word in topic_pattern.split("."):
+        # the separators next to '#' are included in its repeated group, so that it can also match zero words
+        if word == "#" and not regex:
+            regex = r"(?:[^.]+\.)*"
+            separator = ""
+        elif word == "#":
+            regex += r"(?:\.[^.]+)*"
+            separator = r"\."
+        else:
+            regex += separator + ("[^.]+" if word == "*" else re.escape(word))
+            separator = r"\."
+    return re.compile(regex + "$")
+
+
+def split_topic_patterns(topic_patterns: str) -> List[str]:
+    """Returns the non-empty topic patterns from the given comma separated list."""
+    return [topic_pattern.strip() for topic_pattern in topic_patterns.split(",") if topic_pattern.strip()]
+
+
+class SamplingRule:
+    """Class for a sampling rule: either keep one message out of every N or at most X messages per epoch."""
+    PER_EPOCH = "epoch"
+
+    def __init__(self, topic_pattern: str, limit: int, per_epoch: bool):
+        self.__topic_pattern = topic_pattern
+        self.__regex = topic_pattern_to_regex(topic_pattern)
+        self.__limit = max(limit, 1)
+        self.__per_epoch = per_epoch
+
+    @property
+    def topic_pattern(self) -> str:
+        """The topic pattern for the rule."""
+        return self.__topic_pattern
+
+    @property
+    def limit(self) -> int:
+        """N for the rules that keep one message out of every N, or X for the rules with at most X per epoch."""
+        return self.__limit
+
+    @property
+    def per_epoch(self) -> bool:
+        """Returns True, if the rule limits the number of messages per epoch."""
+        return self.__per_epoch
+
+    def matches(self, topic_name: str) -> bool:
+        """Returns True, if the rule applies to the given topic."""
+        return self.__regex.match(topic_name) is not None
+
+    @classmethod
+    def from_string(cls, rule_string: str) -> Union["SamplingRule", None]:
+        """Returns the rule corresponding to a string of the form '<pattern>=1/<N>' or '<pattern>=<X>/epoch'.
+           Returns None, if the string is not a valid rule."""
+        try:
+            topic_pattern, rule = rule_string.split("=")
+            numerator, denominator = rule.strip().split("/")
+            if denominator.strip() == SamplingRule.PER_EPOCH:
+                return cls(topic_pattern.strip(), int(numerator), True)
+            if int(numerator) == 1:
+                return cls(topic_pattern.strip(), int(denominator), False)
+        except ValueError:
+            pass
+        LOGGER.warning("Ignoring invalid topic sampling rule: '{:s}'".format(rule_string))
+        return None
+
+    def __str__(self) -> str:
+        if self.__per_epoch:
+            return "{:s}={:d}/{:s}".format(self.__topic_pattern, self.__limit, SamplingRule.PER_EPOCH)
+        return "{:s}=1/{:d}".format(self.__topic_pattern, self.__limit)
+
+
+class TopicFilter:
+    """Class for selecting the stored messages based on their topics.
+
+    The listened topic patterns are used as the bindings for the message bus exchange. The messages with topics
+    matching the excluded patterns are dropped before they are decoded. The sampling rules drop a part of the
+    messages for the matching topics: either all but one out of every N messages or the messages exceeding
+    the given number per epoch for each simulation. The first matching rule is used for each topic.
+    The simulation state and epoch messages are always kept.
+    """
+    def __init__(self, listened_topics: Optional[List[str]] = None, excluded_topics: Optional[List[str]] = None,
+                 sampling_rules: Optional[List[SamplingRule]] = None):
+        if listened_topics is None:
+            listened_topics = split_topic_patterns(cast(str, ENV_VARIABLES[LISTENED_TOPICS_NAME]))
+        if excluded_topics is None:
+            excluded_topics = split_topic_patterns(cast(str, ENV_VARIABLES[EXCLUDED_TOPICS_NAME]))
+        if sampling_rules is None:
+            sampling_rules = [
+                sampling_rule
+                for sampling_rule in (
+                    SamplingRule.from_string(rule_string)
+                    for rule_string in split_topic_patterns(cast(str, ENV_VARIABLES[TOPIC_SAMPLING_NAME])))
+                if sampling_rule is not None
+            ]
+
+        if not listened_topics or "#" in listened_topics:
+            self.__listened_topics = ["#"]
+        else:
+            self.__listened_topics = listened_topics + [
+                control_topic for control_topic in CONTROL_TOPICS if control_topic not in listened_topics]
+        self.__excluded_topics = excluded_topics
+        self.__excluded_regexes = [topic_pattern_to_regex(topic_pattern) for topic_pattern in excluded_topics]
+        self.__sampling_rules = sampling_rules
+
+        # the filter results are cached for each topic: (excluded, sampling rule)
+        self.__topic_cache = {}
+        self.__sample_counters = {}
+        self.__epoch_counters = collections.OrderedDict()
+        self.__excluded_messages = 0
+        self.__sampled_out_messages = 0
+
+    @property
+    def listened_topics(self) -> List[str]:
+        """The topic patterns that are bound to the exchange."""
+        return self.__listened_topics
+
+    @property
+    def is_active(self) -> bool:
+        """Returns True, if the filter can drop any messages."""
+        return bool(self.__excluded_regexes or self.__sampling_rules)
+
+    @property
+    def excluded_messages(self) -> int:
+        """The number of messages that were dropped because their topic was excluded."""
+        return self.__excluded_messages
+
+    @property
+    def sampled_out_messages(self) -> int:
+        """The number of messages that were dropped by the sampling rules."""
+        return self.__sampled_out_messages
+
+    def accepts_topic(self, topic_name: str) -> bool:
+        """Returns True, if the messages with the given topic are not excluded."""
+        excluded, _ = self.__get_topic_settings(topic_name)
+        if excluded:
+            self.__excluded_messages += 1
+            return False
+        return True
+
+    def sample(self, topic_name: str, simulation_id: Optional[str], epoch_number: Optional[int]) -> bool:
+        """Returns True, if the message with the given topic, simulation id and epoch number should be kept
+           according to the sampling rules."""
+        _, sampling_rule = self.__get_topic_settings(topic_name)
+        if sampling_rule is None:
+            return True
+
+        if sampling_rule.per_epoch:
+            counter_key = (simulation_id, topic_name)
+            counter_epoch, message_count = self.__epoch_counters.pop(counter_key, (epoch_number, 0))
+            if counter_epoch != epoch_number:
+                message_count = 0
+            message_count += 1
+            self.__epoch_counters[counter_key] = (epoch_number, message_count)
+            if len(self.__epoch_counters) > MAX_EPOCH_COUNTERS:
+                self.__epoch_counters.popitem(last=False)
+            keep_message = message_count <= sampling_rule.limit
+
+        else:
+            message_count = self.__sample_counters.get(topic_name, 0)
+            self.__sample_counters[topic_name] = (message_count + 1) % sampling_rule.limit
+            keep_message = message_count == 0
+
+        if not keep_message:
+            self.__sampled_out_messages += 1
+        return keep_message
+
+    def __str__(self) -> str:
+        return "listened: {:s}, excluded: {:s}, sampling: {:s}, excluded messages: {:d}, sampled out: {:d}".format(
+            ", ".join(self.__listened_topics), ", ".join(self.__excluded_topics) or "-",
+            ", ".join(str(sampling_rule) for sampling_rule in self.__sampling_rules) or "-",
+            self.__excluded_messages, self.__sampled_out_messages)
+
+    def __get_topic_settings(self, topic_name: str) -> Tuple[bool, Optional[SamplingRule]]:
+        """Returns whether the topic is excluded and the sampling rule for the topic."""
+        topic_settings = self.__topic_cache.get(topic_name, None)
+        if topic_settings is None:
+            if topic_name in CONTROL_TOPICS:
+                topic_settings = (False, None)
+            else:
+                topic_settings = (
+                    any(regex.match(topic_name) is not None for regex in self.__excluded_regexes),
+                    next(
+                        (sampling_rule for sampling_rule in self.__sampling_rules if sampling_rule.matches(topic_name)),
+                        None)
+                )
+            self.__topic_cache[topic_name] = topic_settings
+        return topic_settings
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 Tampere University and VTT Technical Research Centre of Finland
+# This software was developed as a part of the ProCemPlus project: https://www.senecc.fi/projects/procemplus
+# This source code is licensed under the MIT license. See LICENSE in the repository root directory.
+# Author(s): Ville Heikkilä <ville.heikkila@tuni.fi>
+#            Otto Hylli <otto.hylli@tuni.fi>
+
+"""Module containing a cache for the message type specific validation checks."""
+
+from typing import Any, Dict, FrozenSet, Optional, Type
+
+from tools.exceptions.messages import MessageError
+from tools.messages import BaseMessage, EpochMessage, GeneralMessage, SimulationStateMessage, StatusMessage
+
+
+class MessageValidatorCache:
+    """Class for validating received messages using required attribute checks that are compiled once per message type.
+       Messages that are missing required attributes are rejected before any message object is created.
+
+    The from_json method of the message classes checks all the attributes before creating the message object,
+    and the message constructor checks the attribute values again. Since the required attributes are already
+    checked by the cache, the message object is created directly and the attribute values are checked only once.
+    """
+    MESSAGE_CLASSES = {
+        message_class.CLASS_MESSAGE_TYPE: message_class
+        for message_class in (EpochMessage, SimulationStateMessage, StatusMessage)
+    }
+
+    def __init__(self):
+        self.__required_attributes = {}
+
+    @property
+    def message_types(self) -> Dict[str, FrozenSet[str]]:
+        """The cached message types with their required attributes."""
+        return dict(self.__required_attributes)
+
+    def get_required_attributes(self, message_type: str) -> FrozenSet[str]:
+        """Returns the required attributes for the given message type."""
+        required_attributes = self.__required_attributes.get(message_type, None)
+        if required_attributes is None:
+            message_class = self.get_message_class(message_type)
+            required_attributes = frozenset(
+                attribute_name
+                for attribute_name in message_class.MESSAGE_ATTRIBUTES_FULL
+                if attribute_name not in message_class.OPTIONAL_ATTRIBUTES_FULL
+            )
+            self.__required_attributes[message_type] = required_attributes
+        return required_attributes
+
+    def has_required_attributes(self, json_message: Dict[str, Any]) -> bool:
+        """Returns True, if the given message has a type and all the required attributes for that type."""
+        message_type = json_message.get("Type", None)
+        if not isinstance(message_type, str):
+            return False
+        return self.get_required_attributes(message_type).issubset(json_message.keys())
+
+    def validate(self, json_message: Dict[str, Any]) -> Optional[BaseMessage]:
+        """Returns a message object created from the given message or None if the message is not valid.
+           The message type specific class is used for the known message types if the message is valid for it."""
+        if not self.has_required_attributes(json_message):
+            return None
+
+        message_class = self.get_message_class(json_message["Type"])
+        if message_class is not GeneralMessage:
+            message_object = self.create_message(message_class, json_message)
+            if message_object is not None:
+                return message_object
+        # use the GeneralMessage type when dealing with possible unknown message type
+        return self.create_message(GeneralMessage, json_message)
+
+    @staticmethod
+    def create_message(message_class: Type[BaseMessage], json_message: Dict[str, Any]) -> Optional[BaseMessage]:
+        """Returns a message object of the given class or None if the attribute values are not valid for it."""
+        try:
+            return message_class(**json_message)
+        except (MessageError, TypeError, ValueError):
+            return None
+
+    @classmethod
+    def get_message_class(cls, message_type: str) -> Type[BaseMessage]:
+        """Returns the message class whose required attributes are used for the given message type."""
+        return cls.MESSAGE_CLASSES.get(message_type, GeneralMessage)
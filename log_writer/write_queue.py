@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+# Copyright 2021 Tampere University and VTT Technical Research Centre of Finland
+# This software was developed as a part of the ProCemPlus project: https://www.senecc.fi/projects/procemplus
+# This source code is licensed under the MIT license. See LICENSE in the repository root directory.
+# Author(s): Ville Heikkilä <ville.heikkila@tuni.fi>
+#            Otto Hylli <otto.hylli@tuni.fi>
+
+"""Module containing a bounded write queue that decouples the message intake from the database writes."""
+
+import asyncio
+import time
+from typing import Callable, List, Optional, Tuple, Union, cast
+
+from tools.tools import FullLogger, load_environmental_variables
+
+from log_writer.compression import PayloadCompressor
+from log_writer.metrics import COMPRESSED_PAYLOAD_BYTES, FAILED_DOCUMENTS, STORE_LATENCY
+from log_writer.profiling import STAGE_STORE, STAGE_TIMERS
+from log_writer.storage import StorageBackend
+
+LOGGER = FullLogger(__name__)
+
+WRITE_QUEUE_HIGH_WATER_MARK_NAME = "WRITE_QUEUE_HIGH_WATER_MARK"
+WRITE_QUEUE_LOW_WATER_MARK_NAME = "WRITE_QUEUE_LOW_WATER_MARK"
+WRITE_QUEUE_WRITERS_NAME = "WRITE_QUEUE_WRITERS"
+
+ENV_VARIABLES = load_environmental_variables(
+    (WRITE_QUEUE_HIGH_WATER_MARK_NAME, int, 1000),
+    (WRITE_QUEUE_LOW_WATER_MARK_NAME, int, 500),
+    (WRITE_QUEUE_WRITERS_NAME, int, 2)
+)
+
+
+class WriteJob:
+    """Class for holding a batch of message documents that are written to the database with a single call."""
+    def __init__(self, simulation_id: str, documents: List[Tuple[dict, str]], invalid: bool = False,
+                 priority: bool = False):
+        self.__simulation_id = simulation_id
+        self.__documents = documents
+        self.__invalid = invalid
+        self.__priority = priority
+        self.__latency = None
+        self.__queued = False
+        self.__persisted = asyncio.get_running_loop().create_future()
+        self.__done = asyncio.get_running_loop().create_future()
+
+    @property
+    def simulation_id(self) -> str:
+        """The simulation identifier for the documents."""
+        return self.__simulation_id
+
+    @property
+    def documents(self) -> List[Tuple[dict, str]]:
+        """The message documents as a list of (document, topic) tuples."""
+        return self.__documents
+
+    @property
+    def invalid(self) -> bool:
+        """Returns True, if the documents are invalid messages."""
+        return self.__invalid
+
+    @property
+    def priority(self) -> bool:
+        """Returns True, if the job is written before the other jobs in the queue, e.g. for the control messages."""
+        return self.__priority
+
+    @property
+    def size(self) -> int:
+        """The number of documents in the job."""
+        return len(self.__documents)
+
+    @property
+    def latency(self) -> Union[float, None]:
+        """The time in seconds that the database write took or None if the job has not been written yet."""
+        return self.__latency
+
+    @latency.setter
+    def latency(self, latency: float):
+        """Sets the time in seconds that the database write took."""
+        self.__latency = latency
+
+    @property
+    def queued(self) -> bool:
+        """Returns True, if the job has been accepted to the write queue or to the spool."""
+        return self.__queued
+
+    @queued.setter
+    def queued(self, queued: bool):
+        """Sets whether the job has been accepted to the write queue or to the spool."""
+        self.__queued = queued
+
+    @property
+    def persisted(self) -> asyncio.Future:
+        """Future that will contain the number of persisted documents once the job will no longer be lost when
+           the log writer is stopped, i.e. when the documents have been written to the database or to the spool."""
+        return self.__persisted
+
+    @property
+    def done(self) -> asyncio.Future:
+        """Future that will contain the number of written documents once the job has been handled."""
+        return self.__done
+
+
+class WriteQueue:
+    """Bounded in-memory queue for the message documents that are written to the database by writer tasks.
+
+    The queue is bounded by the number of pending documents. When the number of pending documents reaches
+    the high water mark, adding new jobs is blocked until the writers have lowered the number of pending
+    documents to the low water mark. The priority jobs are not blocked and they are written before
+    the other jobs in the queue. If the payload compression is enabled, the large payload attributes
+    of the documents are compressed in a worker thread just before the documents are written.
+    """
+    def __init__(self, storage: StorageBackend, high_water_mark: Optional[int] = None,
+                 low_water_mark: Optional[int] = None, writers: Optional[int] = None,
+                 compressor: Optional[PayloadCompressor] = None):
+        self.__storage = storage
+        self.__compressor = compressor if compressor is not None else PayloadCompressor()
+
+        if high_water_mark is None:
+            high_water_mark = cast(int, ENV_VARIABLES[WRITE_QUEUE_HIGH_WATER_MARK_NAME])
+        if low_water_mark is None:
+            low_water_mark = cast(int, ENV_VARIABLES[WRITE_QUEUE_LOW_WATER_MARK_NAME])
+        if writers is None:
+            writers = cast(int, ENV_VARIABLES[WRITE_QUEUE_WRITERS_NAME])
+        self.__high_water_mark = max(high_water_mark, 1)
+        self.__low_water_mark = min(max(low_water_mark, 0), self.__high_water_mark - 1)
+        self.__writer_count = max(writers, 1)
+
+        # the jobs are ordered by their priority and then by the order in which they were added
+        self.__jobs = asyncio.PriorityQueue()
+        self.__job_count = 0
+        self.__pending_documents = 0
+        self.__accepting = asyncio.Event()
+        self.__accepting.set()
+        self.__writers = []
+        self.__write_callbacks = []
+
+    @property
+    def pending_documents(self) -> int:
+        """The number of documents that have been added to the queue but not yet written to the database."""
+        return self.__pending_documents
+
+    @property
+    def high_water_mark(self) -> int:
+        """The number of pending documents at which new jobs start to be blocked."""
+        return self.__high_water_mark
+
+    @property
+    def low_water_mark(self) -> int:
+        """The number of pending documents at which the blocked jobs are released."""
+        return self.__low_water_mark
+
+    @property
+    def is_blocking(self) -> bool:
+        """Returns True, if new jobs are currently blocked until the queue has been drained to the low water mark."""
+        return not self.__accepting.is_set()
+
+    def add_write_callback(self, callback: Callable[[WriteJob], None]):
+        """Adds a callback that is called with each job after its documents have been written."""
+        self.__write_callbacks.append(callback)
+
+    async def put(self, job: WriteJob) -> asyncio.Future:
+        """Adds a write job to the queue and returns a future that is done when the job has been written.
+           Waits until the number of pending documents is at the low water mark, if the high water mark
+           has been reached and the job is not a priority job."""
+        self.__start_writers()
+        while not job.priority and not self.__accepting.is_set():
+            await self.__accepting.wait()
+
+        self.__pending_documents += job.size
+        if self.__pending_documents >= self.__high_water_mark:
+            LOGGER.debug("Write queue high water mark reached with {:d} pending documents.".format(
+                self.__pending_documents))
+            self.__accepting.clear()
+
+        self.__job_count += 1
+        self.__jobs.put_nowait((0 if job.priority else 1, self.__job_count, job))
+        job.queued = True
+        return job.done
+
+    async def join(self):
+        """Waits until all the jobs currently in the queue have been handled."""
+        await self.__jobs.join()
+
+    async def close(self):
+        """Stops the writer tasks. Any jobs still in the queue are not written and their futures are resolved
+           with zero written documents, so that nothing is left waiting for them."""
+        for writer in self.__writers:
+            writer.cancel()
+        await asyncio.gather(*self.__writers, return_exceptions=True)
+        self.__writers = []
+
+        while not self.__jobs.empty():
+            _, _, job = self.__jobs.get_nowait()
+            self.__finish_job(job, 0)
+        self.__accepting.set()
+
+    def __start_writers(self):
+        """Starts the writer tasks if they are not already running."""
+        if not self.__writers:
+            self.__writers = [
+                asyncio.create_task(self.__writer())
+                for _ in range(self.__writer_count)
+            ]
+
+    async def __writer(self):
+        """Writes the jobs from the queue to the database. The future of each job is resolved even if
+           the writing fails unexpectedly or the writer is cancelled while writing the job."""
+        while True:
+            _, _, job = await self.__jobs.get()
+            stored_documents = 0
+            try:
+                stored_documents = await self.__write(job)
+            except Exception as error:  # pylint: disable=broad-except
+                LOGGER.error("Unexpected error while writing message documents to simulation {:s}: {:s}".format(
+                    job.simulation_id, str(error)))
+            finally:
+                self.__finish_job(job, stored_documents)
+
+            for callback in self.__write_callbacks:
+                try:
+                    callback(job)
+                except Exception as error:  # pylint: disable=broad-except
+                    LOGGER.warning("Error in a write callback: {:s}".format(str(error)))
+
+    def __finish_job(self, job: WriteJob, stored_documents: int):
+        """Removes the job from the pending documents and resolves its futures."""
+        self.__pending_documents -= job.size
+        if self.__pending_documents <= self.__low_water_mark:
+            self.__accepting.set()
+        self.__jobs.task_done()
+        for future in (job.persisted, job.done):
+            if not future.done():
+                future.set_result(stored_documents)
+
+    async def __write(self, job: WriteJob) -> int:
+        """Writes the documents of the given job to the database and returns the number of written documents."""
+        message_type = "invalid" if job.invalid else "valid"
+        documents = await self.__compress(job)
+        stage_start = STAGE_TIMERS.start(STAGE_STORE)
+        start_time = time.perf_counter()
+        try:
+            stored_messages = await self.__storage.store_messages(
+                documents, invalid=job.invalid, default_simulation_id=job.simulation_id)
+
+        except Exception as error:  # pylint: disable=broad-except
+            LOGGER.error("Error while writing {:s} message documents to simulation {:s}: {:s}".format(
+                message_type, job.simulation_id, str(error)))
+            FAILED_DOCUMENTS.inc(amount=job.size)
+            return 0
+
+        finally:
+            latency = time.perf_counter() - start_time
+            STORE_LATENCY.observe(latency)
+            job.latency = latency
+            STAGE_TIMERS.stop(STAGE_STORE, stage_start)
+
+        if len(stored_messages) != job.size:
+            FAILED_DOCUMENTS.inc(amount=job.size - len(stored_messages))
+            LOGGER.warning(
+                "Only {:d} {:s} message documents out of {:d} written to simulation {:s}.".format(
+                    len(stored_messages), message_type, job.size, job.simulation_id))
+        else:
+            LOGGER.debug("{:d} {:s} documents written to simulation {:s}".format(
+                len(stored_messages), message_type, job.simulation_id))
+
+        return len(stored_messages)
+
+    async def __compress(self, job: WriteJob) -> List[Tuple[dict, str]]:
+        """Returns the documents of the given job with the large payload attributes compressed.
+           The compression is done in the default executor so that it does not block the message intake."""
+        if not self.__compressor.is_active:
+            return job.documents
+
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(
+                None, self.__compressor.compress_documents, job.documents)
+        except Exception as error:  # pylint: disable=broad-except
+            LOGGER.warning("Error while compressing message documents for simulation {:s}: {:s}".format(
+                job.simulation_id, str(error)))
+            return job.documents
+
+        if result.original_bytes > 0:
+            COMPRESSED_PAYLOAD_BYTES.inc("original", amount=result.original_bytes)
+            COMPRESSED_PAYLOAD_BYTES.inc("compressed", amount=result.compressed_bytes)
+        return result.documents